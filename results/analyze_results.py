@@ -4,14 +4,25 @@ CRITAIR Results Analysis Script
 
 Script to analyze and visualize the BertScore evaluation results.
 Generates summary statistics and comparative visualizations.
+
+Tables written by src/evaluation.py also carry a per-stage latency breakdown;
+the Balance can then be computed on generation time alone or end to end:
+    python results/analyze_results.py --balance-on generation
 """
 
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 from pathlib import Path
 
+# Per-stage timing columns added by src/evaluation.py (seconds, except Prompt Tokens)
+STAGE_COLUMNS = ['Embed Time', 'Retrieve Time', 'Load Time', 'Prompt Tokens', 'TTFT', 'Generation Time', 'Total Time']
+
+# Time column the Balance is computed on
+BALANCE_TIME = {'end-to-end': 'Total Time', 'generation': 'Generation Time'}
+
 def load_results():
     """Load all results CSV files."""
     results_dir = Path(__file__).parent / 'tables'
@@ -26,14 +37,43 @@ def load_results():
         'Recommendations': recommendations
     }
 
-def generate_summary():
+def compute_balance(df, basis='end-to-end'):
+    """
+    Balance (time / BertScore, lower is better) on the chosen time basis.
+    
+    Models without the stage column keep the Balance of their 'Inference Time'.
+    """
+    column = BALANCE_TIME[basis]
+    times = df['Inference Time']
+    if column in df:
+        times = df[column].fillna(times)
+    return times / df['BertScore']
+
+def print_stage_breakdown(df):
+    """Print the per-stage timings of the models that have them."""
+    columns = [c for c in STAGE_COLUMNS if c in df]
+    measured = df.dropna(subset=columns, how='all') if columns else df.iloc[0:0]
+    if measured.empty:
+        return
+    print(f"\n⏱️  Latency Breakdown (mean per question):")
+    for _, row in measured.iterrows():
+        stages = ", ".join(
+            f"{c.replace(' Time', '').lower()} {row[c]:.0f}" if c == 'Prompt Tokens' else
+            f"{c.replace(' Time', '').lower()} {row[c]:.2f}s"
+            for c in columns if pd.notna(row[c])
+        )
+        print(f"   • {row['Model']}: {stages}")
+
+def generate_summary(basis='end-to-end'):
     """Generate summary statistics for all datasets."""
     results = load_results()
     
     print("🏆 CRITAIR - AI Models BertScore Evaluation Summary")
+    print(f"⚖️  Balance computed on: {basis} time")
     print("=" * 60)
     
     for category, df in results.items():
+        df['Balance'] = compute_balance(df, basis)
         print(f"\n📊 {category} Data Analysis:")
         print("-" * 40)
         
@@ -51,6 +91,8 @@ def generate_summary():
         print(f"   • Average BertScore: {df['BertScore'].mean():.4f}")
         print(f"   • Average Time: {df['Inference Time'].mean():.2f}s")
         print(f"   • Average Balance: {df['Balance'].mean():.2f}")
+        
+        print_stage_breakdown(df)
 
 def create_comparison_chart():
     """Create comparative visualization of all results."""
@@ -150,10 +192,15 @@ def create_comparison_chart():
     return fig
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CRITAIR results analysis")
+    parser.add_argument('--balance-on', choices=list(BALANCE_TIME), default='end-to-end',
+                        help="Time the Balance is computed on")
+    args = parser.parse_args()
+    
     print("🚀 Generating CRITAIR results analysis...")
     
     # Generate summary
-    generate_summary()
+    generate_summary(args.balance_on)
     
     # Create visualizations
     create_comparison_chart()
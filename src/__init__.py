@@ -7,7 +7,32 @@ Artificial Intelligence models in the context of Colombian electrical regulation
 
 Modules:
 - tools: Core tools and utilities for AI model evaluation
+- async_tools: Async variants of the tools with in-memory session state
+- plot_store: Content-addressed cache of generated event plots
+- chart_templates: Template charts over event aggregates cached per data version
+- event_store: Event table as Parquet partitioned by year and department, with pruned queries
+- sql_engine: DuckDB SQL execution mode for event questions, with validation and benchmark
+- spatial_index: Grid index over event coordinates for polygon and radius queries
+- reliability: Vectorized SAIDI/SAIFI engine over a monthly cube with incremental updates
+- ingestion: Append-only event ingestion that updates the dataset and derived caches
+- compact_events: Dictionary-encoded, compact event table shared as read-only memory maps
+- streaming: Chunked, bounded-memory aggregation of event histories larger than RAM
+- interval_index: Interval index on event inicio/fin for overlap, stabbing and peak-concurrency queries
+- variables_archive: Streamed reader of the *_variables.zip archives with a Parquet cache keyed by archive hash
+- poligono_features: Vectorized per-polygon features and top-5 selection that build info_poligono
+- reglas: Vectorized numeric threshold pre-check that answers clearly compliant variables without the LLM
+- recommendation_cache: Persistent recommendation cache keyed by equipment type, variable and threshold-aligned value bucket
+- hedging: Hedged requests that start a backup model when the primary misses a first-token deadline
+- router: Per-category model router under a latency SLO with EWMA estimates and fallback
+- model_factory: Chat model factory with provider timeouts, circuit breakers and fallback chains
+- ollama_manager: Ollama model preloading and keep-alive under a memory budget, with load vs inference timing
+- evaluation: Question-bank evaluation runs with per-stage timings per question and checkpointed, resumable campaigns
+- replay: Record/replay wrappers for the chat and embedding clients with optional original-latency simulation
+- server: HTTP API with request coalescing, per-client limits and metrics
 - utils: Utility functions for text processing and technical recommendations
+- tracing: Stage-level tracing spans with JSONL and Chrome trace export
+- loadgen: Concurrent multi-session load generator for the tools
+- mock_provider: Mock chat model and embeddings for local runs
 - unstructured_questions: Questions for unstructured data analysis (RAG)
 - structured_questions: Questions for structured data analysis (DataFrames)
 - recomendation_questions: Questions for technical recommendations analysis
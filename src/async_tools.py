@@ -0,0 +1,277 @@
+"""
+Native async variants of the LangChain tools
+Each async tool keeps the name, description and arguments of its counterpart
+in tools.py. Awaiting it (ainvoke) runs retrieval and generation on the event
+loop and keeps the conversation state in memory (SessionStore) instead of the
+pickle files, so a single event loop can hold hundreds of in-flight requests.
+Calling it synchronously (invoke) runs the original tool.
+"""
+
+import asyncio
+from typing import Dict, Optional
+
+from langchain.chains.question_answering import load_qa_chain
+from langchain.memory import ConversationBufferMemory
+from langchain.prompts import PromptTemplate
+from langchain_core.tools import BaseTool, StructuredTool
+
+import tools
+from tools import (
+    EMBEDDINGS_DIR, RAG_TEMPLATE, RESPUESTA_NO_DISPONIBLE,
+    _consultar_eventos, _crear_agente_eventos, _instrucciones_grafico, _respuesta_directa, _version_eventos,
+)
+from chart_templates import COLUMNAS_EVENTOS, get_aggregates, render_chart, select_chart
+from plot_store import default_plot_store
+from router import resolve_model
+from tracing import set_attribute, span
+from utils import create_llm_chat_model, get_vectorstore
+
+
+class SessionStore:
+    """
+    In-memory conversation state for the async tools.
+
+    Replaces memories/{chat_id}.pkl, number_iteration.pkl and answer.pkl:
+    conversation memories and last answers are kept per chat_id, and requests
+    of the same chat_id are serialized so the history stays consistent.
+    """
+
+    def __init__(self):
+        self._memories: Dict[str, ConversationBufferMemory] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._answers: Dict[str, str] = {}
+        self.iterations = 0
+
+    def memory(self, chat_id: str) -> ConversationBufferMemory:
+        """Conversation memory of a chat (created on first use)."""
+        if chat_id not in self._memories:
+            self._memories[chat_id] = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
+        return self._memories[chat_id]
+
+    def lock(self, chat_id: str) -> asyncio.Lock:
+        """Lock that serializes requests of the same chat."""
+        if chat_id not in self._locks:
+            self._locks[chat_id] = asyncio.Lock()
+        return self._locks[chat_id]
+
+    def increment(self, incremento: int) -> int:
+        """Equivalent of the number_iteration.pkl counter."""
+        self.iterations += incremento
+        return self.iterations
+
+    def set_answer(self, chat_id: str, response: str) -> None:
+        self._answers[chat_id] = response
+
+    def answer(self, chat_id: str) -> Optional[str]:
+        """Last answer given in a chat (equivalent of answer.pkl)."""
+        return self._answers.get(chat_id)
+
+    def clear(self, chat_id: Optional[str] = None) -> None:
+        """Forgets one chat, or every chat if chat_id is None."""
+        if chat_id is None:
+            self._memories.clear()
+            self._locks.clear()
+            self._answers.clear()
+        else:
+            self._memories.pop(chat_id, None)
+            self._locks.pop(chat_id, None)
+            self._answers.pop(chat_id, None)
+
+
+default_store = SessionStore()
+
+
+async def aconsultar_coleccion(coleccion: str, query: str, model: str, chat_id: str,
+                               store: Optional[SessionStore] = None) -> str:
+    """
+    Async RAG over one Chroma collection (see tools._consultar_coleccion).
+
+    Args:
+        coleccion (str): Name of the collection inside EMBEDDINGS_DIR
+        query (str): User question
+        model (str): Language model name
+        chat_id (str): Conversation identifier
+        store (Optional[SessionStore]): Conversation state, defaults to default_store
+
+    Returns:
+        str: Model answer
+    """
+    store = store or default_store
+    model = resolve_model(model, "unstructured")
+    with span("tool", tool=coleccion, model=model, chat_id=chat_id, mode="async"):
+        store.increment(1)
+
+        with span("prompt_build"):
+            prompt = PromptTemplate(
+                input_variables=["chat_history", "human_input", "context"], template=RAG_TEMPLATE
+            )
+
+        with span("llm_init"):
+            # Ollama models are loaded when created: a blocking call kept off the event loop
+            llm_chat = await asyncio.to_thread(create_llm_chat_model, model)
+
+        with span("vectorstore_open"):
+            vectorstore = await asyncio.to_thread(get_vectorstore, f"{EMBEDDINGS_DIR}/{coleccion}", model)
+
+        with span("embed_query"):
+            query_embedding = await vectorstore.embeddings.aembed_query(query)
+
+        with span("retrieve", k=5):
+            docs = await vectorstore.asimilarity_search_by_vector(query_embedding, k=5)
+
+        async with store.lock(chat_id):
+            chain = load_qa_chain(llm_chat, chain_type="stuff", memory=store.memory(chat_id), prompt=prompt)
+            with span("generate"):
+                response = (await chain.ainvoke({"input_documents": docs, "human_input": query}))["output_text"]
+
+        store.set_answer(chat_id, response)
+
+    return response
+
+
+async def aeventos_transformadores_run(query: str, model: str, chat_id: str,
+                                       store: Optional[SessionStore] = None) -> str:
+    """
+    Async version of tools.eventos_transformadores.
+
+    Args:
+        query (str): User question
+        model (str): Language model name
+        chat_id (str): Conversation identifier
+        store (Optional[SessionStore]): Conversation state, defaults to default_store
+
+    Returns:
+        str: Agent answer
+    """
+    store = store or default_store
+    model = resolve_model(model, "structured")
+    with span("tool", tool="eventos_transformadores", model=model, chat_id=chat_id, mode="async"):
+        # Same routes as the sync tool (streaming, SAIDI/SAIFI, intervals, SQL), in a worker thread
+        response = await asyncio.to_thread(_respuesta_directa, query, model)
+        if response is not None:
+            store.increment(2)
+            store.set_answer(chat_id, response)
+            return response
+        eventos_trafos = await asyncio.to_thread(_consultar_eventos, query)
+        store.increment(2)
+        try:
+            # Building the agent copies the event table: kept off the event loop
+            agent = await asyncio.to_thread(_crear_agente_eventos, eventos_trafos)
+            with span("generate"):
+                response = (await agent.ainvoke(query))["output"]
+        except Exception as e:
+            print(f"Error en el agente de pandas: {e}")
+            set_attribute("error", repr(e))
+            response = RESPUESTA_NO_DISPONIBLE
+        store.set_answer(chat_id, response)
+    return response
+
+
+async def aeventos_transformadores_plots_run(query: str, model: str, chat_id: str,
+                                             store: Optional[SessionStore] = None) -> str:
+    """
+    Async version of tools.eventos_transformadores_plots.
+
+    Args:
+        query (str): User question
+        model (str): Language model name
+        chat_id (str): Conversation identifier
+        store (Optional[SessionStore]): Conversation state, defaults to default_store
+
+    Returns:
+        str: Agent answer
+    """
+    store = store or default_store
+    model = resolve_model(model, "structured")
+    with span("tool", tool="eventos_transformadores_plots", model=model, chat_id=chat_id, mode="async"):
+        path_plot = await asyncio.to_thread(default_plot_store.allocate_output_path, chat_id)
+        data_version = _version_eventos()
+        key = default_plot_store.key(query, data_version, model)
+        cached = await asyncio.to_thread(default_plot_store.get, key)
+        if cached is not None:
+            response = await asyncio.to_thread(default_plot_store.materialize, cached, path_plot)
+            store.increment(3)
+            store.set_answer(chat_id, response)
+            return response
+
+        # Common charts: the model only picks a template and its parameters
+        aggregates = await asyncio.to_thread(
+            get_aggregates, data_version, lambda: _consultar_eventos(columnas=COLUMNAS_EVENTOS)
+        )
+        try:
+            selection = await asyncio.to_thread(lambda: select_chart(query, create_llm_chat_model(model), aggregates))
+        except Exception as e:
+            print(f"Error seleccionando plantilla de gráfico: {e}")
+            set_attribute("fallback_error.chart_template", repr(e))
+            selection = None
+        if selection is not None:
+            response = await asyncio.to_thread(render_chart, selection, aggregates, path_plot)
+            store.increment(3)
+            await asyncio.to_thread(default_plot_store.put, key, path_plot, response, query=query, model=model)
+            store.set_answer(chat_id, response)
+            return response
+
+        eventos_trafos = await asyncio.to_thread(_consultar_eventos, query)
+        try:
+            agent = await asyncio.to_thread(_crear_agente_eventos, eventos_trafos)
+            with span("generate"):
+                response = (await agent.ainvoke(_instrucciones_grafico(query, path_plot)))["output"]
+            store.increment(3)
+            await asyncio.to_thread(default_plot_store.put, key, path_plot, response, query=query, model=model)
+        except Exception as e:
+            print(f"Error en el agente de pandas: {e}")
+            set_attribute("error", repr(e))
+            response = RESPUESTA_NO_DISPONIBLE
+            store.increment(4)
+            await asyncio.to_thread(default_plot_store.release_output_path, path_plot)
+        store.set_answer(chat_id, response)
+    return response
+
+
+def _coroutine_coleccion(coleccion: str):
+    async def run(query: str, model: str, chat_id: str) -> str:
+        return await aconsultar_coleccion(coleccion, query, model, chat_id)
+    return run
+
+
+def _async_tool(sync_tool: BaseTool, coroutine) -> StructuredTool:
+    """Builds a tool with the sync tool's schema, its function and a native coroutine."""
+    return StructuredTool.from_function(
+        func=sync_tool.func,
+        coroutine=coroutine,
+        name=sync_tool.name,
+        description=sync_tool.description,
+        args_schema=sync_tool.args_schema,
+    )
+
+
+# Collections answered with RAG (same names as the sync tools and the Chroma folders)
+RAG_COLLECTIONS = [
+    "capitulo_1", "capitulo_2", "capitulo_3", "capitulo_4", "resolucion_40117",
+    "normativa_apoyos", "normativa_protecciones", "normativa_aisladores",
+    "redes_aereas_media_tension", "codigo_electrico_colombiano",
+    "requisitos_redes_aereas", "retie",
+]
+
+ASYNC_TOOLS: Dict[str, StructuredTool] = {
+    name: _async_tool(getattr(tools, name), _coroutine_coleccion(name)) for name in RAG_COLLECTIONS
+}
+ASYNC_TOOLS["eventos_transformadores"] = _async_tool(tools.eventos_transformadores, aeventos_transformadores_run)
+ASYNC_TOOLS["eventos_transformadores_plots"] = _async_tool(
+    tools.eventos_transformadores_plots, aeventos_transformadores_plots_run
+)
+
+acapitulo_1 = ASYNC_TOOLS["capitulo_1"]
+acapitulo_2 = ASYNC_TOOLS["capitulo_2"]
+acapitulo_3 = ASYNC_TOOLS["capitulo_3"]
+acapitulo_4 = ASYNC_TOOLS["capitulo_4"]
+aresolucion_40117 = ASYNC_TOOLS["resolucion_40117"]
+anormativa_apoyos = ASYNC_TOOLS["normativa_apoyos"]
+anormativa_protecciones = ASYNC_TOOLS["normativa_protecciones"]
+anormativa_aisladores = ASYNC_TOOLS["normativa_aisladores"]
+aredes_aereas_media_tension = ASYNC_TOOLS["redes_aereas_media_tension"]
+acodigo_electrico_colombiano = ASYNC_TOOLS["codigo_electrico_colombiano"]
+arequisitos_redes_aereas = ASYNC_TOOLS["requisitos_redes_aereas"]
+aretie = ASYNC_TOOLS["retie"]
+aeventos_transformadores = ASYNC_TOOLS["eventos_transformadores"]
+aeventos_transformadores_plots = ASYNC_TOOLS["eventos_transformadores_plots"]
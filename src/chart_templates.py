@@ -0,0 +1,388 @@
+"""
+Template-based chart engine for the common event plots
+A library of parameterized, pre-validated chart specs (events per year/month,
+by cause, by municipality/department, duration histograms, SAIDI/SAIFI trends)
+rendered with the Agg backend from pre-aggregated data. The LLM is only asked
+to pick a spec and its parameters; anything it cannot map to a spec falls
+back to the pandas agent.
+"""
+
+import json
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from tracing import span
+
+
+# Palette requested for user-facing charts (greens and greys)
+COLORES = ["#2E7D32", "#66BB6A", "#A5D6A7", "#616161", "#9E9E9E", "#BDBDBD", "#1B5E20", "#424242"]
+
+# Filters accepted by every spec
+FILTROS = {
+    "anio_inicio": int,
+    "anio_fin": int,
+    "DEP": str,
+    "MUN": str,
+    "tipo_equi_ope": str,
+    "causa": str,
+}
+
+# Categorical filters, matched case-insensitively against the aggregated values
+FILTROS_CATEGORICOS = ["DEP", "MUN", "tipo_equi_ope", "causa"]
+
+DIMENSIONES = ["anio", "mes", "DEP", "MUN", "tipo_equi_ope", "causa"]
+
+# Event table columns the aggregates are built from
+COLUMNAS_EVENTOS = ["FECHA", "DEP", "MUN", "tipo_equi_ope", "causa", "duracion_h", "SAIDI", "SAIFI"]
+
+
+@dataclass
+class ChartSpec:
+    """
+    A pre-validated chart.
+
+    Attributes:
+        name (str): Identifier the LLM returns
+        description (str): What the chart shows (shown to the LLM)
+        params (Dict[str, type]): Spec-specific parameters and their types
+        defaults (Dict[str, Any]): Default parameter values
+        render (Callable): Function (aggregates, params, ax) -> summary sentence
+    """
+    name: str
+    description: str
+    render: Callable
+    params: Dict[str, type] = field(default_factory=dict)
+    defaults: Dict[str, Any] = field(default_factory=dict)
+
+
+class EventAggregates:
+    """
+    Pre-aggregated event data shared by all chart specs.
+
+    Builds once per data version a cube of event counts, durations and
+    SAIDI/SAIFI sums by year, month, department, municipality, equipment
+    type and cause, plus a compact duration table for histograms.
+
+    Args:
+        eventos (pd.DataFrame): Typed event table (see tools._cargar_eventos)
+    """
+
+    def __init__(self, eventos: pd.DataFrame):
+        self.cube, self.duraciones = self._reducir(eventos)
+
+    @staticmethod
+    def _reducir(eventos: pd.DataFrame):
+        fecha = eventos["FECHA"] if "FECHA" in eventos else eventos["inicio"]
+        base = pd.DataFrame({
+            "anio": fecha.dt.year.astype("int16"),
+            "mes": fecha.dt.month.astype("int8"),
+        })
+        for col in FILTROS_CATEGORICOS:
+            base[col] = eventos[col].astype(str) if col in eventos else "N/D"
+        base["duracion_h"] = pd.to_numeric(eventos["duracion_h"], errors="coerce").astype("float32")
+        base["SAIDI"] = pd.to_numeric(eventos["SAIDI"], errors="coerce").astype("float64")
+        base["SAIFI"] = pd.to_numeric(eventos["SAIFI"], errors="coerce").astype("float64")
+
+        cube = (
+            base.groupby(DIMENSIONES, observed=True, sort=False)
+            .agg(eventos=("duracion_h", "size"), duracion_h=("duracion_h", "sum"),
+                 SAIDI=("SAIDI", "sum"), SAIFI=("SAIFI", "sum"))
+            .reset_index()
+        )
+        return cube, base[["anio"] + FILTROS_CATEGORICOS + ["duracion_h"]]
+
+    def append(self, nuevos: pd.DataFrame) -> None:
+        """Adds newly ingested events to the cube and the duration table."""
+        cube, duraciones = self._reducir(nuevos)
+        self.cube = (
+            pd.concat([self.cube, cube], ignore_index=True)
+            .groupby(DIMENSIONES, sort=False)[["eventos", "duracion_h", "SAIDI", "SAIFI"]].sum()
+            .reset_index()
+        )
+        self.duraciones = pd.concat([self.duraciones, duraciones], ignore_index=True)
+
+    @staticmethod
+    def _filtrar(df: pd.DataFrame, params: Dict[str, Any]) -> pd.DataFrame:
+        mask = np.ones(len(df), dtype=bool)
+        if params.get("anio_inicio") is not None:
+            mask &= df["anio"].to_numpy() >= params["anio_inicio"]
+        if params.get("anio_fin") is not None:
+            mask &= df["anio"].to_numpy() <= params["anio_fin"]
+        for col in FILTROS_CATEGORICOS:
+            if params.get(col):
+                mask &= df[col].str.lower().to_numpy() == str(params[col]).lower()
+        return df[mask]
+
+    def cubo(self, params: Dict[str, Any]) -> pd.DataFrame:
+        """Cube rows matching the common filters."""
+        return self._filtrar(self.cube, params)
+
+    def duracion(self, params: Dict[str, Any]) -> pd.Series:
+        """Event durations matching the common filters."""
+        return self._filtrar(self.duraciones, params)["duracion_h"].dropna()
+
+    def valores(self, columna: str) -> List[str]:
+        """Distinct values of a dimension (used to validate LLM parameters)."""
+        return sorted(self.cube[columna].astype(str).unique().tolist())
+
+
+# Renderers --------------------------------------------------------------------------------------
+
+def _estilo(ax, titulo: str, xlabel: str, ylabel: str) -> None:
+    ax.set_title(titulo, fontsize=16)
+    ax.set_xlabel(xlabel, fontsize=14)
+    ax.set_ylabel(ylabel, fontsize=14)
+    ax.tick_params(axis="x", labelrotation=90, labelsize=12)
+    ax.tick_params(axis="y", labelsize=12)
+    ax.grid(True, axis="y", alpha=0.3)
+
+
+def _barras(ax, serie: pd.Series, titulo: str, xlabel: str, ylabel: str) -> None:
+    ax.bar([str(i) for i in serie.index], serie.values, color=COLORES[0], edgecolor=COLORES[3])
+    _estilo(ax, titulo, xlabel, ylabel)
+
+
+def _render_por_anio(agg: EventAggregates, p: Dict[str, Any], ax) -> str:
+    serie = agg.cubo(p).groupby("anio")["eventos"].sum().sort_index()
+    _barras(ax, serie, "Eventos por año", "Año", "Cantidad de eventos")
+    if serie.empty:
+        return "No hay eventos para los filtros indicados."
+    return f"El año con más eventos fue {serie.idxmax()} ({int(serie.max())} eventos)."
+
+
+def _render_por_mes(agg: EventAggregates, p: Dict[str, Any], ax) -> str:
+    cubo = agg.cubo(p)
+    serie = cubo.groupby(["anio", "mes"])["eventos"].sum().sort_index()
+    etiquetas = [f"{a}-{m:02d}" for a, m in serie.index]
+    ax.plot(etiquetas, serie.values, color=COLORES[0], marker="o", markersize=3)
+    _estilo(ax, "Eventos por mes", "Mes", "Cantidad de eventos")
+    if serie.empty:
+        return "No hay eventos para los filtros indicados."
+    a, m = serie.idxmax()
+    return f"El mes con más eventos fue {a}-{m:02d} ({int(serie.max())} eventos)."
+
+
+def _render_top(columna: str, titulo: str, xlabel: str):
+    def render(agg: EventAggregates, p: Dict[str, Any], ax) -> str:
+        serie = agg.cubo(p).groupby(columna)["eventos"].sum()
+        serie = serie.sort_values(ascending=bool(p.get("ascendente")))[: int(p.get("top_n") or 10)]
+        _barras(ax, serie, titulo, xlabel, "Cantidad de eventos")
+        if serie.empty:
+            return "No hay eventos para los filtros indicados."
+        return f"{serie.index[0]} es el primero del gráfico con {int(serie.iloc[0])} eventos."
+    return render
+
+
+def _render_histograma_duracion(agg: EventAggregates, p: Dict[str, Any], ax) -> str:
+    duraciones = agg.duracion(p)
+    if p.get("max_horas"):
+        duraciones = duraciones[duraciones <= float(p["max_horas"])]
+    ax.hist(duraciones.to_numpy(), bins=int(p.get("bins") or 30), color=COLORES[1], edgecolor=COLORES[3])
+    _estilo(ax, "Distribución de la duración de los eventos", "Duración (horas)", "Cantidad de eventos")
+    if duraciones.empty:
+        return "No hay eventos para los filtros indicados."
+    return f"La duración mediana es {duraciones.median():.2f} h y la media {duraciones.mean():.2f} h."
+
+
+def _render_saidi_saifi(agg: EventAggregates, p: Dict[str, Any], ax) -> str:
+    cubo = agg.cubo(p)
+    por = ["anio", "mes"] if p.get("frecuencia") == "mes" else ["anio"]
+    serie = cubo.groupby(por)[["SAIDI", "SAIFI"]].sum().sort_index()
+    etiquetas = [f"{i[0]}-{i[1]:02d}" if isinstance(i, tuple) else str(i) for i in serie.index]
+    ax.plot(etiquetas, serie["SAIDI"].values, color=COLORES[0], marker="o", label="SAIDI")
+    ax2 = ax.twinx()
+    ax2.plot(etiquetas, serie["SAIFI"].values, color=COLORES[3], marker="s", label="SAIFI")
+    ax2.set_ylabel("SAIFI", fontsize=14)
+    _estilo(ax, "Tendencia de SAIDI y SAIFI", "Periodo", "SAIDI")
+    ax.legend(loc="upper left")
+    ax2.legend(loc="upper right")
+    if serie.empty:
+        return "No hay eventos para los filtros indicados."
+    return (f"El mayor SAIDI se presentó en {etiquetas[int(np.argmax(serie['SAIDI'].values))]} "
+            f"y el mayor SAIFI en {etiquetas[int(np.argmax(serie['SAIFI'].values))]}.")
+
+
+CHART_SPECS: Dict[str, ChartSpec] = {spec.name: spec for spec in [
+    ChartSpec("eventos_por_anio", "Cantidad de eventos/interrupciones por año.", _render_por_anio),
+    ChartSpec("eventos_por_mes", "Cantidad de eventos/interrupciones por mes (serie de tiempo).", _render_por_mes),
+    ChartSpec("eventos_por_causa", "Eventos por causa, ordenados (top_n causas).",
+              _render_top("causa", "Eventos por causa", "Causa"),
+              {"top_n": int, "ascendente": bool}, {"top_n": 10, "ascendente": False}),
+    ChartSpec("eventos_por_municipio", "Eventos por municipio (MUN), ordenados (top_n municipios).",
+              _render_top("MUN", "Eventos por municipio", "Municipio"),
+              {"top_n": int, "ascendente": bool}, {"top_n": 10, "ascendente": False}),
+    ChartSpec("eventos_por_departamento", "Eventos por departamento (DEP).",
+              _render_top("DEP", "Eventos por departamento", "Departamento"),
+              {"top_n": int, "ascendente": bool}, {"top_n": 10, "ascendente": False}),
+    ChartSpec("eventos_por_tipo_equipo", "Eventos por tipo de equipo (transformador, interruptor, tramo de red).",
+              _render_top("tipo_equi_ope", "Eventos por tipo de equipo", "Tipo de equipo"),
+              {"top_n": int, "ascendente": bool}, {"top_n": 10, "ascendente": False}),
+    ChartSpec("histograma_duracion", "Histograma de la duración en horas de los eventos.",
+              _render_histograma_duracion, {"bins": int, "max_horas": float}, {"bins": 30}),
+    ChartSpec("tendencia_saidi_saifi", "Tendencia de SAIDI y SAIFI por año o por mes (frecuencia: 'anio' o 'mes').",
+              _render_saidi_saifi, {"frecuencia": str}, {"frecuencia": "anio"}),
+]}
+
+
+# Aggregates cache -------------------------------------------------------------------------------
+
+_agregados: Dict[str, EventAggregates] = {}
+_agregados_lock = threading.Lock()
+
+
+def get_aggregates(data_version: str, cargar_eventos: Callable[[], pd.DataFrame]) -> EventAggregates:
+    """
+    Returns the aggregates of a data version, building them on first use.
+
+    Args:
+        data_version (str): Version of the event data
+        cargar_eventos (Callable[[], pd.DataFrame]): Loader of the typed event table
+
+    Returns:
+        EventAggregates: Aggregates shared by all charts of that version
+    """
+    with _agregados_lock:
+        if data_version not in _agregados:
+            with span("chart_aggregates_build"):
+                _agregados.clear()
+                _agregados[data_version] = EventAggregates(cargar_eventos())
+        return _agregados[data_version]
+
+
+def advance_aggregates(old_version: str, new_version: str, nuevos: pd.DataFrame) -> bool:
+    """
+    Moves cached aggregates to a new data version by appending the new events.
+
+    Args:
+        old_version (str): Version the cached aggregates were built from
+        new_version (str): Version after the append
+        nuevos (pd.DataFrame): Events appended between both versions
+
+    Returns:
+        bool: True if aggregates were advanced, False if none were cached for old_version
+    """
+    with _agregados_lock:
+        agg = _agregados.pop(old_version, None)
+        if agg is None:
+            return False
+        agg.append(nuevos)
+        _agregados[new_version] = agg
+        return True
+
+
+# Spec selection ---------------------------------------------------------------------------------
+
+SELECTION_TEMPLATE = """Eres un asistente que elige gráficos sobre una tabla de interrupciones en redes eléctricas.
+Gráficos disponibles (nombre: descripción | parámetros propios):
+{specs}
+
+Todos los gráficos aceptan además los filtros opcionales: anio_inicio (int), anio_fin (int),
+DEP (departamento), MUN (municipio), tipo_equi_ope (uno de: {tipos}) y causa (causa del evento).
+
+Responde ÚNICAMENTE con un JSON de la forma {{"grafico": "<nombre>", "parametros": {{...}}}}.
+Si ningún gráfico responde la solicitud, responde {{"grafico": null}}.
+
+Solicitud: {query}
+JSON:"""
+
+
+def _describir_specs() -> str:
+    lineas = []
+    for spec in CHART_SPECS.values():
+        params = ", ".join(f"{k} ({t.__name__})" for k, t in spec.params.items()) or "ninguno"
+        lineas.append(f"- {spec.name}: {spec.description} | {params}")
+    return "\n".join(lineas)
+
+
+def validate_selection(raw: Any, agg: Optional[EventAggregates] = None) -> Optional[Dict[str, Any]]:
+    """
+    Validates and coerces an LLM selection against the spec library.
+
+    Args:
+        raw (Any): Parsed JSON returned by the model
+        agg (Optional[EventAggregates]): Aggregates used to check categorical filter values
+
+    Returns:
+        Optional[Dict[str, Any]]: {'grafico': name, 'parametros': params} or None if invalid
+    """
+    if not isinstance(raw, dict) or raw.get("grafico") not in CHART_SPECS:
+        return None
+    spec = CHART_SPECS[raw["grafico"]]
+    allowed = {**FILTROS, **spec.params}
+    params = dict(spec.defaults)
+    for name, value in (raw.get("parametros") or {}).items():
+        if name not in allowed or value is None or value == "":
+            continue
+        try:
+            if allowed[name] is bool:
+                params[name] = value if isinstance(value, bool) else str(value).lower() in ("true", "1", "si", "sí")
+            else:
+                params[name] = allowed[name](value)
+        except (TypeError, ValueError):
+            return None
+    if agg is not None:
+        for col in FILTROS_CATEGORICOS:
+            if col in params:
+                match = [v for v in agg.valores(col) if v.lower() == str(params[col]).lower()]
+                if not match:
+                    return None
+                params[col] = match[0]
+    return {"grafico": spec.name, "parametros": params}
+
+
+def select_chart(query: str, llm_chat, agg: Optional[EventAggregates] = None) -> Optional[Dict[str, Any]]:
+    """
+    Asks the model which spec and parameters answer a request.
+
+    Args:
+        query (str): User request
+        llm_chat: Chat model (see utils.create_llm_chat_model)
+        agg (Optional[EventAggregates]): Aggregates used to list and validate filter values
+
+    Returns:
+        Optional[Dict[str, Any]]: Validated selection or None (fall back to the agent)
+    """
+    tipos = ", ".join(agg.valores("tipo_equi_ope")) if agg is not None else "Transformador, Interruptor, Tramo de red"
+    prompt = SELECTION_TEMPLATE.format(specs=_describir_specs(), tipos=tipos, query=query)
+    with span("chart_select"):
+        content = llm_chat.invoke(prompt).content
+    match = re.search(r"\{.*\}", str(content), re.S)
+    if not match:
+        return None
+    try:
+        raw = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    return validate_selection(raw, agg)
+
+
+def render_chart(selection: Dict[str, Any], agg: EventAggregates, path: str) -> str:
+    """
+    Renders a validated selection to an image with the Agg backend.
+
+    Args:
+        selection (Dict[str, Any]): Output of select_chart/validate_selection
+        agg (EventAggregates): Pre-aggregated data
+        path (str): Output image path
+
+    Returns:
+        str: Answer describing the chart
+    """
+    spec = CHART_SPECS[selection["grafico"]]
+    with span("chart_render", chart=spec.name):
+        fig = Figure(figsize=(12, 7))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        resumen = spec.render(agg, selection["parametros"], ax)
+        fig.tight_layout()
+        fig.savefig(path, dpi=100)
+    filtros = {k: v for k, v in selection["parametros"].items() if k in FILTROS}
+    detalle = f" Filtros: {filtros}." if filtros else ""
+    return f"El gráfico ({spec.name}) fue guardado en {path}. {resumen}{detalle}"
@@ -0,0 +1,401 @@
+"""
+Memory-compact representation of the event table
+Strings are stored as integer codes into dictionaries (columns with the same
+domain, such as cto_equi_ope and FPARENT, share one dictionary), floats other
+than coordinates and reliability measures are stored as float32, and
+timestamps are stored as 32-bit seconds (16-bit days for FECHA) from a fixed
+epoch. Integer columns keep their stored width, so engines built from the
+table (DuckDB) get the same column types as later ingested batches. The
+arrays are saved once per data version as .npy files and opened as
+read-only memory maps, so every worker process reading the same version
+shares one copy through the OS page cache. An ingested batch is encoded
+alone and appended to the arrays of the previous version (dictionaries are
+extended, never reordered), so the full event table is not reloaded.
+
+Memory report (from the project root):
+    python src/compact_events.py
+"""
+
+import argparse
+import json
+import os
+import shutil
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from tracing import span
+
+
+# Columns that share a dictionary (same domain of codes)
+SHARED_DICTIONARIES = {
+    "circuitos": ["cto_equi_ope", "FPARENT"],
+}
+
+# Timestamp columns and their unit: 's' -> int32 seconds, 'D' -> int16 days since EPOCH
+TIMESTAMP_COLUMNS = {"inicio": "s", "fin": "s", "FECHA": "D"}
+EPOCH = np.datetime64("2000-01-01T00:00:00", "s")
+
+# Float columns kept in float64 (sums, radius queries and answers need their precision)
+FLOAT64_COLUMNS = {"LONGITUD", "LATITUD", "duracion_h", "SAIDI", "SAIFI"}
+
+_NAT = {"s": np.iinfo(np.int32).min, "D": np.iinfo(np.int16).min}
+_TIPOS_TIEMPO = {"s": np.int32, "D": np.int16}
+
+
+def _codes_dtype(n: int):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _categorias(serie: pd.Series) -> pd.Series:
+    return serie if isinstance(serie.dtype, pd.CategoricalDtype) else serie.astype("category")
+
+
+def _valores(serie: pd.Series) -> List[str]:
+    """Distinct non-null values of a column, as strings."""
+    cat = _categorias(serie)
+    codes = cat.cat.codes.to_numpy()
+    return [str(v) for v in cat.cat.categories[np.unique(codes[codes >= 0])]]
+
+
+def _codificar(serie: pd.Series, dictionary: pd.Index) -> np.ndarray:
+    """Codes of a column into a (possibly shared) dictionary, -1 for nulls."""
+    cat = _categorias(serie)
+    antiguos = cat.cat.codes.to_numpy()
+    mapa = dictionary.get_indexer(cat.cat.categories.astype(str))
+    return np.where(antiguos >= 0, mapa[antiguos] if len(mapa) else -1, -1)
+
+
+def _tiempo(serie: pd.Series, unidad: str) -> np.ndarray:
+    """Timestamps as seconds ('s') or days ('D') since EPOCH, with a sentinel for NaT."""
+    delta = (serie.to_numpy().astype("datetime64[s]") - EPOCH).astype("timedelta64[s]").astype(np.int64)
+    if unidad == "D":
+        delta = delta // 86400
+    return np.where(serie.isna().to_numpy(), _NAT[unidad], delta).astype(_TIPOS_TIEMPO[unidad])
+
+
+def _downcast(serie: pd.Series) -> np.ndarray:
+    """Numeric column as an array: integers keep their width, floats are float32 unless in FLOAT64_COLUMNS."""
+    if pd.api.types.is_bool_dtype(serie):
+        return serie.to_numpy(dtype=np.bool_)
+    if pd.api.types.is_integer_dtype(serie):
+        # Never narrower than the stored schema: IDs and counts of later batches must still fit
+        return serie.to_numpy()
+    return serie.to_numpy(dtype=np.float64 if serie.name in FLOAT64_COLUMNS else np.float32)
+
+
+class CompactEventTable:
+    """
+    Event table as typed numpy arrays plus string dictionaries.
+
+    Args:
+        arrays (Dict[str, np.ndarray]): One array per column (codes, numbers or encoded timestamps)
+        dictionaries (Dict[str, List[str]]): Dictionaries by name
+        encoding (Dict[str, dict]): Per column {'kind': 'dict'|'num'|'time', 'dictionary'|'unit'}
+        order (List[str]): Column order
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], dictionaries: Dict[str, List[str]],
+                 encoding: Dict[str, dict], order: List[str]):
+        self.arrays = arrays
+        self.dictionaries = dictionaries
+        self.encoding = encoding
+        self.order = order
+        # One dtype object per dictionary, so shared dictionaries are shared in pandas too
+        self._dtypes = {name: pd.CategoricalDtype(values) for name, values in dictionaries.items()}
+
+    def __len__(self) -> int:
+        return len(next(iter(self.arrays.values()))) if self.arrays else 0
+
+    @classmethod
+    def from_frame(cls, eventos: pd.DataFrame) -> "CompactEventTable":
+        """
+        Encodes a typed event table.
+
+        Args:
+            eventos (pd.DataFrame): Typed event table (see tools._cargar_eventos)
+
+        Returns:
+            CompactEventTable: Encoded table
+        """
+        grupo_de = {col: nombre for nombre, cols in SHARED_DICTIONARIES.items() for col in cols if col in eventos}
+        arrays, dictionaries, encoding = {}, {}, {}
+
+        for nombre in set(grupo_de.values()):
+            dictionaries[nombre] = sorted({v for c, g in grupo_de.items() if g == nombre for v in _valores(eventos[c])})
+
+        for col in eventos.columns:
+            serie = eventos[col]
+            if col in TIMESTAMP_COLUMNS and pd.api.types.is_datetime64_any_dtype(serie):
+                unidad = TIMESTAMP_COLUMNS[col]
+                arrays[col], encoding[col] = _tiempo(serie, unidad), {"kind": "time", "unit": unidad}
+            elif pd.api.types.is_numeric_dtype(serie) or pd.api.types.is_bool_dtype(serie):
+                arrays[col], encoding[col] = _downcast(serie), {"kind": "num"}
+            else:
+                nombre = grupo_de.get(col, col)
+                if nombre not in dictionaries:
+                    dictionaries[nombre] = sorted(_valores(serie))
+                codes = _codificar(serie, pd.Index(dictionaries[nombre]))
+                arrays[col] = codes.astype(_codes_dtype(len(dictionaries[nombre])))
+                encoding[col] = {"kind": "dict", "dictionary": nombre}
+
+        return cls(arrays, dictionaries, encoding, list(eventos.columns))
+
+    def append(self, nuevos: pd.DataFrame) -> "CompactEventTable":
+        """
+        Table with a batch of typed events appended, encoded like this one.
+
+        New strings are added at the end of their dictionary, so the codes
+        already stored keep their meaning; codes are widened if a dictionary
+        outgrows their dtype. Only the batch is encoded, and the arrays are
+        concatenated in memory (save() the result to share it).
+
+        Args:
+            nuevos (pd.DataFrame): Typed events with the columns of this table
+
+        Returns:
+            CompactEventTable: New table (this one is left untouched)
+
+        Raises:
+            KeyError: If the batch lacks a column of the table
+        """
+        dictionaries = {nombre: list(valores) for nombre, valores in self.dictionaries.items()}
+        for col in self.order:
+            enc = self.encoding[col]
+            if enc["kind"] == "dict":
+                conocidos = set(dictionaries[enc["dictionary"]])
+                dictionaries[enc["dictionary"]] += [v for v in _valores(nuevos[col]) if v not in conocidos]
+
+        arrays = {}
+        for col in self.order:
+            enc, serie = self.encoding[col], nuevos[col]
+            if enc["kind"] == "time":
+                codificado = _tiempo(serie, enc["unit"])
+            elif enc["kind"] == "num":
+                codificado = _downcast(serie)
+            else:
+                dictionary = dictionaries[enc["dictionary"]]
+                dtype = np.promote_types(self.arrays[col].dtype, _codes_dtype(len(dictionary)))
+                codificado = _codificar(serie, pd.Index(dictionary)).astype(dtype)
+            arrays[col] = np.concatenate([self.arrays[col], codificado])
+        return CompactEventTable(arrays, dictionaries, self.encoding, self.order)
+
+    # Persistence -------------------------------------------------------------------------------
+
+    def save(self, path: str) -> None:
+        """
+        Writes the table as one .npy file per column plus schema.json.
+
+        The folder is written under a temporary name and renamed into place,
+        so it never exists half-written. An existing folder is left alone: it
+        holds the same data version, saved by another process, and may be
+        memory-mapped by its readers.
+
+        Args:
+            path (str): Destination folder (one per data version)
+        """
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for col, array in self.arrays.items():
+            np.save(os.path.join(tmp, f"{self.order.index(col)}.npy"), array)
+        with open(os.path.join(tmp, "schema.json"), "w", encoding="utf-8") as f:
+            json.dump({"order": self.order, "encoding": self.encoding, "dictionaries": self.dictionaries},
+                      f, ensure_ascii=False)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            if not os.path.exists(os.path.join(path, "schema.json")):
+                raise
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    @classmethod
+    def open(cls, path: str, mmap: bool = True) -> "CompactEventTable":
+        """
+        Opens a saved table; with mmap the arrays are read-only views of the files.
+
+        Args:
+            path (str): Folder written by save()
+            mmap (bool): Memory-map the arrays instead of reading them
+
+        Returns:
+            CompactEventTable: Opened table
+        """
+        with open(os.path.join(path, "schema.json"), "r", encoding="utf-8") as f:
+            schema = json.load(f)
+        arrays = {
+            col: np.load(os.path.join(path, f"{i}.npy"), mmap_mode="r" if mmap else None)
+            for i, col in enumerate(schema["order"])
+        }
+        return cls(arrays, schema["dictionaries"], schema["encoding"], schema["order"])
+
+    # Decoding ----------------------------------------------------------------------------------
+
+    def column(self, col: str):
+        """Decoded column: Categorical, numeric array (no copy) or datetime64[s] array."""
+        array, enc = self.arrays[col], self.encoding[col]
+        if enc["kind"] == "dict":
+            return pd.Categorical.from_codes(array, dtype=self._dtypes[enc["dictionary"]])
+        if enc["kind"] == "time":
+            segundos = array.astype(np.int64) * (86400 if enc["unit"] == "D" else 1)
+            fechas = EPOCH + segundos.astype("timedelta64[s]")
+            fechas[array == _NAT[enc["unit"]]] = np.datetime64("NaT")
+            return fechas
+        return array
+
+    def to_frame(self, columns: Optional[List[str]] = None, writable: bool = False) -> pd.DataFrame:
+        """
+        Decodes the table (or some columns) to a DataFrame typed like tools._cargar_eventos.
+
+        Numeric columns are views of the (memory-mapped, read-only) arrays
+        unless `writable` is set; categorical columns reuse the shared
+        dictionaries.
+
+        Args:
+            columns (Optional[List[str]]): Columns to decode (all if None)
+            writable (bool): Copy the arrays, for callers that modify the frame
+
+        Returns:
+            pd.DataFrame: Event table
+        """
+        columns = self.order if columns is None else [c for c in columns if c in self.arrays]
+        return pd.DataFrame({c: self.column(c) for c in columns}, copy=writable)
+
+    # Report ------------------------------------------------------------------------------------
+
+    def memory_report(self, eventos: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        Bytes per column of the compact table, and of a regular DataFrame for comparison.
+
+        Dictionaries are listed once as 'dict:<name>' rows.
+
+        Args:
+            eventos (Optional[pd.DataFrame]): Table before compaction (e.g. tools._cargar_eventos())
+
+        Returns:
+            pd.DataFrame: column, dtype_before, bytes_before, dtype_after, bytes_after
+        """
+        antes = eventos.memory_usage(deep=True, index=False) if eventos is not None else {}
+        filas = []
+        for col in self.order:
+            enc = self.encoding[col]
+            tipo = {"dict": f"codes[{self.arrays[col].dtype}]", "time": f"{self.arrays[col].dtype} ({enc.get('unit')})",
+                    "num": str(self.arrays[col].dtype)}[enc["kind"]]
+            filas.append({
+                "column": col,
+                "dtype_before": str(eventos[col].dtype) if eventos is not None and col in eventos else None,
+                "bytes_before": int(antes[col]) if eventos is not None and col in eventos else None,
+                "dtype_after": tipo,
+                "bytes_after": int(self.arrays[col].nbytes),
+            })
+        for nombre, valores in self.dictionaries.items():
+            filas.append({"column": f"dict:{nombre}", "dtype_before": None, "bytes_before": None,
+                          "dtype_after": f"{len(valores)} values",
+                          "bytes_after": int(sum(len(v.encode("utf-8")) + 49 for v in valores))})
+        reporte = pd.DataFrame(filas)
+        total = {"column": "TOTAL", "dtype_before": None, "bytes_before": reporte["bytes_before"].sum(min_count=1),
+                 "dtype_after": None, "bytes_after": reporte["bytes_after"].sum()}
+        return pd.concat([reporte, pd.DataFrame([total])], ignore_index=True)
+
+
+# Shared snapshot per data version ----------------------------------------------------------------
+
+COMPACT_ROOT = "structured_data/eventos_compact"
+
+_tablas: Dict[str, CompactEventTable] = {}
+_tablas_lock = threading.Lock()
+
+
+def _carpeta(root: str, data_version: str) -> str:
+    return os.path.join(root, data_version.replace("/", "_").replace("+", "_b"))
+
+
+def _podar(root: str, carpeta: str) -> None:
+    """Removes the versions older than the previous one (it stays for workers that have not seen the new one yet)."""
+    anteriores = sorted((os.path.join(root, n) for n in os.listdir(root) if not n.endswith(".tmp")),
+                        key=os.path.getmtime, reverse=True)
+    for ruta in [r for r in anteriores if r != carpeta][1:]:
+        shutil.rmtree(ruta, ignore_errors=True)
+
+
+def get_compact_events(data_version: str, cargar_eventos: Callable[[], pd.DataFrame],
+                       root: str = COMPACT_ROOT) -> CompactEventTable:
+    """
+    Returns the compact table of a data version, memory-mapped from disk.
+
+    The first process that needs a version encodes and saves it; the others
+    (and later calls) only map the files. Versions older than the previous
+    one are removed.
+
+    Args:
+        data_version (str): Version of the event data
+        cargar_eventos (Callable[[], pd.DataFrame]): Loader of the typed event table
+        root (str): Folder holding one subfolder per version
+
+    Returns:
+        CompactEventTable: Read-only table shared by the workers of this machine
+    """
+    with _tablas_lock:
+        if data_version in _tablas:
+            return _tablas[data_version]
+        carpeta = _carpeta(root, data_version)
+        if not os.path.exists(os.path.join(carpeta, "schema.json")):
+            with span("compact_events_build"):
+                CompactEventTable.from_frame(cargar_eventos()).save(carpeta)
+            _podar(root, carpeta)
+        _tablas.clear()
+        _tablas[data_version] = CompactEventTable.open(carpeta)
+        return _tablas[data_version]
+
+
+def advance_compact_events(old_version: str, new_version: str, nuevos: pd.DataFrame,
+                           root: str = COMPACT_ROOT) -> bool:
+    """
+    Moves the cached compact table to a new data version by appending the new events.
+
+    Args:
+        old_version (str): Version the cached table was built from
+        new_version (str): Version after the append
+        nuevos (pd.DataFrame): Events appended between both versions
+        root (str): Folder holding one subfolder per version
+
+    Returns:
+        bool: True if the table was advanced, False if none was cached for old_version
+    """
+    with _tablas_lock:
+        tabla = _tablas.pop(old_version, None)
+        if tabla is None:
+            return False
+        carpeta = _carpeta(root, new_version)
+        if not os.path.exists(os.path.join(carpeta, "schema.json")):
+            with span("compact_events_append", rows=len(nuevos)):
+                tabla.append(nuevos).save(carpeta)
+            _podar(root, carpeta)
+        _tablas[new_version] = CompactEventTable.open(carpeta)
+        return True
+
+
+def main() -> None:
+    from tools import _cargar_eventos
+
+    parser = argparse.ArgumentParser(description="Reporte de memoria de la tabla de eventos compacta")
+    parser.add_argument("--output", default=None, help="CSV donde guardar el reporte")
+    args = parser.parse_args()
+
+    eventos = _cargar_eventos()
+    reporte = CompactEventTable.from_frame(eventos).memory_report(eventos)
+    print(reporte.to_string(index=False))
+    total = reporte.iloc[-1]
+    print(f"\n{total['bytes_before'] / 2**20:.1f} MiB -> {total['bytes_after'] / 2**20:.1f} MiB "
+          f"({total['bytes_before'] / max(total['bytes_after'], 1):.1f}x)")
+    if args.output:
+        reporte.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+Evaluation runs with a per-stage latency breakdown
+Each question of a bank is sent to its tool inside a root span, and the
+spans of the call are reduced to the columns of the results tables: query
+embedding, retrieval (vector store open and search), model load, prompt
+tokens, time to first token, generation and total, all on the monotonic
+perf_counter clock. Model calls are streamed (model_factory.measure_ttft) so
+the first token can be timed. A run writes one row per question, and
+--update-table adds the model's mean breakdown to results/tables, where
+results/analyze_results.py can compute the Balance on generation time alone
+or end to end. With --checkpoint every (model, question) cell is saved as
+it finishes, so an interrupted campaign resumes without repeating finished
+cells, and --cells failed stale re-runs only those.
+
+Usage (from the project root):
+    python src/evaluation.py --model gpt --category unstructured --output results/timings/gpt_unstructured.csv
+    python src/evaluation.py --model mock:1 --category structured --limit 3 --update-table
+    python src/evaluation.py --model gpt llama1 llama2 --category unstructured recommendations \\
+        --checkpoint results/checkpoints/campaign.jsonl --cells missing failed
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from loadgen import QUESTION_BANKS, invoke_tool, prepare_workspace
+from model_factory import measure_ttft
+from router import CATEGORIAS, MODELOS, RESULTS_DIR
+from tracing import Span, get_tracer, span
+
+
+# Stage columns of the results tables -> spans whose time they add up
+STAGE_SPANS = {
+    "Embed Time": ("embed_query",),
+    "Retrieve Time": ("vectorstore_open", "retrieve"),
+    "Load Time": ("model_load",),
+    "Generation Time": ("generate",),
+}
+
+# Checkpoint of a campaign and label of the code/prompt version its cells were run with
+CHECKPOINT_PATH = os.getenv("CRITAIR_EVAL_CHECKPOINT", "results/checkpoints/campaign.jsonl")
+EVAL_VERSION = os.getenv("CRITAIR_EVAL_VERSION", "1")
+
+TIMING_COLUMNS = ["Embed Time", "Retrieve Time", "Load Time", "Prompt Tokens", "TTFT", "Generation Time", "Total Time"]
+
+
+def stage_breakdown(spans: List[Span], raiz: Span) -> Dict[str, float]:
+    """
+    Timing columns of one traced call.
+
+    A stage nested in another span of the same name (a retried generation,
+    a hedged call) is counted once. Load Time adds the warm-up loads
+    (model_load) and the load Ollama reported inside a call (load_s of
+    model_call), which is taken out of Generation Time. TTFT is that of the
+    first model call; prompt tokens add up over every call (an agent makes
+    several).
+
+    Args:
+        spans (List[Span]): Finished spans of the call's trace
+        raiz (Span): Root span of the call
+
+    Returns:
+        Dict[str, float]: Value of each column of TIMING_COLUMNS (nan if the stage did not run)
+    """
+    por_id = {s.span_id: s for s in spans}
+
+    def dentro(s: Span, nombre: str) -> bool:
+        padre = por_id.get(s.parent_id)
+        while padre is not None:
+            if padre.name == nombre:
+                return True
+            padre = por_id.get(padre.parent_id)
+        return False
+
+    def anidado(s: Span) -> bool:
+        return dentro(s, s.name)
+
+    fila = {columna: math.nan for columna in TIMING_COLUMNS}
+    for columna, nombres in STAGE_SPANS.items():
+        duraciones = [s.duration for s in spans if s.name in nombres and not anidado(s)]
+        if duraciones:
+            fila[columna] = sum(duraciones)
+    # Cold loads inside a call (Ollama's load_duration) are load, not generation
+    cargas = [s for s in spans if s.name == "model_call" and s.attributes.get("load_s") and not anidado(s)]
+    if cargas:
+        previa = 0.0 if math.isnan(fila["Load Time"]) else fila["Load Time"]
+        fila["Load Time"] = previa + sum(s.attributes["load_s"] for s in cargas)
+        en_generacion = sum(s.attributes["load_s"] for s in cargas if dentro(s, "generate"))
+        if not math.isnan(fila["Generation Time"]):
+            fila["Generation Time"] = max(fila["Generation Time"] - en_generacion, 0.0)
+    llamadas = sorted((s for s in spans if s.name == "model_call" and s.error is None), key=lambda s: s.start)
+    ttft = [s.attributes["ttft_s"] for s in llamadas if "ttft_s" in s.attributes]
+    if ttft:
+        fila["TTFT"] = ttft[0]
+    tokens = [s.attributes["prompt_tokens"] for s in llamadas if "prompt_tokens" in s.attributes]
+    if tokens:
+        fila["Prompt Tokens"] = sum(tokens)
+    fila["Total Time"] = raiz.duration
+    return fila
+
+
+def timed_call(func: Callable[..., Any], *args, **kwargs) -> Tuple[Any, Dict[str, float]]:
+    """
+    Runs a call under a root span and returns its result and timing columns.
+
+    Args:
+        func (Callable[..., Any]): Tool invocation or any traced function
+        *args, **kwargs: Its arguments
+
+    Returns:
+        Tuple[Any, Dict[str, float]]: Result and stage timings (only Total Time
+            when tracing is disabled)
+    """
+    inicio = time.perf_counter()
+    with measure_ttft(), span("evaluation") as raiz:
+        resultado = func(*args, **kwargs)
+    if raiz is None:
+        fila = {columna: math.nan for columna in TIMING_COLUMNS}
+        fila["Total Time"] = time.perf_counter() - inicio
+        return resultado, fila
+    return resultado, stage_breakdown(get_tracer().spans(raiz.trace_id), raiz)
+
+
+class EvaluationCheckpoint:
+    """
+    Append-only JSONL store of finished (model, question) cells of a campaign.
+
+    Every cell is written and flushed to disk as soon as it finishes, so a
+    provider error or a killed process loses at most the cell in flight. On
+    restart the last record of each cell wins; a truncated last line is
+    ignored.
+
+    Args:
+        path (str): JSONL file of the campaign
+        version (str): Label of the code/prompt version; cells recorded under
+            another one are stale
+        max_age_hours (Optional[float]): Cells older than this are stale (never if None)
+    """
+
+    def __init__(self, path: str = CHECKPOINT_PATH, version: str = EVAL_VERSION,
+                 max_age_hours: Optional[float] = None):
+        self.path = path
+        self.version = version
+        self.max_age_hours = max_age_hours
+        self._lock = threading.Lock()
+        self._celdas: Optional[Dict[str, dict]] = None
+
+    @staticmethod
+    def key(model: str, category: str, tool: str, question: str) -> str:
+        """Cell identifier (the question enters as a hash, so an edited question is a new cell)."""
+        huella = hashlib.sha1(question.encode("utf-8")).hexdigest()[:16]
+        return "\x1f".join([model, category, tool, huella])
+
+    def _cargar(self) -> Dict[str, dict]:
+        if self._celdas is None:
+            self._celdas = {}
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for linea in f:
+                        try:
+                            celda = json.loads(linea)
+                        except json.JSONDecodeError:
+                            continue
+                        self._celdas[celda["key"]] = celda
+        return self._celdas
+
+    def state(self, key: str) -> str:
+        """'missing', 'failed', 'stale' or 'done'."""
+        with self._lock:
+            celda = self._cargar().get(key)
+        if celda is None:
+            return "missing"
+        if celda.get("Error"):
+            return "failed"
+        edad_h = (time.time() - celda["completed_at"]) / 3600
+        if celda.get("version") != self.version or (self.max_age_hours is not None and edad_h > self.max_age_hours):
+            return "stale"
+        return "done"
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            return self._cargar().get(key)
+
+    def record(self, key: str, fila: dict) -> None:
+        """Appends a finished cell and flushes it to disk."""
+        celda = {"key": key, "version": self.version, "completed_at": time.time(), **fila}
+        with self._lock:
+            self._cargar()[key] = celda
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(celda, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def counts(self) -> Dict[str, int]:
+        """Number of cells per state."""
+        with self._lock:
+            claves = list(self._cargar())
+        conteo: Dict[str, int] = {}
+        for clave in claves:
+            estado = self.state(clave)
+            conteo[estado] = conteo.get(estado, 0) + 1
+        return conteo
+
+
+def _ejecutar(model: str, herramienta: str, pregunta: str, chat_id: str) -> dict:
+    # Each question starts a fresh session, so its prompt does not depend on the
+    # answers before it (a resumed campaign and a replay send the same requests)
+    from tools import RESPUESTA_NO_DISPONIBLE
+
+    if os.path.exists(f"memories/{chat_id}.pkl"):
+        os.remove(f"memories/{chat_id}.pkl")
+    try:
+        respuesta, tiempos = timed_call(invoke_tool, herramienta, pregunta, model, chat_id)
+        # The tools answer a failure with a fallback text; the cell is failed as in loadgen
+        error = "fallback" if respuesta == RESPUESTA_NO_DISPONIBLE else None
+    except Exception as e:
+        respuesta, tiempos, error = None, {columna: math.nan for columna in TIMING_COLUMNS}, repr(e)
+    return {"Question": pregunta, "Response": respuesta, "Error": error, **tiempos}
+
+
+def evaluate(model: str, category: str, tool: Optional[str] = None, limit: Optional[int] = None,
+             chat_id: str = "evaluation", checkpoint: Optional[EvaluationCheckpoint] = None,
+             cells: Sequence[str] = ("missing",)) -> pd.DataFrame:
+    """
+    Asks every question of a bank and records the answer and its timings.
+
+    With a checkpoint, each cell is persisted as soon as it finishes and only
+    the cells whose state is in `cells` are run; the others are read back, so
+    an interrupted campaign resumes where it stopped.
+
+    Args:
+        model (str): Model name passed to the tool
+        category (str): Key of loadgen.QUESTION_BANKS
+        tool (Optional[str]): Tool to call (the category's default if None)
+        limit (Optional[int]): Number of questions (all if None)
+        chat_id (str): Session used for the tool calls
+        checkpoint (Optional[EvaluationCheckpoint]): Store of finished cells
+        cells (Sequence[str]): States of the cells to run ('missing', 'failed', 'stale', 'done')
+
+    Returns:
+        pd.DataFrame: One row per question with Question, Response, Error and TIMING_COLUMNS
+            (questions not run and not in the checkpoint are left out)
+    """
+    banco, herramienta = QUESTION_BANKS[category]
+    herramienta = tool or herramienta
+    prepare_workspace([chat_id])
+    filas = []
+    for pregunta in banco()[:limit]:
+        if checkpoint is None:
+            fila = _ejecutar(model, herramienta, pregunta, chat_id)
+        else:
+            clave = checkpoint.key(model, category, herramienta, pregunta)
+            if checkpoint.state(clave) not in cells:
+                celda = checkpoint.get(clave)
+                if celda is not None:
+                    filas.append(celda)
+                continue
+            fila = _ejecutar(model, herramienta, pregunta, chat_id)
+            checkpoint.record(clave, {"Model": model, "Category": category, "Tool": herramienta, **fila})
+        filas.append(fila)
+        print(f"{fila['Total Time']:.2f} s | {pregunta[:70]}")
+    return pd.DataFrame(filas, columns=["Question", "Response", "Error"] + TIMING_COLUMNS)
+
+
+def timing_summary(detalle: pd.DataFrame) -> Dict[str, float]:
+    """Mean of each timing column over the questions answered without error."""
+    validas = detalle[detalle["Error"].isna()]
+    return {columna: float(validas[columna].mean()) for columna in TIMING_COLUMNS}
+
+
+def update_results_table(model: str, category: str, resumen: Dict[str, float], tables_dir: str = RESULTS_DIR) -> str:
+    """
+    Writes a model's mean stage timings into the results table of a category.
+
+    The row of the model is matched by its display name (router.MODELOS) and
+    added if missing; BertScore, Inference Time and Balance are kept.
+
+    Args:
+        model (str): Factory name of the model
+        category (str): Key of router.CATEGORIAS
+        resumen (Dict[str, float]): Output of timing_summary()
+        tables_dir (str): Folder of the results tables
+
+    Returns:
+        str: Path of the updated table
+    """
+    nombres = {factory: display for display, factory in MODELOS.items()}
+    path = os.path.join(tables_dir, CATEGORIAS[category])
+    tabla = pd.read_csv(path) if os.path.exists(path) else pd.DataFrame(columns=["Model"])
+    nombre = nombres.get(model, model)
+    for columna in TIMING_COLUMNS:
+        if columna not in tabla:
+            tabla[columna] = math.nan
+    if not (tabla["Model"] == nombre).any():
+        tabla.loc[len(tabla), "Model"] = nombre
+    fila = tabla["Model"] == nombre
+    for columna, valor in resumen.items():
+        tabla.loc[fila, columna] = valor
+    os.makedirs(tables_dir, exist_ok=True)
+    tabla.to_csv(path, index=False)
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Evaluación con desglose de tiempos por etapa")
+    parser.add_argument("--model", nargs="+", required=True, help="Modelos a evaluar (p.ej. gpt llama2 mock:1.5)")
+    parser.add_argument("--category", nargs="+", choices=list(QUESTION_BANKS), default=["unstructured"])
+    parser.add_argument("--tool", help="Herramienta a usar (por defecto la de cada categoría)")
+    parser.add_argument("--limit", type=int, help="Número de preguntas")
+    parser.add_argument("--output", help="CSV con una fila por modelo y pregunta")
+    parser.add_argument("--update-table", action="store_true", help="Agrega los tiempos medios a results/tables")
+    parser.add_argument("--checkpoint", help=f"Guarda cada celda al terminarla y retoma la campaña (p.ej. {CHECKPOINT_PATH})")
+    parser.add_argument("--cells", nargs="+", choices=["missing", "failed", "stale", "done"], default=["missing"],
+                        help="Celdas a ejecutar según su estado en el checkpoint")
+    parser.add_argument("--version", default=EVAL_VERSION, help="Versión de código/prompts; otras quedan obsoletas")
+    parser.add_argument("--max-age-hours", type=float, help="Celdas más antiguas quedan obsoletas")
+    args = parser.parse_args()
+
+    checkpoint = EvaluationCheckpoint(args.checkpoint, args.version, args.max_age_hours) if args.checkpoint else None
+    if checkpoint is not None:
+        print(f"Checkpoint {args.checkpoint}: {checkpoint.counts() or 'vacío'}")
+
+    detalles = []
+    for model in args.model:
+        for category in args.category:
+            print(f"\n🚀 {model} | {category}")
+            detalle = evaluate(model, category, args.tool, args.limit, checkpoint=checkpoint, cells=args.cells)
+            if detalle["Error"].notna().all():
+                print(f"Ninguna pregunta se respondió sin error: {detalle['Error'].iloc[0] if len(detalle) else 'sin preguntas'}")
+            resumen = timing_summary(detalle)
+            print("⏱️  Tiempos medios por etapa")
+            for columna, valor in resumen.items():
+                print(f"   • {columna}: {valor:.3f}" if columna != "Prompt Tokens" else f"   • {columna}: {valor:.0f}")
+            if args.update_table and detalle["Error"].isna().any():
+                print(f"Tabla actualizada: {update_results_table(model, category, resumen)}")
+            detalles.append(detalle.assign(Model=model, Category=category))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        pd.concat(detalles, ignore_index=True).to_csv(args.output, index=False)
+        print(f"Detalle guardado en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,534 @@
+"""
+Partitioned columnar store for the event table (Tabla_General.csv)
+The typed event table is written once per data version as a Parquet dataset
+partitioned by year and department (anio=YYYY/DEP=...). Queries prune
+partitions from a manifest, push MUN / equipment type filters down to the
+Parquet row groups and read only the requested columns, so the I/O of a
+question scales with the slice it asks about instead of the whole history.
+Each build goes to a new folder inside the dataset root, and a pointer file
+(CURRENT) is swapped atomically to it, so readers in any process always find
+a complete dataset; the previous build is kept until the next one.
+"""
+
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Union
+
+import pandas as pd
+
+from tracing import set_attribute, span
+from utils import normalize_query
+
+
+# Columns that can be filtered (partition keys first)
+PARTITION_COLUMNS = ["anio", "DEP"]
+FILTER_COLUMNS = ["DEP", "MUN", "tipo_equi_ope"]
+
+# Rows per Parquet row group; smaller groups give finer MUN / tipo_equi_ope pruning
+ROW_GROUP_SIZE = 64 * 1024
+
+# File in the dataset root naming the folder of the current build
+POINTER = "CURRENT"
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("EventStore requires pyarrow: pip install pyarrow") from e
+    return pa, ds, pq
+
+
+def _as_list(value: Union[None, str, Iterable[str]]) -> Optional[List[str]]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+class EventStore:
+    """
+    Parquet dataset of the event table, partitioned by year and department.
+
+    Args:
+        root (str): Dataset folder (holds the CURRENT pointer and one folder per build,
+            each with its anio=*/DEP=* partitions and _manifest.json)
+    """
+
+    def __init__(self, root: str = "structured_data/eventos_dataset"):
+        self.root = root
+        self._lock = threading.Lock()
+        self._manifest: Optional[dict] = None
+        self._manifest_key: Optional[tuple] = None
+        self.last_scan: Dict[str, int] = {}
+
+    # Manifest ----------------------------------------------------------------------------------
+
+    @property
+    def path(self) -> str:
+        """Folder of the current build (the root itself for a dataset built without a pointer)."""
+        try:
+            with open(os.path.join(self.root, POINTER), "r", encoding="utf-8") as f:
+                return os.path.join(self.root, f.read().strip())
+        except FileNotFoundError:
+            return self.root
+
+    def _current(self):
+        """Folder of the current build and its manifest (None if not built), read together."""
+        path = self.path
+        manifest_path = os.path.join(path, "_manifest.json")
+        try:
+            clave = (path, os.stat(manifest_path).st_mtime_ns)
+        except FileNotFoundError:
+            self._manifest = None
+            return path, None
+        if self._manifest is None or clave != self._manifest_key:
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    self._manifest = json.load(f)
+                self._manifest_key = clave
+            except (FileNotFoundError, json.JSONDecodeError):
+                return path, None
+        return path, self._manifest
+
+    @property
+    def manifest(self) -> Optional[dict]:
+        """
+        Dataset description (versions, partitions and their files, distinct
+        filter values), or None if not built. Re-read when another process
+        rewrites it or swaps in a new build.
+        """
+        return self._current()[1]
+
+    def _save_manifest(self, manifest: dict, path: Optional[str] = None) -> None:
+        """Writes the manifest of a build folder (the current one by default)."""
+        actual = path is None
+        path = self.path if actual else path
+        destino = os.path.join(path, "_manifest.json")
+        tmp = f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, destino)
+        if actual:
+            self._manifest = manifest
+            self._manifest_key = (path, os.stat(destino).st_mtime_ns)
+
+    def _swap(self, nombre: str) -> None:
+        """Points CURRENT at a complete build folder, then removes all builds but it and the previous one."""
+        anterior = os.path.relpath(self.path, self.root)
+        tmp = os.path.join(self.root, f"{POINTER}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(nombre)
+        os.replace(tmp, os.path.join(self.root, POINTER))
+        # The previous build stays for readers that resolved it just before the swap;
+        # folders still being written (.tmp) belong to other builders
+        for entrada in os.listdir(self.root):
+            if entrada in (POINTER, nombre, anterior) or entrada.endswith(".tmp"):
+                continue
+            ruta = os.path.join(self.root, entrada)
+            if os.path.isdir(ruta):
+                shutil.rmtree(ruta, ignore_errors=True)
+            else:
+                os.remove(ruta)
+
+    @property
+    def version(self) -> Optional[str]:
+        """Data version of the stored events (changes with every appended batch)."""
+        manifest = self.manifest
+        return manifest["version"] if manifest else None
+
+    @property
+    def source_version(self) -> Optional[str]:
+        """Version of the source CSV the dataset is in sync with."""
+        manifest = self.manifest
+        return manifest.get("source_version", manifest["version"]) if manifest else None
+
+    def current_version(self, source_version: str) -> str:
+        """
+        Data version to key caches with.
+
+        Args:
+            source_version (str): Current version of the source CSV
+
+        Returns:
+            str: The dataset version if it is in sync with the source, else source_version
+        """
+        return self.version if self.source_version == source_version else source_version
+
+    @staticmethod
+    def _archivos(path: str, relativo: str, particion: dict) -> List[str]:
+        return [os.path.join(path, relativo, f) for f in particion.get("files", ["part-0.parquet"])]
+
+    def valores(self, columna: str) -> List[str]:
+        """Distinct values of a filter column in the stored data."""
+        return self.manifest["valores"][columna] if self.manifest else []
+
+    # Build -------------------------------------------------------------------------------------
+
+    def build(self, eventos: pd.DataFrame, version: str) -> dict:
+        """
+        Writes the typed event table as a partitioned dataset.
+
+        The dataset is written to a new folder and the CURRENT pointer is
+        swapped to it when complete, so concurrent readers (in this or other
+        processes) never see a half-written or missing dataset.
+
+        Args:
+            eventos (pd.DataFrame): Typed event table (see tools._cargar_eventos)
+            version (str): Data version the dataset is built from
+
+        Returns:
+            dict: Manifest of the new dataset
+        """
+        pa, ds, pq = _pyarrow()
+        with span("event_store_build", rows=len(eventos)):
+            eventos = eventos.copy()
+            eventos["anio"] = eventos["FECHA"].dt.year.astype("int16")
+            # Plain strings (not dictionaries) keep min/max statistics per row group,
+            # and sorting by them makes those statistics selective
+            for col in FILTER_COLUMNS + ["causa"]:
+                if col in eventos:
+                    eventos[col] = eventos[col].astype(str)
+            eventos = eventos.sort_values(["anio", "DEP", "MUN", "tipo_equi_ope", "inicio"], kind="stable")
+
+            nombre = f"v-{time.time_ns()}-{os.getpid()}"
+            tmp = os.path.join(self.root, f"{nombre}.tmp")
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            particiones = {}
+            for (anio, dep), grupo in eventos.groupby(PARTITION_COLUMNS, sort=True, observed=True):
+                relativo = f"anio={int(anio)}/DEP={dep}"
+                os.makedirs(os.path.join(tmp, relativo), exist_ok=True)
+                tabla = pa.Table.from_pandas(grupo.drop(columns=PARTITION_COLUMNS), preserve_index=False)
+                pq.write_table(tabla, os.path.join(tmp, relativo, "part-0.parquet"), row_group_size=ROW_GROUP_SIZE)
+                particiones[relativo] = {"anio": int(anio), "DEP": dep, "rows": len(grupo), "files": ["part-0.parquet"]}
+
+            manifest = {
+                "version": version,
+                "source_version": version,
+                "batches": 0,
+                "rows": len(eventos),
+                "columns": [c for c in eventos.columns if c not in PARTITION_COLUMNS],
+                "dtypes": {c: str(t) for c, t in eventos.dtypes.items() if c not in PARTITION_COLUMNS},
+                "anio_min": int(eventos["anio"].min()) if len(eventos) else None,
+                "anio_max": int(eventos["anio"].max()) if len(eventos) else None,
+                "valores": {c: sorted(eventos[c].dropna().unique().tolist()) for c in FILTER_COLUMNS if c in eventos},
+                "partitions": particiones,
+            }
+            self._save_manifest(manifest, tmp)
+
+            os.replace(tmp, os.path.join(self.root, nombre))
+            self._swap(nombre)
+            self._manifest = None
+        return self.manifest
+
+    def ensure(self, source_version: str, cargar_eventos: Callable[[], pd.DataFrame]) -> None:
+        """
+        Rebuilds the dataset if it is not in sync with the source CSV.
+
+        Args:
+            source_version (str): Current version of the source CSV
+            cargar_eventos (Callable[[], pd.DataFrame]): Loader of the typed event table
+        """
+        if self.source_version == source_version:
+            return
+        with self._lock:
+            if self.source_version != source_version:
+                self.build(cargar_eventos(), source_version)
+
+    def append(self, nuevos: pd.DataFrame, source_version: Optional[str] = None) -> str:
+        """
+        Appends a batch of typed events as new files of their partitions.
+
+        Existing files are not rewritten; the manifest (rows, files, distinct
+        values, year range) is updated and the data version bumped. If the
+        dataset was already rebuilt from a source CSV at source_version (a
+        concurrent ensure() after the batch reached the CSV), it holds the batch
+        and nothing is written.
+
+        Args:
+            nuevos (pd.DataFrame): Typed events with the stored columns
+            source_version (Optional[str]): New version of the source CSV if the
+                batch was also appended to it
+
+        Returns:
+            str: New data version
+
+        Raises:
+            FileNotFoundError: If the dataset has not been built
+        """
+        pa, ds, pq = _pyarrow()
+        with self._lock:
+            path, manifest = self._current()
+            if manifest is None:
+                raise FileNotFoundError(f"Event dataset not built: {self.root}")
+            if source_version is not None and manifest.get("source_version") == source_version:
+                return manifest["version"]
+            manifest = json.loads(json.dumps(manifest))
+            lote = manifest["batches"] + 1 if "batches" in manifest else 1
+
+            with span("event_store_append", rows=len(nuevos)):
+                nuevos = nuevos.copy()
+                nuevos["anio"] = nuevos["FECHA"].dt.year.astype("int16")
+                for col in FILTER_COLUMNS + ["causa"]:
+                    if col in nuevos:
+                        nuevos[col] = nuevos[col].astype(str)
+                esquema = None
+                for (anio, dep), grupo in nuevos.groupby(PARTITION_COLUMNS, sort=True, observed=True):
+                    relativo = f"anio={int(anio)}/DEP={dep}"
+                    particion = manifest["partitions"].setdefault(
+                        relativo, {"anio": int(anio), "DEP": dep, "rows": 0, "files": []}
+                    )
+                    if esquema is None:
+                        # New files share the schema of the existing ones
+                        existente = next(iter(manifest["partitions"].items()))
+                        esquema = pq.read_schema(self._archivos(path, *existente)[0]) if existente[1]["rows"] else None
+                    grupo = grupo.drop(columns=PARTITION_COLUMNS)
+                    if esquema is not None:
+                        grupo = grupo.reindex(columns=esquema.names)
+                        tabla = pa.Table.from_pandas(grupo, schema=esquema, preserve_index=False)
+                    else:
+                        tabla = pa.Table.from_pandas(grupo, preserve_index=False)
+                    nombre = f"part-{lote}.parquet"
+                    os.makedirs(os.path.join(path, relativo), exist_ok=True)
+                    pq.write_table(tabla, os.path.join(path, relativo, nombre), row_group_size=ROW_GROUP_SIZE)
+                    particion.setdefault("files", ["part-0.parquet"]).append(nombre)
+                    particion["rows"] += len(grupo)
+
+                manifest["rows"] += len(nuevos)
+                manifest["batches"] = lote
+                manifest["source_version"] = source_version or manifest.get("source_version", manifest["version"])
+                manifest["version"] = f"{manifest['version'].split('+')[0]}+{lote}"
+                anios = [a for a in (manifest["anio_min"], manifest["anio_max"]) if a is not None]
+                anios += [int(nuevos["anio"].min()), int(nuevos["anio"].max())]
+                manifest["anio_min"], manifest["anio_max"] = min(anios), max(anios)
+                for col in FILTER_COLUMNS:
+                    if col in nuevos:
+                        manifest["valores"][col] = sorted(set(manifest["valores"].get(col, [])) | set(nuevos[col].dropna()))
+                self._save_manifest(manifest, path)
+        return manifest["version"]
+
+    def compact(self, max_files: int = 8) -> int:
+        """
+        Rewrites partitions that accumulated more than max_files files into one file.
+
+        Args:
+            max_files (int): Files a partition may hold before it is compacted
+
+        Returns:
+            int: Number of partitions compacted
+        """
+        pa, ds, pq = _pyarrow()
+        compactadas = 0
+        with self._lock:
+            path, manifest = self._current()
+            manifest = json.loads(json.dumps(manifest or {"partitions": {}}))
+            for relativo, particion in manifest["partitions"].items():
+                archivos = self._archivos(path, relativo, particion)
+                if len(archivos) <= max_files:
+                    continue
+                with span("event_store_compact", partition=relativo, files=len(archivos)):
+                    tabla = pa.concat_tables([pq.read_table(a) for a in archivos], promote_options="default")
+                    nombre = f"part-c{manifest.get('batches', 0)}.parquet"
+                    pq.write_table(tabla, os.path.join(path, relativo, nombre), row_group_size=ROW_GROUP_SIZE)
+                    particion["files"] = [nombre]
+                    compactadas += 1
+            if compactadas:
+                self._save_manifest(manifest, path)
+                for relativo, particion in manifest["partitions"].items():
+                    for nombre in os.listdir(os.path.join(path, relativo)):
+                        if nombre.endswith(".parquet") and nombre not in particion["files"]:
+                            os.remove(os.path.join(path, relativo, nombre))
+        return compactadas
+
+    # Query -------------------------------------------------------------------------------------
+
+    def _canonico(self, columna: str, valores: Optional[List[str]]) -> Optional[List[str]]:
+        """Maps user values to the stored spelling (case and accent insensitive)."""
+        if valores is None:
+            return None
+        conocidos = {normalize_query(v): v for v in self.valores(columna)}
+        return [conocidos.get(normalize_query(v), v) for v in valores]
+
+    def query(self, columns: Optional[Sequence[str]] = None, anio_inicio: Optional[int] = None,
+              anio_fin: Optional[int] = None, DEP: Union[None, str, Iterable[str]] = None,
+              MUN: Union[None, str, Iterable[str]] = None,
+              tipo_equi_ope: Union[None, str, Iterable[str]] = None) -> pd.DataFrame:
+        """
+        Reads a slice of the event table.
+
+        Year and department filters select partition folders from the manifest;
+        municipality and equipment type filters are pushed down to the Parquet
+        row groups. Only the requested columns are read.
+
+        Args:
+            columns (Optional[Sequence[str]]): Columns to return (all if None)
+            anio_inicio (Optional[int]): First year included
+            anio_fin (Optional[int]): Last year included
+            DEP (str | list, optional): Department(s)
+            MUN (str | list, optional): Municipality(ies)
+            tipo_equi_ope (str | list, optional): Equipment type(s)
+
+        Returns:
+            pd.DataFrame: Matching events, typed like tools._cargar_eventos (plus DEP)
+
+        Raises:
+            FileNotFoundError: If the dataset has not been built
+        """
+        pa, ds, pq = _pyarrow()
+        path, manifest = self._current()
+        if manifest is None:
+            raise FileNotFoundError(f"Event dataset not built: {self.root}")
+
+        deps = self._canonico("DEP", _as_list(DEP))
+        muns = self._canonico("MUN", _as_list(MUN))
+        tipos = self._canonico("tipo_equi_ope", _as_list(tipo_equi_ope))
+
+        with span("event_store_scan"):
+            particiones = [
+                (relativo, p) for relativo, p in manifest["partitions"].items()
+                if (anio_inicio is None or p["anio"] >= anio_inicio)
+                and (anio_fin is None or p["anio"] <= anio_fin)
+                and (deps is None or p["DEP"] in deps)
+            ]
+            archivos = [a for relativo, p in particiones for a in self._archivos(path, relativo, p)]
+
+            columnas = list(columns) if columns is not None else list(manifest["columns"]) + ["DEP"]
+            leer = [c for c in columnas if c not in PARTITION_COLUMNS]
+            filtro = None
+            for col, valores in (("MUN", muns), ("tipo_equi_ope", tipos)):
+                if valores is not None:
+                    condicion = ds.field(col).isin(valores)
+                    filtro = condicion if filtro is None else filtro & condicion
+
+            if archivos:
+                dataset = ds.dataset(
+                    archivos, format="parquet", partition_base_dir=path,
+                    partitioning=ds.partitioning(pa.schema([("anio", pa.int16()), ("DEP", pa.string())]), flavor="hive"),
+                )
+                tabla = dataset.to_table(columns=leer + [c for c in PARTITION_COLUMNS if c in columnas], filter=filtro)
+                eventos = tabla.to_pandas()
+            else:
+                eventos = pd.DataFrame(columns=[c for c in columnas])
+
+            self.last_scan = {
+                "partitions": len(particiones),
+                "files": len(archivos),
+                "partitions_total": len(manifest["partitions"]),
+                "rows": len(eventos),
+                "rows_total": manifest["rows"],
+                "columns": len(columnas),
+            }
+            for clave, valor in self.last_scan.items():
+                set_attribute(clave, valor)
+
+        for col in eventos.select_dtypes(include=["object"]).columns:
+            eventos[col] = eventos[col].astype("category")
+        return eventos[[c for c in columnas if c in eventos]]
+
+    # Filter inference --------------------------------------------------------------------------
+
+    def _patron(self, valor: str, plural: bool) -> str:
+        palabras = normalize_query(valor).split()
+        sufijo = r"(?:e?s)?" if plural else ""
+        # Letters may be split or joined differently ("Villamaría" / "Villa María")
+        cuerpo = r"\s*".join(r"\s?".join(re.escape(c) for c in p) + sufijo for p in palabras)
+        return rf"\b{cuerpo}\b"
+
+    def _coincidencias(self, texto: str, columna: str, plural: bool = False,
+                       valores: Optional[Dict[str, List[str]]] = None) -> List[str]:
+        candidatos = valores.get(columna, []) if valores is not None else self.valores(columna)
+        return [v for v in candidatos if v and re.search(self._patron(v, plural), texto)]
+
+    def infer_filters(self, query: str,
+                      valores: Optional[Dict[str, List[str]]] = None) -> Dict[str, Union[int, List[str]]]:
+        """
+        Infers conservative scan filters from a question.
+
+        Recognizes year ranges ('entre el año 2019 y el año 2023', 'a partir del
+        año 2022', 'antes del año 2022', 'en el año 2023', 'el último año') and
+        department, municipality and equipment type names present in the data.
+        Anything not recognized is left unfiltered.
+
+        Args:
+            query (str): User question
+            valores (Optional[Dict[str, List[str]]]): Known values per column
+                (defaults to those of the stored dataset)
+
+        Returns:
+            Dict[str, Union[int, List[str]]]: Keyword arguments for query()
+        """
+        texto = normalize_query(query)
+        filtros: Dict[str, Union[int, List[str]]] = {}
+
+        # Years, not digits of a coordinate such as 5.2019
+        anios = [int(a) for a in re.findall(r"(?<![\d.,])(?:19|20)\d{2}(?![\d]|[.,]\d)", texto)]
+        if re.search(r"\bentre\b", texto) and len(anios) >= 2:
+            filtros["anio_inicio"], filtros["anio_fin"] = min(anios[:2]), max(anios[:2])
+        elif len(anios) == 1:
+            anio = anios[0]
+            if re.search(rf"\b(?:a partir|desde|despues)\b[^0-9]*{anio}", texto):
+                filtros["anio_inicio"] = anio
+            elif re.search(rf"\bantes\b[^0-9]*{anio}", texto):
+                filtros["anio_fin"] = anio - 1
+            elif re.search(rf"\bhasta\b[^0-9]*{anio}", texto):
+                filtros["anio_fin"] = anio
+            elif re.search(rf"\ben (?:el )?(?:ano )?{anio}\b", texto):
+                filtros["anio_inicio"] = filtros["anio_fin"] = anio
+        elif re.search(r"\bultimo ano\b", texto) and self.manifest and self.manifest["anio_max"] is not None:
+            filtros["anio_inicio"] = filtros["anio_fin"] = self.manifest["anio_max"]
+
+        deps = self._coincidencias(texto, "DEP", valores=valores)
+        # A municipality sharing its name with a matched department is not a filter
+        muns = [m for m in self._coincidencias(texto, "MUN", valores=valores)
+                if normalize_query(m) not in map(normalize_query, deps)]
+        tipos = self._coincidencias(texto, "tipo_equi_ope", plural=True, valores=valores)
+        # Questions about what did NOT happen need the other places to compare with
+        if re.search(r"\bno se (?:ha|halla|haya)|\bningun", texto):
+            return filtros
+        if deps:
+            filtros["DEP"] = deps
+        if muns:
+            filtros["MUN"] = muns
+        # 'tipo de equipo' questions compare equipment types: never restrict them
+        if tipos and not re.search(r"\btipos? de equipos?\b", texto):
+            filtros["tipo_equi_ope"] = tipos
+        return filtros
+
+
+def filtrar(eventos: pd.DataFrame, anio_inicio: Optional[int] = None, anio_fin: Optional[int] = None,
+            **valores: Union[None, str, Iterable[str]]) -> pd.DataFrame:
+    """
+    Applies the filters of EventStore.query to an in-memory event table.
+
+    Args:
+        eventos (pd.DataFrame): Typed event table
+        anio_inicio (Optional[int]): First year included
+        anio_fin (Optional[int]): Last year included
+        **valores: DEP, MUN and/or tipo_equi_ope value(s), matched case and accent insensitive
+
+    Returns:
+        pd.DataFrame: Matching events
+    """
+    mask = pd.Series(True, index=eventos.index)
+    anio = eventos["FECHA"].dt.year
+    if anio_inicio is not None:
+        mask &= anio >= anio_inicio
+    if anio_fin is not None:
+        mask &= anio <= anio_fin
+    for col, valor in valores.items():
+        buscados = _as_list(valor)
+        if buscados is not None:
+            buscados = {normalize_query(v) for v in buscados}
+            mask &= eventos[col].astype(str).map(normalize_query).isin(buscados)
+    return eventos[mask]
+
+
+default_event_store = EventStore()
@@ -0,0 +1,381 @@
+"""
+Hedged requests across two chat models for tail-latency control
+A request is streamed from the primary model; if no token arrives within a
+deadline (or the primary fails first), the same request is sent to a backup
+model and the first of the two to finish answers, while the other one is
+cancelled (its stream is closed). Selected in create_llm_chat_model() with
+names such as 'gemini-2.5-pro-exp-03-25|gpt' or 'mock:3|mock:0.5@1.5'
+(primary|backup@deadline in seconds, CRITAIR_HEDGE_DEADLINE by default).
+
+Every hedged model keeps counters of how often hedging fires and who wins,
+and the latency percentiles with hedging and of the primary alone. A small
+fraction of the primaries that lose are left running (shadowed) so the
+primary's tail is measured on live traffic; the benchmark below measures
+both distributions on the same load.
+
+Usage (from the project root):
+    python src/hedging.py --primary mock:3 --backup mock:0.5 --deadline 1 --requests 200
+"""
+
+import argparse
+import asyncio
+import operator
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from functools import reduce
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from tracing import bind_context, set_attribute, span
+
+
+HEDGE_DEADLINE = float(os.getenv("CRITAIR_HEDGE_DEADLINE", "2.0"))
+
+# Fraction of the requests won by the backup whose primary is not cancelled,
+# so its full latency is measured (0 keeps only a lower bound)
+HEDGE_SHADOW_RATE = float(os.getenv("CRITAIR_HEDGE_SHADOW_RATE", "0.05"))
+
+# Latency samples kept per hedged model
+MUESTRAS = 10_000
+
+
+def is_hedged_model(model: str) -> bool:
+    """
+    Checks if a model name asks for hedging.
+
+    Args:
+        model (str): Model name
+
+    Returns:
+        bool: True for 'primary|backup' and 'primary|backup@deadline' names
+    """
+    return "|" in model
+
+
+def parse_hedged_name(model: str) -> Tuple[str, str, float]:
+    """Primary, backup and deadline of a 'primary|backup@deadline' name."""
+    nombres, _, deadline = model.partition("@")
+    primario, _, respaldo = nombres.partition("|")
+    return primario.strip(), respaldo.strip(), float(deadline) if deadline else HEDGE_DEADLINE
+
+
+class HedgeStats:
+    """
+    Hedging counters and latency samples of one hedged model.
+
+    The latency of the primary alone is estimated from the requests it won
+    plus the shadowed ones (primaries left running after losing), weighted by
+    the inverse of the shadow rate. Without shadowing, a lost primary counts
+    with its latency when cancelled, a lower bound.
+    """
+
+    def __init__(self, max_samples: int = MUESTRAS):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.backup_wins = 0
+        self.failures = 0
+        self.censored = 0
+        self._observadas: deque = deque(maxlen=max_samples)
+        self._primarias: deque = deque(maxlen=max_samples)   # (latency, weight)
+
+    def record(self, latencia: float, cubierta: bool, ganador: Optional[str]) -> None:
+        with self._lock:
+            self.requests += 1
+            self.hedged += cubierta
+            self.backup_wins += ganador == "backup"
+            self.failures += ganador is None
+            if ganador is not None:
+                self._observadas.append(latencia)
+
+    def record_primary(self, latencia: float, peso: float = 1.0, censurada: bool = False) -> None:
+        with self._lock:
+            self.censored += censurada
+            self._primarias.append((latencia, peso))
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Fire rate, wins and p50/p95/p99 with hedging vs the primary alone.
+
+        Returns:
+            Dict[str, float]: Counters, hedge_rate, p<q>_s (observed),
+            p<q>_primary_s (estimated primary alone) and p<q>_saved_s
+        """
+        with self._lock:
+            resumen = {"requests": self.requests, "hedged": self.hedged, "backup_wins": self.backup_wins,
+                       "failures": self.failures, "censored": self.censored,
+                       "hedge_rate": self.hedged / self.requests if self.requests else 0.0}
+            observadas = np.array(self._observadas, dtype=np.float64)
+            primarias = np.array(self._primarias, dtype=np.float64).reshape(-1, 2)
+        orden = np.argsort(primarias[:, 0])
+        valores, acumulado = primarias[orden, 0], np.cumsum(primarias[orden, 1])
+        for q in (50, 95, 99):
+            observada = float(np.percentile(observadas, q)) if len(observadas) else np.nan
+            primaria = (float(valores[min(np.searchsorted(acumulado, q / 100 * acumulado[-1]), len(valores) - 1)])
+                        if len(valores) else np.nan)
+            resumen[f"p{q}_s"] = observada
+            resumen[f"p{q}_primary_s"] = primaria
+            resumen[f"p{q}_saved_s"] = primaria - observada
+        return resumen
+
+
+_stats: Dict[str, HedgeStats] = {}
+_stats_lock = threading.Lock()
+
+
+def get_hedge_stats(model_name: str) -> HedgeStats:
+    """Statistics of a hedged model name, shared by all its instances in the process."""
+    with _stats_lock:
+        if model_name not in _stats:
+            _stats[model_name] = HedgeStats()
+        return _stats[model_name]
+
+
+def hedge_metrics() -> Dict[str, Dict[str, float]]:
+    """Summary of every hedged model used in the process."""
+    with _stats_lock:
+        nombres = list(_stats)
+    return {nombre: get_hedge_stats(nombre).summary() for nombre in nombres}
+
+
+def _resultado(partes: List[Any]) -> ChatResult:
+    """Chat result from the streamed chunks of a response."""
+    mensaje = reduce(operator.add, partes) if partes else AIMessage(content="")
+    return ChatResult(generations=[ChatGeneration(message=AIMessage(content=mensaje.content))])
+
+
+class HedgedChatModel(BaseChatModel):
+    """
+    Chat model that hedges a primary model with a backup one.
+
+    Attributes:
+        primary (BaseChatModel): Model tried first
+        backup (BaseChatModel): Model started when the primary misses the deadline
+        deadline (float): Seconds to wait for the primary's first token
+        shadow_rate (float): Fraction of lost primaries left running to measure
+            the latency hedging saves
+        model_name (str): Name reported by the model (key of its statistics)
+    """
+    primary: BaseChatModel
+    backup: BaseChatModel
+    deadline: float = HEDGE_DEADLINE
+    shadow_rate: float = HEDGE_SHADOW_RATE
+    model_name: str = "hedged"
+
+    @classmethod
+    def from_name(cls, model: str, factory: Callable[[str], BaseChatModel]) -> "HedgedChatModel":
+        """
+        Builds a hedged model from a 'primary|backup@deadline' name.
+
+        Args:
+            model (str): Model name
+            factory (Callable[[str], BaseChatModel]): Builds each side (utils.create_llm_chat_model)
+
+        Returns:
+            HedgedChatModel: Configured hedged model
+        """
+        primario, respaldo, deadline = parse_hedged_name(model)
+        return cls(primary=factory(primario), backup=factory(respaldo), deadline=deadline, model_name=model)
+
+    @property
+    def _llm_type(self) -> str:
+        return "critair-hedged"
+
+    @property
+    def stats(self) -> HedgeStats:
+        return get_hedge_stats(self.model_name)
+
+    def _registrar(self, inicio: float, cubierta: bool, ganador: Optional[str]) -> bool:
+        """
+        Records a finished request; returns whether a losing primary is left running as a shadow.
+        """
+        latencia = time.perf_counter() - inicio
+        self.stats.record(latencia, cubierta, ganador)
+        set_attribute("hedged", cubierta)
+        set_attribute("winner", ganador)
+        if ganador == "primary":
+            self.stats.record_primary(latencia)
+        elif ganador == "backup":
+            if self.shadow_rate > 0 and random.random() < self.shadow_rate:
+                return True
+            if self.shadow_rate <= 0:
+                self.stats.record_primary(latencia, censurada=True)
+        return False
+
+    # Sync ----------------------------------------------------------------------------------------
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        resultados: queue.Queue = queue.Queue()
+        primer_token = threading.Event()
+        cancelar = {"primary": threading.Event(), "backup": threading.Event()}
+        sombra = threading.Event()
+        inicio = time.perf_counter()
+
+        def correr(nombre: str, modelo: BaseChatModel) -> None:
+            partes = []
+            try:
+                for chunk in modelo.stream(messages, stop=stop, **kwargs):
+                    if nombre == "primary":
+                        primer_token.set()
+                    if cancelar[nombre].is_set():
+                        # Leaving the loop closes the stream (and its HTTP connection)
+                        return
+                    partes.append(chunk)
+                resultados.put((nombre, partes, None))
+                if sombra.is_set() and nombre == "primary":
+                    self.stats.record_primary(time.perf_counter() - inicio, 1 / self.shadow_rate)
+            except Exception as e:
+                resultados.put((nombre, None, e))
+            finally:
+                if nombre == "primary":
+                    primer_token.set()
+
+        activos = set()
+
+        def iniciar(nombre: str, modelo: BaseChatModel) -> None:
+            activos.add(nombre)
+            threading.Thread(target=bind_context(correr), args=(nombre, modelo), daemon=True).start()
+
+        with span("hedge", model=self.model_name, deadline=self.deadline):
+            iniciar("primary", self.primary)
+            cubierta = not primer_token.wait(self.deadline)
+            if cubierta:
+                iniciar("backup", self.backup)
+            error = None
+            while activos:
+                nombre, partes, error_actual = resultados.get()
+                activos.discard(nombre)
+                if error_actual is None:
+                    if self._registrar(inicio, cubierta, nombre):
+                        sombra.set()
+                    else:
+                        for otro in activos:
+                            cancelar[otro].set()
+                    return _resultado(partes)
+                error = error or error_actual
+                # The primary failed: the backup is the fallback
+                if not cubierta:
+                    cubierta = True
+                    iniciar("backup", self.backup)
+            self._registrar(inicio, cubierta, None)
+            raise error
+
+    # Async ---------------------------------------------------------------------------------------
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        primer_token = asyncio.Event()
+        inicio = time.perf_counter()
+
+        async def correr(nombre: str, modelo: BaseChatModel) -> ChatResult:
+            partes = []
+            async for chunk in modelo.astream(messages, stop=stop, **kwargs):
+                if nombre == "primary":
+                    primer_token.set()
+                partes.append(chunk)
+            return _resultado(partes)
+
+        def al_terminar_sombra(tarea: asyncio.Task) -> None:
+            if not tarea.cancelled() and tarea.exception() is None:
+                self.stats.record_primary(time.perf_counter() - inicio, 1 / self.shadow_rate)
+
+        with span("hedge", model=self.model_name, deadline=self.deadline):
+            primaria = asyncio.ensure_future(correr("primary", self.primary))
+            espera = asyncio.ensure_future(primer_token.wait())
+            listos, _ = await asyncio.wait({primaria, espera}, timeout=self.deadline,
+                                           return_when=asyncio.FIRST_COMPLETED)
+            espera.cancel()
+            cubierta = not listos or (primaria.done() and primaria.exception() is not None)
+            tareas = {primaria: "primary"}
+            if cubierta:
+                tareas[asyncio.ensure_future(correr("backup", self.backup))] = "backup"
+
+            pendientes = set(tareas)
+            error = None
+            try:
+                while pendientes:
+                    listos, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+                    for tarea in listos:
+                        if tarea.exception() is None:
+                            if self._registrar(inicio, cubierta, tareas[tarea]):
+                                primaria.add_done_callback(al_terminar_sombra)
+                                del tareas[primaria]
+                            return tarea.result()
+                        error = error or tarea.exception()
+                    # The primary failed after its first token: fall back to the backup
+                    if not pendientes and not cubierta:
+                        cubierta = True
+                        respaldo = asyncio.ensure_future(correr("backup", self.backup))
+                        tareas[respaldo] = "backup"
+                        pendientes = {respaldo}
+            finally:
+                # Losers are cancelled (a shadowed primary was removed from tareas)
+                for tarea in tareas:
+                    tarea.cancel()
+            self._registrar(inicio, cubierta, None)
+            raise error
+
+
+async def benchmark(primary: str, backup: str, deadline: float, requests: int = 200,
+                    concurrency: int = 20) -> Dict[str, Dict[str, float]]:
+    """
+    Latency of the primary alone vs hedged with the backup, on the same request load.
+
+    Args:
+        primary (str): Primary model name
+        backup (str): Backup model name
+        deadline (float): First-token deadline in seconds
+        requests (int): Requests per configuration
+        concurrency (int): Requests in flight at a time
+
+    Returns:
+        Dict[str, Dict[str, float]]: p50/p95/p99 per configuration and the hedging summary
+    """
+    from utils import create_llm_chat_model
+
+    semaforo = asyncio.Semaphore(concurrency)
+
+    async def medir(modelo: BaseChatModel, i: int) -> float:
+        async with semaforo:
+            inicio = time.perf_counter()
+            await modelo.ainvoke([HumanMessage(content=f"Pregunta de prueba {i}")])
+            return time.perf_counter() - inicio
+
+    resultado = {}
+    nombre_cubierto = f"{primary}|{backup}@{deadline}"
+    for nombre in (primary, nombre_cubierto):
+        modelo = create_llm_chat_model(nombre)
+        latencias = await asyncio.gather(*(medir(modelo, i) for i in range(requests)))
+        resultado[nombre] = {f"p{q}_s": float(np.percentile(latencias, q)) for q in (50, 95, 99)}
+    # Read through the instance: run as a script, this module and the one utils imports differ
+    resultado["hedging"] = modelo.stats.summary()
+    return resultado
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de solicitudes cubiertas entre dos modelos")
+    parser.add_argument("--primary", default="mock:3")
+    parser.add_argument("--backup", default="mock:0.5")
+    parser.add_argument("--deadline", type=float, default=HEDGE_DEADLINE)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    resultado = asyncio.run(benchmark(args.primary, args.backup, args.deadline, args.requests, args.concurrency))
+    for nombre, valores in resultado.items():
+        print(nombre)
+        for clave, valor in valores.items():
+            print(f"  {clave}: {valor:.3f}" if isinstance(valor, float) else f"  {clave}: {valor}")
+
+
+if __name__ == "__main__":
+    main()
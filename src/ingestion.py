@@ -0,0 +1,265 @@
+"""
+Append-only ingestion of new interruption events
+A batch of events is validated and typed once, appended to the partitioned
+event dataset as new files (and to Tabla_General.csv, so the CSV stays the
+complete source), and merged into every derived structure cached in the
+process (chart aggregates, compact event table, reliability cube, spatial index,
+SQL engine, streamed summary, interval index).
+The data version is bumped, which invalidates version-keyed caches such as
+the plot store. A day's batch costs in proportion to its own size.
+
+Usage (from the project root):
+    python src/ingestion.py nuevos_eventos.csv
+"""
+
+import argparse
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Union
+
+import pandas as pd
+
+from chart_templates import advance_aggregates
+from compact_events import advance_compact_events
+from event_store import PARTITION_COLUMNS, EventStore, default_event_store
+from interval_index import advance_interval_index
+from reliability import advance_reliability_engine
+from spatial_index import advance_spatial_index
+from sql_engine import advance_sql_engine
+from streaming import advance_streaming_summary
+from tracing import set_attribute, span
+
+
+# Columns a batch must provide (FECHA, fin and duracion_h are derived if missing)
+REQUIRED_COLUMNS = ["inicio", "DEP", "MUN", "tipo_equi_ope"]
+
+DATETIME_COLUMNS = {"inicio": "%Y-%m-%d %H:%M:%S", "fin": "%Y-%m-%d %H:%M:%S", "FECHA": "%Y-%m-%d"}
+
+# Caches updated in place after every batch: f(old_version, new_version, new_events) -> bool
+DEPENDENTS: List[Callable[[str, str, pd.DataFrame], bool]] = [
+    advance_aggregates,
+    advance_compact_events,
+    advance_reliability_engine,
+    advance_spatial_index,
+    advance_sql_engine,
+    advance_streaming_summary,
+    advance_interval_index,
+]
+
+
+@dataclass
+class IngestReport:
+    """
+    Result of an ingested batch.
+
+    Attributes:
+        accepted (int): Events appended
+        rejected (int): Events dropped by validation
+        errors (List[str]): Reasons for rejected events and dropped columns, and caches that failed to advance
+        old_version (str): Data version before the batch
+        new_version (str): Data version after the batch
+        updated (Dict[str, bool]): Whether each cached structure was advanced in place (False if it
+            was not cached or failed and was dropped)
+        seconds (float): Ingestion time
+    """
+    accepted: int = 0
+    rejected: int = 0
+    errors: List[str] = field(default_factory=list)
+    old_version: Optional[str] = None
+    new_version: Optional[str] = None
+    updated: Dict[str, bool] = field(default_factory=dict)
+    seconds: float = 0.0
+
+
+def validate_batch(lote: pd.DataFrame, columnas: List[str], dtypes: Optional[Dict[str, str]] = None):
+    """
+    Validates and types a batch of raw events.
+
+    Dates are parsed with the formats of Tabla_General.csv, FECHA is derived
+    from inicio when missing (and duracion_h from inicio/fin), numeric columns
+    are coerced to their stored dtype and string columns become categories. Rows without a valid
+    start or without DEP/MUN/tipo_equi_ope are rejected.
+
+    Args:
+        lote (pd.DataFrame): Raw events (e.g. read from a CSV with dtype=str)
+        columnas (List[str]): Columns of the stored event table
+        dtypes (Optional[Dict[str, str]]): Stored pandas dtype of each column
+
+    Returns:
+        Tuple[pd.DataFrame, List[str]]: Typed events with the stored columns, and errors
+    """
+    errores = []
+    faltantes = [c for c in REQUIRED_COLUMNS if c not in lote]
+    if faltantes:
+        raise ValueError(f"Batch is missing required columns: {', '.join(faltantes)}")
+    extra = [c for c in lote.columns if c not in columnas]
+    if extra:
+        errores.append(f"Dropped unknown columns: {', '.join(extra)}")
+
+    lote = lote.reset_index(drop=True)
+    eventos = pd.DataFrame(index=lote.index)
+    for col, formato in DATETIME_COLUMNS.items():
+        if col in lote:
+            eventos[col] = pd.to_datetime(lote[col].astype(str), format=formato, errors="coerce")
+    if "FECHA" not in eventos or eventos["FECHA"].isna().all():
+        eventos["FECHA"] = eventos["inicio"].dt.normalize()
+    else:
+        eventos["FECHA"] = eventos["FECHA"].fillna(eventos["inicio"].dt.normalize())
+    if "duracion_h" not in lote and "fin" in eventos:
+        eventos["duracion_h"] = (eventos["fin"] - eventos["inicio"]).dt.total_seconds() / 3600
+
+    dtypes = dtypes or {}
+    for col in columnas:
+        if col in eventos:
+            continue
+        if col not in lote:
+            eventos[col] = pd.Series(index=lote.index, dtype=dtypes.get(col, "object"))
+        elif str(dtypes.get(col, "")).startswith(("int", "float")) or pd.api.types.is_numeric_dtype(lote[col]):
+            eventos[col] = pd.to_numeric(lote[col], errors="coerce")
+        else:
+            eventos[col] = lote[col].where(lote[col].notna(), None)
+
+    invalidos = eventos["inicio"].isna()
+    for col in ["DEP", "MUN", "tipo_equi_ope"]:
+        invalidos |= eventos[col].isna() | (eventos[col].astype(str).str.strip() == "")
+    if invalidos.any():
+        errores.append(f"Rejected {int(invalidos.sum())} events without a valid inicio, DEP, MUN or tipo_equi_ope "
+                       f"(rows {', '.join(map(str, lote.index[invalidos][:10]))}{'...' if invalidos.sum() > 10 else ''})")
+    eventos = eventos[~invalidos].reset_index(drop=True)
+
+    for col in eventos.select_dtypes(include=["object"]).columns:
+        eventos[col] = eventos[col].astype("category")
+    eventos = _cast_to_schema(eventos, dtypes)
+    return eventos[[c for c in columnas if c in eventos]], errores
+
+
+def _cast_to_schema(eventos: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """Casts numeric columns to their stored dtype (integer columns with nulls stay float)."""
+    for col, dtype in dtypes.items():
+        if col not in eventos or not str(dtype).startswith(("int", "uint", "float", "bool")):
+            continue
+        if str(dtype).startswith(("int", "uint", "bool")) and eventos[col].isna().any():
+            continue
+        eventos[col] = eventos[col].astype(dtype)
+    return eventos
+
+
+class EventIngestor:
+    """
+    Appends batches of events to the event dataset and the derived structures.
+
+    Args:
+        store (EventStore): Partitioned event dataset
+        csv_path (Optional[str]): Source CSV appended as well (None to leave it untouched)
+        dependents (Optional[List[Callable]]): Cache advancers (defaults to DEPENDENTS)
+    """
+
+    def __init__(self, store: EventStore = default_event_store,
+                 csv_path: Optional[str] = "structured_data/Tabla_General.csv",
+                 dependents: Optional[List[Callable[[str, str, pd.DataFrame], bool]]] = None):
+        self.store = store
+        self.csv_path = csv_path
+        self.dependents = DEPENDENTS if dependents is None else dependents
+        self._lock = threading.Lock()
+
+    def _version_csv(self) -> Optional[str]:
+        if self.csv_path is None:
+            return None
+        try:
+            estado = os.stat(self.csv_path)
+        except FileNotFoundError:
+            return None
+        return f"{estado.st_size}-{estado.st_mtime_ns}"
+
+    def _append_csv(self, eventos: pd.DataFrame) -> None:
+        """Appends the batch to the source CSV with its column order and date formats."""
+        columnas = pd.read_csv(self.csv_path, nrows=0).columns
+        salida = eventos.reindex(columns=columnas).copy()
+        for col, formato in DATETIME_COLUMNS.items():
+            if col in salida:
+                salida[col] = salida[col].dt.strftime(formato)
+        salida.to_csv(self.csv_path, mode="a", header=False, index=False)
+
+    def append(self, lote: Union[pd.DataFrame, List[dict]]) -> IngestReport:
+        """
+        Ingests a batch of events.
+
+        Args:
+            lote (Union[pd.DataFrame, List[dict]]): Raw events with the columns of Tabla_General.csv
+
+        Returns:
+            IngestReport: Accepted and rejected events, versions and updated caches
+
+        Raises:
+            FileNotFoundError: If the event dataset has not been built yet
+            ValueError: If the batch lacks a required column
+        """
+        inicio = time.perf_counter()
+        lote = pd.DataFrame(lote) if not isinstance(lote, pd.DataFrame) else lote
+        reporte = IngestReport()
+        with self._lock, span("ingest", rows=len(lote)):
+            manifest = self.store.manifest
+            if manifest is None:
+                raise FileNotFoundError(f"Event dataset not built: {self.store.root}")
+            if self._version_csv() not in (None, self.store.source_version):
+                raise RuntimeError("Tabla_General.csv changed since the dataset was built; rebuild it first")
+
+            with span("ingest_validate"):
+                dtypes = manifest.get("dtypes")
+                columnas = manifest["columns"] + [c for c in PARTITION_COLUMNS if c != "anio" and c not in manifest["columns"]]
+                eventos, reporte.errors = validate_batch(lote, columnas, dtypes)
+            reporte.accepted, reporte.rejected = len(eventos), len(lote) - len(eventos)
+            reporte.old_version = reporte.new_version = self.store.version
+            if not len(eventos):
+                reporte.seconds = time.perf_counter() - inicio
+                return reporte
+
+            source_version = None
+            if self.csv_path is not None and os.path.exists(self.csv_path):
+                with span("ingest_csv_append"):
+                    self._append_csv(eventos)
+                source_version = self._version_csv()
+            # A concurrent ensure() may rebuild the dataset from the appended CSV before
+            # the store lock is taken: store.append then leaves it as is, and advancing
+            # the old_version caches with the batch still yields the rebuilt contents
+            reporte.new_version = self.store.append(eventos, source_version)
+
+            # The batch is stored: a cache that fails to advance is dropped (advancers pop it
+            # before appending) and is rebuilt from the dataset on its next use
+            with span("ingest_update_caches"):
+                for advance in self.dependents:
+                    try:
+                        reporte.updated[advance.__name__] = advance(reporte.old_version, reporte.new_version, eventos)
+                    except Exception as e:
+                        reporte.updated[advance.__name__] = False
+                        reporte.errors.append(f"{advance.__name__} failed, its cache will be rebuilt: {e!r}")
+                        set_attribute(f"error.{advance.__name__}", repr(e))
+        reporte.seconds = time.perf_counter() - inicio
+        return reporte
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ingesta incremental de eventos")
+    parser.add_argument("archivo", help="CSV con los nuevos eventos (mismas columnas que Tabla_General.csv)")
+    parser.add_argument("--no-csv", action="store_true", help="No añadir los eventos a Tabla_General.csv")
+    parser.add_argument("--compact", type=int, default=None,
+                        help="Compactar particiones con más de N archivos tras la ingesta")
+    args = parser.parse_args()
+
+    from tools import _cargar_eventos, _version_csv
+
+    default_event_store.ensure(_version_csv(), _cargar_eventos)
+    ingestor = EventIngestor(csv_path=None if args.no_csv else "structured_data/Tabla_General.csv")
+    reporte = ingestor.append(pd.read_csv(args.archivo, dtype=str))
+    print(f"Eventos añadidos: {reporte.accepted} | rechazados: {reporte.rejected} | "
+          f"versión {reporte.old_version} -> {reporte.new_version} | {reporte.seconds:.2f} s")
+    for error in reporte.errors:
+        print(f"  - {error}")
+    if args.compact is not None:
+        print(f"Particiones compactadas: {default_event_store.compact(args.compact)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""
+Interval index over event durations (inicio / fin)
+Events are split into levels by duration (powers of two of a resolution) and
+sorted by start inside each level, so the events overlapping a time window
+are found with two binary searches per level: in a level of width W every
+event starting in [desde - W/2, hasta] overlaps the window, and only those
+starting in [desde - W, desde - W/2) are tested. Counts use the sorted start
+and end times, and peak concurrency is a vectorized sweep over the endpoints
+of the overlapping events. Used by the event tools for questions about
+outages during a time window or simultaneous interruptions per circuit.
+"""
+
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from tracing import set_attribute, span
+from utils import normalize_query
+
+
+# Duration resolution of the first level (shorter events share it)
+RESOLUCION = np.timedelta64(1, "m").astype("timedelta64[ns]").astype(np.int64)
+
+Instante = Union[str, pd.Timestamp, np.datetime64]
+
+
+def _ns(valores) -> np.ndarray:
+    """Timestamps as int64 nanoseconds (NaT -> iinfo.min)."""
+    return np.asarray(pd.to_datetime(valores), dtype="datetime64[ns]").view(np.int64)
+
+
+def _instante(valor: Optional[Instante], defecto: int) -> int:
+    return defecto if valor is None else int(pd.Timestamp(valor).as_unit("ns").value)
+
+
+def _barrido(inicio: np.ndarray, fin: np.ndarray, grupos: Optional[np.ndarray] = None):
+    """
+    Peak number of simultaneous intervals, per group.
+
+    Closed intervals: an event ending at t and another starting at t overlap.
+
+    Args:
+        inicio (np.ndarray): Start times (int64)
+        fin (np.ndarray): End times (int64, >= inicio)
+        grupos (Optional[np.ndarray]): Integer group code of each interval
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Group codes, peak per group and time of the peak
+    """
+    grupos = np.zeros(len(inicio), dtype=np.int64) if grupos is None else np.asarray(grupos, dtype=np.int64)
+    tiempos = np.concatenate([inicio, fin])
+    deltas = np.concatenate([np.ones(len(inicio), dtype=np.int64), -np.ones(len(fin), dtype=np.int64)])
+    codigos = np.concatenate([grupos, grupos])
+    # Starts before ends at equal times
+    orden = np.lexsort((-deltas, tiempos, codigos))
+    # Every group's deltas add up to zero, so the global running sum restarts at each group
+    activos = np.cumsum(deltas[orden])
+    codigos, tiempos = codigos[orden], tiempos[orden]
+    if not len(activos):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    cortes = np.flatnonzero(np.r_[True, codigos[1:] != codigos[:-1]])
+    picos = np.maximum.reduceat(activos, cortes)
+    # First position of each group's peak
+    limites = np.r_[cortes[1:], len(activos)]
+    en_pico = activos == np.repeat(picos, limites - cortes)
+    posiciones = np.flatnonzero(en_pico)
+    primeras = posiciones[np.searchsorted(posiciones, cortes)]
+    return codigos[cortes], picos, tiempos[primeras]
+
+
+class IntervalIndex:
+    """
+    Index of closed time intervals for overlap, stabbing and count queries.
+
+    Events without an end (or ending before they start) are indexed as instants.
+
+    Args:
+        inicio (np.ndarray): Start times (datetime64 or pandas datetimes)
+        fin (np.ndarray): End times
+        resolution (int): Width of the first duration level in nanoseconds
+    """
+
+    def __init__(self, inicio, fin, resolution: int = RESOLUCION):
+        inicio, fin = _ns(inicio), _ns(fin)
+        nat = np.iinfo(np.int64).min
+        valido = inicio != nat
+        fin = np.where((fin == nat) | (fin < inicio), inicio, fin)
+        self.size = len(inicio)
+        self.resolution = resolution
+        posiciones = np.flatnonzero(valido)
+        inicio, fin = inicio[valido], fin[valido]
+
+        self._inicios = np.sort(inicio)
+        self._fines = np.sort(fin)
+        self.desde = int(self._inicios[0]) if len(inicio) else 0
+        self.hasta = int(self._fines[-1]) if len(fin) else 0
+
+        # Level j holds durations in (W/2, W] with W = resolution * 2**j (level 0: up to resolution)
+        duracion = np.maximum(fin - inicio, 1)
+        niveles = np.ceil(np.log2(np.maximum(duracion / resolution, 1))).astype(np.int64)
+        self._niveles: List[Tuple[int, np.ndarray, np.ndarray, np.ndarray]] = []
+        for nivel in np.unique(niveles):
+            miembros = np.flatnonzero(niveles == nivel)
+            orden = miembros[np.argsort(inicio[miembros], kind="stable")]
+            self._niveles.append((int(resolution * 2 ** int(nivel)), inicio[orden], fin[orden], posiciones[orden]))
+
+    def overlapping(self, desde: Instante, hasta: Optional[Instante] = None) -> np.ndarray:
+        """
+        Positions of the intervals overlapping [desde, hasta].
+
+        Args:
+            desde (Instante): Window start
+            hasta (Optional[Instante]): Window end (desde for a single instant)
+
+        Returns:
+            np.ndarray: Sorted positions in the original arrays
+        """
+        a = _instante(desde, self.desde)
+        b = _instante(hasta, a)
+        partes = []
+        for ancho, inicios, fines, posiciones in self._niveles:
+            # Starts in [a - ancho, b] may overlap; those from a - ancho/2 on always do
+            # (in the first level durations can be shorter than ancho/2, so only from a on)
+            seguro = a - ancho // 2 if ancho > self.resolution else a
+            i = np.searchsorted(inicios, a - ancho, side="left")
+            j = np.searchsorted(inicios, seguro, side="left")
+            k = np.searchsorted(inicios, b, side="right")
+            if i < j:
+                dudosos = np.arange(i, min(j, k))
+                partes.append(posiciones[dudosos[fines[dudosos] >= a]])
+            partes.append(posiciones[max(j, i):k])
+        return np.sort(np.concatenate(partes)) if partes else np.empty(0, dtype=np.int64)
+
+    def stabbing(self, instante: Instante) -> np.ndarray:
+        """Positions of the intervals active at an instant."""
+        return self.overlapping(instante, instante)
+
+    def count(self, desde: Instante, hasta: Optional[Instante] = None) -> int:
+        """
+        Number of intervals overlapping [desde, hasta] with two binary searches.
+
+        Args:
+            desde (Instante): Window start
+            hasta (Optional[Instante]): Window end (desde for a single instant)
+
+        Returns:
+            int: Overlapping intervals
+        """
+        a = _instante(desde, self.desde)
+        b = _instante(hasta, a)
+        # Started by b minus those already over before a
+        return int(np.searchsorted(self._inicios, b, side="right") - np.searchsorted(self._fines, a, side="left"))
+
+
+class EventIntervalIndex:
+    """
+    Interval index bound to the event table, returning event subsets and concurrency.
+
+    Args:
+        eventos (pd.DataFrame): Typed event table with inicio and fin
+    """
+
+    # Appended batches are indexed as separate segments, merged once there are this many
+    MAX_SEGMENTOS = 16
+
+    def __init__(self, eventos: pd.DataFrame):
+        with span("interval_index_build", rows=len(eventos)):
+            self._segmentos = [self._segmento(eventos)]
+        self._picos: Dict[Tuple[str, ...], pd.DataFrame] = {}
+
+    @staticmethod
+    def _segmento(eventos: pd.DataFrame):
+        eventos = eventos.reset_index(drop=True)
+        fin = eventos["fin"] if "fin" in eventos else eventos["inicio"]
+        return eventos, IntervalIndex(eventos["inicio"], fin)
+
+    @property
+    def eventos(self) -> pd.DataFrame:
+        """All indexed events."""
+        if len(self._segmentos) == 1:
+            return self._segmentos[0][0]
+        return pd.concat([e for e, _ in self._segmentos], ignore_index=True)
+
+    def append(self, nuevos: pd.DataFrame) -> None:
+        """
+        Indexes newly ingested events as a new segment.
+
+        Args:
+            nuevos (pd.DataFrame): New typed events
+        """
+        if not len(nuevos):
+            return
+        with span("interval_index_append", rows=len(nuevos)):
+            self._segmentos.append(self._segmento(nuevos))
+            if len(self._segmentos) >= self.MAX_SEGMENTOS:
+                self._segmentos = [self._segmento(self.eventos)]
+            self._picos = {}
+
+    def superpuestos(self, desde: Instante, hasta: Optional[Instante] = None) -> pd.DataFrame:
+        """Events overlapping [desde, hasta] (a single instant if hasta is None)."""
+        with span("interval_query", tipo="superpuestos"):
+            partes = [e.iloc[indice.overlapping(desde, hasta)] for e, indice in self._segmentos]
+            set_attribute("rows", sum(len(p) for p in partes))
+        return partes[0] if len(partes) == 1 else pd.concat(partes, ignore_index=True)
+
+    def activos(self, instante: Instante) -> pd.DataFrame:
+        """Events in progress at an instant."""
+        return self.superpuestos(instante, instante)
+
+    def contar(self, desde: Instante, hasta: Optional[Instante] = None) -> int:
+        """Number of events overlapping [desde, hasta], without materializing them."""
+        return sum(indice.count(desde, hasta) for _, indice in self._segmentos)
+
+    def concurrencia_maxima(self, por: Sequence[str] = ("cto_equi_ope",), desde: Optional[Instante] = None,
+                            hasta: Optional[Instante] = None, eventos: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        Maximum number of simultaneous interruptions per group.
+
+        With a window, only the events overlapping it are swept (clipped to
+        the window); the whole-history result is computed once per grouping.
+
+        Args:
+            por (Sequence[str]): Grouping columns (empty for the whole network)
+            desde (Optional[Instante]): Window start
+            hasta (Optional[Instante]): Window end
+            eventos (Optional[pd.DataFrame]): Event subset to sweep instead (e.g. filtered superpuestos())
+
+        Returns:
+            pd.DataFrame: Grouping columns, 'concurrencia_maxima' and 'inicio_pico',
+            sorted by concurrencia_maxima descending
+        """
+        por = list(por)
+        clave = tuple(por)
+        entero = eventos is None and desde is None and hasta is None
+        if entero and clave in self._picos:
+            return self._picos[clave]
+        with span("interval_concurrency", por=",".join(por)):
+            if eventos is None:
+                eventos = self.superpuestos(desde, hasta) if desde is not None else self.eventos
+            inicio = _ns(eventos["inicio"])
+            fin = _ns(eventos["fin"]) if "fin" in eventos else inicio.copy()
+            nat = np.iinfo(np.int64).min
+            valido = inicio != nat
+            fin = np.where((fin == nat) | (fin < inicio), inicio, fin)
+            if desde is not None:
+                a = _instante(desde, 0)
+                inicio = np.maximum(inicio, a)
+            if desde is not None or hasta is not None:
+                b = _instante(hasta, _instante(desde, 0))
+                fin = np.minimum(fin, b)
+            if por:
+                codigos, grupos = pd.MultiIndex.from_frame(eventos[por].astype(str)).factorize()
+            else:
+                codigos, grupos = np.zeros(len(eventos), dtype=np.int64), None
+            cod, picos, instantes = _barrido(inicio[valido], fin[valido], np.asarray(codigos)[valido])
+            tabla = pd.DataFrame({"concurrencia_maxima": picos, "inicio_pico": pd.to_datetime(instantes)})
+            if por:
+                tabla = pd.concat([pd.DataFrame(list(grupos[cod]), columns=por), tabla], axis=1)
+            tabla = tabla.sort_values(["concurrencia_maxima", "inicio_pico"], ascending=[False, True],
+                                      ignore_index=True)
+            set_attribute("rows", len(tabla))
+        if entero:
+            self._picos[clave] = tabla
+        return tabla
+
+
+# Index cache -------------------------------------------------------------------------------------
+
+_indices: Dict[str, EventIntervalIndex] = {}
+_indices_lock = threading.Lock()
+
+
+def get_interval_index(data_version: str, cargar_eventos: Callable[[], pd.DataFrame]) -> EventIntervalIndex:
+    """
+    Returns the interval index of a data version, building it on first use.
+
+    Args:
+        data_version (str): Version of the event data
+        cargar_eventos (Callable[[], pd.DataFrame]): Loader of the typed event table
+
+    Returns:
+        EventIntervalIndex: Index shared by the event tools
+    """
+    with _indices_lock:
+        if data_version not in _indices:
+            _indices.clear()
+            _indices[data_version] = EventIntervalIndex(cargar_eventos())
+        return _indices[data_version]
+
+
+def advance_interval_index(old_version: str, new_version: str, nuevos: pd.DataFrame) -> bool:
+    """
+    Moves a cached index to a new data version by indexing the new events.
+
+    Args:
+        old_version (str): Version the cached index was built from
+        new_version (str): Version after the append
+        nuevos (pd.DataFrame): Events appended between both versions
+
+    Returns:
+        bool: True if an index was advanced, False if none was cached for old_version
+    """
+    with _indices_lock:
+        indice = _indices.pop(old_version, None)
+        if indice is None:
+            return False
+        indice.append(nuevos)
+        _indices[new_version] = indice
+        return True
+
+
+# Question answering ------------------------------------------------------------------------------
+
+_FECHA = r"(\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{4})(?:[ T](\d{1,2}:\d{2}(?::\d{2})?))?"
+
+
+def _leer_fecha(fecha: str, hora: Optional[str]) -> pd.Timestamp:
+    dia = pd.to_datetime(fecha, format="%d/%m/%Y") if "/" in fecha else pd.Timestamp(fecha)
+    return dia + pd.to_timedelta(f"{hora}:00" if hora and hora.count(":") == 1 else (hora or "0:00:00"))
+
+
+def infer_window(query: str) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """
+    Finds the time window of a question.
+
+    Two dates ('entre el 2021-03-04 08:00 y el 2021-03-05') give a window; a
+    single date gives that whole day and a single date with time an instant.
+    Dates are YYYY-MM-DD or DD/MM/YYYY, optionally followed by HH:MM.
+
+    Args:
+        query (str): User question
+
+    Returns:
+        Optional[Tuple[pd.Timestamp, pd.Timestamp]]: (desde, hasta), or None
+    """
+    fechas = re.findall(_FECHA, query)
+    try:
+        if len(fechas) >= 2:
+            desde, hasta = _leer_fecha(*fechas[0]), _leer_fecha(*fechas[1])
+            if not fechas[1][1]:
+                hasta += pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+            return min(desde, hasta), max(desde, hasta)
+        if len(fechas) == 1:
+            desde = _leer_fecha(*fechas[0])
+            return (desde, desde) if fechas[0][1] else (desde, desde + pd.Timedelta(days=1) - pd.Timedelta(seconds=1))
+    except ValueError:
+        return None
+    return None
+
+
+def is_interval_question(query: str) -> bool:
+    """Whether a question asks about overlapping or simultaneous interruptions, or a dated window."""
+    texto = normalize_query(query)
+    if re.search(r"simultane|concurren|al mismo tiempo|superpon|superpu|solap|traslap", texto):
+        return True
+    return infer_window(query) is not None and bool(re.search(r"\b(?:durante|activ[oa]s?|en curso)\b", texto))
+
+
+ANSWER_TEMPLATE = """Responde en español, de forma breve y directa, la pregunta usando solo los datos.
+concurrencia_maxima es el mayor número de interrupciones simultáneas del grupo e inicio_pico el instante en que ocurrió.
+Ventana: {ventana}
+Filtros aplicados: {filtros}
+
+Pregunta: {query}
+Interrupciones que se superponen con la ventana: {total}
+{tablas}
+
+Respuesta:"""
+
+
+def answer_intervals(query: str, llm_chat, indice: EventIntervalIndex, filtros: Dict[str, object],
+                     max_rows: int = 30) -> str:
+    """
+    Answers an overlap / concurrency question from the interval index.
+
+    Args:
+        query (str): User question
+        llm_chat: Chat model (see utils.create_llm_chat_model)
+        indice (EventIntervalIndex): Index over the event table
+        filtros (Dict[str, object]): Year, department, municipality and equipment type filters
+        max_rows (int): Maximum table rows shown to the model
+
+    Returns:
+        str: Model answer
+    """
+    from event_store import filtrar
+
+    ventana = infer_window(query)
+    eventos = indice.superpuestos(*ventana) if ventana is not None else indice.eventos
+    eventos = filtrar(eventos, **filtros)
+    texto = normalize_query(query)
+    por = [col for col, patron in (("MUN", r"\bmunicipios?\b"), ("DEP", r"\bdepartamentos?\b"),
+                                   ("tipo_equi_ope", r"\btipos? de equipos?\b"), ("cto_equi_ope", r"\bcircuitos?\b"))
+           if re.search(patron, texto) and col in eventos] or ["cto_equi_ope"]
+    desde, hasta = ventana if ventana is not None else (None, None)
+    # Whole history without filters: peaks cached in the index
+    barrer = eventos if ventana is not None or filtros else None
+    tablas = [
+        "Concurrencia máxima total:\n" + indice.concurrencia_maxima((), desde, hasta, barrer).to_string(index=False),
+        f"Concurrencia máxima por {', '.join(por)}:\n"
+        + indice.concurrencia_maxima(por, desde, hasta, barrer).head(max_rows).to_string(index=False),
+    ]
+    if ventana is not None and len(eventos):
+        columnas = [c for c in ["Evento", "equipo_ope", "cto_equi_ope", "inicio", "fin", "causa", "MUN"] if c in eventos]
+        tablas.append("Interrupciones:\n" + eventos.sort_values("inicio")[columnas].head(max_rows).to_string(index=False))
+    with span("generate"):
+        respuesta = llm_chat.invoke(ANSWER_TEMPLATE.format(
+            ventana=f"{desde} a {hasta}" if ventana is not None else "toda la historia",
+            filtros=filtros or "ninguno", query=query, total=len(eventos), tablas="\n\n".join(tablas),
+        ))
+    return getattr(respuesta, "content", respuesta)
@@ -0,0 +1,355 @@
+"""
+Concurrent multi-session load generator for the tool layer
+Replays the question banks as concurrent chat sessions, either as a fixed
+number of sessions (closed loop) or as sessions arriving at a given rate
+(open loop, Poisson arrivals), and reports throughput, latency percentiles
+and error rates over time
+
+Usage (from the project root):
+    python src/loadgen.py --model mock:1.5 --sessions 20 --duration 60
+    python src/loadgen.py --model gpt --arrival-rate 0.5 --duration 300 --think-time exp:5
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from recomendation_questions import get_recomendation_questions
+from structured_questions import get_structured_questions
+from unstructured_questions import get_unstructured_questions
+from tracing import bind_context, get_tracer, span
+
+
+# Question bank and default tool per category
+QUESTION_BANKS = {
+    "unstructured": (get_unstructured_questions, "retie"),
+    "structured": (get_structured_questions, "eventos_transformadores"),
+    "recommendations": (get_recomendation_questions, "retie"),
+}
+
+
+@dataclass
+class RequestRecord:
+    """
+    Outcome of a single tool call.
+
+    Attributes:
+        session (str): chat_id of the session that issued the request
+        category (str): Question bank the question came from
+        tool (str): Tool invoked
+        start (float): Seconds since the beginning of the run
+        latency (float): Response time in seconds
+        ok (bool): False if the tool raised or returned its fallback answer
+        error (Optional[str]): Error description
+    """
+    session: str
+    category: str
+    tool: str
+    start: float
+    latency: float
+    ok: bool
+    error: Optional[str] = None
+
+
+def parse_think_time(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parses a think-time model.
+
+    Args:
+        spec (str): 'none', 'const:<s>', 'exp:<mean s>' or 'uniform:<min s>:<max s>'
+
+    Returns:
+        Callable[[random.Random], float]: Sampler of pauses in seconds
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(":")] if params else []
+    if kind == "none":
+        return lambda rng: 0.0
+    if kind == "const":
+        return lambda rng: values[0]
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    raise ValueError(f"Modelo de think-time no reconocido: {spec}")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile.
+
+    Args:
+        values (List[float]): Sample
+        q (float): Percentile between 0 and 100
+
+    Returns:
+        float: Percentile value (nan for an empty sample)
+    """
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100.0 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def prepare_workspace(chat_ids: List[str]) -> None:
+    """
+    Creates the files and folders the tools expect in the working directory.
+
+    Args:
+        chat_ids (List[str]): Session identifiers that will be used
+    """
+    if not os.path.exists("number_iteration.pkl"):
+        with open("number_iteration.pkl", "w") as archivo:
+            archivo.write("0")
+    os.makedirs("memories", exist_ok=True)
+    for chat_id in chat_ids:
+        os.makedirs(f"plots/{chat_id}", exist_ok=True)
+
+
+def invoke_tool(tool_name: str, query: str, model: str, chat_id: str) -> str:
+    """
+    Calls a tool from tools.py the same way an agent would.
+
+    Args:
+        tool_name (str): Name of the tool in tools.py
+        query (str): Question
+        model (str): Model name
+        chat_id (str): Session identifier
+
+    Returns:
+        str: Tool response
+    """
+    import tools
+    return getattr(tools, tool_name).invoke({"query": query, "model": model, "chat_id": chat_id})
+
+
+class LoadGenerator:
+    """
+    Drives concurrent sessions against the tools and collects per-request records.
+
+    Args:
+        model (str): Model name passed to every tool
+        categories (List[str]): Question banks to replay
+        tool_overrides (Dict[str, str]): Tool to use per category instead of the default
+        think_time (str): Think-time model between questions of a session
+        seed (int): Random seed for question order, think times and arrivals
+        invoke (Callable): Function (tool, query, model, chat_id) -> response
+    """
+
+    def __init__(self, model: str, categories: List[str], tool_overrides: Optional[Dict[str, str]] = None,
+                 think_time: str = "none", seed: int = 0, invoke: Callable = invoke_tool):
+        self.model = model
+        self.think_time = parse_think_time(think_time)
+        self.seed = seed
+        self.invoke = invoke
+        self.workload: List[Tuple[str, str, str]] = []
+        tool_overrides = tool_overrides or {}
+        for category in categories:
+            get_questions, default_tool = QUESTION_BANKS[category]
+            tool = tool_overrides.get(category, default_tool)
+            self.workload.extend((category, tool, q) for q in get_questions())
+        self.records: List[RequestRecord] = []
+        self._lock = threading.Lock()
+        self._t0 = 0.0
+
+    def _request(self, session: str, category: str, tool: str, question: str) -> None:
+        from tools import RESPUESTA_NO_DISPONIBLE
+
+        start = time.perf_counter()
+        ok, error = True, None
+        try:
+            with span("loadgen.request", tool=tool, chat_id=session, category=category):
+                response = self.invoke(tool, question, self.model, session)
+            if response == RESPUESTA_NO_DISPONIBLE:
+                ok, error = False, "fallback"
+        except Exception as e:
+            ok, error = False, f"{type(e).__name__}: {e}"
+        end = time.perf_counter()
+        record = RequestRecord(session, category, tool, start - self._t0, end - start, ok, error)
+        with self._lock:
+            self.records.append(record)
+
+    def _session(self, session: str, deadline: float, max_questions: Optional[int]) -> None:
+        rng = random.Random(f"{self.seed}:{session}")
+        order = list(self.workload)
+        rng.shuffle(order)
+        done = 0
+        while time.perf_counter() < deadline and (max_questions is None or done < max_questions):
+            category, tool, question = order[done % len(order)]
+            self._request(session, category, tool, question)
+            done += 1
+            pause = self.think_time(rng)
+            if pause:
+                time.sleep(min(pause, max(deadline - time.perf_counter(), 0)))
+
+    def run_closed(self, sessions: int, duration: float, max_questions: Optional[int] = None) -> List[RequestRecord]:
+        """
+        Runs a fixed number of sessions in parallel until the duration expires.
+
+        Args:
+            sessions (int): Number of concurrent chat_ids
+            duration (float): Run length in seconds
+            max_questions (Optional[int]): Stop each session after this many questions
+
+        Returns:
+            List[RequestRecord]: One record per request
+        """
+        chat_ids = [f"loadgen_{i}" for i in range(sessions)]
+        prepare_workspace(chat_ids)
+        self._t0 = time.perf_counter()
+        deadline = self._t0 + duration
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            for chat_id in chat_ids:
+                pool.submit(bind_context(self._session), chat_id, deadline, max_questions)
+        return self.records
+
+    def run_open(self, arrival_rate: float, duration: float, questions_per_session: int = 1,
+                 max_concurrency: int = 256) -> List[RequestRecord]:
+        """
+        Starts new sessions following a Poisson process until the duration expires.
+
+        Args:
+            arrival_rate (float): Mean new sessions per second
+            duration (float): Arrival window in seconds (in-flight sessions are awaited)
+            questions_per_session (int): Questions asked by each session
+            max_concurrency (int): Upper bound of simultaneous sessions
+
+        Returns:
+            List[RequestRecord]: One record per request
+        """
+        rng = random.Random(self.seed)
+        self._t0 = time.perf_counter()
+        deadline = self._t0 + duration
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            i = 0
+            next_arrival = self._t0
+            while True:
+                next_arrival += rng.expovariate(arrival_rate)
+                if next_arrival >= deadline:
+                    break
+                time.sleep(max(next_arrival - time.perf_counter(), 0))
+                chat_id = f"loadgen_{i}"
+                prepare_workspace([chat_id])
+                pool.submit(bind_context(self._session), chat_id, float("inf"), questions_per_session)
+                i += 1
+        return self.records
+
+
+def summarize(records: List[RequestRecord], window: float) -> Dict:
+    """
+    Aggregates request records overall, per category and per time window.
+
+    Args:
+        records (List[RequestRecord]): Records from a run
+        window (float): Width of the time windows in seconds
+
+    Returns:
+        Dict: Summary with 'overall', 'by_category' and 'windows' entries
+    """
+    def stats(group: List[RequestRecord], span_s: float) -> Dict:
+        latencies = [r.latency for r in group if r.ok]
+        errors = sum(1 for r in group if not r.ok)
+        return {
+            "requests": len(group),
+            "throughput_rps": len(group) / span_s if span_s > 0 else float("nan"),
+            "error_rate": errors / len(group) if group else 0.0,
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else float("nan"),
+        }
+
+    if not records:
+        return {"overall": stats([], 0), "by_category": {}, "windows": []}
+
+    total_span = max(r.start + r.latency for r in records)
+    by_category = {}
+    for category in sorted({r.category for r in records}):
+        by_category[category] = stats([r for r in records if r.category == category], total_span)
+
+    # Requests are assigned to the window in which they completed
+    windows = []
+    n_windows = int(total_span // window) + 1
+    for w in range(n_windows):
+        lo, hi = w * window, (w + 1) * window
+        group = [r for r in records if lo <= r.start + r.latency < hi]
+        windows.append({"t_start": lo, **stats(group, window)})
+
+    return {"overall": stats(records, total_span), "by_category": by_category, "windows": windows}
+
+
+def print_report(summary: Dict) -> None:
+    """Prints a summary produced by summarize()."""
+    header = f"{'':>12} {'req':>6} {'rps':>7} {'err%':>6} {'p50':>7} {'p95':>7} {'p99':>7}"
+
+    def row(label, s):
+        print(f"{label:>12} {s['requests']:>6} {s['throughput_rps']:>7.2f} {100 * s['error_rate']:>6.1f} "
+              f"{s['p50']:>7.2f} {s['p95']:>7.2f} {s['p99']:>7.2f}")
+
+    print("📊 LOAD TEST SUMMARY")
+    print("=" * len(header))
+    print(header)
+    row("overall", summary["overall"])
+    for category, s in summary["by_category"].items():
+        row(category[:12], s)
+    print("\n⏱️  OVER TIME (completed requests per window)")
+    print(header)
+    for w in summary["windows"]:
+        row(f"t={w['t_start']:.0f}s", w)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Generador de carga concurrente para las herramientas de CRITAIR")
+    parser.add_argument("--model", default="mock", help="Modelo pasado a las herramientas (p.ej. gpt, llama2, mock:1.5)")
+    parser.add_argument("--categories", nargs="+", default=list(QUESTION_BANKS), choices=list(QUESTION_BANKS))
+    parser.add_argument("--tool", action="append", default=[], metavar="CATEGORY=TOOL",
+                        help="Herramienta a usar para una categoría (se puede repetir)")
+    parser.add_argument("--sessions", type=int, default=10, help="Sesiones concurrentes (modo cerrado)")
+    parser.add_argument("--arrival-rate", type=float, default=None,
+                        help="Llegadas de sesiones por segundo (modo abierto, Poisson)")
+    parser.add_argument("--questions-per-session", type=int, default=None)
+    parser.add_argument("--max-concurrency", type=int, default=256, help="Límite de sesiones simultáneas en modo abierto")
+    parser.add_argument("--duration", type=float, default=60.0, help="Duración en segundos")
+    parser.add_argument("--think-time", default="none", help="none | const:S | exp:MEAN | uniform:MIN:MAX")
+    parser.add_argument("--window", type=float, default=10.0, help="Ancho de ventana del reporte en segundos")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Archivo JSONL con un registro por petición")
+    parser.add_argument("--summary", help="Archivo JSON con el resumen")
+    parser.add_argument("--trace", help="Archivo de trazas en formato Chrome trace-event")
+    args = parser.parse_args(argv)
+
+    overrides = dict(item.split("=", 1) for item in args.tool)
+    generator = LoadGenerator(args.model, args.categories, overrides, args.think_time, args.seed)
+
+    print(f"🚀 Modelo: {args.model} | Preguntas: {len(generator.workload)} | Duración: {args.duration}s")
+    if args.arrival_rate:
+        records = generator.run_open(args.arrival_rate, args.duration, args.questions_per_session or 1,
+                                     args.max_concurrency)
+    else:
+        records = generator.run_closed(args.sessions, args.duration, args.questions_per_session)
+
+    summary = summarize(records, args.window)
+    print_report(summary)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for r in records:
+                f.write(json.dumps(asdict(r), ensure_ascii=False) + "\n")
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    if args.trace:
+        get_tracer().export_chrome_trace(args.trace)
+
+
+if __name__ == "__main__":
+    main()
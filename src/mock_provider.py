@@ -0,0 +1,157 @@
+"""
+Mock LLM provider for running the tools without API keys
+Provides a chat model with configurable simulated latency and deterministic
+embeddings, selected in create_llm_chat_model() with model names such as
+'mock' or 'mock:2.5' (mean latency in seconds)
+"""
+
+import asyncio
+import hashlib
+import math
+import random
+import time
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+def is_mock_model(model: str) -> bool:
+    """
+    Checks if a model name refers to the mock provider.
+
+    Args:
+        model (str): Model name
+
+    Returns:
+        bool: True for 'mock' and 'mock:<latency>' names
+    """
+    return model == "mock" or model.startswith("mock:")
+
+
+class MockChatModel(BaseChatModel):
+    """
+    Chat model that answers deterministically after a simulated delay.
+
+    Latency is drawn from a log-normal distribution with the given mean and
+    standard deviation, which reproduces the long right tail seen in the
+    results tables.
+
+    Attributes:
+        latency_mean (float): Mean response time in seconds
+        latency_std (float): Standard deviation of the response time in seconds
+        first_token_fraction (float): Fraction of the latency spent before the first streamed token
+        failure_rate (float): Probability of raising an error instead of answering
+        model_name (str): Name reported by the model
+    """
+    latency_mean: float = 1.0
+    latency_std: float = 0.3
+    first_token_fraction: float = 0.3
+    failure_rate: float = 0.0
+    model_name: str = "mock"
+
+    @classmethod
+    def from_name(cls, model: str) -> "MockChatModel":
+        """
+        Builds a mock model from a 'mock' or 'mock:<latency_mean>' name.
+
+        Args:
+            model (str): Model name
+
+        Returns:
+            MockChatModel: Configured mock model
+        """
+        _, _, latency = model.partition(":")
+        if latency:
+            mean = float(latency)
+            return cls(latency_mean=mean, latency_std=0.3 * mean, model_name=model)
+        return cls(model_name=model)
+
+    @property
+    def _llm_type(self) -> str:
+        return "critair-mock"
+
+    def _sample_latency(self) -> float:
+        if self.latency_mean <= 0:
+            return 0.0
+        sigma2 = math.log(1 + (self.latency_std / self.latency_mean) ** 2)
+        mu = math.log(self.latency_mean) - sigma2 / 2
+        return random.lognormvariate(mu, math.sqrt(sigma2))
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        if random.random() < self.failure_rate:
+            raise RuntimeError(f"{self.model_name}: simulated provider failure")
+        last = str(messages[-1].content) if messages else ""
+        digest = hashlib.sha1(last.encode("utf-8")).hexdigest()[:8]
+        return f"Respuesta simulada ({self.model_name}, {digest}) a: {last.strip()[-200:]}"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._sample_latency())
+        text = self._respond(messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._sample_latency())
+        text = self._respond(messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        latency = self._sample_latency()
+        time.sleep(latency * self.first_token_fraction)
+        words = self._respond(messages).split(" ")
+        pause = latency * (1 - self.first_token_fraction) / max(len(words), 1)
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(pause)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any):
+        latency = self._sample_latency()
+        await asyncio.sleep(latency * self.first_token_fraction)
+        words = self._respond(messages).split(" ")
+        pause = latency * (1 - self.first_token_fraction) / max(len(words), 1)
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(pause)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class MockEmbeddings(Embeddings):
+    """
+    Deterministic hash-based embeddings (same text, same vector).
+
+    Args:
+        size (int): Embedding dimension
+    """
+
+    def __init__(self, size: int = 64):
+        self.size = size
+
+    def _embed(self, text: str) -> List[float]:
+        values = []
+        counter = 0
+        while len(values) < self.size:
+            digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+            values.extend(b / 255.0 - 0.5 for b in digest)
+            counter += 1
+        values = values[:self.size]
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
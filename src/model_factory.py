@@ -0,0 +1,527 @@
+"""
+Model factory with per-provider timeouts, circuit breakers and fallback chains
+Chat models are built with the connect/read timeouts and retries of their
+provider (OpenAI, Google, Ollama), so a hung backend fails the call instead
+of blocking a worker. Every call goes through the circuit breaker of its
+provider: after repeated failures or slow responses the breaker opens and
+calls to that provider are skipped until a probe succeeds. A call that fails
+or finds the breaker open moves on to the next model of its fallback chain
+(CRITAIR_FALLBACKS="llama1>gpt,gemini-2.5-pro-exp-03-25>gemini-2.0-flash-001").
+Breaker state and counters are exposed by model_factory_metrics(). Every
+call records its prompt tokens, and inside measure_ttft() calls are streamed
+to record their time to first token.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+from langchain_community.chat_models import ChatOllama
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, message_chunk_to_message
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_openai import ChatOpenAI
+
+from mock_provider import MockChatModel, is_mock_model
+from ollama_manager import OllamaManager, default_ollama_manager
+from replay import REPLAY_MODE, ReplayMissError, wrap_chat_model
+from tracing import set_attribute, span
+
+
+# (connect, read) timeouts in seconds per provider, overridable with CRITAIR_TIMEOUT_<PROVIDER>="connect,read".
+# ChatOllama and ChatGoogleGenerativeAI take a single request timeout: the read one.
+TIMEOUTS = {"openai": (5.0, 60.0), "google": (5.0, 120.0), "ollama": (2.0, 300.0), "mock": (None, None)}
+
+# Retries done by the provider client before the call counts as failed
+MAX_RETRIES = {"openai": 1, "google": 1}
+
+# Models used when a call fails, in order
+FALLBACKS = os.getenv("CRITAIR_FALLBACKS", "")
+
+# Names of the evaluated models -> provider model id
+MODELOS_OLLAMA = {"llama1": "llama3.1", "llama2": "llama3.2:1b"}
+MODELOS_OPENAI = {"gpt": "gpt-3.5-turbo"}
+
+
+# Set inside measure_ttft()
+_medir_ttft: ContextVar[bool] = ContextVar("critair_measure_ttft", default=False)
+
+
+@contextmanager
+def measure_ttft() -> Iterator[None]:
+    """
+    Streams the model calls made inside the block, so each model_call span
+    gets the time to its first token (ttft_s). The answer is the same.
+    """
+    token = _medir_ttft.set(True)
+    try:
+        yield
+    finally:
+        _medir_ttft.reset(token)
+
+
+def prompt_tokens(messages: List[BaseMessage], respuesta: Optional[BaseMessage]) -> Tuple[int, bool]:
+    """
+    Prompt tokens of a call, as reported by the provider.
+
+    Args:
+        messages (List[BaseMessage]): Messages sent
+        respuesta (Optional[BaseMessage]): Answer (usage_metadata, or Ollama's prompt_eval_count)
+
+    Returns:
+        Tuple[int, bool]: Token count and whether it is an estimate (4 characters per
+            token) because the provider did not report it
+    """
+    usage = getattr(respuesta, "usage_metadata", None) or {}
+    metadata = getattr(respuesta, "response_metadata", None) or {}
+    reportados = (usage.get("input_tokens") or metadata.get("prompt_eval_count")
+                  or (metadata.get("token_usage") or {}).get("prompt_tokens"))
+    if reportados:
+        return int(reportados), False
+    return sum(len(str(m.content)) for m in messages) // 4, True
+
+
+class ModelUnavailableError(RuntimeError):
+    """Raised when every model of a fallback chain failed or had its breaker open."""
+
+
+def provider_of(model: str) -> str:
+    """
+    Provider that serves a model name.
+
+    Args:
+        model (str): Model name accepted by create_llm_chat_model
+
+    Returns:
+        str: 'mock', 'openai', 'google' or 'ollama' (any other name is an Ollama model)
+    """
+    if is_mock_model(model):
+        return "mock"
+    if model.startswith("gpt"):
+        return "openai"
+    if model.startswith("gemini"):
+        return "google"
+    return "ollama"
+
+
+def _timeouts() -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    timeouts = dict(TIMEOUTS)
+    for proveedor in timeouts:
+        valor = os.getenv(f"CRITAIR_TIMEOUT_{proveedor.upper()}")
+        if valor:
+            connect, _, read = valor.partition(",")
+            timeouts[proveedor] = (float(connect), float(read or connect))
+    return timeouts
+
+
+def parse_fallbacks(texto: str) -> Dict[str, List[str]]:
+    """'a>b>c,d>e' -> {'a': ['b', 'c'], 'd': ['e']}"""
+    cadenas = {}
+    for cadena in filter(None, (c.strip() for c in texto.split(","))):
+        modelos = [m.strip() for m in cadena.split(">") if m.strip()]
+        if len(modelos) > 1:
+            cadenas[modelos[0]] = modelos[1:]
+    return cadenas
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one provider.
+
+    Closed: calls go through. It opens after max_failures consecutive failures
+    or max_slow consecutive responses slower than slow_threshold; while open,
+    calls are rejected. After reset_timeout one probe call is let through
+    (half-open): success closes the breaker, failure opens it again. A probe
+    that ends without a result (a hedged stream closed, a task cancelled) is
+    released, and one still unresolved after reset_timeout is replaced by a
+    new probe, so the breaker cannot stay half-open forever.
+
+    Args:
+        name (str): Provider name
+        max_failures (int): Consecutive failures that open the breaker
+        max_slow (int): Consecutive slow responses that open the breaker
+        slow_threshold (Optional[float]): Seconds above which a response counts as slow (None: never)
+        reset_timeout (float): Seconds open before a probe is allowed
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    # Numeric value of each state for the metrics endpoint
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, max_failures: int = 5, max_slow: int = 5,
+                 slow_threshold: Optional[float] = None, reset_timeout: float = 30.0):
+        self.name = name
+        self.max_failures = max_failures
+        self.max_slow = max_slow
+        self.slow_threshold = slow_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_at = 0.0
+        self._failures = 0
+        self._slow = 0
+        self.counters = {"calls": 0, "failures": 0, "slow": 0, "rejected": 0, "trips": 0}
+
+    def allow(self) -> bool:
+        """Whether a call may go to the provider now (counts a rejection otherwise)."""
+        with self._lock:
+            ahora = time.monotonic()
+            if self.state == self.OPEN and ahora - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and self._probe_in_flight and ahora - self._probe_at >= self.reset_timeout:
+                # The probe never reported back
+                self._probe_in_flight = False
+            if self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self._probe_in_flight):
+                if self.state == self.HALF_OPEN:
+                    self._probe_in_flight, self._probe_at = True, ahora
+                self.counters["calls"] += 1
+                return True
+            self.counters["rejected"] += 1
+            return False
+
+    def release(self) -> None:
+        """Ends a call that neither succeeded nor failed (closed or cancelled), freeing a half-open probe."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def _trip(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._failures = self._slow = 0
+        self._probe_in_flight = False
+        self.counters["trips"] += 1
+
+    def record_success(self, latency: float) -> None:
+        with self._lock:
+            self._failures = 0
+            if self.slow_threshold is not None and latency > self.slow_threshold:
+                self.counters["slow"] += 1
+                self._slow += 1
+                if self.state == self.HALF_OPEN or self._slow >= self.max_slow:
+                    self._trip()
+                    return
+            else:
+                self._slow = 0
+            self.state = self.CLOSED
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.counters["failures"] += 1
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.max_failures:
+                self._trip()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, **self.counters}
+
+
+class ModelFactory:
+    """
+    Builds chat models with timeouts, wrapped in their provider's breaker and fallback chain.
+
+    Args:
+        fallbacks (Optional[Dict[str, List[str]]]): Fallback models per model name (CRITAIR_FALLBACKS by default)
+        timeouts (Optional[Dict[str, Tuple[float, float]]]): (connect, read) seconds per provider
+        max_failures (int): Consecutive failures that open a breaker
+        max_slow (int): Consecutive slow responses that open a breaker
+        slow_fraction (float): A response is slow above this fraction of the read timeout
+        reset_timeout (float): Seconds a breaker stays open before a probe
+        ollama (Optional[OllamaManager]): Keeps the Ollama models warm (default_ollama_manager by default)
+    """
+
+    def __init__(self, fallbacks: Optional[Dict[str, List[str]]] = None,
+                 timeouts: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+                 max_failures: int = 5, max_slow: int = 5, slow_fraction: float = 0.8, reset_timeout: float = 30.0,
+                 ollama: Optional[OllamaManager] = None):
+        self.fallbacks = fallbacks if fallbacks is not None else parse_fallbacks(FALLBACKS)
+        self.timeouts = timeouts if timeouts is not None else _timeouts()
+        self.max_failures = max_failures
+        self.max_slow = max_slow
+        self.slow_fraction = slow_fraction
+        self.reset_timeout = reset_timeout
+        self.ollama = ollama or default_ollama_manager
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._clientes: Dict[str, BaseChatModel] = {}
+        self._lock = threading.Lock()
+        self.fallback_calls = 0
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        """Breaker of the provider of a model."""
+        proveedor = provider_of(model)
+        with self._lock:
+            if proveedor not in self._breakers:
+                read = self.timeouts.get(proveedor, (None, None))[1]
+                self._breakers[proveedor] = CircuitBreaker(
+                    proveedor, self.max_failures, self.max_slow,
+                    read * self.slow_fraction if read else None, self.reset_timeout,
+                )
+            return self._breakers[proveedor]
+
+    def chain(self, model: str) -> List[str]:
+        """The model followed by its fallbacks."""
+        return [model] + [m for m in self.fallbacks.get(model, []) if m != model]
+
+    def build(self, model: str) -> BaseChatModel:
+        """
+        Provider chat model with its timeouts (no breaker or fallback).
+
+        Args:
+            model (str): Model name ('gpt', 'gpt-4o', 'llama1', 'llama2', 'gemini-...', 'mock', or any Ollama model)
+
+        Returns:
+            BaseChatModel: Client of the provider
+        """
+        proveedor = provider_of(model)
+        connect, read = self.timeouts.get(proveedor, (None, None))
+        if proveedor == "mock":
+            return MockChatModel.from_name(model)
+        if proveedor == "openai":
+            return ChatOpenAI(temperature=0, model=MODELOS_OPENAI.get(model, model),
+                              timeout=httpx.Timeout(read, connect=connect), max_retries=MAX_RETRIES["openai"])
+        if proveedor == "google":
+            return ChatGoogleGenerativeAI(temperature=0, model=model, timeout=read, max_retries=MAX_RETRIES["google"])
+        return ChatOllama(model=MODELOS_OLLAMA.get(model, model), temperature=0, base_url=self.ollama.host,
+                          keep_alive=self.ollama.keep_alive, timeout=int(read) if read else None)
+
+    def client(self, model: str) -> BaseChatModel:
+        """
+        Client of a model, built once and reused (provider clients keep their
+        connection pools), wrapped for recording or replay when CRITAIR_LLM_REPLAY is set.
+        """
+        with self._lock:
+            cliente = self._clientes.get(model)
+        if cliente is None:
+            cliente = wrap_chat_model(lambda: self.build(model), model)
+            with self._lock:
+                cliente = self._clientes.setdefault(model, cliente)
+        return cliente
+
+    def warm(self, model: str) -> None:
+        """
+        Loads an Ollama model before its first call, so its load time is not
+        measured as inference. A backend that cannot be reached counts as a
+        failure of its breaker; nothing is tried while the breaker is open.
+        """
+        if provider_of(model) != "ollama" or REPLAY_MODE == "replay":
+            return
+        breaker = self.breaker(model)
+        if breaker.state != CircuitBreaker.CLOSED:
+            return
+        try:
+            self.ollama.ensure_loaded(MODELOS_OLLAMA.get(model, model))
+        except httpx.HTTPError as e:
+            print(f"No se pudo precargar {model} en Ollama: {e}")
+            breaker.record_failure()
+
+    def record(self, model: str, breaker: CircuitBreaker, respuesta: Optional[BaseMessage], latencia: float) -> None:
+        """Records a successful call: breaker, and load vs inference time of Ollama models (last chunk when streaming)."""
+        if provider_of(model) == "ollama":
+            metadata = respuesta.response_metadata if respuesta is not None else {}
+            carga = self.ollama.record_call(MODELOS_OLLAMA.get(model, model), metadata, latencia)
+            set_attribute("load_s", carga)
+            latencia -= carga
+        breaker.record_success(latencia)
+
+    def create(self, model: str) -> BaseChatModel:
+        """Chat model of a name, guarded by breakers and with its fallback chain (Ollama models are warmed)."""
+        self.warm(model)
+        return ResilientChatModel(chain=self.chain(model), factory=self)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Breaker state and counters per provider, and the number of calls served by a fallback."""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {"breakers": {nombre: b.snapshot() for nombre, b in breakers.items()},
+                "fallback_calls": self.fallback_calls}
+
+
+default_model_factory = ModelFactory()
+
+
+def model_factory_metrics() -> Dict[str, Any]:
+    """Metrics of the default factory (see ModelFactory.metrics)."""
+    return default_model_factory.metrics()
+
+
+class ResilientChatModel(BaseChatModel):
+    """
+    Chat model that tries each model of a chain whose breaker lets the call through.
+
+    Streaming is supported (hedging relies on the first token): a model that
+    fails before its first chunk falls back to the next one; once chunks were
+    returned, a failure is raised. The latency a breaker sees excludes the
+    model load Ollama reports, so a cold load is not taken for a slow response.
+
+    Attributes:
+        chain (List[str]): Model names, the requested one first
+        factory (Any): ModelFactory that builds the models and owns the breakers
+    """
+    chain: List[str]
+    factory: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "critair-resilient"
+
+    def _intentos(self) -> Iterator[Tuple[str, CircuitBreaker]]:
+        """Models of the chain whose breaker allows a call, in order."""
+        for i, modelo in enumerate(self.chain):
+            breaker = self.factory.breaker(modelo)
+            if breaker.allow():
+                if i:
+                    self.factory.fallback_calls += 1
+                    set_attribute("fallback", modelo)
+                yield modelo, breaker
+
+    @staticmethod
+    def _llamar(cliente: BaseChatModel, messages: List[BaseMessage], stop: Optional[List[str]],
+                inicio: float, **kwargs: Any) -> BaseMessage:
+        """invoke(), or a stream that records the time to first token inside measure_ttft()."""
+        if not _medir_ttft.get():
+            return cliente.invoke(messages, stop=stop, **kwargs)
+        respuesta = None
+        for chunk in cliente.stream(messages, stop=stop, **kwargs):
+            if respuesta is None:
+                set_attribute("ttft_s", time.perf_counter() - inicio)
+                respuesta = chunk
+            else:
+                respuesta += chunk
+        return message_chunk_to_message(respuesta) if respuesta is not None else AIMessage(content="")
+
+    @staticmethod
+    async def _allamar(cliente: BaseChatModel, messages: List[BaseMessage], stop: Optional[List[str]],
+                       inicio: float, **kwargs: Any) -> BaseMessage:
+        """Async version of _llamar()."""
+        if not _medir_ttft.get():
+            return await cliente.ainvoke(messages, stop=stop, **kwargs)
+        respuesta = None
+        async for chunk in cliente.astream(messages, stop=stop, **kwargs):
+            if respuesta is None:
+                set_attribute("ttft_s", time.perf_counter() - inicio)
+                respuesta = chunk
+            else:
+                respuesta += chunk
+        return message_chunk_to_message(respuesta) if respuesta is not None else AIMessage(content="")
+
+    def _sin_modelos(self, error: Optional[Exception]) -> ModelUnavailableError:
+        return ModelUnavailableError(f"No model available in {self.chain}: {error or 'circuit breakers open'}")
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        error = None
+        for modelo, breaker in self._intentos():
+            with span("model_call", model=modelo, provider=breaker.name):
+                inicio = time.perf_counter()
+                try:
+                    respuesta = self._llamar(self.factory.client(modelo), messages, stop, inicio, **kwargs)
+                except ReplayMissError:
+                    # A missing recording is not a provider failure: falling back would
+                    # replay (or miss) another model's answer
+                    breaker.release()
+                    raise
+                except Exception as e:
+                    breaker.record_failure()
+                    error = e
+                    continue
+                except BaseException:
+                    breaker.release()
+                    raise
+                self.factory.record(modelo, breaker, respuesta, time.perf_counter() - inicio)
+                tokens, estimados = prompt_tokens(messages, respuesta)
+                set_attribute("prompt_tokens", tokens)
+                set_attribute("prompt_tokens_estimated", estimados)
+            return ChatResult(generations=[ChatGeneration(message=respuesta)])
+        raise self._sin_modelos(error) from error
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        error = None
+        for modelo, breaker in self._intentos():
+            with span("model_call", model=modelo, provider=breaker.name):
+                inicio = time.perf_counter()
+                try:
+                    respuesta = await self._allamar(self.factory.client(modelo), messages, stop, inicio, **kwargs)
+                except ReplayMissError:
+                    # A missing recording is not a provider failure: falling back would
+                    # replay (or miss) another model's answer
+                    breaker.release()
+                    raise
+                except Exception as e:
+                    breaker.record_failure()
+                    error = e
+                    continue
+                except BaseException:
+                    breaker.release()
+                    raise
+                self.factory.record(modelo, breaker, respuesta, time.perf_counter() - inicio)
+                tokens, estimados = prompt_tokens(messages, respuesta)
+                set_attribute("prompt_tokens", tokens)
+                set_attribute("prompt_tokens_estimated", estimados)
+            return ChatResult(generations=[ChatGeneration(message=respuesta)])
+        raise self._sin_modelos(error) from error
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        error = None
+        for modelo, breaker in self._intentos():
+            inicio = time.perf_counter()
+            ultimo = None
+            try:
+                for chunk in self.factory.client(modelo).stream(messages, stop=stop, **kwargs):
+                    ultimo = chunk
+                    yield ChatGenerationChunk(message=chunk)
+            except ReplayMissError:
+                breaker.release()
+                raise
+            except Exception as e:
+                breaker.record_failure()
+                if ultimo is not None:
+                    raise
+                error = e
+                continue
+            except BaseException:
+                # Stream closed by its consumer (a hedge that lost) or task cancelled
+                breaker.release()
+                raise
+            self.factory.record(modelo, breaker, ultimo, time.perf_counter() - inicio)
+            return
+        raise self._sin_modelos(error) from error
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any):
+        error = None
+        for modelo, breaker in self._intentos():
+            inicio = time.perf_counter()
+            ultimo = None
+            try:
+                async for chunk in self.factory.client(modelo).astream(messages, stop=stop, **kwargs):
+                    ultimo = chunk
+                    yield ChatGenerationChunk(message=chunk)
+            except ReplayMissError:
+                breaker.release()
+                raise
+            except Exception as e:
+                breaker.record_failure()
+                if ultimo is not None:
+                    raise
+                error = e
+                continue
+            except BaseException:
+                # Stream closed by its consumer (a hedge that lost) or task cancelled
+                breaker.release()
+                raise
+            self.factory.record(modelo, breaker, ultimo, time.perf_counter() - inicio)
+            return
+        raise self._sin_modelos(error) from error
@@ -0,0 +1,285 @@
+"""
+Warm-keeping of the local Ollama models
+The first request to an Ollama model pays its load into memory, which used
+to end up inside the measured inference time. The manager loads a model
+before it is used (and the configured ones at start-up), asks Ollama to keep
+it resident (keep_alive), and unloads the least recently used models when
+the resident ones would exceed a memory budget. Load time is recorded apart
+from steady-state inference: warm-ups are timed by the manager, and the
+load_duration Ollama reports for every call is subtracted from its latency.
+
+Usage (from the project root):
+    python src/ollama_manager.py --preload llama1 llama2 qwen2.5:7b --budget-gb 12
+"""
+
+import argparse
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+import numpy as np
+import pandas as pd
+
+from tracing import set_attribute, span
+
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+if not OLLAMA_HOST.startswith("http"):
+    OLLAMA_HOST = f"http://{OLLAMA_HOST}"
+
+# How long Ollama keeps a model loaded after its last request ('-1' keeps it until unloaded)
+KEEP_ALIVE = os.getenv("CRITAIR_OLLAMA_KEEP_ALIVE", "30m")
+
+# Memory the resident models may use, in GB (0 for no budget)
+MEMORY_BUDGET_GB = float(os.getenv("CRITAIR_OLLAMA_MEMORY_GB", "0"))
+
+# Models loaded at start-up (comma-separated Ollama names or factory names such as llama1)
+PRELOAD = [m.strip() for m in os.getenv("CRITAIR_OLLAMA_PRELOAD", "").split(",") if m.strip()]
+
+# A call whose reported load_duration is below this (seconds) found the model already loaded
+MIN_LOAD = 0.1
+
+# Seconds to reach the Ollama server
+CONNECT_TIMEOUT = 2.0
+
+GB = 1024 ** 3
+
+
+def parse_keep_alive(keep_alive) -> float:
+    """'30m', '2h', '45s', '300' or -1 -> seconds (inf for a negative value)."""
+    texto = str(keep_alive).strip()
+    unidades = {"s": 1, "m": 60, "h": 3600}
+    factor = unidades.get(texto[-1:], 1)
+    numero = float(texto[:-1] if texto[-1:] in unidades else texto)
+    return float("inf") if numero < 0 else numero * factor
+
+
+class OllamaManager:
+    """
+    Keeps Ollama models warm under a memory budget, unloading the least recently used.
+
+    Args:
+        host (str): Ollama server URL
+        keep_alive (str): keep_alive sent with every load ('30m', '-1', ...)
+        memory_budget_gb (float): Memory the resident models may use (0 for no budget)
+        timeout (float): Seconds a load may take
+    """
+
+    def __init__(self, host: str = OLLAMA_HOST, keep_alive: str = KEEP_ALIVE,
+                 memory_budget_gb: float = MEMORY_BUDGET_GB, timeout: float = 300.0):
+        self.host = host.rstrip("/")
+        self.keep_alive = keep_alive
+        self.keep_alive_s = parse_keep_alive(keep_alive)
+        self.memory_budget = memory_budget_gb * GB
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        # model -> (bytes in memory, last use) of the resident models, least recently used first
+        self._residentes: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._tamanos: Dict[str, float] = {}
+        self._cargas: Dict[str, List[float]] = {}
+        self._inferencias: Dict[str, List[float]] = {}
+        self.unloads = 0
+
+    # Ollama API ---------------------------------------------------------------------------------
+
+    def _post(self, ruta: str, payload: dict) -> dict:
+        respuesta = httpx.post(f"{self.host}{ruta}", json=payload,
+                               timeout=httpx.Timeout(self.timeout, connect=CONNECT_TIMEOUT))
+        respuesta.raise_for_status()
+        return respuesta.json()
+
+    def _get(self, ruta: str) -> dict:
+        respuesta = httpx.get(f"{self.host}{ruta}", timeout=httpx.Timeout(10.0, connect=CONNECT_TIMEOUT))
+        respuesta.raise_for_status()
+        return respuesta.json()
+
+    def loaded(self) -> Dict[str, float]:
+        """Models Ollama has in memory -> bytes they use."""
+        return {m["name"]: float(m.get("size", 0)) for m in self._get("/api/ps").get("models", [])}
+
+    def _estimar(self, model: str) -> float:
+        """Bytes a model will use: measured on an earlier load, else its file size."""
+        if model in self._tamanos:
+            return self._tamanos[model]
+        try:
+            for m in self._get("/api/tags").get("models", []):
+                if m["name"] in (model, f"{model}:latest"):
+                    return float(m.get("size", 0))
+        except httpx.HTTPError:
+            pass
+        return 0.0
+
+    def _sincronizar(self) -> None:
+        """Updates the resident models and their sizes from /api/ps (keeping their LRU order)."""
+        en_memoria = {nombre.removesuffix(":latest"): tamano for nombre, tamano in self.loaded().items()}
+        with self._lock:
+            for model in list(self._residentes):
+                if model not in en_memoria:
+                    del self._residentes[model]
+            for model, tamano in en_memoria.items():
+                self._tamanos[model] = tamano
+                if model in self._residentes:
+                    self._residentes[model][0] = tamano
+                else:
+                    self._residentes[model] = [tamano, 0.0]
+                    self._residentes.move_to_end(model, last=False)
+
+    # Loading and unloading ----------------------------------------------------------------------
+
+    def is_warm(self, model: str) -> bool:
+        """Whether a model was used recently enough to still be loaded."""
+        with self._lock:
+            residente = self._residentes.get(model)
+            return residente is not None and time.time() - residente[1] < self.keep_alive_s
+
+    def unload(self, model: str) -> None:
+        """Asks Ollama to release a model."""
+        self._post("/api/generate", {"model": model, "keep_alive": 0})
+        with self._lock:
+            self._residentes.pop(model, None)
+            self.unloads += 1
+
+    def _liberar(self, necesario: float, excepto: str) -> None:
+        """Unloads least recently used models until `necesario` more bytes fit in the budget."""
+        if not self.memory_budget:
+            return
+        while True:
+            with self._lock:
+                usado = sum(tamano for tamano, _ in self._residentes.values())
+                victimas = [m for m in self._residentes if m != excepto]
+            if usado + necesario <= self.memory_budget or not victimas:
+                return
+            print(f"Descargando {victimas[0]} de Ollama (presupuesto de memoria)")
+            self.unload(victimas[0])
+
+    def ensure_loaded(self, model: str) -> float:
+        """
+        Loads a model if it is not resident, making room for it within the budget.
+
+        Args:
+            model (str): Ollama model name
+
+        Returns:
+            float: Seconds spent loading it (0.0 if it was warm)
+
+        Raises:
+            httpx.HTTPError: If Ollama cannot be reached or the load fails
+        """
+        if self.is_warm(model):
+            self.touch(model)
+            return 0.0
+        with self._load_lock:
+            self._sincronizar()
+            if model in self._residentes:
+                self.touch(model)
+                return 0.0
+            self._liberar(self._estimar(model), model)
+            with span("model_load", model=model):
+                inicio = time.perf_counter()
+                respuesta = self._post("/api/generate", {"model": model, "keep_alive": self.keep_alive})
+                carga = respuesta.get("load_duration", 0) / 1e9 or time.perf_counter() - inicio
+                set_attribute("load_s", carga)
+            self._sincronizar()
+            with self._lock:
+                self._cargas.setdefault(model, []).append(carga)
+            self.touch(model)
+            # The measured size may be larger than the estimate
+            self._liberar(0.0, model)
+        return carga
+
+    def touch(self, model: str) -> None:
+        """Marks a model as just used."""
+        with self._lock:
+            residente = self._residentes.setdefault(model, [self._tamanos.get(model, 0.0), 0.0])
+            residente[1] = time.time()
+            self._residentes.move_to_end(model)
+
+    def warm(self, model: str) -> float:
+        """ensure_loaded() that reports failures instead of raising them (returns -1.0 on failure)."""
+        try:
+            return self.ensure_loaded(model)
+        except httpx.HTTPError as e:
+            print(f"No se pudo cargar {model} en Ollama: {e}")
+            return -1.0
+
+    def preload(self, models: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """
+        Loads the configured models (CRITAIR_OLLAMA_PRELOAD by default).
+
+        Args:
+            models (Optional[Iterable[str]]): Ollama model names
+
+        Returns:
+            Dict[str, float]: Load seconds per model (-1.0 for those that failed)
+        """
+        return {model: self.warm(model) for model in (PRELOAD if models is None else models)}
+
+    # Timing --------------------------------------------------------------------------------------
+
+    def record_call(self, model: str, metadata: dict, latencia: float) -> float:
+        """
+        Splits the latency of a finished call into load and steady-state inference.
+
+        Args:
+            model (str): Ollama model name
+            metadata (dict): response_metadata of the answer (load_duration in ns)
+            latencia (float): Seconds the call took
+
+        Returns:
+            float: Seconds of the call spent loading the model
+        """
+        carga = (metadata or {}).get("load_duration", 0) / 1e9
+        carga = carga if carga >= MIN_LOAD else 0.0
+        with self._lock:
+            if carga:
+                self._cargas.setdefault(model, []).append(carga)
+            self._inferencias.setdefault(model, []).append(max(latencia - carga, 0.0))
+        self.touch(model)
+        return carga
+
+    def report(self) -> pd.DataFrame:
+        """Loads, load time and steady-state inference time per model."""
+        with self._lock:
+            modelos = sorted(set(self._cargas) | set(self._inferencias) | set(self._residentes))
+            filas = []
+            for model in modelos:
+                cargas = self._cargas.get(model, [])
+                inferencias = self._inferencias.get(model, [])
+                filas.append({
+                    "model": model,
+                    "resident": model in self._residentes,
+                    "size_gb": self._tamanos.get(model, 0.0) / GB,
+                    "loads": len(cargas),
+                    "load_s_mean": float(np.mean(cargas)) if cargas else np.nan,
+                    "calls": len(inferencias),
+                    "inference_s_mean": float(np.mean(inferencias)) if inferencias else np.nan,
+                    "inference_s_p95": float(np.percentile(inferencias, 95)) if inferencias else np.nan,
+                })
+        return pd.DataFrame(filas)
+
+
+default_ollama_manager = OllamaManager()
+
+
+def main() -> None:
+    from model_factory import MODELOS_OLLAMA
+
+    parser = argparse.ArgumentParser(description="Precarga de modelos de Ollama bajo un presupuesto de memoria")
+    parser.add_argument("--preload", nargs="*", default=PRELOAD, help="Modelos a cargar (p.ej. llama1 qwen2.5:7b)")
+    parser.add_argument("--budget-gb", type=float, default=MEMORY_BUDGET_GB, help="0 para no limitar")
+    parser.add_argument("--keep-alive", default=KEEP_ALIVE)
+    parser.add_argument("--host", default=OLLAMA_HOST)
+    args = parser.parse_args()
+
+    manager = OllamaManager(args.host, args.keep_alive, args.budget_gb)
+    for model, segundos in manager.preload(MODELOS_OLLAMA.get(m, m) for m in args.preload).items():
+        print(f"{model}: {'error' if segundos < 0 else f'{segundos:.2f} s de carga'}")
+    print(manager.report().to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
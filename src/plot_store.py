@@ -0,0 +1,281 @@
+"""
+Content-addressed store for the charts generated by eventos_transformadores_plots
+Images are keyed by (normalized query, data version, model) so a repeated
+question over unchanged data is answered from disk instead of running a new
+agent. Output filenames per chat are allocated from a counter (no directory
+listing) and claimed with an exclusive create, so server workers never hand
+out the same file; old artifacts are evicted by total size and age. Workers
+share index.json: each write merges it with the file under an exclusive lock.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: the index is only serialized within the process
+    fcntl = None
+
+from utils import normalize_query
+
+
+class PlotStore:
+    """
+    Plot artifact cache with an on-disk JSON index.
+
+    Args:
+        root (str): Folder holding cached images and index.json
+        max_bytes (int): Maximum total size of cached images
+        max_age_seconds (float): Artifacts older than this are evicted
+    """
+
+    def __init__(self, root: str = "plots/_store", max_bytes: int = 512 * 1024 * 1024,
+                 max_age_seconds: float = 30 * 24 * 3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._index: Optional[Dict[str, dict]] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query: str, data_version: str, model: str) -> str:
+        """
+        Content address of a chart.
+
+        Args:
+            query (str): User request
+            data_version (str): Version of the event data the chart was drawn from
+            model (str): Model that generated the chart
+
+        Returns:
+            str: Hex digest used as key and file name
+        """
+        payload = "\x1f".join([normalize_query(query), data_version, model])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # Index handling ----------------------------------------------------------------------------
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.root, "index.json")
+
+    def _read_index(self) -> Dict[str, dict]:
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _load_index(self) -> Dict[str, dict]:
+        if self._index is None:
+            self._index = self._read_index()
+        return self._index
+
+    @contextmanager
+    def _index_lock(self):
+        """Exclusive lock of index.json across processes (flock on index.json.lock)."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(f"{self._index_path}.lock", "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _save_index(self) -> None:
+        """
+        Writes the index merged with the one on disk, then evicts (self._lock held).
+
+        Entries other workers added are kept and the latest access of each
+        entry wins; entries whose image is gone (evicted by another worker)
+        are dropped.
+        """
+        with self._index_lock():
+            for key, entry in self._read_index().items():
+                propio = self._index.setdefault(key, entry)
+                propio["last_access"] = max(propio["last_access"], entry["last_access"])
+            self._index = {k: e for k, e in self._index.items() if os.path.exists(e["file"])}
+            self._evict()
+            tmp = f"{self._index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._index, f, ensure_ascii=False)
+            os.replace(tmp, self._index_path)
+
+    # Output paths ------------------------------------------------------------------------------
+
+    def allocate_output_path(self, chat_id: str, extension: str = "jpg") -> str:
+        """
+        Reserves the next plots/{chat_id}/output_{n} path.
+
+        The path is claimed by creating it empty with O_CREAT | O_EXCL, so two
+        processes (server workers) never get the same one; a name another
+        process took is skipped. The counter persisted in
+        plots/{chat_id}/.next_output is only a starting point, re-read on every
+        call; the folder is only listed for chats created before it existed.
+
+        Args:
+            chat_id (str): Conversation identifier
+            extension (str): Image extension
+
+        Returns:
+            str: Relative path of the new image (an empty file until the chart is written)
+        """
+        folder = f"plots/{chat_id}"
+        counter_path = os.path.join(folder, ".next_output")
+        with self._lock:
+            os.makedirs(folder, exist_ok=True)
+            try:
+                with open(counter_path, "r") as f:
+                    number_image = int(f.read())
+            except (FileNotFoundError, ValueError):
+                number_image = len([n for n in os.listdir(folder) if not n.startswith(".")])
+            while True:
+                path = f"{folder}/output_{number_image}.{extension}"
+                try:
+                    os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    break
+                except FileExistsError:
+                    number_image += 1
+            tmp = f"{counter_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(str(number_image + 1))
+            os.replace(tmp, counter_path)
+        return path
+
+    @staticmethod
+    def release_output_path(path: str) -> None:
+        """Removes the placeholder of an allocated path no chart was written to."""
+        try:
+            if not os.path.getsize(path):
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    # Cache operations --------------------------------------------------------------------------
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Looks up a cached chart.
+
+        Args:
+            key (str): Content address from PlotStore.key
+
+        Returns:
+            Optional[dict]: Entry with 'file', 'response' and 'output_path' (the chat
+            path the image was first written to), or None on a miss
+        """
+        with self._lock:
+            entry = self._load_index().get(key)
+            if entry is None or not os.path.exists(entry["file"]):
+                self.misses += 1
+                return None
+            if time.time() - entry["created"] > self.max_age_seconds:
+                self._remove(key)
+                self._save_index()
+                self.misses += 1
+                return None
+            entry["last_access"] = time.time()
+            self.hits += 1
+            return dict(entry)
+
+    def materialize(self, entry: dict, path: str) -> str:
+        """
+        Places a cached image at a chat output path (hard link, or copy across devices),
+        replacing the placeholder left by allocate_output_path.
+
+        Args:
+            entry (dict): Entry returned by get()
+            path (str): Destination path
+
+        Returns:
+            str: Cached answer with the original image path replaced by the new one
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(entry["file"], tmp)
+        except OSError:
+            shutil.copyfile(entry["file"], tmp)
+        os.replace(tmp, path)
+        return entry["response"].replace(entry.get("output_path") or path, path)
+
+    def put(self, key: str, image_path: str, response: str, **metadata) -> Optional[dict]:
+        """
+        Stores a freshly generated chart and evicts old artifacts.
+
+        Args:
+            key (str): Content address from PlotStore.key
+            image_path (str): Generated image
+            response (str): Textual answer that accompanied the image
+            **metadata: Extra fields kept in the index (query, model, data_version, ...)
+
+        Returns:
+            Optional[dict]: Stored entry, or None if the image was not written
+        """
+        if not os.path.exists(image_path) or not os.path.getsize(image_path):
+            return None
+        os.makedirs(self.root, exist_ok=True)
+        extension = os.path.splitext(image_path)[1] or ".jpg"
+        target = os.path.join(self.root, f"{key}{extension}")
+        tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(image_path, tmp)
+        os.replace(tmp, target)
+
+        now = time.time()
+        entry = {
+            "file": target,
+            "size": os.path.getsize(target),
+            "created": now,
+            "last_access": now,
+            "response": response,
+            "output_path": image_path,
+            **metadata,
+        }
+        with self._lock:
+            self._load_index()[key] = entry
+            self._save_index()
+        return dict(entry)
+
+    def _remove(self, key: str) -> None:
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            try:
+                os.remove(entry["file"])
+            except FileNotFoundError:
+                pass
+
+    def _evict(self) -> None:
+        now = time.time()
+        for key in [k for k, e in self._index.items() if now - e["created"] > self.max_age_seconds]:
+            self._remove(key)
+        total = sum(e["size"] for e in self._index.values())
+        # Least recently used first until the size budget is met
+        for key, entry in sorted(self._index.items(), key=lambda kv: kv[1]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            total -= entry["size"]
+            self._remove(key)
+
+    def stats(self) -> dict:
+        """Number of entries, total bytes and hit/miss counters."""
+        with self._lock:
+            index = self._load_index()
+            return {
+                "entries": len(index),
+                "bytes": sum(e["size"] for e in index.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+default_plot_store = PlotStore()
@@ -0,0 +1,264 @@
+"""
+Vectorized builder of the info_poligono samples consumed by recomendacion()
+The variable table of an equipment type (one row per equipment, with the
+polygon it belongs to) is reduced in one group-by to per-polygon features
+named like those in EXCLUDED_VARIABLES: <VAR>_mean, _median, _min, _max and
+_std for numeric variables and <VAR>_<value>_count for categorical ones.
+Each polygon's top 5 features are the ones that deviate most from the other
+polygons of the same equipment type (largest |z-score|, optionally weighted),
+picked with a single argpartition over the feature matrix. The result is kept
+as arrays and only turned into the nested info_poligono dict on demand.
+
+Usage (from the project root):
+    python src/poligono_features.py variables.csv --poligono-col poligono --tipo-col Tipo_de_equipo
+"""
+
+import argparse
+import json
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from tracing import span
+from utils import EXCLUDED_VARIABLES
+
+
+ESTADISTICAS = ["mean", "median", "min", "max", "std"]
+
+# Columns never used as variables (identifiers and location)
+COLUMNAS_EXCLUIDAS = ["LONGITUD", "LATITUD"]
+
+# Categorical columns with more distinct values are identifiers (equipment codes,
+# addresses), skipped instead of expanded into one _count feature per value
+MAX_CATEGORIAS = 50
+
+TOP = 5
+
+
+def polygon_features(tabla: pd.DataFrame, poligono_col: str = "poligono",
+                     excluir: Sequence[str] = (), max_categorias: Optional[int] = MAX_CATEGORIAS) -> pd.DataFrame:
+    """
+    Per-polygon features of one equipment type's variable table.
+
+    Args:
+        tabla (pd.DataFrame): One row per equipment with the polygon id and its variables
+        poligono_col (str): Polygon id column
+        excluir (Sequence[str]): Columns not treated as variables
+        max_categorias (Optional[int]): Categorical columns with more distinct values
+            are skipped (None to keep them all)
+
+    Returns:
+        pd.DataFrame: One row per polygon (indexed by id), columns <VAR>_<stat>
+        and <VAR>_<value>_count, plus LONGITUD/LATITUD centroids when present
+    """
+    excluir = set(excluir) | set(COLUMNAS_EXCLUIDAS) | {poligono_col}
+    numericas = [c for c in tabla.columns if c not in excluir and pd.api.types.is_numeric_dtype(tabla[c])
+                 and not pd.api.types.is_bool_dtype(tabla[c])]
+    categoricas = [c for c in tabla.columns if c not in excluir and c not in numericas
+                   and (max_categorias is None or tabla[c].nunique() <= max_categorias)]
+    grupos = tabla.groupby(poligono_col, sort=True, observed=True)
+
+    partes = []
+    if numericas:
+        estadisticas = grupos[numericas].agg(ESTADISTICAS)
+        estadisticas.columns = [f"{var}_{est}" for var, est in estadisticas.columns]
+        partes.append(estadisticas)
+    for col in categoricas:
+        conteos = pd.crosstab(tabla[poligono_col], tabla[col].astype(str))
+        conteos.columns = [f"{col}_{valor}_count" for valor in conteos.columns]
+        partes.append(conteos)
+    for col in COLUMNAS_EXCLUIDAS:
+        if col in tabla:
+            partes.append(grupos[col].mean().to_frame(col))
+    if not partes:
+        return pd.DataFrame(index=pd.Index(sorted(tabla[poligono_col].unique()), name=poligono_col))
+    return pd.concat(partes, axis=1)
+
+
+@dataclass
+class PolygonTop5:
+    """
+    Top features of each polygon and equipment type, as arrays.
+
+    Attributes:
+        poligonos (np.ndarray): Polygon id of each sample
+        tipos (np.ndarray): Equipment type of each sample
+        features (np.ndarray): Feature names (indexed by indices)
+        indices (np.ndarray): (samples, k) int32 positions in features, -1 if fewer than k
+        valores (np.ndarray): (samples, k) float64 feature values (exact, they reach prompts and rule checks)
+        puntajes (np.ndarray): (samples, k) float32 selection scores (|z| times weight)
+        lon (np.ndarray): Centroid longitude of each sample (NaN if unknown)
+        lat (np.ndarray): Centroid latitude of each sample (NaN if unknown)
+    """
+    poligonos: np.ndarray
+    tipos: np.ndarray
+    features: np.ndarray
+    indices: np.ndarray
+    valores: np.ndarray
+    puntajes: np.ndarray
+    lon: np.ndarray
+    lat: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.poligonos)
+
+    @property
+    def nbytes(self) -> int:
+        return int(sum(getattr(self, c).nbytes for c in ["indices", "valores", "puntajes", "lon", "lat"]))
+
+    def _clave(self, i: int) -> str:
+        return f"{self.poligonos[i]}_{self.tipos[i]}"
+
+    def to_info_poligono(self, muestras: Optional[Iterable[int]] = None) -> Dict[str, dict]:
+        """
+        Builds the info_poligono dict expected by utils.recomendacion.
+
+        Args:
+            muestras (Optional[Iterable[int]]): Sample positions to include (all if None)
+
+        Returns:
+            Dict[str, dict]: '<poligono>_<tipo>' -> {'Tipo_de_equipo', 'top_5', 'poligono_id'
+            and, when known, 'LONGITUD' / 'LATITUD' (used for the event history)}
+        """
+        info = {}
+        for i in (range(len(self)) if muestras is None else muestras):
+            validos = self.indices[i] >= 0
+            muestra = {
+                "Tipo_de_equipo": self.tipos[i],
+                "top_5": dict(zip(self.features[self.indices[i][validos]].tolist(),
+                                  self.valores[i][validos].tolist())),
+                "poligono_id": self.poligonos[i].item() if hasattr(self.poligonos[i], "item") else self.poligonos[i],
+            }
+            if np.isfinite(self.lon[i]) and np.isfinite(self.lat[i]):
+                muestra["LONGITUD"], muestra["LATITUD"] = float(self.lon[i]), float(self.lat[i])
+            info[self._clave(i)] = muestra
+        return info
+
+    def to_frame(self) -> pd.DataFrame:
+        """Long table: one row per sample and selected feature, with its rank, value and score."""
+        filas, rangos = np.nonzero(self.indices >= 0)
+        return pd.DataFrame({
+            "poligono": self.poligonos[filas],
+            "Tipo_de_equipo": self.tipos[filas],
+            "rango": rangos + 1,
+            "variable": self.features[self.indices[filas, rangos]],
+            "valor": self.valores[filas, rangos],
+            "puntaje": self.puntajes[filas, rangos],
+        })
+
+
+def _top_k(features: pd.DataFrame, k: int, pesos: Optional[Dict[str, float]],
+           excluidas: Sequence[str]):
+    """Positions, values and scores of the k largest |z| features per row (NaN features never chosen)."""
+    nombres = np.array([c for c in features.columns if c not in excluidas and c not in COLUMNAS_EXCLUIDAS])
+    matriz = features[nombres].to_numpy(dtype=np.float64) if len(nombres) else np.empty((len(features), 0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        media = np.nanmean(matriz, axis=0) if len(matriz) else np.zeros(len(nombres))
+        desviacion = np.nanstd(matriz, axis=0) if len(matriz) else np.ones(len(nombres))
+        z = np.abs((matriz - media) / np.where(desviacion > 0, desviacion, np.nan))
+    # Constant features score 0 (still eligible); missing values are never selected
+    puntajes = np.where(np.isnan(matriz), -np.inf, np.nan_to_num(z, nan=0.0))
+    if pesos:
+        puntajes = puntajes * np.array([pesos.get(n, 1.0) for n in nombres])
+
+    k_real = min(k, len(nombres))
+    indices = np.full((len(matriz), k), -1, dtype=np.int32)
+    valores = np.full((len(matriz), k), np.nan, dtype=np.float64)
+    mejores = np.full((len(matriz), k), np.nan, dtype=np.float32)
+    if k_real and len(matriz):
+        candidatos = np.argpartition(-puntajes, k_real - 1, axis=1)[:, :k_real]
+        orden = np.argsort(-np.take_along_axis(puntajes, candidatos, axis=1), axis=1, kind="stable")
+        elegidos = np.take_along_axis(candidatos, orden, axis=1)
+        seleccion = np.take_along_axis(puntajes, elegidos, axis=1)
+        validos = np.isfinite(seleccion)
+        indices[:, :k_real] = np.where(validos, elegidos, -1)
+        valores[:, :k_real] = np.take_along_axis(matriz, elegidos, axis=1)
+        mejores[:, :k_real] = np.where(validos, seleccion, np.nan)
+    return nombres, indices, valores, mejores
+
+
+def build_info_poligono(tablas: Dict[str, pd.DataFrame], poligono_col: str = "poligono", k: int = TOP,
+                        pesos: Optional[Dict[str, float]] = None,
+                        excluidas: Sequence[str] = EXCLUDED_VARIABLES, excluir: Sequence[str] = (),
+                        max_categorias: Optional[int] = MAX_CATEGORIAS) -> PolygonTop5:
+    """
+    Per-polygon features and top-k selection for every equipment type.
+
+    Args:
+        tablas (Dict[str, pd.DataFrame]): Variable table of each equipment type
+            (the key is the Tipo_de_equipo used by recomendacion)
+        poligono_col (str): Polygon id column
+        k (int): Features kept per sample
+        pesos (Optional[Dict[str, float]]): Weight of each feature in the ranking (e.g. model importances)
+        excluidas (Sequence[str]): Features never selected (defaults to utils.EXCLUDED_VARIABLES)
+        excluir (Sequence[str]): Columns of the tables not treated as variables (identifiers)
+        max_categorias (Optional[int]): Categorical columns with more distinct values are
+            skipped (None to keep them all)
+
+    Returns:
+        PolygonTop5: Samples of all equipment types
+    """
+    partes = []
+    nombres_globales: List[str] = []
+    posicion: Dict[str, int] = {}
+    for tipo, tabla in tablas.items():
+        with span("poligono_features", tipo_equipo=tipo, rows=len(tabla)):
+            features = polygon_features(tabla, poligono_col, excluir, max_categorias)
+            nombres, indices, valores, puntajes = _top_k(features, k, pesos, excluidas)
+        # Feature names shared across types
+        for nombre in map(str, nombres):
+            if nombre not in posicion:
+                posicion[nombre] = len(nombres_globales)
+                nombres_globales.append(nombre)
+        traduccion = np.array([posicion[str(n)] for n in nombres] + [-1], dtype=np.int32)
+        partes.append((
+            features.index.to_numpy(),
+            np.full(len(features), tipo, dtype=object),
+            traduccion[np.where(indices >= 0, indices, len(nombres))],
+            valores, puntajes,
+            features["LONGITUD"].to_numpy(dtype=np.float64) if "LONGITUD" in features else np.full(len(features), np.nan),
+            features["LATITUD"].to_numpy(dtype=np.float64) if "LATITUD" in features else np.full(len(features), np.nan),
+        ))
+    if not partes:
+        vacio = np.empty((0, k))
+        return PolygonTop5(np.empty(0, dtype=object), np.empty(0, dtype=object), np.empty(0, dtype=object),
+                           vacio.astype(np.int32), vacio.astype(np.float64), vacio.astype(np.float32),
+                           np.empty(0), np.empty(0))
+    columnas = list(zip(*partes))
+    return PolygonTop5(
+        poligonos=np.concatenate(columnas[0]),
+        tipos=np.concatenate(columnas[1]),
+        features=np.array(nombres_globales, dtype=object),
+        indices=np.concatenate(columnas[2]).astype(np.int32),
+        valores=np.concatenate(columnas[3]),
+        puntajes=np.concatenate(columnas[4]),
+        lon=np.concatenate(columnas[5]),
+        lat=np.concatenate(columnas[6]),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Top-5 de variables por polígono y tipo de equipo")
+    parser.add_argument("archivo", help="CSV con una fila por equipo: polígono, tipo de equipo y variables")
+    parser.add_argument("--poligono-col", default="poligono")
+    parser.add_argument("--tipo-col", default="Tipo_de_equipo")
+    parser.add_argument("--k", type=int, default=TOP)
+    parser.add_argument("--excluir", nargs="*", default=[], help="Columnas que no son variables (p.ej. identificadores)")
+    parser.add_argument("--max-categorias", type=int, default=MAX_CATEGORIAS,
+                        help="Omitir variables categóricas con más valores distintos (0 para no omitir ninguna)")
+    parser.add_argument("--output", default="info_poligono.json")
+    args = parser.parse_args()
+
+    tabla = pd.read_csv(args.archivo)
+    tablas = {tipo: grupo.drop(columns=[args.tipo_col]) for tipo, grupo in tabla.groupby(args.tipo_col)}
+    resultado = build_info_poligono(tablas, args.poligono_col, args.k, excluir=args.excluir,
+                                    max_categorias=args.max_categorias or None)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(resultado.to_info_poligono(), f, ensure_ascii=False, indent=2, default=str)
+    print(f"{len(resultado)} muestras ({resultado.nbytes / 1024:.0f} KiB en arreglos) -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
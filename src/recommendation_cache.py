@@ -0,0 +1,236 @@
+"""
+Persistent cache of the recommendations generated by recomendacion()
+Recommendations are keyed by model, equipment type, variable and value
+bucket, so polygons whose value of a variable is nearly the same reuse the
+text generated for the first one, with their own value substituted. Bucket
+edges are the normative limits of the variable (reglas.RuleSet), any bins
+configured for it, and geometric sub-bins of a relative width in between, so
+two values in one bucket are never on different sides of a limit. Items with
+an interruption history are always generated (their prompt is specific to
+the equipment). The index is a JSON file written atomically.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from typing import Dict, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from utils import normalize_query
+
+
+CACHE_PATH = os.getenv("CRITAIR_RECOMMENDATION_CACHE", "structured_data/recommendation_cache.json")
+
+# Relative width of the geometric sub-bins between edges
+ANCHO = 0.05
+
+# Source recorded for recommendations served from the cache
+CACHE_SOURCE = "cache"
+
+
+def _texto_valor(valor) -> str:
+    return str(valor).strip()
+
+
+def sustituir_valor(texto: str, anterior, nuevo) -> str:
+    """
+    Replaces the value a cached recommendation was written for with another.
+
+    '182.0' also matches '182' (and the reverse) but never a longer number
+    such as '1820' or '18.2'.
+
+    Args:
+        texto (str): Cached recommendation
+        anterior: Value it was generated for
+        nuevo: Value of the current sample
+
+    Returns:
+        str: Recommendation with the value replaced
+    """
+    formas = {_texto_valor(anterior)}
+    try:
+        numero = float(anterior)
+        formas |= {f"{numero:g}", repr(numero)}
+        if numero.is_integer():
+            formas.add(str(int(numero)))
+    except (TypeError, ValueError):
+        pass
+    formas = sorted((f for f in formas if f), key=len, reverse=True)
+    if not formas:
+        return texto
+    patron = r"(?<![\w.])(?:" + "|".join(map(re.escape, formas)) + r")(?![\w]|\.\d)"
+    return re.sub(patron, lambda _: _texto_valor(nuevo), texto)
+
+
+class RecommendationCache:
+    """
+    Recommendation cache with a JSON index and hit counters per equipment type.
+
+    Args:
+        path (Optional[str]): JSON index (None keeps the cache in memory only)
+        ancho (float): Relative width of the sub-bins between edges
+        bins (Optional[Dict[Tuple[str, str], Sequence[float]]]): Extra edges per
+            (tipo_equipo, variable)
+        reglas: reglas.RuleSet whose limits are bucket edges (None for reglas.default_rules)
+        max_entries (int): Entries kept, least recently used evicted first
+        enabled (bool): False to bypass the cache
+    """
+
+    def __init__(self, path: Optional[str] = CACHE_PATH, ancho: float = ANCHO,
+                 bins: Optional[Dict[Tuple[str, str], Sequence[float]]] = None, reglas=None,
+                 max_entries: int = 50_000, enabled: bool = True):
+        self.path = path
+        self.ancho = ancho
+        self.bins = {(normalize_query(t), normalize_query(v)): sorted(b) for (t, v), b in (bins or {}).items()}
+        self.reglas = reglas
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._index: Optional[Dict[str, dict]] = None
+        self._dirty = False
+        self.contadores: Dict[str, Dict[str, int]] = {}
+
+    # Buckets -----------------------------------------------------------------------------------
+
+    def _bordes(self, item: dict) -> list:
+        """Bucket edges of an item: normative limits and configured bins."""
+        import reglas as _reglas
+
+        bordes = list(self.bins.get((normalize_query(str(item["tipo_equipo"])),
+                                     normalize_query(str(item["variable"]))), []))
+        umbral = (self.reglas or _reglas.default_rules).umbral(item)
+        if umbral is not None:
+            bordes += [l for l in (umbral.minimo, umbral.maximo) if math.isfinite(l)]
+        return sorted(set(bordes))
+
+    def bucket(self, item: dict) -> str:
+        """
+        Bucket of an item's value.
+
+        Numeric values fall in the interval between edges that contains them
+        (a value equal to an edge is a bucket of its own, since limits are
+        inclusive) and then in a geometric sub-bin of relative width ancho;
+        anything else is matched exactly.
+        """
+        valor = pd.to_numeric(pd.Series([item["valor_variable"]], dtype=object), errors="coerce").iloc[0]
+        if pd.isna(valor):
+            return f"v:{normalize_query(_texto_valor(item['valor_variable']))}"
+        bordes = self._bordes(item)
+        intervalo = bisect_left(bordes, valor) + bisect_right(bordes, valor)
+        if valor == 0:
+            return f"{intervalo}:0"
+        sub = math.floor(math.log(abs(valor)) / math.log1p(self.ancho))
+        return f"{intervalo}:{'-' if valor < 0 else '+'}{sub}"
+
+    def key(self, model: str, item: dict) -> str:
+        """Cache key of an item for a model."""
+        return "\x1f".join([model, normalize_query(str(item["tipo_equipo"])),
+                            normalize_query(str(item["variable"])), self.bucket(item)])
+
+    # Index handling ----------------------------------------------------------------------------
+
+    def _load_index(self) -> Dict[str, dict]:
+        if self._index is None:
+            self._index = {}
+            if self.path:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._index = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    pass
+        return self._index
+
+    def save(self) -> None:
+        """Writes the index if it changed, evicting the least recently used entries."""
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            index = self._load_index()
+            if len(index) > self.max_entries:
+                viejas = sorted(index, key=lambda k: index[k]["last_access"])[:len(index) - self.max_entries]
+                for clave in viejas:
+                    del index[clave]
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+    # Cache operations --------------------------------------------------------------------------
+
+    def cacheable(self, item: dict) -> bool:
+        """Items with an interruption history get a prompt of their own and are never reused."""
+        return self.enabled and not item.get("historial_eventos")
+
+    def _contar(self, item: dict, resultado: str) -> None:
+        conteo = self.contadores.setdefault(str(item["tipo_equipo"]), {"hits": 0, "misses": 0})
+        conteo[resultado] += 1
+
+    def get(self, model: str, item: dict) -> Optional[str]:
+        """
+        Cached recommendation for an item, with the item's value substituted.
+
+        Args:
+            model (str): Model name
+            item (dict): Item from utils._variables_to_recommend
+
+        Returns:
+            Optional[str]: Recommendation, or None on a miss
+        """
+        if not self.cacheable(item):
+            return None
+        key = self.key(model, item)
+        with self._lock:
+            entry = self._load_index().get(key)
+            if entry is None:
+                self._contar(item, "misses")
+                return None
+            entry["last_access"] = time.time()
+            entry["hits"] = entry.get("hits", 0) + 1
+            self._dirty = True
+            self._contar(item, "hits")
+        return sustituir_valor(entry["response"], entry["valor"], item["valor_variable"])
+
+    def put(self, model: str, item: dict, response: str) -> None:
+        """Stores a freshly generated recommendation (saved to disk by save())."""
+        if not self.cacheable(item) or not response:
+            return
+        key = self.key(model, item)
+        now = time.time()
+        with self._lock:
+            self._load_index()[key] = {
+                "response": response,
+                "valor": _texto_valor(item["valor_variable"]),
+                "created": now,
+                "last_access": now,
+                "hits": 0,
+            }
+            self._dirty = True
+
+    def stats(self) -> Dict[str, dict]:
+        """Hits, misses and hit rate per equipment type (plus 'total')."""
+        with self._lock:
+            filas = {tipo: dict(c) for tipo, c in self.contadores.items()}
+        total = {"hits": sum(c["hits"] for c in filas.values()), "misses": sum(c["misses"] for c in filas.values())}
+        filas["total"] = total
+        for conteo in filas.values():
+            consultas = conteo["hits"] + conteo["misses"]
+            conteo["hit_rate"] = conteo["hits"] / consultas if consultas else 0.0
+        return filas
+
+    def describe(self) -> str:
+        """One line per equipment type with its hit rate."""
+        return "\n".join(f"Caché de recomendaciones [{tipo}]: {c['hits']}/{c['hits'] + c['misses']} "
+                         f"aciertos ({c['hit_rate']:.0%})" for tipo, c in self.stats().items())
+
+
+default_recommendation_cache = RecommendationCache()
+
+# Cache that never serves nor stores a recommendation
+NO_CACHE = RecommendationCache(path=None, enabled=False)
@@ -0,0 +1,356 @@
+"""
+Numeric rule pre-check for recomendacion()
+Each (tipo_equipo, variable) may have a machine-readable threshold (minimum,
+maximum, unit, regulation and ambiguity margin), read from a CSV next to the
+variables workbooks. Optionally (desde_texto=True), when the workbook text
+states a single explicit limit ("entre 10 y 20", "máximo 25", "> 30 kV"), it is
+parsed from its Sugerencia and Normativa columns; such a limit has no unit the
+sample value can be checked against, so it is off by default. The values of all samples are classified at once as
+compliant, non-compliant, ambiguous (within the margin of a limit) or unknown
+(no threshold, missing value or a statistic the limit does not apply to).
+Compliant values get a templated recommendation; only the rest are sent to
+the LLM.
+
+Thresholds CSV (CRITAIR_UMBRALES, default arbol_decision_recomendaciones/umbrales.csv):
+    tipo_equipo,variable,minimo,maximo,unidad,normativa,margen
+
+Usage (from the project root):
+    python src/reglas.py info_poligono.json
+"""
+
+import argparse
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils import normalize_query
+
+
+UMBRALES_PATH = os.getenv("CRITAIR_UMBRALES", "arbol_decision_recomendaciones/umbrales.csv")
+
+# Fraction of the limit (or of the range width) considered too close to call
+MARGEN = 0.05
+
+COMPLIANT = "compliant"
+NON_COMPLIANT = "non_compliant"
+AMBIGUOUS = "ambiguous"
+UNKNOWN = "unknown"
+ESTADOS = [COMPLIANT, NON_COMPLIANT, AMBIGUOUS, UNKNOWN]
+
+# Source recorded for recommendations answered by a rule (no LLM call)
+RULE_SOURCE = "rule"
+
+# Feature statistics a limit on the variable applies to (_std and _count never do)
+_SUFIJO = re.compile(r"_(mean|median|min|max|std|count)$", re.IGNORECASE)
+_ESTADISTICAS_COMPARABLES = {"", "mean", "median", "min", "max"}
+
+_NUMERO = r"(-?\d+(?:[.,]\d+)?)"
+_RANGO = re.compile(rf"entre\s+{_NUMERO}\s*(?:y|a|-)\s*{_NUMERO}")
+_MINIMO = re.compile(rf"(?:>=|≥|>|mayor o igual (?:a|que)|mayor (?:a|que)|minim[oa](?: de)?|al menos|"
+                     rf"no (?:menor|inferior) (?:a|de|que))\s*{_NUMERO}")
+_MAXIMO = re.compile(rf"(?:<=|≤|<|menor o igual (?:a|que)|menor (?:a|que)|maxim[oa](?: de)?|"
+                     rf"no (?:mayor|superior) (?:a|de|que)|no (?:debe )?exced(?:a|er)(?: de)?)\s*{_NUMERO}")
+
+
+@dataclass
+class Umbral:
+    """
+    Normative range of a variable.
+
+    Attributes:
+        minimo (float): Lower limit (NaN if none)
+        maximo (float): Upper limit (NaN if none)
+        unidad (str): Unit of the limits
+        normativa (str): Regulation that sets them
+        margen (float): Fraction of the limit within which a value is ambiguous
+        origen (str): 'csv' or 'texto' (parsed from the workbook)
+    """
+    minimo: float = np.nan
+    maximo: float = np.nan
+    unidad: str = ""
+    normativa: str = ""
+    margen: float = MARGEN
+    origen: str = "csv"
+
+    def describir(self) -> str:
+        unidad = f" {self.unidad}" if self.unidad else ""
+        if np.isfinite(self.minimo) and np.isfinite(self.maximo):
+            return f"between {self.minimo:g} and {self.maximo:g}{unidad}"
+        if np.isfinite(self.minimo):
+            return f"of at least {self.minimo:g}{unidad}"
+        return f"of at most {self.maximo:g}{unidad}"
+
+
+def _clave(tipo_equipo: str, variable: str) -> Tuple[str, str]:
+    return normalize_query(str(tipo_equipo)), normalize_query(str(variable)).replace(" ", "_")
+
+
+def _numero(texto: str) -> float:
+    return float(texto.replace(",", "."))
+
+
+def parse_threshold(*textos: Optional[str]) -> Optional[Umbral]:
+    """
+    Limit stated in workbook text ('entre 10 y 20', 'máximo 25', 'rigidez > 30 kV').
+
+    Text giving several limits (e.g. one per property of the insulating oil)
+    does not say which one the variable is compared with, so it yields None.
+
+    Args:
+        *textos (Optional[str]): Sugerencia, Normativa...
+
+    Returns:
+        Optional[Umbral]: The limit, or None if the text states none or more than one
+    """
+    texto = " ".join(normalize_query(t) for t in textos if isinstance(t, str))
+    rangos = _RANGO.findall(texto)
+    sin_rangos = _RANGO.sub(" ", texto)
+    minimos = _MINIMO.findall(sin_rangos)
+    maximos = _MAXIMO.findall(sin_rangos)
+    if len(rangos) == 1 and not minimos and not maximos:
+        a, b = sorted([_numero(rangos[0][0]), _numero(rangos[0][1])])
+        return Umbral(a, b, origen="texto")
+    if not rangos and len(minimos) <= 1 and len(maximos) <= 1 and (minimos or maximos):
+        umbral = Umbral(_numero(minimos[0]) if minimos else np.nan,
+                        _numero(maximos[0]) if maximos else np.nan, origen="texto")
+        # A lower limit above the upper one comes from two different properties
+        if not umbral.minimo >= umbral.maximo:
+            return umbral
+    return None
+
+
+def clasificar(valores: np.ndarray, minimos: np.ndarray, maximos: np.ndarray,
+               margenes: np.ndarray) -> np.ndarray:
+    """
+    Vectorized classification of values against their limits.
+
+    Args:
+        valores (np.ndarray): Values (NaN if missing)
+        minimos (np.ndarray): Lower limits (NaN if none)
+        maximos (np.ndarray): Upper limits (NaN if none)
+        margenes (np.ndarray): Ambiguity margin of each limit (fraction)
+
+    Returns:
+        np.ndarray: One of ESTADOS per value
+    """
+    valores, minimos, maximos, margenes = (np.asarray(a, dtype=np.float64)
+                                           for a in (valores, minimos, maximos, margenes))
+    con_min, con_max = np.isfinite(minimos), np.isfinite(maximos)
+    ancho = np.where(con_min & con_max, maximos - minimos, np.nan)
+    with np.errstate(invalid="ignore"):
+        # Margin as a fraction of the range width, or of the limit itself when only one is set
+        tolerancia_min = margenes * np.where(np.isfinite(ancho), ancho, np.abs(minimos))
+        tolerancia_max = margenes * np.where(np.isfinite(ancho), ancho, np.abs(maximos))
+        fuera = (con_min & (valores < minimos)) | (con_max & (valores > maximos))
+        cerca = ((con_min & (valores < minimos + tolerancia_min))
+                 | (con_max & (valores > maximos - tolerancia_max)))
+
+    estados = np.full(len(valores), COMPLIANT, dtype=object)
+    estados[cerca] = AMBIGUOUS
+    estados[fuera] = NON_COMPLIANT
+    estados[~np.isfinite(valores) | ~(con_min | con_max)] = UNKNOWN
+    return estados
+
+
+@dataclass
+class RuleReport:
+    """
+    Outcome of the pre-check of one recommendation run.
+
+    Attributes:
+        total (int): Variables checked
+        estados (Dict[str, int]): Count per state
+        por_tipo (Dict[str, Dict[str, int]]): Count per equipment type and state
+    """
+    total: int = 0
+    estados: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(ESTADOS, 0))
+    por_tipo: Dict[str, Dict[str, int]] = field(default_factory=dict)
+
+    @property
+    def llamadas_ahorradas(self) -> int:
+        """LLM calls replaced by a templated recommendation."""
+        return self.estados[COMPLIANT]
+
+    @property
+    def llamadas_llm(self) -> int:
+        return self.total - self.llamadas_ahorradas
+
+    def to_dict(self) -> dict:
+        return {"total": self.total, **self.estados, "llm_calls": self.llamadas_llm,
+                "llm_calls_saved": self.llamadas_ahorradas, "por_tipo": self.por_tipo}
+
+    def __str__(self) -> str:
+        detalle = ", ".join(f"{e}={n}" for e, n in self.estados.items())
+        return (f"Reglas: {self.llamadas_ahorradas} de {self.total} llamadas al LLM ahorradas ({detalle})")
+
+
+class RuleSet:
+    """
+    Thresholds per (tipo_equipo, variable) and the pre-check of recommendation items.
+
+    Args:
+        path (Optional[str]): Thresholds CSV (missing file means no CSV thresholds)
+        desde_texto (bool): Also parse limits from the workbook Sugerencia/Normativa text
+            (their unit is unknown, so a value in another unit could pass as compliant)
+        margen (float): Default ambiguity margin
+    """
+
+    def __init__(self, path: Optional[str] = UMBRALES_PATH, desde_texto: bool = False, margen: float = MARGEN):
+        self.path = path
+        self.desde_texto = desde_texto
+        self.margen = margen
+        self._umbrales: Optional[Dict[Tuple[str, str], Umbral]] = None
+        self.ultimo_reporte: Optional[RuleReport] = None
+
+    @property
+    def enabled(self) -> bool:
+        """False for a ruleset without any source of thresholds (NO_RULES)."""
+        return bool(self.path) or self.desde_texto
+
+    @property
+    def umbrales(self) -> Dict[Tuple[str, str], Umbral]:
+        """CSV thresholds, read on first use."""
+        if self._umbrales is None:
+            self._umbrales = self._leer(self.path) if self.path and os.path.exists(self.path) else {}
+        return self._umbrales
+
+    def _leer(self, path: str) -> Dict[Tuple[str, str], Umbral]:
+        tabla = pd.read_csv(path)
+        umbrales = {}
+        for fila in tabla.to_dict("records"):
+            margen = pd.to_numeric(fila.get("margen"), errors="coerce")
+            umbrales[_clave(fila["tipo_equipo"], fila["variable"])] = Umbral(
+                minimo=float(pd.to_numeric(fila.get("minimo"), errors="coerce")),
+                maximo=float(pd.to_numeric(fila.get("maximo"), errors="coerce")),
+                unidad="" if pd.isna(fila.get("unidad")) else str(fila["unidad"]),
+                normativa="" if pd.isna(fila.get("normativa")) else str(fila["normativa"]),
+                margen=self.margen if pd.isna(margen) else float(margen),
+            )
+        return umbrales
+
+    def umbral(self, item: dict) -> Optional[Umbral]:
+        """
+        Threshold of a recommendation item (see utils._variables_to_recommend).
+
+        The CSV is looked up by the workbook variable and by the original
+        feature name without its statistic suffix; the workbook text is
+        parsed only when the CSV has no entry.
+        """
+        original = item.get("variable_original", item["variable"])
+        for variable in (item["variable"], _SUFIJO.sub("", str(original))):
+            umbral = self.umbrales.get(_clave(item["tipo_equipo"], variable))
+            if umbral is not None:
+                return umbral
+        if self.desde_texto:
+            umbral = parse_threshold(item.get("sugerencia"), item.get("seccion"))
+            if umbral is not None:
+                umbral.margen = self.margen
+            return umbral
+        return None
+
+    def clasificar_items(self, items: List[dict]) -> Tuple[np.ndarray, List[Optional[Umbral]]]:
+        """
+        States of a list of recommendation items, classified in one pass.
+
+        Returns:
+            Tuple[np.ndarray, List[Optional[Umbral]]]: State and threshold of each item
+        """
+        umbrales = [self.umbral(item) for item in items]
+        sufijos = [(_SUFIJO.search(str(item.get("variable_original", ""))) or [None, ""])[1].lower()
+                   for item in items]
+        valores = pd.to_numeric(pd.Series([item["valor_variable"] for item in items], dtype=object),
+                                errors="coerce").to_numpy(dtype=np.float64, copy=True)
+        # Limits do not apply to dispersions or category counts
+        valores[np.array([s not in _ESTADISTICAS_COMPARABLES for s in sufijos], dtype=bool)] = np.nan
+        vacio = Umbral()
+        estados = clasificar(
+            valores,
+            np.array([(u or vacio).minimo for u in umbrales], dtype=np.float64),
+            np.array([(u or vacio).maximo for u in umbrales], dtype=np.float64),
+            np.array([(u or vacio).margen for u in umbrales], dtype=np.float64),
+        )
+        return estados, umbrales
+
+    def precheck(self, items: Iterable[Tuple[str, Optional[dict]]]) -> Tuple[Dict[str, str], RuleReport]:
+        """
+        Templated recommendations for the compliant items of a run.
+
+        Args:
+            items: (key, item) pairs from utils._variables_to_recommend (None items are skipped)
+
+        Returns:
+            Tuple[Dict[str, str], RuleReport]: Recommendation of each compliant key and the report
+        """
+        pares = [(key, item) for key, item in items if item is not None]
+        reporte = RuleReport(total=len(pares))
+        if not pares:
+            self.ultimo_reporte = reporte
+            return {}, reporte
+
+        estados, umbrales = self.clasificar_items([item for _, item in pares])
+        plantillas = {}
+        for (key, item), estado, umbral in zip(pares, estados, umbrales):
+            reporte.estados[estado] += 1
+            conteo = reporte.por_tipo.setdefault(str(item["tipo_equipo"]), dict.fromkeys(ESTADOS, 0))
+            conteo[estado] += 1
+            if estado == COMPLIANT:
+                plantillas[key] = recomendacion_plantilla(item, umbral)
+        self.ultimo_reporte = reporte
+        return plantillas, reporte
+
+
+def recomendacion_plantilla(item: dict, umbral: Umbral) -> str:
+    """Recommendation of a variable whose value is clearly inside its normative range."""
+    normativa = umbral.normativa or " ".join(str(item.get(c) or "").strip() for c in ("seccion", "documento")).strip()
+    rango = umbral.describir()
+    texto = (f"The variable {item['variable']} has a value of {item['valor_variable']}, which is within the "
+             f"range {rango} required by {normativa or 'the applicable regulation'}, so it complies and no "
+             f"adjustment is needed. Keep it {rango} and check it again in the periodic maintenance, "
+             f"especially if operating conditions change.")
+    if isinstance(item.get("sugerencia"), str) and item["sugerencia"].strip():
+        texto += f" {item['sugerencia'].strip()}"
+    return texto
+
+
+default_rules = RuleSet()
+
+# Ruleset that sends every variable to the LLM (pre-check disabled)
+NO_RULES = RuleSet(path=None, desde_texto=False)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pre-chequeo de reglas numéricas sobre info_poligono")
+    parser.add_argument("info_poligono", help="JSON de info_poligono (por ejemplo de poligono_features.py)")
+    parser.add_argument("--umbrales", default=UMBRALES_PATH)
+    parser.add_argument("--desde-texto", action="store_true",
+                        help="Extraer también límites del texto de los libros (sin verificar unidades)")
+    parser.add_argument("--output", default=None, help="CSV con el estado de cada variable")
+    args = parser.parse_args()
+
+    from utils import _variables_to_recommend
+
+    with open(args.info_poligono, "r", encoding="utf-8") as f:
+        info_poligono = json.load(f)
+    reglas = RuleSet(args.umbrales, desde_texto=args.desde_texto)
+    pares = [(key, item) for key, item in _variables_to_recommend(info_poligono) if item is not None]
+    estados, umbrales = reglas.clasificar_items([item for _, item in pares])
+    _, reporte = reglas.precheck(pares)
+    print(reporte)
+    for tipo, conteo in reporte.por_tipo.items():
+        print(f"  {tipo}: " + ", ".join(f"{e}={n}" for e, n in conteo.items()))
+    if args.output:
+        pd.DataFrame({
+            "key": [key for key, _ in pares],
+            "valor": [item["valor_variable"] for _, item in pares],
+            "estado": estados,
+            "umbral": [u.describir() if u else "" for u in umbrales],
+        }).to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Vectorized reliability-index engine (SAIDI, SAIFI, event counts and durations)
+Events are reduced once to a monthly cube by circuit (cto_equi_ope, FPARENT),
+municipality, department and equipment type holding only mergeable
+quantities (counts and sums). Indices per any combination of those
+dimensions and time windows, and rolling windows, are group-bys over the
+cube; newly appended events are reduced and merged into it without
+recomputing the history.
+"""
+
+import re
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from tracing import set_attribute, span
+from utils import normalize_query
+
+
+DIMENSIONES = ["cto_equi_ope", "FPARENT", "MUN", "DEP", "tipo_equi_ope"]
+
+# Additive measures kept per cube cell
+MEDIDAS = ["eventos", "duracion_h", "SAIDI", "SAIFI", "usuarios"]
+
+FRECUENCIAS = {"anio": "Y", "trimestre": "Q", "mes": "M"}
+
+
+def _cubo(eventos: pd.DataFrame) -> pd.DataFrame:
+    """Reduces events to the monthly cube (one row per month and dimension values)."""
+    fecha = eventos["FECHA"] if "FECHA" in eventos else eventos["inicio"]
+    base = pd.DataFrame({"mes": fecha.dt.to_period("M").dt.to_timestamp()})
+    for col in DIMENSIONES:
+        base[col] = eventos[col].astype(str) if col in eventos else "N/D"
+    base["eventos"] = np.ones(len(eventos), dtype=np.int64)
+    for col, origen in (("duracion_h", "duracion_h"), ("SAIDI", "SAIDI"), ("SAIFI", "SAIFI"), ("usuarios", "cnt_usus")):
+        base[col] = pd.to_numeric(eventos[origen], errors="coerce").fillna(0.0).to_numpy(dtype=float) \
+            if origen in eventos else 0.0
+    return base.groupby(["mes"] + DIMENSIONES, sort=False, dropna=False)[MEDIDAS].sum().reset_index()
+
+
+def _as_list(value: Union[None, str, Iterable[str]]) -> Optional[List[str]]:
+    if value is None:
+        return None
+    return [value] if isinstance(value, str) else list(value)
+
+
+def _derivadas(tabla: pd.DataFrame) -> pd.DataFrame:
+    """Adds per-event means to a table of summed measures."""
+    eventos = tabla["eventos"].replace(0, np.nan)
+    return tabla.assign(
+        duracion_media_h=tabla["duracion_h"] / eventos,
+        SAIDI_promedio=tabla["SAIDI"] / eventos,
+        SAIFI_promedio=tabla["SAIFI"] / eventos,
+    )
+
+
+class ReliabilityEngine:
+    """
+    SAIDI/SAIFI, event counts and durations per circuit, place, equipment type and period.
+
+    Args:
+        eventos (pd.DataFrame): Typed event table (see tools._cargar_eventos)
+    """
+
+    def __init__(self, eventos: pd.DataFrame):
+        with span("reliability_build", rows=len(eventos)):
+            self.cube = _cubo(eventos)
+        self.rows = len(eventos)
+        self._lock = threading.Lock()
+
+    def append(self, nuevos: pd.DataFrame) -> None:
+        """
+        Merges newly appended events into the cube.
+
+        Only the new events are reduced; their cube cells are added to the
+        existing ones, so the cost does not depend on the length of the history.
+
+        Args:
+            nuevos (pd.DataFrame): New typed events
+        """
+        if not len(nuevos):
+            return
+        with span("reliability_append", rows=len(nuevos)):
+            delta = _cubo(nuevos)
+            with self._lock:
+                self.cube = (
+                    pd.concat([self.cube, delta], ignore_index=True)
+                    .groupby(["mes"] + DIMENSIONES, sort=False, dropna=False)[MEDIDAS].sum()
+                    .reset_index()
+                )
+                self.rows += len(nuevos)
+
+    def _filtrar(self, anio_inicio: Optional[int] = None, anio_fin: Optional[int] = None,
+                 desde: Optional[str] = None, hasta: Optional[str] = None, **valores) -> pd.DataFrame:
+        cube = self.cube
+        mask = np.ones(len(cube), dtype=bool)
+        meses = cube["mes"]
+        if anio_inicio is not None:
+            mask &= (meses.dt.year >= anio_inicio).to_numpy()
+        if anio_fin is not None:
+            mask &= (meses.dt.year <= anio_fin).to_numpy()
+        if desde is not None:
+            mask &= (meses >= pd.Timestamp(desde).to_period("M").to_timestamp()).to_numpy()
+        if hasta is not None:
+            mask &= (meses <= pd.Timestamp(hasta).to_period("M").to_timestamp()).to_numpy()
+        for col, valor in valores.items():
+            buscados = _as_list(valor)
+            if buscados is not None:
+                if col not in DIMENSIONES:
+                    raise ValueError(f"Unknown dimension: {col}")
+                normalizados = {normalize_query(v) for v in buscados}
+                mask &= cube[col].map(normalize_query).isin(normalizados).to_numpy()
+        return cube[mask]
+
+    def indices(self, por: Sequence[str] = (), frecuencia: Optional[str] = None,
+                **filtros) -> pd.DataFrame:
+        """
+        Reliability indices grouped by dimensions and/or period.
+
+        Args:
+            por (Sequence[str]): Dimensions to group by (subset of DIMENSIONES)
+            frecuencia (Optional[str]): 'anio', 'trimestre' or 'mes' to add a period column
+            **filtros: anio_inicio, anio_fin, desde, hasta (dates) and DEP, MUN,
+                tipo_equi_ope, cto_equi_ope, FPARENT value(s)
+
+        Returns:
+            pd.DataFrame: Events, total duration (h), SAIDI, SAIFI and affected users
+            sums, plus per-event means (duracion_media_h, SAIDI_promedio, SAIFI_promedio)
+        """
+        with span("reliability_query", por=",".join(por), frecuencia=frecuencia or ""):
+            cube = self._filtrar(**filtros)
+            claves = list(por)
+            if frecuencia is not None:
+                cube = cube.assign(periodo=cube["mes"].dt.to_period(FRECUENCIAS[frecuencia]).dt.to_timestamp())
+                claves = ["periodo"] + claves
+            if claves:
+                tabla = cube.groupby(claves, sort=True, dropna=False)[MEDIDAS].sum().reset_index()
+            else:
+                tabla = cube[MEDIDAS].sum().to_frame().T
+                tabla["eventos"] = tabla["eventos"].astype(np.int64)
+            set_attribute("rows", len(tabla))
+        return _derivadas(tabla)
+
+    def rolling(self, por: Sequence[str] = (), ventana_meses: int = 12, **filtros) -> pd.DataFrame:
+        """
+        Rolling-window indices on the monthly series of each group.
+
+        Months without events count as zero, so every window covers exactly
+        ventana_meses calendar months (fewer at the start of the series).
+
+        Args:
+            por (Sequence[str]): Dimensions to group by
+            ventana_meses (int): Window length in months
+            **filtros: Same filters as indices()
+
+        Returns:
+            pd.DataFrame: One row per month and group with the windowed sums and means
+        """
+        with span("reliability_rolling", ventana_meses=ventana_meses):
+            cube = self._filtrar(**filtros)
+            if not len(cube):
+                return _derivadas(pd.DataFrame(columns=["mes"] + list(por) + MEDIDAS))
+            mensual = cube.groupby(["mes"] + list(por), sort=True, dropna=False)[MEDIDAS].sum()
+            meses = pd.date_range(cube["mes"].min(), cube["mes"].max(), freq="MS", name="mes")
+            partes = []
+            for medida in MEDIDAS:
+                serie = mensual[medida].unstack(list(por)) if por else mensual[medida].to_frame(medida)
+                ventana = serie.reindex(meses, fill_value=0).fillna(0).rolling(ventana_meses, min_periods=1).sum()
+                partes.append((ventana.stack(list(range(len(por))), future_stack=True) if por
+                               else ventana[medida]).rename(medida))
+            tabla = pd.concat(partes, axis=1).reset_index()
+        return _derivadas(tabla)
+
+
+# Engine cache ------------------------------------------------------------------------------------
+
+_engines: Dict[str, ReliabilityEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_reliability_engine(data_version: str, cargar_eventos: Callable[[], pd.DataFrame]) -> ReliabilityEngine:
+    """
+    Returns the engine of a data version, building it on first use.
+
+    Args:
+        data_version (str): Version of the event data
+        cargar_eventos (Callable[[], pd.DataFrame]): Loader of the typed event table
+
+    Returns:
+        ReliabilityEngine: Engine shared by every question on that version
+    """
+    with _engines_lock:
+        if data_version not in _engines:
+            _engines.clear()
+            _engines[data_version] = ReliabilityEngine(cargar_eventos())
+        return _engines[data_version]
+
+
+def advance_reliability_engine(old_version: str, new_version: str, nuevos: pd.DataFrame) -> bool:
+    """
+    Moves a cached engine to a new data version by appending the new events.
+
+    Args:
+        old_version (str): Version the cached engine was built from
+        new_version (str): Version after the append
+        nuevos (pd.DataFrame): Events appended between both versions
+
+    Returns:
+        bool: True if an engine was advanced, False if none was cached for old_version
+    """
+    with _engines_lock:
+        engine = _engines.pop(old_version, None)
+        if engine is None:
+            return False
+        engine.append(nuevos)
+        _engines[new_version] = engine
+        return True
+
+
+# Question answering ------------------------------------------------------------------------------
+
+def is_reliability_question(query: str) -> bool:
+    """Whether a question asks for SAIDI or SAIFI."""
+    return bool(re.search(r"\bsai(?:di|fi)\b", normalize_query(query)))
+
+
+def infer_grouping(query: str, filtros: Dict[str, object]) -> Dict[str, object]:
+    """
+    Infers the dimensions and period of a SAIDI/SAIFI question.
+
+    A dimension named in the question ('el municipio que...', 'por tipo de
+    equipo', 'circuito') is grouped by unless it is already a filter.
+
+    Args:
+        query (str): User question
+        filtros (Dict[str, object]): Filters inferred for the question (see EventStore.infer_filters)
+
+    Returns:
+        Dict[str, object]: 'por' and 'frecuencia' arguments for ReliabilityEngine.indices
+    """
+    texto = normalize_query(query)
+    por = []
+    for col, patron in (("MUN", r"\bmunicipios?\b"), ("DEP", r"\bdepartamentos?\b"),
+                        ("tipo_equi_ope", r"\btipos? de equipos?\b"), ("cto_equi_ope", r"\bcircuitos?\b")):
+        if re.search(patron, texto) and col not in filtros:
+            por.append(col)
+    frecuencia = None
+    if re.search(r"\b(?:por|cada) mes\b|\bmensual", texto):
+        frecuencia = "mes"
+    elif re.search(r"\b(?:por|cada) trimestre\b|\btrimestral", texto):
+        frecuencia = "trimestre"
+    elif re.search(r"\b(?:por|cada) ano\b|\banual", texto):
+        frecuencia = "anio"
+    return {"por": por, "frecuencia": frecuencia}
+
+
+ANSWER_TEMPLATE = """Responde en español, de forma breve y directa, la pregunta usando solo la tabla de indicadores.
+Columnas: eventos (número de interrupciones), duracion_h (horas totales), SAIDI y SAIFI (sumas),
+SAIDI_promedio y SAIFI_promedio (promedio por interrupción), duracion_media_h (horas por interrupción).
+Filtros aplicados: {filtros}
+
+Pregunta: {query}
+Tabla:
+{tabla}
+
+Respuesta:"""
+
+
+def answer_reliability(query: str, llm_chat, engine: ReliabilityEngine, filtros: Dict[str, object],
+                       max_rows: int = 40) -> str:
+    """
+    Answers a SAIDI/SAIFI question from the engine's indices.
+
+    Args:
+        query (str): User question
+        llm_chat: Chat model (see utils.create_llm_chat_model)
+        engine (ReliabilityEngine): Engine over the event table
+        filtros (Dict[str, object]): Year, department, municipality and equipment type filters
+        max_rows (int): Maximum table rows shown to the model
+
+    Returns:
+        str: Model answer
+    """
+    agrupacion = infer_grouping(query, filtros)
+    tabla = engine.indices(**agrupacion, **filtros)
+    if agrupacion["por"] and not agrupacion["frecuencia"] and len(tabla) > max_rows:
+        # Keep both extremes so 'mayor' and 'menor' questions can be answered
+        tabla = tabla.sort_values("SAIDI_promedio", ascending=False)
+        tabla = pd.concat([tabla.head(max_rows // 2), tabla.tail(max_rows // 2)])
+    with span("generate"):
+        respuesta = llm_chat.invoke(ANSWER_TEMPLATE.format(
+            filtros=filtros or "ninguno", query=query, tabla=tabla.head(max_rows).to_string(index=False)
+        ))
+    return getattr(respuesta, "content", respuesta)
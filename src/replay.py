@@ -0,0 +1,385 @@
+"""
+Record/replay of the chat and embedding calls
+In record mode (CRITAIR_LLM_REPLAY=record) every provider call made through
+create_llm_chat_model() and create_embeddings() is stored with a fingerprint
+of its request (model, messages or texts, options), its full response and
+its timings. In replay mode (CRITAIR_LLM_REPLAY=replay) the same requests are
+answered from the store without contacting any provider; a request that was
+never recorded raises ReplayMissError, so replays are deterministic. With
+CRITAIR_REPLAY_LATENCY=1 replayed answers wait as long as the original call
+did (and stream their first token after the original TTFT). BertScore
+re-runs, prompt-template refactors and regression tests then run offline
+and for free.
+
+Usage (from the project root):
+    CRITAIR_LLM_REPLAY=record python src/evaluation.py --model gpt --category unstructured
+    CRITAIR_LLM_REPLAY=replay python src/evaluation.py --model gpt --category unstructured
+    python src/replay.py
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (AIMessageChunk, BaseMessage, message_chunk_to_message,
+                                     messages_from_dict, messages_to_dict)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+# 'off', 'record' or 'replay'
+REPLAY_MODE = os.getenv("CRITAIR_LLM_REPLAY", "off")
+
+REPLAY_PATH = os.getenv("CRITAIR_REPLAY_PATH", "results/replay/llm_calls.jsonl")
+
+# Replayed answers take as long as the original call
+REPLAY_LATENCY = os.getenv("CRITAIR_REPLAY_LATENCY", "0") == "1"
+
+MODOS = ("off", "record", "replay")
+
+
+class ReplayMissError(RuntimeError):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+def fingerprint(kind: str, model: str, request: Any) -> str:
+    """
+    Identifier of a request: SHA-256 of its canonical JSON.
+
+    Args:
+        kind (str): 'chat' or 'embedding'
+        model (str): Model name
+        request (Any): Messages, text and options of the call
+
+    Returns:
+        str: Hex digest
+    """
+    canonico = json.dumps([kind, model, request], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+
+class ReplayStore:
+    """
+    Append-only JSONL store of recorded calls, indexed by fingerprint.
+
+    The last record of a fingerprint wins; a truncated last line is ignored.
+
+    Args:
+        path (str): JSONL file
+    """
+
+    def __init__(self, path: str = REPLAY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._registros: Optional[Dict[str, dict]] = None
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+    def _cargar(self) -> Dict[str, dict]:
+        if self._registros is None:
+            self._registros = {}
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for linea in f:
+                        try:
+                            registro = json.loads(linea)
+                        except json.JSONDecodeError:
+                            continue
+                        self._registros[registro["fingerprint"]] = registro
+        return self._registros
+
+    def get(self, huella: str) -> Optional[dict]:
+        with self._lock:
+            registro = self._cargar().get(huella)
+            if registro is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return registro
+
+    def put(self, huella: str, registro: dict) -> None:
+        """Stores a call (appended and flushed to the JSONL file)."""
+        registro = {"fingerprint": huella, "recorded_at": time.time(), **registro}
+        with self._lock:
+            self._cargar()[huella] = registro
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            self.recorded += 1
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        """Number of recorded calls per (kind, model)."""
+        with self._lock:
+            registros = list(self._cargar().values())
+        conteo: Dict[str, Dict[str, int]] = {}
+        for r in registros:
+            conteo.setdefault(r["kind"], {}).setdefault(r["model"], 0)
+            conteo[r["kind"]][r["model"]] += 1
+        return conteo
+
+
+_stores: Dict[str, ReplayStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_replay_store(path: str = REPLAY_PATH) -> ReplayStore:
+    """Shared store of a file (one index in memory per path)."""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ReplayStore(path)
+        return _stores[path]
+
+
+def _peticion_chat(messages: List[BaseMessage], stop: Optional[List[str]], kwargs: dict) -> dict:
+    # Function calls of an agent's turns live in additional_kwargs (their content is empty)
+    mensajes = [[m.type, m.content] + ([m.additional_kwargs] if m.additional_kwargs else []) for m in messages]
+    return {"messages": mensajes, "stop": stop, "kwargs": kwargs}
+
+
+class RecordReplayChatModel(BaseChatModel):
+    """
+    Chat model that records the calls of another one, or replays them.
+
+    Attributes:
+        inner (Any): Provider chat model (only called in record mode)
+        model_name (str): Name the calls are recorded under
+        mode (str): 'record' or 'replay'
+        store (Any): ReplayStore
+        simulate_latency (bool): Replayed answers wait the original latency
+    """
+    inner: Any = None
+    model_name: str = ""
+    mode: str = "record"
+    store: Any = None
+    simulate_latency: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "critair-replay"
+
+    def _replay(self, huella: str) -> dict:
+        registro = self.store.get(huella)
+        if registro is None:
+            raise ReplayMissError(f"Call to {self.model_name} was not recorded ({huella[:12]}) in {self.store.path}")
+        return registro
+
+    def _respuesta(self, registro: dict) -> BaseMessage:
+        return messages_from_dict([registro["response"]])[0]
+
+    def _guardar(self, huella: str, request: dict, respuesta: BaseMessage, latencia: float,
+                 ttft: Optional[float] = None) -> None:
+        self.store.put(huella, {"kind": "chat", "model": self.model_name, "request": request,
+                                "response": messages_to_dict([respuesta])[0], "latency_s": latencia, "ttft_s": ttft})
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        request = _peticion_chat(messages, stop, kwargs)
+        huella = fingerprint("chat", self.model_name, request)
+        if self.mode == "replay":
+            registro = self._replay(huella)
+            if self.simulate_latency:
+                time.sleep(registro["latency_s"])
+            return ChatResult(generations=[ChatGeneration(message=self._respuesta(registro))])
+        inicio = time.perf_counter()
+        respuesta = self.inner.invoke(messages, stop=stop, **kwargs)
+        self._guardar(huella, request, respuesta, time.perf_counter() - inicio)
+        return ChatResult(generations=[ChatGeneration(message=respuesta)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        request = _peticion_chat(messages, stop, kwargs)
+        huella = fingerprint("chat", self.model_name, request)
+        if self.mode == "replay":
+            registro = self._replay(huella)
+            if self.simulate_latency:
+                await asyncio.sleep(registro["latency_s"])
+            return ChatResult(generations=[ChatGeneration(message=self._respuesta(registro))])
+        inicio = time.perf_counter()
+        respuesta = await self.inner.ainvoke(messages, stop=stop, **kwargs)
+        self._guardar(huella, request, respuesta, time.perf_counter() - inicio)
+        return ChatResult(generations=[ChatGeneration(message=respuesta)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        request = _peticion_chat(messages, stop, kwargs)
+        huella = fingerprint("chat", self.model_name, request)
+        if self.mode == "replay":
+            registro = self._replay(huella)
+            respuesta = self._respuesta(registro)
+            if self.simulate_latency:
+                # Streamed and non-streamed recordings of a request share their fingerprint
+                time.sleep(registro.get("ttft_s") or registro["latency_s"])
+            yield ChatGenerationChunk(message=AIMessageChunk(content=respuesta.content,
+                                                             response_metadata=respuesta.response_metadata))
+            if self.simulate_latency and registro.get("ttft_s") is not None:
+                time.sleep(max(registro["latency_s"] - registro["ttft_s"], 0.0))
+            return
+        inicio = time.perf_counter()
+        ttft = None
+        total = None
+        for chunk in self.inner.stream(messages, stop=stop, **kwargs):
+            if total is None:
+                ttft = time.perf_counter() - inicio
+                total = chunk
+            else:
+                total += chunk
+            yield ChatGenerationChunk(message=chunk)
+        if total is not None:
+            self._guardar(huella, request, message_chunk_to_message(total), time.perf_counter() - inicio, ttft)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any):
+        request = _peticion_chat(messages, stop, kwargs)
+        huella = fingerprint("chat", self.model_name, request)
+        if self.mode == "replay":
+            registro = self._replay(huella)
+            respuesta = self._respuesta(registro)
+            if self.simulate_latency:
+                await asyncio.sleep(registro.get("ttft_s") or registro["latency_s"])
+            yield ChatGenerationChunk(message=AIMessageChunk(content=respuesta.content,
+                                                             response_metadata=respuesta.response_metadata))
+            if self.simulate_latency and registro.get("ttft_s") is not None:
+                await asyncio.sleep(max(registro["latency_s"] - registro["ttft_s"], 0.0))
+            return
+        inicio = time.perf_counter()
+        ttft = None
+        total = None
+        async for chunk in self.inner.astream(messages, stop=stop, **kwargs):
+            if total is None:
+                ttft = time.perf_counter() - inicio
+                total = chunk
+            else:
+                total += chunk
+            yield ChatGenerationChunk(message=chunk)
+        if total is not None:
+            self._guardar(huella, request, message_chunk_to_message(total), time.perf_counter() - inicio, ttft)
+
+
+class RecordReplayEmbeddings(Embeddings):
+    """
+    Embeddings that record the vectors of another client, or replay them (one record per text).
+
+    Args:
+        inner (Optional[Embeddings]): Provider client (only called in record mode)
+        model_name (str): Name the vectors are recorded under
+        mode (str): 'record' or 'replay'
+        store (Optional[ReplayStore]): Store (the shared one of REPLAY_PATH by default)
+        simulate_latency (bool): Replayed vectors wait the original latency
+    """
+
+    def __init__(self, inner: Optional[Embeddings], model_name: str, mode: str = "record",
+                 store: Optional[ReplayStore] = None, simulate_latency: bool = REPLAY_LATENCY):
+        self.inner = inner
+        self.model_name = model_name
+        self.mode = mode
+        self.store = store or get_replay_store()
+        self.simulate_latency = simulate_latency
+
+    def _huella(self, texto: str) -> str:
+        return fingerprint("embedding", self.model_name, texto)
+
+    def _replay(self, textos: List[str]) -> List[List[float]]:
+        vectores, espera = [], 0.0
+        for texto in textos:
+            registro = self.store.get(self._huella(texto))
+            if registro is None:
+                raise ReplayMissError(f"Embedding of {texto[:40]!r} with {self.model_name} was not recorded")
+            vectores.append(registro["response"])
+            espera += registro["latency_s"]
+        if self.simulate_latency:
+            time.sleep(espera)
+        return vectores
+
+    def _guardar(self, textos: List[str], vectores: List[List[float]], latencia: float) -> None:
+        # The latency of a batch is split evenly among its texts
+        for texto, vector in zip(textos, vectores):
+            self.store.put(self._huella(texto), {"kind": "embedding", "model": self.model_name, "request": texto,
+                                                 "response": list(vector), "latency_s": latencia / len(textos)})
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.mode == "replay":
+            return self._replay(texts)
+        inicio = time.perf_counter()
+        vectores = self.inner.embed_documents(texts)
+        if texts:
+            self._guardar(texts, vectores, time.perf_counter() - inicio)
+        return vectores
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.mode == "replay":
+            return self._replay([text])[0]
+        inicio = time.perf_counter()
+        vector = self.inner.embed_query(text)
+        self._guardar([text], [vector], time.perf_counter() - inicio)
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.mode == "replay":
+            return await asyncio.to_thread(self._replay, texts)
+        inicio = time.perf_counter()
+        vectores = await self.inner.aembed_documents(texts)
+        if texts:
+            await asyncio.to_thread(self._guardar, texts, vectores, time.perf_counter() - inicio)
+        return vectores
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.mode == "replay":
+            return (await asyncio.to_thread(self._replay, [text]))[0]
+        inicio = time.perf_counter()
+        vector = await self.inner.aembed_query(text)
+        await asyncio.to_thread(self._guardar, [text], [vector], time.perf_counter() - inicio)
+        return vector
+
+
+def wrap_chat_model(build: Callable[[], BaseChatModel], model: str, mode: str = REPLAY_MODE) -> BaseChatModel:
+    """
+    Provider chat model wrapped for recording or replay.
+
+    Args:
+        build (Callable[[], BaseChatModel]): Builds the provider client (not called
+            in replay mode, so no API key or server is needed)
+        model (str): Name the calls are recorded under
+        mode (str): 'off', 'record' or 'replay' (CRITAIR_LLM_REPLAY by default)
+
+    Returns:
+        BaseChatModel: The provider client when the mode is 'off', else a RecordReplayChatModel
+    """
+    if mode not in MODOS:
+        raise ValueError(f"Modo de replay no reconocido: {mode}")
+    if mode == "off":
+        return build()
+    return RecordReplayChatModel(inner=build() if mode == "record" else None, model_name=model, mode=mode,
+                                 store=get_replay_store(), simulate_latency=REPLAY_LATENCY)
+
+
+def wrap_embeddings(build: Callable[[], Embeddings], model: str, mode: str = REPLAY_MODE) -> Embeddings:
+    """Embeddings client wrapped for recording or replay (see wrap_chat_model)."""
+    if mode not in MODOS:
+        raise ValueError(f"Modo de replay no reconocido: {mode}")
+    if mode == "off":
+        return build()
+    return RecordReplayEmbeddings(build() if mode == "record" else None, model, mode)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Llamadas grabadas para replay")
+    parser.add_argument("--path", default=REPLAY_PATH)
+    args = parser.parse_args()
+
+    resumen = get_replay_store(args.path).summary()
+    if not resumen:
+        print(f"Sin llamadas grabadas en {args.path}")
+    for tipo, modelos in resumen.items():
+        for modelo, n in sorted(modelos.items()):
+            print(f"{tipo:<10} {modelo:<30} {n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+SLO-aware model router driven by the measured quality and latency
+The results tables (results/tables/*_results.csv) give the BertScore and mean
+inference time of every evaluated model per request category. With the model
+name 'auto', each request goes to the model with the best measured quality
+whose latency estimate meets the category's SLO. Latency estimates start at
+the measured inference time and follow live traffic (EWMA); a model that
+fails repeatedly is skipped for a cool-down period and the next candidate is
+used instead. A small fraction of requests probes other candidates so their
+estimates do not go stale.
+
+Usage (from the project root):
+    python src/router.py --slo structured=5 --slo unstructured=12
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from tracing import set_attribute, span
+
+
+RESULTS_DIR = os.getenv("CRITAIR_RESULTS_DIR", "results/tables")
+
+# Results table of each request category
+CATEGORIAS = {
+    "unstructured": "unstructured_data_results.csv",
+    "structured": "structured_data_results.csv",
+    "recommendations": "recommendations_results.csv",
+}
+
+# Latency SLO (seconds) per category, overridable with CRITAIR_SLO="structured=5,unstructured=12"
+SLO = {"unstructured": 15.0, "structured": 8.0, "recommendations": 10.0}
+
+# Model names of the results tables -> names accepted by create_llm_chat_model
+MODELOS = {
+    "gpt-3.5 turbo": "gpt",
+    "gpt 4o": "gpt-4o",
+    "Gemini 2.0": "gemini-2.0-flash-001",
+    "Gemini 2.5": "gemini-2.5-pro-exp-03-25",
+    "Llama 3.1:8b": "llama1",
+    "Llama 3.2:1b": "llama2",
+    "Qwen 2.5:1.5b": "qwen2.5:1.5b",
+    "Qwen 2.5:7b": "qwen2.5:7b",
+    "DeepSeek-r1:7b": "deepseek-r1:7b",
+    "DeepSeek-r1:1.5b": "deepseek-r1:1.5b",
+}
+
+# Models the router may use (comma-separated factory names; all of the tables if empty)
+ROUTER_MODELS = [m.strip() for m in os.getenv("CRITAIR_ROUTER_MODELS", "").split(",") if m.strip()]
+
+
+def _slo_entorno() -> Dict[str, float]:
+    slo = dict(SLO)
+    for parte in filter(None, os.getenv("CRITAIR_SLO", "").split(",")):
+        categoria, _, segundos = parte.partition("=")
+        slo[categoria.strip()] = float(segundos)
+    return slo
+
+
+def is_routed_model(model: str) -> bool:
+    """True for 'auto' and 'auto:<category>' model names."""
+    return model == "auto" or model.startswith("auto:")
+
+
+def resolve_model(model: str, categoria: str) -> str:
+    """
+    Model name a tool of a category should use ('auto' becomes 'auto:<categoria>').
+
+    Args:
+        model (str): Model name received by the tool
+        categoria (str): Key of CATEGORIAS
+
+    Returns:
+        str: The name unchanged, or the routed name of the category
+    """
+    return f"auto:{categoria}" if model == "auto" else model
+
+
+class ModelRouter:
+    """
+    Per-category model selection under a latency SLO.
+
+    Args:
+        tables_dir (str): Folder with the results tables
+        slo (Optional[Dict[str, float]]): Latency SLO per category (SLO and CRITAIR_SLO by default)
+        modelos (Optional[List[str]]): Factory names the router may use (all of the tables if None)
+        alpha (float): EWMA weight of a new latency or error observation
+        max_fallos (int): Consecutive failures that mark a model as degraded
+        max_error_rate (float): Error-rate EWMA above which a model is degraded
+        cooldown (float): Seconds a degraded model is skipped before it is probed again
+        exploracion (float): Fraction of requests sent to another healthy candidate
+    """
+
+    def __init__(self, tables_dir: str = RESULTS_DIR, slo: Optional[Dict[str, float]] = None,
+                 modelos: Optional[List[str]] = None, alpha: float = 0.2, max_fallos: int = 3,
+                 max_error_rate: float = 0.5, cooldown: float = 60.0, exploracion: float = 0.05):
+        self.tables_dir = tables_dir
+        self.slo = slo if slo is not None else _slo_entorno()
+        self.modelos = modelos if modelos is not None else (ROUTER_MODELS or None)
+        self.alpha = alpha
+        self.max_fallos = max_fallos
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.exploracion = exploracion
+        self._lock = threading.Lock()
+        self._estado: Optional[Dict[str, Dict[str, dict]]] = None
+
+    def _cargar(self) -> Dict[str, Dict[str, dict]]:
+        """State of every (category, model) from the results tables, read on first use."""
+        if self._estado is None:
+            estado = {}
+            for categoria, archivo in CATEGORIAS.items():
+                estado[categoria] = {}
+                path = os.path.join(self.tables_dir, archivo)
+                if not os.path.exists(path):
+                    continue
+                for fila in pd.read_csv(path).to_dict("records"):
+                    modelo = MODELOS.get(fila["Model"], fila["Model"])
+                    if self.modelos is None or modelo in self.modelos:
+                        estado[categoria][modelo] = self._nuevo(fila["BertScore"], fila["Inference Time"])
+            self._estado = estado
+        return self._estado
+
+    @staticmethod
+    def _nuevo(calidad: float, latencia: float) -> dict:
+        return {"calidad": float(calidad), "latencia": float(latencia), "error_rate": 0.0, "fallos": 0,
+                "degradado_hasta": 0.0, "observaciones": 0, "ultima": 0.0}
+
+    def register(self, categoria: str, modelo: str, calidad: float, latencia: float) -> None:
+        """
+        Adds (or resets) a candidate that is not in the results tables.
+
+        Args:
+            categoria (str): Request category
+            modelo (str): Factory name of the model
+            calidad (float): Measured quality (BertScore)
+            latencia (float): Initial latency estimate in seconds
+        """
+        with self._lock:
+            self._cargar().setdefault(categoria, {})[modelo] = self._nuevo(calidad, latencia)
+
+    def candidates(self, categoria: str) -> List[str]:
+        """
+        Models of a category in the order they should be tried.
+
+        Healthy models whose latency estimate meets the SLO come first, best
+        quality first; then the other healthy models, fastest first; degraded
+        models last, those whose cool-down ends sooner first.
+
+        Args:
+            categoria (str): Key of CATEGORIAS
+
+        Returns:
+            List[str]: Factory names (the fallback chain)
+
+        Raises:
+            KeyError: If the category has no candidates
+        """
+        ahora = time.time()
+        with self._lock:
+            estado = self._cargar().get(categoria)
+            if not estado:
+                raise KeyError(f"No models to route for category: {categoria}")
+            slo = self.slo.get(categoria, float("inf"))
+            sanos = [m for m, e in estado.items() if e["degradado_hasta"] <= ahora]
+            dentro = sorted((m for m in sanos if estado[m]["latencia"] <= slo), key=lambda m: -estado[m]["calidad"])
+            fuera = sorted((m for m in sanos if estado[m]["latencia"] > slo), key=lambda m: estado[m]["latencia"])
+            degradados = sorted((m for m in estado if m not in sanos), key=lambda m: estado[m]["degradado_hasta"])
+        orden = dentro + fuera + degradados
+        if len(sanos) > 1 and random.random() < self.exploracion:
+            # Probe the least recently observed healthy model
+            sonda = min((m for m in sanos if m != orden[0]), key=lambda m: estado[m]["ultima"])
+            orden.remove(sonda)
+            orden.insert(0, sonda)
+        return orden
+
+    def select(self, categoria: str) -> str:
+        """Model a request of the category should go to."""
+        return self.candidates(categoria)[0]
+
+    def observe(self, categoria: str, modelo: str, latencia: float, ok: bool = True) -> None:
+        """
+        Updates the estimates of a model with a finished request.
+
+        Args:
+            categoria (str): Request category
+            modelo (str): Model that served it
+            latencia (float): Seconds it took
+            ok (bool): False if the call failed
+        """
+        with self._lock:
+            e = self._cargar().get(categoria, {}).get(modelo)
+            if e is None:
+                return
+            e["observaciones"] += 1
+            e["ultima"] = time.time()
+            e["error_rate"] = (1 - self.alpha) * e["error_rate"] + self.alpha * (0.0 if ok else 1.0)
+            if ok:
+                e["latencia"] = (1 - self.alpha) * e["latencia"] + self.alpha * latencia
+                e["fallos"] = 0
+                return
+            e["fallos"] += 1
+            if e["fallos"] >= self.max_fallos or e["error_rate"] > self.max_error_rate:
+                e["degradado_hasta"] = time.time() + self.cooldown
+                e["fallos"] = 0
+
+    def snapshot(self) -> pd.DataFrame:
+        """Current state of every candidate (one row per category and model)."""
+        ahora = time.time()
+        with self._lock:
+            filas = [{"categoria": c, "modelo": m, "slo_s": self.slo.get(c), **e, "degradado": e["degradado_hasta"] > ahora}
+                     for c, modelos in self._cargar().items() for m, e in modelos.items()]
+        return pd.DataFrame(filas)
+
+
+default_router = ModelRouter()
+
+
+class RoutedChatModel(BaseChatModel):
+    """
+    Chat model that sends each call to the model chosen by a ModelRouter.
+
+    The call goes to the first candidate and, if it fails, to the next ones;
+    every attempt updates the router's estimates.
+
+    Attributes:
+        categoria (str): Request category
+        router (Any): ModelRouter
+        factory (Any): Builds a chat model from its name (utils.create_llm_chat_model)
+    """
+    categoria: str = "unstructured"
+    router: Any = None
+    factory: Any = None
+
+    @classmethod
+    def from_name(cls, model: str, factory: Callable[[str], BaseChatModel],
+                  router: Optional[ModelRouter] = None) -> "RoutedChatModel":
+        """Builds a routed model from an 'auto' or 'auto:<category>' name."""
+        _, _, categoria = model.partition(":")
+        return cls(categoria=categoria or "unstructured", router=router or default_router, factory=factory)
+
+    @property
+    def _llm_type(self) -> str:
+        return "critair-routed"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        error = None
+        for modelo in self.router.candidates(self.categoria):
+            with span("route", category=self.categoria, model=modelo):
+                inicio = time.perf_counter()
+                try:
+                    respuesta = self.factory(modelo).invoke(messages, stop=stop, **kwargs)
+                except Exception as e:
+                    self.router.observe(self.categoria, modelo, time.perf_counter() - inicio, ok=False)
+                    set_attribute("error", repr(e))
+                    error = e
+                    continue
+                self.router.observe(self.categoria, modelo, time.perf_counter() - inicio)
+            return ChatResult(generations=[ChatGeneration(message=respuesta)])
+        raise error
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        error = None
+        for modelo in self.router.candidates(self.categoria):
+            with span("route", category=self.categoria, model=modelo):
+                inicio = time.perf_counter()
+                try:
+                    # The factory warms Ollama models with a blocking call
+                    cliente = await asyncio.to_thread(self.factory, modelo)
+                    respuesta = await cliente.ainvoke(messages, stop=stop, **kwargs)
+                except Exception as e:
+                    self.router.observe(self.categoria, modelo, time.perf_counter() - inicio, ok=False)
+                    set_attribute("error", repr(e))
+                    error = e
+                    continue
+                self.router.observe(self.categoria, modelo, time.perf_counter() - inicio)
+            return ChatResult(generations=[ChatGeneration(message=respuesta)])
+        raise error
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Modelo elegido por categoría según el SLO de latencia")
+    parser.add_argument("--tables-dir", default=RESULTS_DIR)
+    parser.add_argument("--slo", action="append", default=[], help="categoria=segundos (repetible)")
+    args = parser.parse_args()
+
+    slo = _slo_entorno()
+    for parte in args.slo:
+        categoria, _, segundos = parte.partition("=")
+        slo[categoria] = float(segundos)
+    router = ModelRouter(args.tables_dir, slo, exploracion=0.0)
+    for categoria in CATEGORIAS:
+        try:
+            orden = router.candidates(categoria)
+        except KeyError as e:
+            print(e)
+            continue
+        print(f"{categoria} (SLO {slo.get(categoria)} s): {orden[0]}  | respaldo: {', '.join(orden[1:4])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+HTTP serving layer for the tools and recomendacion()
+Identical in-flight requests (same tool, model and normalized query, and
+for the RAG tools the same chat) are coalesced into a single upstream call,
+each client has a concurrency limit and every request a timeout. Health and
+metrics endpoints are included.
+
+Usage (from the project root, no API keys needed with the mock provider):
+    python src/server.py --default-model mock:1.5 --port 8000
+    curl -X POST localhost:8000/tools/retie -H 'Content-Type: application/json' \
+         -d '{"query": "¿Qué exige el RETIE para la puesta a tierra?", "chat_id": "demo"}'
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from async_tools import ASYNC_TOOLS, default_store
+from hedging import hedge_metrics
+from model_factory import CircuitBreaker, default_model_factory, model_factory_metrics
+from ollama_manager import PRELOAD, default_ollama_manager
+from recommendation_cache import NO_CACHE, default_recommendation_cache
+from reglas import NO_RULES, default_rules
+from router import default_router
+from tracing import span
+from utils import arecomendacion, normalize_query
+
+
+# Tools whose answer does not depend on the chat, coalesced across chats. The plots
+# tool is left out: its answer is a path under the requesting chat's folder
+STATELESS_TOOLS = ("eventos_transformadores",)
+
+
+class ToolRequest(BaseModel):
+    query: str
+    model: Optional[str] = None
+    chat_id: str = "default"
+
+
+class RecommendationRequest(BaseModel):
+    info_poligono: Dict[str, Any]
+    model: Optional[str] = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution.
+
+    The first caller (leader) starts the work; callers arriving while it is in
+    flight await the same result. The shared task is shielded, so a follower
+    timing out or disconnecting does not cancel the upstream call.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Runs func once per key among concurrent callers.
+
+        Args:
+            key (Hashable): Coalescing key
+            func (Callable[[], Awaitable[Any]]): Work to run if no call is in flight
+
+        Returns:
+            Tuple[Any, bool]: Result and whether this call was coalesced into another one
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task), shared
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+
+class ClientLimiter:
+    """
+    Per-client concurrency limit; requests over the limit are rejected.
+
+    Args:
+        max_per_client (int): Maximum simultaneous requests per client
+    """
+
+    def __init__(self, max_per_client: int):
+        self.max_per_client = max_per_client
+        self._active: Dict[str, int] = defaultdict(int)
+
+    def acquire(self, client: str) -> bool:
+        if self._active[client] >= self.max_per_client:
+            return False
+        self._active[client] += 1
+        return True
+
+    def release(self, client: str) -> None:
+        self._active[client] -= 1
+        if self._active[client] <= 0:
+            del self._active[client]
+
+
+class Metrics:
+    """Request counters and latency histograms exposed in Prometheus text format."""
+
+    BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 20, 40, 60, 120)
+
+    def __init__(self):
+        self.requests = defaultdict(int)        # (endpoint, status) -> count
+        self.coalesced = defaultdict(int)       # endpoint -> count
+        self.latency_sum = defaultdict(float)   # endpoint -> seconds
+        self.latency_count = defaultdict(int)
+        self.latency_buckets = defaultdict(lambda: [0] * len(Metrics.BUCKETS))
+        self.in_flight = 0
+        self.started = time.time()
+
+    def observe(self, endpoint: str, status: int, latency: float, coalesced: bool) -> None:
+        self.requests[(endpoint, status)] += 1
+        if coalesced:
+            self.coalesced[endpoint] += 1
+        self.latency_sum[endpoint] += latency
+        self.latency_count[endpoint] += 1
+        for i, bound in enumerate(self.BUCKETS):
+            if latency <= bound:
+                self.latency_buckets[endpoint][i] += 1
+
+    def render(self, extra: Dict[str, float]) -> str:
+        lines = ["# TYPE critair_requests_total counter"]
+        for (endpoint, status), n in sorted(self.requests.items()):
+            lines.append(f'critair_requests_total{{endpoint="{endpoint}",status="{status}"}} {n}')
+        lines.append("# TYPE critair_coalesced_total counter")
+        for endpoint, n in sorted(self.coalesced.items()):
+            lines.append(f'critair_coalesced_total{{endpoint="{endpoint}"}} {n}')
+        lines.append("# TYPE critair_request_seconds histogram")
+        for endpoint in sorted(self.latency_count):
+            for bound, n in zip(self.BUCKETS, self.latency_buckets[endpoint]):
+                lines.append(f'critair_request_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {n}')
+            lines.append(f'critair_request_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {self.latency_count[endpoint]}')
+            lines.append(f'critair_request_seconds_sum{{endpoint="{endpoint}"}} {self.latency_sum[endpoint]:.6f}')
+            lines.append(f'critair_request_seconds_count{{endpoint="{endpoint}"}} {self.latency_count[endpoint]}')
+        lines.append(f"critair_in_flight_requests {self.in_flight}")
+        for name, value in extra.items():
+            lines.append(f"critair_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def create_app(default_model: str = "mock", max_per_client: int = 4, timeout: float = 120.0,
+               max_concurrency_recommendation: int = 8, recommendation_cache=default_recommendation_cache,
+               reglas=default_rules) -> FastAPI:
+    """
+    Builds the FastAPI application.
+
+    Args:
+        default_model (str): Model used when a request does not specify one
+        max_per_client (int): Maximum simultaneous requests per client (X-Client-Id header or IP)
+        timeout (float): Per-request timeout in seconds
+        max_concurrency_recommendation (int): LLM calls in parallel inside one recommendation
+        recommendation_cache: recommendation_cache.RecommendationCache used by /recomendacion
+            (recommendation_cache.NO_CACHE to generate every recommendation)
+        reglas: reglas.RuleSet of the /recomendacion pre-check (reglas.NO_RULES to
+            send every variable to the model)
+
+    Returns:
+        FastAPI: Application
+    """
+    app = FastAPI(title="CRITAIR", description="Herramientas de normativa, eventos y recomendaciones")
+    flight = SingleFlight()
+    limiter = ClientLimiter(max_per_client)
+    metrics = Metrics()
+
+    def client_id(request: Request) -> str:
+        return request.headers.get("x-client-id") or (request.client.host if request.client else "unknown")
+
+    async def serve(request: Request, endpoint: str, key: Hashable, func: Callable[[], Awaitable[Any]]):
+        client = client_id(request)
+        if not limiter.acquire(client):
+            metrics.observe(endpoint, 429, 0.0, False)
+            raise HTTPException(status_code=429, detail="Demasiadas peticiones simultáneas para este cliente")
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        status, coalesced = 200, False
+        try:
+            with span("http.request", endpoint=endpoint, client=client):
+                result, coalesced = await asyncio.wait_for(flight.do(key, func), timeout)
+            return result, coalesced
+        except asyncio.TimeoutError:
+            status = 504
+            raise HTTPException(status_code=504, detail=f"Tiempo de espera agotado ({timeout}s)")
+        except HTTPException as e:
+            status = e.status_code
+            raise
+        except Exception as e:
+            status = 500
+            raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {e}")
+        finally:
+            metrics.in_flight -= 1
+            limiter.release(client)
+            metrics.observe(endpoint, status, time.perf_counter() - start, coalesced)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "uptime_s": time.time() - metrics.started, "tools": sorted(ASYNC_TOOLS)}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def get_metrics():
+        extra = {
+            "inflight_upstream_calls": len(flight),
+            "session_iterations_total": default_store.iterations,
+        }
+        for modelo, resumen in hedge_metrics().items():
+            for clave in ("requests", "hedged", "backup_wins", "p95_s", "p99_s", "p95_saved_s", "p99_saved_s"):
+                extra[f'hedge_{clave}{{model="{modelo}"}}'] = resumen[clave]
+        for fila in default_router.snapshot().to_dict("records"):
+            etiquetas = f'{{category="{fila["categoria"]}",model="{fila["modelo"]}"}}'
+            extra[f"router_latency_ewma_seconds{etiquetas}"] = round(fila["latencia"], 6)
+            extra[f"router_error_rate{etiquetas}"] = round(fila["error_rate"], 6)
+            extra[f"router_degraded{etiquetas}"] = int(fila["degradado"])
+        fabrica = model_factory_metrics()
+        for proveedor, breaker in fabrica["breakers"].items():
+            etiquetas = f'{{provider="{proveedor}"}}'
+            extra[f"circuit_breaker_state{etiquetas}"] = CircuitBreaker.STATE_VALUES[breaker["state"]]
+            for clave in ("calls", "failures", "slow", "rejected", "trips"):
+                extra[f"circuit_breaker_{clave}_total{etiquetas}"] = breaker[clave]
+        extra["model_fallback_calls_total"] = fabrica["fallback_calls"]
+        for fila in default_ollama_manager.report().to_dict("records"):
+            etiquetas = f'{{model="{fila["model"]}"}}'
+            extra[f"ollama_resident{etiquetas}"] = int(fila["resident"])
+            extra[f"ollama_loads_total{etiquetas}"] = fila["loads"]
+            for clave in ("load_s_mean", "inference_s_mean", "inference_s_p95"):
+                if not math.isnan(fila[clave]):
+                    extra[f"ollama_{clave.replace('_s_', '_seconds_')}{etiquetas}"] = round(fila[clave], 6)
+        return metrics.render(extra)
+
+    @app.post("/tools/{tool_name}")
+    async def run_tool(tool_name: str, body: ToolRequest, request: Request):
+        if tool_name not in ASYNC_TOOLS:
+            raise HTTPException(status_code=404, detail=f"Herramienta desconocida: {tool_name}")
+        model = body.model or default_model
+        payload = {"query": body.query, "model": model, "chat_id": body.chat_id}
+        key = ("tool", tool_name, model, normalize_query(body.query))
+        if tool_name not in STATELESS_TOOLS:
+            # The RAG prompt includes the chat's history and plots are written to the chat's
+            # folder: only requests of the same chat are identical
+            key += (body.chat_id,)
+
+        response, coalesced = await serve(request, tool_name, key, lambda: ASYNC_TOOLS[tool_name].ainvoke(payload))
+        return {"response": response, "model": model, "coalesced": coalesced}
+
+    @app.post("/recomendacion")
+    async def run_recommendation(body: RecommendationRequest, request: Request):
+        model = body.model or default_model
+        digest = hashlib.sha256(json.dumps(body.info_poligono, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        key = ("recomendacion", model, digest)
+
+        (responses, times), coalesced = await serve(
+            request, "recomendacion", key,
+            lambda: arecomendacion(model, body.info_poligono, max_concurrency_recommendation,
+                                   reglas=reglas, cache=recommendation_cache),
+        )
+        return {"responses": responses, "times": times, "model": model, "coalesced": coalesced}
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Servidor HTTP de CRITAIR")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--default-model", default="mock", help="Modelo por defecto (p.ej. gpt, llama2, mock:1.5)")
+    parser.add_argument("--max-per-client", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--no-recommendation-cache", action="store_true",
+                        help="Generar todas las recomendaciones sin la caché persistente")
+    parser.add_argument("--no-rules", action="store_true",
+                        help="Enviar todas las variables al modelo, sin el pre-chequeo de reglas")
+    args = parser.parse_args()
+
+    # Ollama models of CRITAIR_OLLAMA_PRELOAD are loaded before the first request
+    for modelo in PRELOAD:
+        default_model_factory.warm(modelo)
+    app = create_app(args.default_model, args.max_per_client, args.timeout,
+                     recommendation_cache=NO_CACHE if args.no_recommendation_cache else default_recommendation_cache,
+                     reglas=NO_RULES if args.no_rules else default_rules)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
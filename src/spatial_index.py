@@ -0,0 +1,381 @@
+"""
+Spatial index over the event coordinates (LONGITUD / LATITUD)
+Events are bucketed in a regular longitude/latitude grid sorted by cell, so
+polygon and radius queries only test the events of the cells overlapping
+the query's bounding box (vectorized ray casting and haversine distances).
+Used by the event tools (coordinates or a WKT polygon in the question) and by
+recomendacion() to add the event history around each equipment.
+"""
+
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from tracing import set_attribute, span
+
+
+RADIO_TIERRA_KM = 6371.0088
+
+# Grid cell side in degrees (~1.1 km at the equator)
+CELL_SIZE_DEG = 0.01
+
+Anillo = Sequence[Tuple[float, float]]
+Poligono = Union[Anillo, Dict[str, Any]]
+
+
+def haversine_km(lon1, lat1, lon2, lat2) -> np.ndarray:
+    """Great-circle distance in km (vectorized over numpy arrays)."""
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(a))
+
+
+def _poligonos(poligono: Poligono) -> List[List[np.ndarray]]:
+    """
+    Normalizes a polygon to a list of polygons, each a list of (n, 2) rings.
+
+    Accepts a list of (lon, lat) vertices or a GeoJSON Polygon / MultiPolygon.
+    """
+    if isinstance(poligono, dict):
+        if poligono.get("type") == "Polygon":
+            return [[np.asarray(r, dtype=float)[:, :2] for r in poligono["coordinates"]]]
+        if poligono.get("type") == "MultiPolygon":
+            return [[np.asarray(r, dtype=float)[:, :2] for r in p] for p in poligono["coordinates"]]
+        raise ValueError(f"Unsupported geometry type: {poligono.get('type')}")
+    anillo = np.asarray(poligono, dtype=float)
+    if anillo.ndim != 2 or anillo.shape[0] < 3:
+        raise ValueError("A polygon needs at least 3 (lon, lat) vertices")
+    return [[anillo[:, :2]]]
+
+
+def _dentro_anillos(x: np.ndarray, y: np.ndarray, anillos: List[np.ndarray]) -> np.ndarray:
+    """Even-odd rule over all rings of one polygon (holes included)."""
+    dentro = np.zeros(len(x), dtype=bool)
+    for anillo in anillos:
+        xi, yi = anillo[:, 0], anillo[:, 1]
+        xj, yj = np.roll(xi, 1), np.roll(yi, 1)
+        for x1, y1, x2, y2 in zip(xi, yi, xj, yj):
+            cruza = (y1 > y) != (y2 > y)
+            if not cruza.any():
+                continue
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x_corte = (x2 - x1) * (y - y1) / (y2 - y1) + x1
+            dentro ^= cruza & (x < x_corte)
+    return dentro
+
+
+class SpatialIndex:
+    """
+    Regular grid index over longitude/latitude points.
+
+    Points are sorted by cell, so the points of a row of cells are one
+    contiguous slice found with a binary search.
+
+    Args:
+        lon (np.ndarray): Longitudes
+        lat (np.ndarray): Latitudes
+        cell_size (float): Cell side in degrees
+    """
+
+    def __init__(self, lon: np.ndarray, lat: np.ndarray, cell_size: float = CELL_SIZE_DEG):
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        valido = np.isfinite(lon) & np.isfinite(lat)
+        self.cell_size = cell_size
+        self.size = len(lon)
+        posiciones = np.flatnonzero(valido)
+
+        if len(posiciones):
+            self.lon0, self.lat0 = lon[valido].min(), lat[valido].min()
+            self.lon1, self.lat1 = lon[valido].max(), lat[valido].max()
+        else:
+            self.lon0 = self.lat0 = self.lon1 = self.lat1 = 0.0
+        self.ny = int((self.lat1 - self.lat0) // cell_size) + 1
+
+        claves = self._celda_x(lon[valido]) * self.ny + self._celda_y(lat[valido])
+        orden = np.argsort(claves, kind="stable")
+        self._claves = claves[orden]
+        self._posiciones = posiciones[orden]
+        self._lon = lon[self._posiciones]
+        self._lat = lat[self._posiciones]
+
+    def _celda_x(self, lon) -> np.ndarray:
+        return ((np.asarray(lon) - self.lon0) // self.cell_size).astype(np.int64)
+
+    def _celda_y(self, lat) -> np.ndarray:
+        return ((np.asarray(lat) - self.lat0) // self.cell_size).astype(np.int64)
+
+    @property
+    def bbox(self) -> Tuple[float, float, float, float]:
+        """(lon_min, lat_min, lon_max, lat_max) of the indexed points."""
+        return self.lon0, self.lat0, self.lon1, self.lat1
+
+    def _candidatos(self, lon_min: float, lat_min: float, lon_max: float, lat_max: float) -> np.ndarray:
+        """Sorted-array slots of the points in the cells overlapping a bounding box."""
+        lon_min, lat_min = max(lon_min, self.lon0), max(lat_min, self.lat0)
+        lon_max, lat_max = min(lon_max, self.lon1), min(lat_max, self.lat1)
+        if lon_min > lon_max or lat_min > lat_max or not len(self._claves):
+            return np.empty(0, dtype=np.int64)
+        columnas = np.arange(self._celda_x(lon_min), self._celda_x(lon_max) + 1)
+        inicio = np.searchsorted(self._claves, columnas * self.ny + self._celda_y(lat_min), side="left")
+        fin = np.searchsorted(self._claves, columnas * self.ny + self._celda_y(lat_max), side="right")
+        if not len(inicio):
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(a, b) for a, b in zip(inicio, fin)])
+
+    def within_polygon(self, poligono: Poligono) -> np.ndarray:
+        """
+        Positions of the points inside a polygon.
+
+        Args:
+            poligono (Poligono): (lon, lat) vertices or GeoJSON Polygon/MultiPolygon
+
+        Returns:
+            np.ndarray: Sorted positions in the original arrays
+        """
+        resultado = []
+        for anillos in _poligonos(poligono):
+            exterior = anillos[0]
+            slots = self._candidatos(exterior[:, 0].min(), exterior[:, 1].min(),
+                                     exterior[:, 0].max(), exterior[:, 1].max())
+            dentro = _dentro_anillos(self._lon[slots], self._lat[slots], anillos)
+            resultado.append(self._posiciones[slots[dentro]])
+        return np.unique(np.concatenate(resultado)) if resultado else np.empty(0, dtype=np.int64)
+
+    def within_radius(self, lon: float, lat: float, radio_km: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Positions of the points within a distance of a location.
+
+        Args:
+            lon (float): Longitude of the center
+            lat (float): Latitude of the center
+            radio_km (float): Radius in km
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Sorted positions and their distances in km
+        """
+        dlat = np.degrees(radio_km / RADIO_TIERRA_KM)
+        dlon = dlat / max(np.cos(np.radians(lat)), 1e-6)
+        slots = self._candidatos(lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+        distancias = haversine_km(lon, lat, self._lon[slots], self._lat[slots])
+        cerca = distancias <= radio_km
+        posiciones, distancias = self._posiciones[slots[cerca]], distancias[cerca]
+        orden = np.argsort(posiciones)
+        return posiciones[orden], distancias[orden]
+
+
+class EventSpatialIndex:
+    """
+    Spatial index bound to the event table, returning event subsets and aggregates.
+
+    Args:
+        eventos (pd.DataFrame): Typed event table with LONGITUD and LATITUD
+        cell_size (float): Grid cell side in degrees
+    """
+
+    # Appended batches are indexed as separate segments, merged once there are this many
+    MAX_SEGMENTOS = 16
+
+    def __init__(self, eventos: pd.DataFrame, cell_size: float = CELL_SIZE_DEG):
+        self.cell_size = cell_size
+        with span("spatial_index_build", rows=len(eventos)):
+            self._segmentos = [self._segmento(eventos)]
+
+    def _segmento(self, eventos: pd.DataFrame):
+        eventos = eventos.reset_index(drop=True)
+        return eventos, SpatialIndex(eventos["LONGITUD"].to_numpy(), eventos["LATITUD"].to_numpy(), self.cell_size)
+
+    @property
+    def eventos(self) -> pd.DataFrame:
+        """All indexed events."""
+        if len(self._segmentos) == 1:
+            return self._segmentos[0][0]
+        return pd.concat([e for e, _ in self._segmentos], ignore_index=True)
+
+    @property
+    def index(self) -> SpatialIndex:
+        """Index of the main segment (its bbox is used to read coordinates in questions)."""
+        return self._segmentos[0][1]
+
+    def append(self, nuevos: pd.DataFrame) -> None:
+        """
+        Indexes newly ingested events as a new segment.
+
+        Only the new events are sorted; segments are merged into one when
+        MAX_SEGMENTOS is reached.
+
+        Args:
+            nuevos (pd.DataFrame): New typed events
+        """
+        if not len(nuevos):
+            return
+        with span("spatial_index_append", rows=len(nuevos)):
+            self._segmentos.append(self._segmento(nuevos))
+            if len(self._segmentos) >= self.MAX_SEGMENTOS:
+                self._segmentos = [self._segmento(self.eventos)]
+
+    def en_poligono(self, poligono: Poligono) -> pd.DataFrame:
+        """Events inside a polygon."""
+        with span("spatial_query", tipo="poligono"):
+            partes = [e.iloc[indice.within_polygon(poligono)] for e, indice in self._segmentos]
+            set_attribute("rows", sum(len(p) for p in partes))
+        return partes[0] if len(partes) == 1 else pd.concat(partes, ignore_index=True)
+
+    def en_radio(self, lon: float, lat: float, radio_km: float) -> pd.DataFrame:
+        """Events within radio_km of (lon, lat), with their distance in 'distancia_km'."""
+        with span("spatial_query", tipo="radio", radio_km=radio_km):
+            partes = []
+            for e, indice in self._segmentos:
+                posiciones, distancias = indice.within_radius(lon, lat, radio_km)
+                partes.append(e.iloc[posiciones].assign(distancia_km=distancias))
+            set_attribute("rows", sum(len(p) for p in partes))
+        return partes[0] if len(partes) == 1 else pd.concat(partes, ignore_index=True)
+
+    def consultar(self, zona: Dict[str, Any]) -> pd.DataFrame:
+        """
+        Events of a zone returned by infer_zone().
+
+        Args:
+            zona (Dict[str, Any]): {'tipo': 'radio', 'lon', 'lat', 'radio_km'} or
+                {'tipo': 'poligono', 'poligono'}
+
+        Returns:
+            pd.DataFrame: Events in the zone
+        """
+        if zona["tipo"] == "radio":
+            return self.en_radio(zona["lon"], zona["lat"], zona["radio_km"])
+        return self.en_poligono(zona["poligono"])
+
+    @staticmethod
+    def resumen(eventos: pd.DataFrame, top: int = 3) -> Dict[str, Any]:
+        """
+        Aggregates of an event subset.
+
+        Args:
+            eventos (pd.DataFrame): Events (e.g. from en_radio / en_poligono)
+            top (int): Number of causes and equipment types listed
+
+        Returns:
+            Dict[str, Any]: Event count, total and mean duration (h), SAIDI and
+            SAIFI sums, year range and most frequent causes and equipment types
+        """
+        duracion = pd.to_numeric(eventos["duracion_h"], errors="coerce") if "duracion_h" in eventos else pd.Series(dtype=float)
+        fechas = eventos["FECHA"] if "FECHA" in eventos else pd.Series(dtype="datetime64[ns]")
+        return {
+            "eventos": int(len(eventos)),
+            "duracion_h_total": float(duracion.sum()),
+            "duracion_h_media": float(duracion.mean()) if len(duracion.dropna()) else None,
+            "SAIDI": float(eventos["SAIDI"].sum()) if "SAIDI" in eventos else None,
+            "SAIFI": float(eventos["SAIFI"].sum()) if "SAIFI" in eventos else None,
+            "anio_min": int(fechas.min().year) if len(fechas.dropna()) else None,
+            "anio_max": int(fechas.max().year) if len(fechas.dropna()) else None,
+            "causas": eventos["causa"].value_counts().head(top).to_dict() if "causa" in eventos else {},
+            "tipos_equipo": eventos["tipo_equi_ope"].value_counts().head(top).to_dict() if "tipo_equi_ope" in eventos else {},
+        }
+
+    @staticmethod
+    def describir(resumen: Dict[str, Any]) -> str:
+        """One-sentence description of resumen(), used in prompts."""
+        if not resumen["eventos"]:
+            return "no se registran interrupciones en la zona"
+        causas = ", ".join(f"{c} ({n})" for c, n in resumen["causas"].items() if n)
+        return (
+            f"{resumen['eventos']} interrupciones entre {resumen['anio_min']} y {resumen['anio_max']}, "
+            f"duración media {resumen['duracion_h_media']:.2f} h, SAIDI acumulado {resumen['SAIDI']:.4f}, "
+            f"SAIFI acumulado {resumen['SAIFI']:.4f}; causas más frecuentes: {causas}"
+        )
+
+
+# Index cache -------------------------------------------------------------------------------------
+
+_indices: Dict[str, EventSpatialIndex] = {}
+_indices_lock = threading.Lock()
+
+
+def get_spatial_index(data_version: str, cargar_eventos: Callable[[], pd.DataFrame]) -> EventSpatialIndex:
+    """
+    Returns the spatial index of a data version, building it on first use.
+
+    Args:
+        data_version (str): Version of the event data
+        cargar_eventos (Callable[[], pd.DataFrame]): Loader of the typed event table
+
+    Returns:
+        EventSpatialIndex: Index shared by the tools and the recommendations
+    """
+    with _indices_lock:
+        if data_version not in _indices:
+            _indices.clear()
+            _indices[data_version] = EventSpatialIndex(cargar_eventos())
+        return _indices[data_version]
+
+
+def advance_spatial_index(old_version: str, new_version: str, nuevos: pd.DataFrame) -> bool:
+    """
+    Moves a cached index to a new data version by indexing the new events.
+
+    Args:
+        old_version (str): Version the cached index was built from
+        new_version (str): Version after the append
+        nuevos (pd.DataFrame): Events appended between both versions
+
+    Returns:
+        bool: True if an index was advanced, False if none was cached for old_version
+    """
+    with _indices_lock:
+        indice = _indices.pop(old_version, None)
+        if indice is None:
+            return False
+        indice.append(nuevos)
+        _indices[new_version] = indice
+        return True
+
+
+# Zone inference ----------------------------------------------------------------------------------
+
+_NUMERO = r"-?\d{1,3}\.\d+"
+
+
+def infer_zone(query: str, bbox: Optional[Tuple[float, float, float, float]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Finds a zone in a question: a WKT POLYGON, or a radius around a coordinate pair.
+
+    'a 5 km de 5.07, -75.52' and 'en un radio de 500 m alrededor de (-75.52, 5.07)'
+    are recognized. Pairs are read as (lat, lon) unless only the swapped order
+    falls inside bbox (the extent of the data).
+
+    Args:
+        query (str): User question
+        bbox (Optional[Tuple[float, float, float, float]]): (lon_min, lat_min, lon_max, lat_max) of the data
+
+    Returns:
+        Optional[Dict[str, Any]]: Zone for EventSpatialIndex.consultar, or None
+    """
+    wkt = re.search(r"POLYGON\s*\(\((.*?)\)\)", query, flags=re.IGNORECASE)
+    if wkt:
+        vertices = [tuple(map(float, p.split()[:2])) for p in wkt.group(1).split(",") if p.strip()]
+        if len(vertices) >= 3:
+            return {"tipo": "poligono", "poligono": vertices}
+
+    par = re.search(rf"\(?\s*({_NUMERO})\s*,\s*({_NUMERO})\s*\)?", query)
+    radio = re.search(r"(\d+(?:[.,]\d+)?)\s*(km|kil[oó]metros?|m|metros?)\b", query, flags=re.IGNORECASE)
+    if not (par and radio):
+        return None
+
+    a, b = float(par.group(1)), float(par.group(2))
+    lat, lon = a, b
+    if abs(a) > 90:
+        lat, lon = b, a
+    elif bbox is not None:
+        lon_min, lat_min, lon_max, lat_max = bbox
+        # Half a degree of margin: radius centers can lie just outside the events' extent
+        dentro = lambda x, y: lon_min - 0.5 <= x <= lon_max + 0.5 and lat_min - 0.5 <= y <= lat_max + 0.5
+        if not dentro(b, a) and dentro(a, b):
+            lat, lon = b, a
+
+    valor = float(radio.group(1).replace(",", "."))
+    radio_km = valor if radio.group(2).lower().startswith("k") else valor / 1000
+    return {"tipo": "radio", "lon": lon, "lat": lat, "radio_km": radio_km}
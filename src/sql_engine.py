@@ -0,0 +1,365 @@
+"""
+Embedded SQL execution mode for event questions
+Instead of letting the pandas agent run generated Python over the whole
+frame, the model writes one SQL query against the event table, the query is
+validated (single read-only SELECT, no file or network access) and executed
+by DuckDB with multi-threaded vectorized execution. The result is then put
+into words by the model. Invalid or failing queries fall back to the pandas
+agent in tools.eventos_transformadores.
+
+Enable it with CRITAIR_EVENTOS_ENGINE=sql. Side-by-side benchmark on the
+structured question set (from the project root):
+    python src/sql_engine.py --model gpt --output results/tables/eventos_engine_benchmark.csv
+"""
+
+import argparse
+import csv
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from tracing import set_attribute, span
+
+
+# Execution mode of tools.eventos_transformadores: 'pandas' (agent) or 'sql'
+EVENTOS_ENGINE = os.getenv("CRITAIR_EVENTOS_ENGINE", "pandas").lower()
+
+# Rows of a result shown to the model when it writes the answer
+MAX_RESULT_ROWS = 50
+
+# Categorical columns whose distinct values are listed in the prompt (if not too many)
+MAX_VALORES_PROMPT = 30
+
+# Functions that could reach files, the network or the catalog; also blocked by
+# disabling external access on the connection, checked here to fail early
+FUNCIONES_PROHIBIDAS = [
+    "read_csv", "read_csv_auto", "read_parquet", "parquet_scan", "read_json", "read_json_auto",
+    "read_text", "read_blob", "glob", "sniff_csv", "query_table", "duckdb_settings",
+    "duckdb_extensions", "getenv",
+]
+
+
+class SQLValidationError(ValueError):
+    """Raised when generated SQL is not a single read-only query over the event table."""
+
+
+def extract_sql(text: str) -> str:
+    """
+    Extracts the SQL statement from a model answer (plain or in a code fence).
+
+    Args:
+        text (str): Model output
+
+    Returns:
+        str: SQL statement without fences or trailing semicolons
+    """
+    match = re.search(r"```(?:sql)?\s*(.*?)```", text, flags=re.DOTALL | re.IGNORECASE)
+    sql = match.group(1) if match else text
+    match = re.search(r"\b(?:select|with)\b.*", sql, flags=re.DOTALL | re.IGNORECASE)
+    sql = match.group(0) if match else sql
+    return sql.strip().rstrip(";").strip()
+
+
+def validate_sql(sql: str) -> str:
+    """
+    Checks that generated SQL is a single SELECT with no forbidden functions.
+
+    Args:
+        sql (str): SQL statement
+
+    Returns:
+        str: The statement, unchanged
+
+    Raises:
+        SQLValidationError: If the statement is empty, not a single SELECT or
+            uses a forbidden function
+    """
+    import duckdb
+
+    if not sql:
+        raise SQLValidationError("Empty query")
+    try:
+        statements = duckdb.extract_statements(sql)
+    except duckdb.Error as e:
+        raise SQLValidationError(f"Unparseable query: {e}") from e
+    if len(statements) != 1:
+        raise SQLValidationError(f"Expected one statement, got {len(statements)}")
+    if statements[0].type != duckdb.StatementType.SELECT:
+        raise SQLValidationError(f"Only SELECT queries are allowed, got {statements[0].type.name}")
+    usadas = [f for f in FUNCIONES_PROHIBIDAS if re.search(rf"\b{f}\s*\(", sql, flags=re.IGNORECASE)]
+    if usadas:
+        raise SQLValidationError(f"Forbidden functions: {', '.join(usadas)}")
+    return sql
+
+
+class EventSQLEngine:
+    """
+    In-process DuckDB database holding the event table as 'eventos'.
+
+    The table is copied into DuckDB once per data version; after that the
+    connection loses access to files and the network, so a query can only
+    read 'eventos'. Each query runs on its own cursor, so the engine can be
+    shared by threads.
+
+    Args:
+        eventos (pd.DataFrame): Typed event table (see tools._cargar_eventos)
+        threads (Optional[int]): DuckDB worker threads (all cores if None)
+    """
+
+    def __init__(self, eventos: pd.DataFrame, threads: Optional[int] = None):
+        import duckdb
+
+        with span("sql_engine_load", rows=len(eventos)):
+            self._con = duckdb.connect(":memory:")
+            if threads:
+                self._con.execute(f"SET threads = {int(threads)}")
+            self._con.register("eventos_df", eventos)
+            self._con.execute("CREATE TABLE eventos AS SELECT * FROM eventos_df")
+            self._con.unregister("eventos_df")
+            self._con.execute("SET enable_external_access = false")
+            self._con.execute("SET lock_configuration = true")
+
+            self.schema = self._con.execute("DESCRIBE eventos").fetchall()
+            self.anio_min, self.anio_max = self._con.execute(
+                "SELECT min(year(FECHA)), max(year(FECHA)) FROM eventos"
+            ).fetchone()
+            self.valores: Dict[str, List[str]] = {}
+            for nombre, tipo, *_ in self.schema:
+                if tipo.startswith("ENUM") or tipo == "VARCHAR":
+                    n, = self._con.execute(f'SELECT count(DISTINCT "{nombre}") FROM eventos').fetchone()
+                    if n <= MAX_VALORES_PROMPT:
+                        self.valores[nombre] = [
+                            str(v) for v, in self._con.execute(
+                                f'SELECT DISTINCT "{nombre}" FROM eventos WHERE "{nombre}" IS NOT NULL ORDER BY 1'
+                            ).fetchall()
+                        ]
+
+    def append(self, nuevos: pd.DataFrame) -> None:
+        """
+        Inserts newly ingested events into the 'eventos' table.
+
+        Args:
+            nuevos (pd.DataFrame): New typed events (columns matched by name)
+        """
+        with span("sql_engine_append", rows=len(nuevos)):
+            cursor = self._con.cursor()
+            try:
+                cursor.register("nuevos_df", nuevos)
+                cursor.execute("INSERT INTO eventos BY NAME SELECT * FROM nuevos_df")
+                cursor.unregister("nuevos_df")
+                self.anio_min, self.anio_max = cursor.execute(
+                    "SELECT min(year(FECHA)), max(year(FECHA)) FROM eventos"
+                ).fetchone()
+            finally:
+                cursor.close()
+
+    def describe(self) -> str:
+        """Table description used in the SQL prompt."""
+        lineas = []
+        for nombre, tipo, *_ in self.schema:
+            tipo = "VARCHAR" if tipo.startswith("ENUM") else tipo
+            linea = f"- {nombre} ({tipo})"
+            if nombre in self.valores:
+                linea += f": {', '.join(self.valores[nombre])}"
+            lineas.append(linea)
+        return "\n".join(lineas)
+
+    def execute(self, sql: str, max_rows: int = MAX_RESULT_ROWS) -> pd.DataFrame:
+        """
+        Validates and runs a query.
+
+        Args:
+            sql (str): SELECT statement over 'eventos'
+            max_rows (int): Maximum rows returned
+
+        Returns:
+            pd.DataFrame: Query result
+
+        Raises:
+            SQLValidationError: If the statement is rejected by validate_sql
+            duckdb.Error: If execution fails
+        """
+        validate_sql(sql)
+        with span("sql_execute"):
+            cursor = self._con.cursor()
+            try:
+                resultado = cursor.execute(f"SELECT * FROM ({sql}) AS q LIMIT {int(max_rows)}").df()
+            finally:
+                cursor.close()
+            set_attribute("rows", len(resultado))
+        return resultado
+
+
+# Engine cache ------------------------------------------------------------------------------------
+
+_engines: Dict[str, EventSQLEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_sql_engine(data_version: str, cargar_eventos: Callable[[], pd.DataFrame]) -> EventSQLEngine:
+    """
+    Returns the SQL engine of a data version, loading it on first use.
+
+    Args:
+        data_version (str): Version of the event data
+        cargar_eventos (Callable[[], pd.DataFrame]): Loader of the typed event table
+
+    Returns:
+        EventSQLEngine: Engine shared by every question on that version
+    """
+    with _engines_lock:
+        if data_version not in _engines:
+            _engines.clear()
+            _engines[data_version] = EventSQLEngine(cargar_eventos())
+        return _engines[data_version]
+
+
+def advance_sql_engine(old_version: str, new_version: str, nuevos: pd.DataFrame) -> bool:
+    """
+    Moves a cached engine to a new data version by inserting the new events.
+
+    Args:
+        old_version (str): Version the cached engine was loaded from
+        new_version (str): Version after the append
+        nuevos (pd.DataFrame): Events appended between both versions
+
+    Returns:
+        bool: True if an engine was advanced, False if none was cached for old_version
+    """
+    with _engines_lock:
+        engine = _engines.pop(old_version, None)
+        if engine is None:
+            return False
+        engine.append(nuevos)
+        _engines[new_version] = engine
+        return True
+
+
+# Question answering ------------------------------------------------------------------------------
+
+SQL_TEMPLATE = """Eres un analista de datos de interrupciones en redes eléctricas.
+Escribe UNA consulta SQL (dialecto DuckDB) de solo lectura sobre la tabla `eventos` que responda la pregunta.
+Cada fila es una interrupción. Los datos van del año {anio_min} al año {anio_max}; "el último año" es {anio_max}.
+
+Columnas (con sus valores posibles cuando son pocos):
+{columnas}
+
+Usa year(FECHA) para filtrar por año y compara textos con los valores exactos de la lista.
+Responde únicamente con la consulta SQL, sin explicaciones.
+
+Pregunta: {query}
+SQL:"""
+
+ANSWER_TEMPLATE = """Responde en español, de forma breve y directa, la pregunta usando solo el resultado de la consulta.
+
+Pregunta: {query}
+Consulta SQL ejecutada: {sql}
+Resultado:
+{resultado}
+
+Respuesta:"""
+
+
+def _texto(respuesta) -> str:
+    return getattr(respuesta, "content", respuesta)
+
+
+def answer_with_sql(query: str, llm_chat, engine: EventSQLEngine) -> Dict[str, object]:
+    """
+    Answers an event question by generating, validating and running SQL.
+
+    Args:
+        query (str): User question
+        llm_chat: Chat model (see utils.create_llm_chat_model)
+        engine (EventSQLEngine): Engine over the event table
+
+    Returns:
+        Dict[str, object]: 'response', 'sql' and 'rows' (rows in the result)
+
+    Raises:
+        SQLValidationError: If the generated SQL is rejected
+        duckdb.Error: If the query fails
+    """
+    with span("sql_generate"):
+        prompt = SQL_TEMPLATE.format(
+            anio_min=engine.anio_min, anio_max=engine.anio_max, columnas=engine.describe(), query=query
+        )
+        sql = extract_sql(_texto(llm_chat.invoke(prompt)))
+
+    resultado = engine.execute(sql)
+
+    with span("generate"):
+        tabla = resultado.to_string(index=False) if len(resultado) else "(sin filas)"
+        response = _texto(llm_chat.invoke(ANSWER_TEMPLATE.format(query=query, sql=sql, resultado=tabla)))
+    return {"response": response, "sql": sql, "rows": len(resultado)}
+
+
+# Benchmark ---------------------------------------------------------------------------------------
+
+def benchmark(questions: List[str], model: str, output: Optional[str] = None) -> pd.DataFrame:
+    """
+    Times the SQL mode against the pandas agent on the same questions.
+
+    Args:
+        questions (List[str]): Questions to ask (e.g. structured_questions)
+        model (str): Model used by the SQL mode (the pandas agent uses gpt-3.5-turbo)
+        output (Optional[str]): CSV path to save the per-question results
+
+    Returns:
+        pd.DataFrame: One row per question and engine with time, answer and errors
+    """
+    from tools import _consultar_eventos, _crear_agente_eventos, _version_eventos
+    from utils import create_llm_chat_model
+
+    engine = get_sql_engine(_version_eventos(), _consultar_eventos)
+    llm_chat = create_llm_chat_model(model)
+    filas = []
+    for i, query in enumerate(questions):
+        inicio = time.perf_counter()
+        try:
+            r = answer_with_sql(query, llm_chat, engine)
+            filas.append({"question_idx": i, "engine": "sql", "time": time.perf_counter() - inicio,
+                          "response": r["response"], "sql": r["sql"], "error": ""})
+        except Exception as e:
+            filas.append({"question_idx": i, "engine": "sql", "time": time.perf_counter() - inicio,
+                          "response": "", "sql": "", "error": f"{type(e).__name__}: {e}"})
+
+        inicio = time.perf_counter()
+        try:
+            response = _crear_agente_eventos(_consultar_eventos(query)).invoke(query)["output"]
+            error = ""
+        except Exception as e:
+            response, error = "", f"{type(e).__name__}: {e}"
+        filas.append({"question_idx": i, "engine": "pandas_agent", "time": time.perf_counter() - inicio,
+                      "response": response, "sql": "", "error": error})
+
+    resultados = pd.DataFrame(filas)
+    if output:
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        resultados.to_csv(output, index=False, quoting=csv.QUOTE_NONNUMERIC)
+    return resultados
+
+
+def main() -> None:
+    from structured_questions import get_structured_questions
+
+    parser = argparse.ArgumentParser(description="Benchmark SQL (DuckDB) vs agente de pandas")
+    parser.add_argument("--model", default="gpt", help="Modelo que genera el SQL")
+    parser.add_argument("--output", default="results/tables/eventos_engine_benchmark.csv")
+    args = parser.parse_args()
+
+    resultados = benchmark(get_structured_questions(), args.model, args.output)
+    resumen = resultados.assign(ok=resultados["error"] == "").groupby("engine").agg(
+        preguntas=("time", "size"), sin_error=("ok", "sum"), media_s=("time", "mean"),
+        p50_s=("time", "median"), p95_s=("time", lambda t: t.quantile(0.95)),
+    )
+    print(resumen.to_string())
+    print(f"\nResultados por pregunta en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
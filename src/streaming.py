@@ -0,0 +1,520 @@
+"""
+Out-of-core streaming aggregation of the event history
+Tabla_General.csv is read in chunks sized from a memory ceiling; each chunk
+is reduced to a cube of mergeable quantities (event counts and sums of
+duration, SAIDI, SAIFI and affected users by year, month, department,
+municipality, equipment type and cause) and merged into the running
+result, so memory depends on the chunk size and the number of groups, not
+on the length of the history. Counts, means, top-k and SAIDI/SAIFI are
+answered from the merged cube.
+
+Usage (from the project root):
+    python src/streaming.py resumen --memory-mb 512
+    python src/streaming.py benchmark --rows 100000000 --memory-mb 512
+"""
+
+import argparse
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from reliability import infer_grouping
+from tracing import set_attribute, span
+from utils import normalize_query
+
+
+# Memory ceiling of the streaming mode (MiB)
+STREAMING_MEMORY_MB = int(os.getenv("CRITAIR_STREAMING_MEMORY_MB", "1024"))
+
+DIMENSIONES = ["anio", "mes", "DEP", "MUN", "tipo_equi_ope", "causa"]
+
+# Additive measures kept per cube cell
+MEDIDAS = ["eventos", "duracion_h", "SAIDI", "SAIFI", "usuarios"]
+
+# Columns read from the CSV
+COLUMNAS = ["FECHA", "DEP", "MUN", "tipo_equi_ope", "causa", "duracion_h", "SAIDI", "SAIFI", "cnt_usus"]
+CATEGORICAS = ["DEP", "MUN", "tipo_equi_ope", "causa"]
+
+# Peak working memory of a chunk relative to its parsed size (text buffers, parsing, reduction)
+FACTOR_TRABAJO = 4
+
+
+def _reducir(chunk: pd.DataFrame):
+    """Reduces a chunk to cube rows; returns the cube and the number of rows without a valid date."""
+    fecha = chunk["FECHA"]
+    if not pd.api.types.is_datetime64_any_dtype(fecha):
+        fecha = pd.to_datetime(fecha.astype(str), format="%Y-%m-%d", errors="coerce")
+    validos = fecha.notna().to_numpy()
+    base = pd.DataFrame({
+        "anio": fecha.dt.year.to_numpy()[validos].astype(np.int16),
+        "mes": fecha.dt.month.to_numpy()[validos].astype(np.int8),
+    })
+    for col in CATEGORICAS:
+        # Grouped as categories; only the (small) cube is converted to strings
+        base[col] = pd.Categorical(chunk[col])[validos] if col in chunk else "N/D"
+    base["eventos"] = np.ones(len(base), dtype=np.int64)
+    for col, origen in (("duracion_h", "duracion_h"), ("SAIDI", "SAIDI"), ("SAIFI", "SAIFI"), ("usuarios", "cnt_usus")):
+        base[col] = pd.to_numeric(chunk[origen], errors="coerce").to_numpy(dtype=float)[validos] \
+            if origen in chunk else 0.0
+    cube = base.groupby(DIMENSIONES, sort=False, observed=True, dropna=False)[MEDIDAS].sum().reset_index()
+    for col in CATEGORICAS:
+        cube[col] = cube[col].astype(str)
+    return cube, int((~validos).sum())
+
+
+def _fusionar(a: pd.DataFrame, b: pd.DataFrame) -> pd.DataFrame:
+    if not len(a):
+        return b
+    if not len(b):
+        return a
+    return pd.concat([a, b], ignore_index=True).groupby(DIMENSIONES, sort=False)[MEDIDAS].sum().reset_index()
+
+
+def _medias(tabla: pd.DataFrame) -> pd.DataFrame:
+    eventos = tabla["eventos"].replace(0, np.nan)
+    return tabla.assign(
+        duracion_media_h=tabla["duracion_h"] / eventos,
+        SAIDI_promedio=tabla["SAIDI"] / eventos,
+        SAIFI_promedio=tabla["SAIFI"] / eventos,
+    )
+
+
+@dataclass
+class StreamingSummary:
+    """
+    Mergeable partial result of the streaming aggregation.
+
+    Attributes:
+        cube (pd.DataFrame): Sums of MEDIDAS by DIMENSIONES
+        rows (int): Events aggregated
+        rejected (int): Events skipped for lacking a valid FECHA
+        chunks (int): Chunks processed
+        seconds (float): Processing time
+        peak_bytes (int): Largest estimated working set (chunk plus cube)
+    """
+    cube: pd.DataFrame = field(default_factory=lambda: pd.DataFrame(columns=DIMENSIONES + MEDIDAS))
+    rows: int = 0
+    rejected: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+    peak_bytes: int = 0
+
+    @classmethod
+    def from_chunk(cls, chunk: pd.DataFrame) -> "StreamingSummary":
+        """Partial result of a single chunk."""
+        cube, rechazados = _reducir(chunk)
+        return cls(cube=cube, rows=len(chunk) - rechazados, rejected=rechazados, chunks=1)
+
+    def merge(self, other: "StreamingSummary") -> "StreamingSummary":
+        """
+        Combines two partial results (associative, so chunks can be merged in any grouping).
+
+        Args:
+            other (StreamingSummary): Partial result of other chunks
+
+        Returns:
+            StreamingSummary: Combined result
+        """
+        return StreamingSummary(
+            cube=_fusionar(self.cube, other.cube),
+            rows=self.rows + other.rows,
+            rejected=self.rejected + other.rejected,
+            chunks=self.chunks + other.chunks,
+            seconds=self.seconds + other.seconds,
+            peak_bytes=max(self.peak_bytes, other.peak_bytes),
+        )
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def _filtrar(self, anio_inicio: Optional[int] = None, anio_fin: Optional[int] = None,
+                 **valores) -> pd.DataFrame:
+        cube = self.cube
+        mask = np.ones(len(cube), dtype=bool)
+        if anio_inicio is not None:
+            mask &= cube["anio"].to_numpy() >= anio_inicio
+        if anio_fin is not None:
+            mask &= cube["anio"].to_numpy() <= anio_fin
+        for col, valor in valores.items():
+            if valor is None:
+                continue
+            if col not in DIMENSIONES:
+                raise ValueError(f"Unknown dimension: {col}")
+            buscados = {normalize_query(v) for v in ([valor] if isinstance(valor, str) else valor)}
+            mask &= cube[col].map(normalize_query).isin(buscados).to_numpy()
+        return cube[mask]
+
+    def totals(self, por: Sequence[str] = (), frecuencia: Optional[str] = None, **filtros) -> pd.DataFrame:
+        """
+        Counts, sums and per-event means grouped by dimensions and/or period.
+
+        Args:
+            por (Sequence[str]): Dimensions to group by (DEP, MUN, tipo_equi_ope, causa)
+            frecuencia (Optional[str]): 'anio', 'trimestre' or 'mes' to add a period column
+            **filtros: anio_inicio, anio_fin and DEP, MUN, tipo_equi_ope, causa value(s)
+
+        Returns:
+            pd.DataFrame: Events, duration (h), SAIDI, SAIFI and users sums plus
+            duracion_media_h, SAIDI_promedio and SAIFI_promedio
+        """
+        cube = self._filtrar(**filtros)
+        claves = list(por)
+        if frecuencia == "anio":
+            claves = ["anio"] + claves
+        elif frecuencia == "trimestre":
+            cube = cube.assign(trimestre=(cube["mes"].astype(int) - 1) // 3 + 1)
+            claves = ["anio", "trimestre"] + claves
+        elif frecuencia == "mes":
+            claves = ["anio", "mes"] + claves
+        if claves:
+            tabla = cube.groupby(claves, sort=True)[MEDIDAS].sum().reset_index()
+        else:
+            tabla = cube[MEDIDAS].sum().to_frame().T
+            tabla["eventos"] = tabla["eventos"].astype(np.int64)
+        return _medias(tabla)
+
+    def top_k(self, columna: str, k: int = 5, medida: str = "eventos", **filtros) -> pd.DataFrame:
+        """
+        Values of a dimension with the largest sum of a measure.
+
+        Exact: every group is kept in the cube, so no candidate is dropped
+        between chunks.
+
+        Args:
+            columna (str): Dimension (e.g. 'MUN' or 'causa')
+            k (int): Number of values
+            medida (str): Measure to rank by (one of MEDIDAS)
+            **filtros: Same filters as totals()
+
+        Returns:
+            pd.DataFrame: The k largest groups with their totals and means
+        """
+        return self.totals(por=[columna], **filtros).nlargest(k, medida).reset_index(drop=True)
+
+    def valores(self, columna: str) -> List[str]:
+        """Distinct values of a dimension."""
+        return sorted(self.cube[columna].astype(str).unique().tolist())
+
+    def append(self, nuevos: pd.DataFrame) -> None:
+        """Merges newly ingested events (see ingestion.py) into the cube."""
+        parcial = StreamingSummary.from_chunk(nuevos)
+        self.cube = _fusionar(self.cube, parcial.cube)
+        self.rows += parcial.rows
+        self.rejected += parcial.rejected
+
+
+class StreamingAggregator:
+    """
+    Aggregates an event history in bounded-memory chunks.
+
+    Args:
+        memory_mb (int): Memory ceiling in MiB for a chunk and the running cube
+        chunk_rows (Optional[int]): Fixed chunk size (estimated from memory_mb if None)
+    """
+
+    def __init__(self, memory_mb: int = STREAMING_MEMORY_MB, chunk_rows: Optional[int] = None):
+        self.memory_mb = memory_mb
+        self.chunk_rows = chunk_rows
+
+    @property
+    def memory_bytes(self) -> int:
+        return int(self.memory_mb * 2**20)
+
+    def chunk_rows_for(self, path: str, sample_rows: int = 10000) -> int:
+        """
+        Chunk size that keeps a parsed chunk within the memory ceiling.
+
+        Args:
+            path (str): CSV with the events
+            sample_rows (int): Rows read to measure the parsed size of a row
+
+        Returns:
+            int: Rows per chunk
+        """
+        if self.chunk_rows is not None:
+            return self.chunk_rows
+        return self._filas_por_bloque(self._leer(path, nrows=sample_rows))
+
+    def _filas_por_bloque(self, muestra: pd.DataFrame) -> int:
+        por_fila = muestra.memory_usage(deep=True, index=False).sum() / max(len(muestra), 1)
+        # Half of the ceiling for the chunk, the rest for the running cube
+        return max(1000, int(self.memory_bytes / 2 / (por_fila * FACTOR_TRABAJO)))
+
+    @staticmethod
+    def _leer(path: str, **kwargs):
+        columnas = pd.read_csv(path, nrows=0).columns
+        return pd.read_csv(path, usecols=[c for c in COLUMNAS if c in columnas],
+                           dtype={c: "category" for c in CATEGORICAS}, **kwargs)
+
+    def iter_csv(self, path: str) -> Iterator[pd.DataFrame]:
+        """Yields the events of a CSV in chunks of chunk_rows_for(path) rows."""
+        with self._leer(path, chunksize=self.chunk_rows_for(path)) as lector:
+            yield from lector
+
+    def aggregate(self, chunks: Iterable[pd.DataFrame]) -> StreamingSummary:
+        """
+        Reduces and merges a stream of event chunks.
+
+        Args:
+            chunks (Iterable[pd.DataFrame]): Event chunks (with the columns in COLUMNAS)
+
+        Returns:
+            StreamingSummary: Merged result
+
+        Raises:
+            MemoryError: If the merged cube alone exceeds half of the memory ceiling
+        """
+        inicio = time.perf_counter()
+        resumen = StreamingSummary()
+        with span("streaming_aggregate", memory_mb=self.memory_mb):
+            for chunk in chunks:
+                parcial = StreamingSummary.from_chunk(chunk)
+                uso = int(chunk.memory_usage(deep=True, index=False).sum())
+                resumen = resumen.merge(parcial)
+                cubo = int(resumen.cube.memory_usage(deep=True, index=False).sum())
+                resumen.peak_bytes = max(resumen.peak_bytes, uso + cubo)
+                if cubo > self.memory_bytes / 2:
+                    raise MemoryError(f"Streaming cube uses {cubo / 2**20:.0f} MiB, more than half of the "
+                                      f"{self.memory_mb} MiB ceiling")
+            resumen.seconds = time.perf_counter() - inicio
+            set_attribute("rows", resumen.rows)
+            set_attribute("chunks", resumen.chunks)
+        return resumen
+
+    def aggregate_csv(self, path: str) -> StreamingSummary:
+        """Streams and aggregates a CSV (e.g. Tabla_General.csv)."""
+        return self.aggregate(self.iter_csv(path))
+
+
+def requires_streaming(path: str, memory_mb: int = STREAMING_MEMORY_MB, sample_rows: int = 10000) -> bool:
+    """
+    Whether loading a CSV whole would exceed the memory ceiling.
+
+    The typed size is estimated from the parsed size and on-disk size of a sample.
+
+    Args:
+        path (str): CSV with the events
+        memory_mb (int): Memory ceiling in MiB
+        sample_rows (int): Rows of the sample
+
+    Returns:
+        bool: True if the file should be aggregated in streaming mode
+    """
+    try:
+        tamano = os.path.getsize(path)
+    except OSError:
+        return False
+    if tamano * 0.5 < memory_mb * 2**20:
+        return False
+    with open(path, "rb") as f:
+        lineas = [f.readline() for _ in range(sample_rows + 1)]
+    muestra = pd.read_csv(path, nrows=sample_rows)
+    en_disco = sum(len(l) for l in lineas[1:]) / max(len(muestra), 1)
+    en_memoria = muestra.memory_usage(deep=True, index=False).sum() / max(len(muestra), 1)
+    return tamano / en_disco * en_memoria > memory_mb * 2**20
+
+
+# Summary cache -----------------------------------------------------------------------------------
+
+_resumenes: Dict[str, StreamingSummary] = {}
+_resumenes_lock = threading.Lock()
+
+
+def get_streaming_summary(data_version: str, path: str, memory_mb: int = STREAMING_MEMORY_MB) -> StreamingSummary:
+    """
+    Returns the streamed summary of a data version, aggregating the CSV on first use.
+
+    Args:
+        data_version (str): Version of the event data
+        path (str): CSV with the events
+        memory_mb (int): Memory ceiling in MiB
+
+    Returns:
+        StreamingSummary: Summary shared by every question on that version
+    """
+    with _resumenes_lock:
+        if data_version not in _resumenes:
+            _resumenes.clear()
+            _resumenes[data_version] = StreamingAggregator(memory_mb).aggregate_csv(path)
+        return _resumenes[data_version]
+
+
+def advance_streaming_summary(old_version: str, new_version: str, nuevos: pd.DataFrame) -> bool:
+    """
+    Moves a cached summary to a new data version by merging the new events.
+
+    Args:
+        old_version (str): Version the cached summary was built from
+        new_version (str): Version after the append
+        nuevos (pd.DataFrame): Events appended between both versions
+
+    Returns:
+        bool: True if a summary was advanced, False if none was cached for old_version
+    """
+    with _resumenes_lock:
+        resumen = _resumenes.pop(old_version, None)
+        if resumen is None:
+            return False
+        resumen.append(nuevos)
+        _resumenes[new_version] = resumen
+        return True
+
+
+# Question answering ------------------------------------------------------------------------------
+
+ANSWER_TEMPLATE = """Responde en español, de forma breve y directa, la pregunta usando solo las tablas.
+Columnas: eventos (número de interrupciones), duracion_h (horas totales), SAIDI y SAIFI (sumas),
+usuarios (usuarios afectados), SAIDI_promedio y SAIFI_promedio (promedio por interrupción),
+duracion_media_h (horas por interrupción).
+Filtros aplicados: {filtros}
+
+Pregunta: {query}
+{tablas}
+
+Respuesta:"""
+
+
+def answer_streaming(query: str, llm_chat, resumen: StreamingSummary, filtros: Dict[str, object],
+                     max_rows: int = 40) -> str:
+    """
+    Answers an event question from the streamed summary.
+
+    Args:
+        query (str): User question
+        llm_chat: Chat model (see utils.create_llm_chat_model)
+        resumen (StreamingSummary): Summary of the event history
+        filtros (Dict[str, object]): Year, department, municipality and equipment type filters
+        max_rows (int): Maximum rows per table shown to the model
+
+    Returns:
+        str: Model answer
+    """
+    agrupacion = infer_grouping(query, filtros)
+    por = [c for c in agrupacion["por"] if c in DIMENSIONES]
+    if re.search(r"\bcausas?\b", normalize_query(query)) and "causa" not in por:
+        por.append("causa")
+    tablas = {"Totales": resumen.totals(frecuencia=agrupacion["frecuencia"], **filtros)}
+    for col in por:
+        tablas[f"Por {col}"] = resumen.totals(por=[col], **filtros).sort_values("eventos", ascending=False)
+    texto = "\n".join(f"{nombre}:\n{tabla.head(max_rows).to_string(index=False)}\n" for nombre, tabla in tablas.items())
+    with span("generate"):
+        respuesta = llm_chat.invoke(ANSWER_TEMPLATE.format(filtros=filtros or "ninguno", query=query, tablas=texto))
+    return getattr(respuesta, "content", respuesta)
+
+
+# Benchmark ---------------------------------------------------------------------------------------
+
+def synthetic_chunks(rows: int, chunk_rows: int, seed: int = 0) -> Iterator[pd.DataFrame]:
+    """
+    Generates a synthetic event history chunk by chunk (never held whole in memory).
+
+    Args:
+        rows (int): Total events
+        chunk_rows (int): Events per chunk
+        seed (int): Random seed
+
+    Yields:
+        pd.DataFrame: Chunks with the columns in COLUMNAS
+    """
+    rng = np.random.default_rng(seed)
+    municipios = np.array([f"MUN_{i}" for i in range(120)])
+    departamentos = np.array(["Caldas", "Risaralda", "Quindio", "Tolima"])
+    tipos = np.array(["Transformador", "Interruptor", "Tramo de red"])
+    causas = np.array(["Descarga atmosferica", "Vegetacion", "Animales", "Falla equipo", "Desconocida"])
+    inicio = np.datetime64("2010-01-01", "D")
+    for desde in range(0, rows, chunk_rows):
+        n = min(chunk_rows, rows - desde)
+        mun = rng.integers(0, len(municipios), n)
+        yield pd.DataFrame({
+            "FECHA": inicio + rng.integers(0, 15 * 365, n).astype("timedelta64[D]"),
+            "DEP": pd.Categorical.from_codes(mun % len(departamentos), departamentos),
+            "MUN": pd.Categorical.from_codes(mun, municipios),
+            "tipo_equi_ope": pd.Categorical.from_codes(rng.integers(0, len(tipos), n), tipos),
+            "causa": pd.Categorical.from_codes(rng.integers(0, len(causas), n), causas),
+            "duracion_h": rng.exponential(2.0, n),
+            "SAIDI": rng.random(n) * 0.01,
+            "SAIFI": rng.random(n) * 0.005,
+            "cnt_usus": rng.integers(1, 500, n),
+        })
+
+
+def _pico_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark(rows: int, memory_mb: int = STREAMING_MEMORY_MB, csv: Optional[str] = None,
+              chunk_rows: Optional[int] = None) -> Dict[str, float]:
+    """
+    Throughput of the streaming aggregation on a synthetic history.
+
+    Args:
+        rows (int): Synthetic events
+        memory_mb (int): Memory ceiling in MiB
+        csv (Optional[str]): If given, the history is written to this CSV (unless
+            it exists) and parsed from it; otherwise chunks are generated in memory
+        chunk_rows (Optional[int]): Fixed chunk size (estimated from memory_mb if None)
+
+    Returns:
+        Dict[str, float]: rows, chunks, seconds, rows_per_s, peak_working_set_mb, peak_rss_mb
+    """
+    agregador = StreamingAggregator(memory_mb, chunk_rows)
+    generados = chunk_rows or agregador._filas_por_bloque(next(synthetic_chunks(10000, 10000)))
+    if csv is None:
+        resumen = agregador.aggregate(synthetic_chunks(rows, generados))
+    else:
+        if not os.path.exists(csv):
+            for i, chunk in enumerate(synthetic_chunks(rows, generados)):
+                chunk.to_csv(csv, mode="a", header=i == 0, index=False, date_format="%Y-%m-%d")
+        resumen = agregador.aggregate_csv(csv)
+    return {
+        "rows": resumen.rows,
+        "chunks": resumen.chunks,
+        "seconds": round(resumen.seconds, 2),
+        "rows_per_s": round(resumen.rows_per_second),
+        "peak_working_set_mb": round(resumen.peak_bytes / 2**20, 1),
+        "peak_rss_mb": _pico_rss_mb(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Agregación por bloques de la historia de eventos")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_resumen = sub.add_parser("resumen", help="Agregar Tabla_General.csv por bloques")
+    p_resumen.add_argument("--path", default="structured_data/Tabla_General.csv")
+    p_resumen.add_argument("--memory-mb", type=int, default=STREAMING_MEMORY_MB)
+    p_resumen.add_argument("--top", type=int, default=5, help="Top-k de municipios y causas")
+    p_bench = sub.add_parser("benchmark", help="Rendimiento sobre una historia sintética")
+    p_bench.add_argument("--rows", type=int, default=100_000_000)
+    p_bench.add_argument("--memory-mb", type=int, default=STREAMING_MEMORY_MB)
+    p_bench.add_argument("--chunk-rows", type=int, default=None)
+    p_bench.add_argument("--csv", default=None, help="Escribir y leer la historia sintética desde este CSV")
+    args = parser.parse_args()
+
+    if args.comando == "benchmark":
+        for clave, valor in benchmark(args.rows, args.memory_mb, args.csv, args.chunk_rows).items():
+            print(f"{clave}: {valor}")
+        return
+
+    resumen = StreamingAggregator(args.memory_mb).aggregate_csv(args.path)
+    print(f"Eventos: {resumen.rows} ({resumen.rejected} sin fecha) en {resumen.chunks} bloques, "
+          f"{resumen.seconds:.1f} s, {resumen.rows_per_second:,.0f} filas/s, "
+          f"pico {resumen.peak_bytes / 2**20:.0f} MiB")
+    print(resumen.totals(frecuencia="anio").to_string(index=False))
+    for col in ["MUN", "causa"]:
+        print(f"\nTop {args.top} {col}:")
+        print(resumen.top_k(col, args.top).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,46 @@
 # PACKAGES:
 from langchain.tools import tool
-import json
 import os
 import pickle
+import re
 from langchain.prompts import PromptTemplate
 from langchain.memory import ConversationBufferMemory
 from langchain.chains.question_answering import load_qa_chain
-from langchain_community.chat_models import ChatOllama
-from langchain_ollama import OllamaLLM
-from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.chat_models import ChatOpenAI
 from langchain.agents.agent_types import AgentType
 from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
-from langchain_openai import OpenAI
 import pandas as pd
-from langchain_google_genai import ChatGoogleGenerativeAI
 import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
-import time
-
-@tool
-def capitulo_1(query: str, model:str, chat_id:str) -> str:
-    """
-    Usar cuando se necesite responder preguntas acerca del capítulo 1 del RETIE.
-    El capítulo 1 del RETIE establece las medidas para garantizar la seguridad de las personas, 
-    la vida animal y vegetal, y la preservación del medio ambiente en relación con los riesgos de origen 
-    eléctrico. Además, se asegura de que los sistemas, instalaciones, equipos y productos utilizados en la
-    generación, transmisión, transformación, distribución y uso final de la energía eléctrica cumplan 
-    con objetivos legítimos como la protección de la vida y la salud humana, animal y vegetal, la 
-    prevención de prácticas que puedan inducir a error al usuario, entre otros. 
-    También se establecen responsabilidades para diseñadores, constructores, operadores, propietarios, 
-    fabricantes, importadores y distribuidores de materiales eléctricos, así como entidades encargadas 
-    de la evaluación de la conformidad.
-    """
-
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
-        
-    # Abrir el archivo en modo de escritura
-    with open(f"number_iteration.pkl", "w") as archivo:
-        # Escribir el número entero en el archivo
-        number_iteration=number_iteration+1
-        archivo.write(str(number_iteration))
-        
-    #PROMP TEMPLATE:
-    template = """ Se te proporcionará una serie de textos que contienen instrucciones sobre cómo 
-                resolver preguntas acerca de normativas en redes eléctricas de nivel de tensión 2. Según estos textos,
-                responde a la pregunta de la manera más completa posible.
+import threading
+from typing import Dict, List, Optional
+from utils import create_llm_chat_model, get_vectorstore
+from chart_templates import COLUMNAS_EVENTOS, get_aggregates, render_chart, select_chart
+from compact_events import get_compact_events
+from event_store import default_event_store, filtrar
+from model_factory import default_model_factory
+from spatial_index import get_spatial_index, infer_zone
+from interval_index import answer_intervals, get_interval_index, is_interval_question
+from sql_engine import EVENTOS_ENGINE, answer_with_sql, get_sql_engine
+from reliability import answer_reliability, get_reliability_engine, is_reliability_question
+from streaming import answer_streaming, get_streaming_summary, requires_streaming
+from plot_store import default_plot_store
+from router import resolve_model
+from tracing import set_attribute, span
+
+# Directorio con las colecciones Chroma de cada documento normativo
+EMBEDDINGS_DIR = os.getenv("CRITAIR_EMBEDDINGS_DIR", "C:/Users/User/Documents/Dashboard_Criticidad/Dashboard_CHEC/embeddings_by_procces")
+
+# Tabla de eventos e interrupciones
+EVENTOS_PATH = 'structured_data/Tabla_General.csv'
+
+_iteracion_lock = threading.Lock()
+
+# Respuesta devuelta cuando el agente de eventos no logra responder
+RESPUESTA_NO_DISPONIBLE = "De acuerdo a mi conocimiento actual, no tengo la capacidad para responder a tu pregunta, por favor reformula tu pregunta."
+
+#PROMP TEMPLATE (común a todas las herramientas de normativa):
+RAG_TEMPLATE = """ Se te proporcionará una serie de textos que contienen instrucciones sobre cómo 
+                resolver preguntas acerca de normativas en redes eléctricas de nivel de tensión 2. 
+                Según estos textos, responde a la pregunta de la manera más completa posible.
 
                 Dado el siguiente contexto y teniendo en cuenta el historial de la conversación, 
                 responde a las preguntas hechas por el usuario:
@@ -63,446 +51,401 @@ def capitulo_1(query: str, model:str, chat_id:str) -> str:
                 Human: {human_input}
                 Chatbot (RESPUESTA FORMAL):
                 """ 
-    prompt = PromptTemplate(
-        input_variables=["chat_history", "human_input", "context"], template=template
-    )
-
-    memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
-
-    if model=="gpt":
-        llm_chat=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    elif model=="llama1":
-        llm_chat=ChatOllama(model="llama3.1",temperature=0)
-    elif model=="llama2":
-        llm_chat=ChatOllama(model="llama3.2:1b",temperature=0)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    else:
-        try:
-            llm_chat=ChatOllama(model=model,temperature=0)
-        except:
-            llm_chat=ChatOpenAI(temperature=0, model=model)
 
-    
-    chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
-    
-    # Load the chat history of the conversation for every particular agent
-    path_memory=f"memories/{chat_id}.pkl"
-    if os.path.exists(path_memory):
-        with open(path_memory, 'rb') as f:
-            memory = pickle.load(f) #memory of the conversation
-        
-        chain.memory=memory
 
-    embeddings = OpenAIEmbeddings(model="text-embedding-ada-002") #word2vec model of openAI
-    # load from disk
-    vectorstore = Chroma(persist_directory=f"C:/Users/User/Documents/Dashboard_Criticidad/Dashboard_CHEC/embeddings_by_procces/capitulo_1",embedding_function=embeddings)
+def _incrementar_iteracion(incremento: int) -> int:
+    """
+    Incrementa el contador global de iteraciones guardado en number_iteration.pkl.
 
-    docs=vectorstore.similarity_search(query,k=5) #Retriever
+    La lectura y escritura se hacen bajo un lock y el archivo se reemplaza de
+    forma atómica, para que sesiones concurrentes no lean un archivo truncado.
 
-    print(docs)
+    Args:
+        incremento (int): Valor a sumar al contador
 
-    response=chain({"input_documents": docs, "human_input": query, "chat_history":memory}, return_only_outputs=False)['output_text'] #AI answer
+    Returns:
+        int: Nuevo valor del contador
+    """
+    with span("iteration_counter"), _iteracion_lock:
+        # Abrir el archivo en modo de lectura
+        with open(f"number_iteration.pkl", "r") as archivo:
+            # Convertir el contenido a un número entero
+            number_iteration = int(archivo.read())
+
+        # Escribir en un archivo temporal y reemplazar el original
+        number_iteration = number_iteration + incremento
+        ruta_temporal = f"number_iteration.pkl.{os.getpid()}.tmp"
+        with open(ruta_temporal, "w") as archivo:
+            archivo.write(str(number_iteration))
+        os.replace(ruta_temporal, "number_iteration.pkl")
 
-    #Save the chat history (memory) for a new iteration of the conversation for the general agent:
-    with open(path_memory, 'wb') as f:
-        pickle.dump(chain.memory, f)
+    return number_iteration
 
-    
-    # Abre el archivo en modo binario de escritura y guarda la cadena
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
 
-    return response
+def _guardar_respuesta(response: str) -> None:
+    """Guarda la última respuesta en answer.pkl."""
+    with span("answer_save"):
+        with open("answer.pkl", 'wb') as archivo:
+            pickle.dump(response, archivo)
 
 
-@tool
-def capitulo_2(query: str, model:str, chat_id:str) -> str:
-    """
-    Usar cuando se necesite responder preguntas acerca del capítulo 2 del RETIE.
-    El capítulo 2 del RETIE establece los requisitos y ensayos mínimos aplicables a los equipos y 
-    productos utilizados en instalaciones eléctricas, con el fin de promover su adecuada utilización 
-    fijando los parámetros mínimos de calidad, desempeño y seguridad. 
-    Este capítulo también garantiza la protección de la vida y la salud humana, 
-    la protección del medio ambiente, la prevención de prácticas que puedan inducir a error al usuario,
-    y el uso racional y eficiente de la energía. 
-    Además, se basa en objetivos específicos como unificar los requisitos de seguridad para los
-    productos eléctricos de mayor utilización, prevenir actos que induzcan a error a los usuarios, y 
-    exigir requisitos para contribuir al uso racional y eficiente de la energía. También se establecen 
-    normas para la certificación de productos, marcaciones, rotulados, y responsabilidades de los 
-    productores y comercializadores.
+def _consultar_coleccion(coleccion: str, query: str, model: str, chat_id: str) -> str:
     """
+    Responde una pregunta con RAG sobre una colección Chroma de documentos normativos.
 
+    Args:
+        coleccion (str): Nombre de la colección dentro de EMBEDDINGS_DIR
+        query (str): Pregunta del usuario
+        model (str): Nombre del modelo de lenguaje
+        chat_id (str): Identificador de la conversación
 
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
-        
-    # Abrir el archivo en modo de escritura
-    with open(f"number_iteration.pkl", "w") as archivo:
-        # Escribir el número entero en el archivo
-        number_iteration=number_iteration+1
-        archivo.write(str(number_iteration))
-
-    #PROMP TEMPLATE:
-    template = """ Se te proporcionará una serie de textos que contienen instrucciones sobre cómo 
-                resolver preguntas acerca de normativas en redes eléctricas de nivel de tensión 2. Según estos textos,
-                responde a la pregunta de la manera más completa posible.
+    Returns:
+        str: Respuesta generada por el modelo
+    """
+    # 'auto': el enrutador elige el modelo de cada llamada
+    model=resolve_model(model, "unstructured")
+    with span("tool", tool=coleccion, model=model, chat_id=chat_id):
+        _incrementar_iteracion(1)
 
-                Dado el siguiente contexto y teniendo en cuenta el historial de la conversación, 
-                responde a las preguntas hechas por el usuario:
+        with span("prompt_build"):
+            prompt = PromptTemplate(
+                input_variables=["chat_history", "human_input", "context"], template=RAG_TEMPLATE
+            )
+            memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
 
-                {context}
+        with span("llm_init"):
+            llm_chat = create_llm_chat_model(model)
+            chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
 
-                {chat_history}
-                Human: {human_input}
-                Chatbot (RESPUESTA FORMAL):
-                """ 
-    prompt = PromptTemplate(
-        input_variables=["chat_history", "human_input", "context"], template=template
-    )
-
-    memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
-
-    if model=="gpt":
-        llm_chat=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    elif model=="llama1":
-        llm_chat=ChatOllama(model="llama3.1",temperature=0)
-    elif model=="llama2":
-        llm_chat=ChatOllama(model="llama3.2:1b",temperature=0)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    else:
-        try:
-            llm_chat=ChatOllama(model=model,temperature=0)
-        except:
-            llm_chat=ChatOpenAI(temperature=0, model=model)
+        # Load the chat history of the conversation for every particular agent
+        path_memory=f"memories/{chat_id}.pkl"
+        with span("memory_load"):
+            if os.path.exists(path_memory):
+                with open(path_memory, 'rb') as f:
+                    memory = pickle.load(f) #memory of the conversation
 
-    
-    chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
-    
-    # Load the chat history of the conversation for every particular agent
-    path_memory=f"memories/{chat_id}.pkl"
-    if os.path.exists(path_memory):
-        with open(path_memory, 'rb') as f:
-            memory = pickle.load(f) #memory of the conversation
-        
-        chain.memory=memory
+                chain.memory=memory
+
+        with span("vectorstore_open"):
+            # load from disk (once per process, shared between sessions)
+            vectorstore = get_vectorstore(f"{EMBEDDINGS_DIR}/{coleccion}", model)
+            embeddings = vectorstore.embeddings #word2vec model of openAI (local embeddings for mock models)
 
-    embeddings = OpenAIEmbeddings(model="text-embedding-ada-002") #word2vec model of openAI
-    # load from disk
-    vectorstore = Chroma(persist_directory=f"C:/Users/User/Documents/Dashboard_Criticidad/Dashboard_CHEC/embeddings_by_procces/capitulo_2",embedding_function=embeddings)
+        with span("embed_query"):
+            query_embedding = embeddings.embed_query(query)
 
-    docs=vectorstore.similarity_search(query,k=5) #Retriever
+        with span("retrieve", k=5):
+            docs=vectorstore.similarity_search_by_vector(query_embedding,k=5) #Retriever
 
-    print(docs)
+        print(docs)
 
-    response=chain({"input_documents": docs, "human_input": query, "chat_history":memory}, return_only_outputs=False)['output_text'] #AI answer
+        with span("generate"):
+            response=chain({"input_documents": docs, "human_input": query, "chat_history":memory}, return_only_outputs=False)['output_text'] #AI answer
 
-    #Save the chat history (memory) for a new iteration of the conversation for the general agent:
-    with open(path_memory, 'wb') as f:
-        pickle.dump(chain.memory, f)
+        #Save the chat history (memory) for a new iteration of the conversation for the general agent:
+        with span("memory_save"):
+            with open(path_memory, 'wb') as f:
+                pickle.dump(chain.memory, f)
 
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
+        _guardar_respuesta(response)
 
     return response
 
 
-@tool
-def capitulo_3(query: str, model:str, chat_id:str) -> str:
+def _version_csv() -> str:
     """
-    Usar cuando se necesite responder preguntas acerca del capítulo 3 del RETIE.
-    El Capítulo 3 del RETIE se refiere a los requisitos generales de las instalaciones eléctricas. 
-    En este capítulo se establecen normativas y criterios para el diseño, operación y mantenimiento de
-    las instalaciones eléctricas, así como para la protección contra riesgos eléctricos. 
-    Se abordan temas como las competencias y responsabilidades de las personas que intervienen 
-    en las instalaciones eléctricas, el diseño de las instalaciones, los espacios para montaje de equipos,
-    el código de colores para conductores, 
-    entre otros aspectos relevantes para garantizar la seguridad y eficiencia de las redes eléctricas 
-    de nivel de tensión 2.
+    Versión de Tabla_General.csv.
+
+    Returns:
+        str: Tamaño y fecha de modificación del archivo
     """
+    try:
+        estado = os.stat(EVENTOS_PATH)
+    except FileNotFoundError:
+        return "sin_datos"
+    return f"{estado.st_size}-{estado.st_mtime_ns}"
 
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
-        
-    # Abrir el archivo en modo de escritura
-    with open(f"number_iteration.pkl", "w") as archivo:
-        # Escribir el número entero en el archivo
-        number_iteration=number_iteration+1
-        archivo.write(str(number_iteration))
 
+# Decisión de streaming por versión de Tabla_General.csv (requiere leer una muestra)
+_streaming_por_version: Dict[str, bool] = {}
 
 
-    #PROMP TEMPLATE:
-    template = """ Se te proporcionará una serie de textos que contienen instrucciones sobre cómo 
-                resolver preguntas acerca de normativas en redes eléctricas de nivel de tensión 2. Según estos textos,
-                responde a la pregunta de la manera más completa posible.
+def _requiere_streaming() -> bool:
+    """
+    Indica si Tabla_General.csv debe agregarse por bloques, calculado una vez por versión.
 
-                Dado el siguiente contexto y teniendo en cuenta el historial de la conversación, 
-                responde a las preguntas hechas por el usuario:
+    Returns:
+        bool: Resultado de streaming.requires_streaming para la versión actual
+    """
+    version = _version_csv()
+    decision = _streaming_por_version.get(version)
+    if decision is None:
+        decision = requires_streaming(EVENTOS_PATH)
+        _streaming_por_version.clear()
+        _streaming_por_version[version] = decision
+    return decision
 
-                {context}
 
-                {chat_history}
-                Human: {human_input}
-                Chatbot (RESPUESTA FORMAL):
-                """ 
-    prompt = PromptTemplate(
-        input_variables=["chat_history", "human_input", "context"], template=template
-    )
-
-    memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
-    print("MODEL")
-    print(model)
-    if model=="gpt":
-        llm_chat=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    elif model=="llama1":
-        llm_chat=ChatOllama(model="llama3.1",temperature=0)
-    elif model=="llama2":
-        llm_chat=ChatOllama(model="llama3.2:1b",temperature=0)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    else:
-        try:
-            llm_chat=ChatOllama(model=model,temperature=0)
-        except:
-            llm_chat=ChatOpenAI(temperature=0, model=model)
+def _version_eventos() -> str:
+    """
+    Versión de la tabla de eventos, usada para invalidar resultados en caché.
 
-    
-    chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
-    
-    # Load the chat history of the conversation for every particular agent
-    path_memory=f"memories/{chat_id}.pkl"
-    if os.path.exists(path_memory):
-        with open(path_memory, 'rb') as f:
-            memory = pickle.load(f) #memory of the conversation
-        
-        chain.memory=memory
+    Returns:
+        str: Versión de Tabla_General.csv, con el número de lotes ingeridos
+        (ver ingestion.py) si el dataset particionado está sincronizado con él
+    """
+    return default_event_store.current_version(_version_csv())
 
-    embeddings = OpenAIEmbeddings(model="text-embedding-ada-002") #word2vec model of openAI
-    # load from disk
-    vectorstore = Chroma(persist_directory=f"C:/Users/User/Documents/Dashboard_Criticidad/Dashboard_CHEC/embeddings_by_procces/capitulo_3",embedding_function=embeddings)
 
-    docs=vectorstore.similarity_search(query,k=5) #Retriever
+def _cargar_eventos() -> pd.DataFrame:
+    """
+    Carga y tipifica la tabla de eventos de structured_data/Tabla_General.csv.
 
-    print(docs)
+    Returns:
+        pd.DataFrame: Eventos con columnas numéricas, categóricas y de fecha tipificadas
+    """
+    with span("events_load"):
+        eventos_trafos = pd.read_csv(EVENTOS_PATH)
+        NUMERIC_COLUMNS = eventos_trafos.select_dtypes(include=['number']).columns.tolist()
+        CATEGORICAL_COLUMNS= eventos_trafos.select_dtypes(include=['object', 'category']).columns.tolist()
 
-    response=chain({"input_documents": docs, "human_input": query, "chat_history":memory}, return_only_outputs=False)['output_text'] #AI answer
+        eventos_trafos[NUMERIC_COLUMNS] = eventos_trafos[NUMERIC_COLUMNS].apply(pd.to_numeric, errors='coerce')
 
-    #Save the chat history (memory) for a new iteration of the conversation for the general agent:
-    with open(path_memory, 'wb') as f:
-        pickle.dump(chain.memory, f)
+        # 4. Convertir columnas categóricas al tipo 'category'
+        # Esto optimiza el uso de memoria y puede mejorar el rendimiento en ciertas operaciones
+        eventos_trafos[CATEGORICAL_COLUMNS] = eventos_trafos[CATEGORICAL_COLUMNS].astype('category')
 
-    
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
+        # Supongamos que tu DataFrame se llama df y la columna de fecha se llama 'fecha_sin_hora'
+        eventos_trafos['FECHA'] = pd.to_datetime(eventos_trafos['FECHA'].astype(str), format='%Y-%m-%d')
+        # Supongamos que la columna de fecha y hora se llama 'fecha_con_hora'
+        eventos_trafos['inicio'] = pd.to_datetime(eventos_trafos['inicio'].astype(str), format='%Y-%m-%d %H:%M:%S')
+        eventos_trafos['fin'] = pd.to_datetime(eventos_trafos['fin'].astype(str), format='%Y-%m-%d %H:%M:%S')
 
-    return response
+    return eventos_trafos
 
-@tool
-def capitulo_4(query: str, model:str, chat_id:str) -> str:
+
+def _consultar_eventos(query: Optional[str] = None, columnas: Optional[List[str]] = None) -> pd.DataFrame:
     """
-    Usar cuando se necesite responder preguntas acerca del capítulo 4 del RETIE.
-    El capítulo 4 del RETIE aborda la Evaluación de la Conformidad en el Reglamento Técnico de 
-    Instalaciones Eléctricas. Define los requisitos mínimos para los Certificados de Producto, 
-    tales como la identificación clara de que es un certificado, el nombre del organismo certificador, 
-    el esquema de certificación empleado, el número o referencia del certificado, así como 
-    la identificación del productor, fabricante y del producto. También describe el alcance de la 
-    certificación. Además, establece que el Ministerio de Minas y Energía de Colombia es la entidad 
-    responsable de crear, revisar, actualizar e interpretar el RETIE, y detalla las sanciones para 
-    quienes incumplan los requisitos del reglamento, incluyendo empresas de servicios públicos, 
-    responsables de instalaciones eléctricas, usuarios, productores y laboratorios de pruebas.
+    Lee de la tabla de eventos solo las particiones y columnas necesarias.
+
+    El dataset particionado (por año y departamento) se reconstruye cuando
+    cambia Tabla_General.csv; los filtros de año, departamento, municipio y
+    tipo de equipo se infieren de la pregunta. Si la pregunta trae una
+    coordenada con un radio o un POLYGON((...)), la zona se resuelve con el
+    índice espacial. Sin filtros se devuelve la tabla compacta de
+    compact_events.py (memory map de solo lectura compartido por los
+    workers; quien la modifique debe copiarla). Sin pyarrow se carga la
+    tabla completa.
+
+    Args:
+        query (Optional[str]): Pregunta del usuario (None para no filtrar)
+        columnas (Optional[List[str]]): Columnas a leer (todas si es None)
+
+    Returns:
+        pd.DataFrame: Eventos de la porción consultada
     """
+    try:
+        default_event_store.ensure(_version_csv(), _cargar_eventos)
+    except ImportError:
+        eventos_trafos = _cargar_eventos()
+        return eventos_trafos if columnas is None else eventos_trafos[columnas]
+    version = _version_eventos()
 
+    filtros = default_event_store.infer_filters(query) if query else {}
 
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
-        
-    # Abrir el archivo en modo de escritura
-    with open(f"number_iteration.pkl", "w") as archivo:
-        # Escribir el número entero en el archivo
-        number_iteration=number_iteration+1
-        archivo.write(str(number_iteration))
+    # Coordenadas o polígono en la pregunta: índice espacial y luego los demás filtros
+    indice = get_spatial_index(version, _consultar_eventos) if query and re.search(r"\d\.\d", query) else None
+    zona = infer_zone(query, indice.index.bbox) if indice is not None else None
+    if zona is not None:
+        eventos_trafos = filtrar(indice.consultar(zona), **filtros)
+        return eventos_trafos if columnas is None else eventos_trafos[columnas]
 
+    # Tabla completa: vista compacta mapeada en memoria, compartida entre procesos
+    if not filtros:
+        with span("events_load", compact=True):
+            return get_compact_events(version, default_event_store.query).to_frame(columnas)
 
-    #PROMP TEMPLATE:
-    template = """ Se te proporcionará una serie de textos que contienen instrucciones sobre cómo 
-                resolver preguntas acerca de normativas en redes eléctricas de nivel de tensión 2. Según estos textos,
-                responde a la pregunta de la manera más completa posible.
+    with span("events_load", **{k: str(v) for k, v in filtros.items()}):
+        return default_event_store.query(columns=columnas, **filtros)
 
-                Dado el siguiente contexto y teniendo en cuenta el historial de la conversación, 
-                responde a las preguntas hechas por el usuario:
 
-                {context}
+def _crear_agente_eventos(eventos_trafos: pd.DataFrame):
+    """
+    Crea el agente de pandas que responde preguntas sobre la tabla de eventos.
 
-                {chat_history}
-                Human: {human_input}
-                Chatbot (RESPUESTA FORMAL):
-                """ 
-    prompt = PromptTemplate(
-        input_variables=["chat_history", "human_input", "context"], template=template
-    )
-
-    memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
-
-    if model=="gpt":
-        llm_chat=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    elif model=="llama1":
-        llm_chat=ChatOllama(model="llama3.1",temperature=0)
-    elif model=="llama2":
-        llm_chat=ChatOllama(model="llama3.2:1b",temperature=0)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    else:
-        try:
-            llm_chat=ChatOllama(model=model,temperature=0)
-        except:
-            llm_chat=ChatOpenAI(temperature=0, model=model)
+    El agente recibe una copia escribible: la tabla sin filtros es un memory
+    map de solo lectura compartido con los motores (SQL, confiabilidad,
+    índices), y el código que genera el agente puede modificar el DataFrame.
 
-    
-    chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
-    
-    # Load the chat history of the conversation for every particular agent
-    path_memory=f"memories/{chat_id}.pkl"
-    if os.path.exists(path_memory):
-        with open(path_memory, 'rb') as f:
-            memory = pickle.load(f) #memory of the conversation
-        
-        chain.memory=memory
+    Args:
+        eventos_trafos (pd.DataFrame): Tabla de eventos
 
-    embeddings = OpenAIEmbeddings(model="text-embedding-ada-002") #word2vec model of openAI
-    # load from disk
-    vectorstore = Chroma(persist_directory=f"C:/Users/User/Documents/Dashboard_Criticidad/Dashboard_CHEC/embeddings_by_procces/capitulo_4",embedding_function=embeddings)
+    Returns:
+        AgentExecutor: Agente con funciones de OpenAI
+    """
+    with span("agent_build"):
+        return create_pandas_dataframe_agent(
+        default_model_factory.client("gpt"),  # Con los timeouts de OpenAI (y grabación/replay); el agente necesita funciones
+        eventos_trafos.copy(),
+        verbose=True,
+        agent_type=AgentType.OPENAI_FUNCTIONS,
+        allow_dangerous_code=True,
+        include_df_in_prompt=True,  # Incluye las primeras filas del DataFrame en el prompt
+        number_of_head_rows=5)
 
-    docs=vectorstore.similarity_search(query,k=5) #Retriever
 
-    print(docs)
+def _respuesta_directa(query: str, model: str) -> Optional[str]:
+    """
+    Responde una pregunta de eventos sin el agente de pandas, si alguna ruta aplica.
 
-    response=chain({"input_documents": docs, "human_input": query, "chat_history":memory}, return_only_outputs=False)['output_text'] #AI answer
+    En orden: resumen por bloques (historia más grande que la memoria),
+    motor de confiabilidad (SAIDI/SAIFI), índice de intervalos (eventos
+    superpuestos o simultáneos) y modo SQL. Una ruta que falla se registra
+    (mensaje y atributo fallback_error.<ruta> del span) y se pasa a la
+    siguiente. Compartida por eventos_transformadores y su versión async.
 
-    #Save the chat history (memory) for a new iteration of the conversation for the general agent:
-    with open(path_memory, 'wb') as f:
-        pickle.dump(chain.memory, f)
+    Args:
+        query (str): Pregunta del usuario
+        model (str): Modelo ya resuelto
 
+    Returns:
+        Optional[str]: Respuesta, o None si se debe usar el agente de pandas
+    """
+    # Historia más grande que la memoria: agregación por bloques de Tabla_General.csv
+    if _requiere_streaming():
+        resumen=get_streaming_summary(_version_eventos(), EVENTOS_PATH)
+        filtros=default_event_store.infer_filters(
+            query, valores={col: resumen.valores(col) for col in ["DEP", "MUN", "tipo_equi_ope"]})
+        return answer_streaming(query, create_llm_chat_model(model), resumen, filtros)
+
+    rutas=[]
+    # SAIDI / SAIFI: indicadores calculados por el motor de confiabilidad
+    if is_reliability_question(query) and not re.search(r"\d\.\d", query):
+        rutas.append(("reliability", "Error calculando SAIDI/SAIFI", lambda: answer_reliability(
+            query, create_llm_chat_model(model), get_reliability_engine(_version_eventos(), _consultar_eventos),
+            default_event_store.infer_filters(query))))
+    # Interrupciones superpuestas con una ventana de tiempo o simultáneas: índice de intervalos
+    if is_interval_question(query):
+        rutas.append(("intervals", "Error consultando el índice de intervalos", lambda: answer_intervals(
+            query, create_llm_chat_model(model), get_interval_index(_version_eventos(), _consultar_eventos),
+            default_event_store.infer_filters(query))))
+    # Modo SQL: el modelo escribe una consulta que DuckDB ejecuta sobre la tabla
+    if EVENTOS_ENGINE == "sql":
+        rutas.append(("sql", "Consulta SQL no válida", lambda: answer_with_sql(
+            query, create_llm_chat_model(model), get_sql_engine(_version_eventos(), _consultar_eventos))["response"]))
+
+    for ruta, mensaje, responder in rutas:
+        try:
+            return responder()
+        except Exception as e:
+            print(f"{mensaje}, se usa la siguiente ruta: {e}")
+            set_attribute(f"fallback_error.{ruta}", repr(e))
+    return None
 
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
 
-    return response
+def _instrucciones_grafico(query: str, path_plot: str) -> str:
+    """
+    Agrega a la pregunta las instrucciones de estilo y la ruta donde guardar el gráfico.
+
+    Args:
+        query (str): Pregunta del usuario
+        path_plot (str): Ruta relativa de la imagen
+
+    Returns:
+        str: Consulta para el agente
+    """
+    return f"""{query}. Construye el gráfico de la forma más estética posible para mostrar a un usuario. 
+    Puedes utilizar los siguientes colores: verde y gris en diferentes tonalidades (si es necesario, utiliza más colores).
+    Además, los títulos y ejes de los gráficos deben estar en español.
+    Guarda la imagen en la ruta relativa {path_plot}.
+    No ejecutes el comando plt.show().
+    Siempre ejecuta el comando plt.tight_layout().
+    Siempre poner los ejes del gráfico con un fontsize = 14.
+    Siempre rotar las etiquetas del eje x a 90 grados.
+    """
 
 
 @tool
-def resolucion_40117(query: str, model:str, chat_id:str) -> str:
+def capitulo_1(query: str, model:str, chat_id:str) -> str:
     """
-    Usar cuando se necesite responder preguntas acerca de la resolución resolucion 40117 del 02 de Abril de 2024.
+    Usar cuando se necesite responder preguntas acerca del capítulo 1 del RETIE.
+    El capítulo 1 del RETIE establece las medidas para garantizar la seguridad de las personas, 
+    la vida animal y vegetal, y la preservación del medio ambiente en relación con los riesgos de origen 
+    eléctrico. Además, se asegura de que los sistemas, instalaciones, equipos y productos utilizados en la
+    generación, transmisión, transformación, distribución y uso final de la energía eléctrica cumplan 
+    con objetivos legítimos como la protección de la vida y la salud humana, animal y vegetal, la 
+    prevención de prácticas que puedan inducir a error al usuario, entre otros. 
+    También se establecen responsabilidades para diseñadores, constructores, operadores, propietarios, 
+    fabricantes, importadores y distribuidores de materiales eléctricos, así como entidades encargadas 
+    de la evaluación de la conformidad.
     """
 
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
-        
-    # Abrir el archivo en modo de escritura
-    with open(f"number_iteration.pkl", "w") as archivo:
-        # Escribir el número entero en el archivo
-        number_iteration=number_iteration+1
-        archivo.write(str(number_iteration))
-
-
-    #PROMP TEMPLATE:
-    template = """ Se te proporcionará una serie de textos que contienen instrucciones sobre cómo 
-                resolver preguntas acerca de normativas en redes eléctricas de nivel de tensión 2. Según estos textos,
-                responde a la pregunta de la manera más completa posible.
+    return _consultar_coleccion("capitulo_1", query, model, chat_id)
 
-                Dado el siguiente contexto y teniendo en cuenta el historial de la conversación, 
-                responde a las preguntas hechas por el usuario:
 
-                {context}
+@tool
+def capitulo_2(query: str, model:str, chat_id:str) -> str:
+    """
+    Usar cuando se necesite responder preguntas acerca del capítulo 2 del RETIE.
+    El capítulo 2 del RETIE establece los requisitos y ensayos mínimos aplicables a los equipos y 
+    productos utilizados en instalaciones eléctricas, con el fin de promover su adecuada utilización 
+    fijando los parámetros mínimos de calidad, desempeño y seguridad. 
+    Este capítulo también garantiza la protección de la vida y la salud humana, 
+    la protección del medio ambiente, la prevención de prácticas que puedan inducir a error al usuario,
+    y el uso racional y eficiente de la energía. 
+    Además, se basa en objetivos específicos como unificar los requisitos de seguridad para los
+    productos eléctricos de mayor utilización, prevenir actos que induzcan a error a los usuarios, y 
+    exigir requisitos para contribuir al uso racional y eficiente de la energía. También se establecen 
+    normas para la certificación de productos, marcaciones, rotulados, y responsabilidades de los 
+    productores y comercializadores.
+    """
 
-                {chat_history}
-                Human: {human_input}
-                Chatbot (RESPUESTA FORMAL):
-                """ 
-    prompt = PromptTemplate(
-        input_variables=["chat_history", "human_input", "context"], template=template
-    )
-
-    memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
-
-    if model=="gpt":
-        llm_chat=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    elif model=="llama1":
-        llm_chat=ChatOllama(model="llama3.1",temperature=0)
-    elif model=="llama2":
-        llm_chat=ChatOllama(model="llama3.2:1b",temperature=0)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    else:
-        try:
-            llm_chat=ChatOllama(model=model,temperature=0)
-        except:
-            llm_chat=ChatOpenAI(temperature=0, model=model)
+    return _consultar_coleccion("capitulo_2", query, model, chat_id)
 
-    
-    chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
-    
-    # Load the chat history of the conversation for every particular agent
-    path_memory=f"memories/{chat_id}.pkl"
-    if os.path.exists(path_memory):
-        with open(path_memory, 'rb') as f:
-            memory = pickle.load(f) #memory of the conversation
-        
-        chain.memory=memory
 
-    embeddings = OpenAIEmbeddings(model="text-embedding-ada-002") #word2vec model of openAI
-    # load from disk
-    vectorstore = Chroma(persist_directory=f"C:/Users/User/Documents/Dashboard_Criticidad/Dashboard_CHEC/embeddings_by_procces/resolucion_40117",embedding_function=embeddings)
+@tool
+def capitulo_3(query: str, model:str, chat_id:str) -> str:
+    """
+    Usar cuando se necesite responder preguntas acerca del capítulo 3 del RETIE.
+    El Capítulo 3 del RETIE se refiere a los requisitos generales de las instalaciones eléctricas. 
+    En este capítulo se establecen normativas y criterios para el diseño, operación y mantenimiento de
+    las instalaciones eléctricas, así como para la protección contra riesgos eléctricos. 
+    Se abordan temas como las competencias y responsabilidades de las personas que intervienen 
+    en las instalaciones eléctricas, el diseño de las instalaciones, los espacios para montaje de equipos,
+    el código de colores para conductores, 
+    entre otros aspectos relevantes para garantizar la seguridad y eficiencia de las redes eléctricas 
+    de nivel de tensión 2.
+    """
+
+    return _consultar_coleccion("capitulo_3", query, model, chat_id)
 
-    docs=vectorstore.similarity_search(query,k=5) #Retriever
 
-    print(docs)
+@tool
+def capitulo_4(query: str, model:str, chat_id:str) -> str:
+    """
+    Usar cuando se necesite responder preguntas acerca del capítulo 4 del RETIE.
+    El capítulo 4 del RETIE aborda la Evaluación de la Conformidad en el Reglamento Técnico de 
+    Instalaciones Eléctricas. Define los requisitos mínimos para los Certificados de Producto, 
+    tales como la identificación clara de que es un certificado, el nombre del organismo certificador, 
+    el esquema de certificación empleado, el número o referencia del certificado, así como 
+    la identificación del productor, fabricante y del producto. También describe el alcance de la 
+    certificación. Además, establece que el Ministerio de Minas y Energía de Colombia es la entidad 
+    responsable de crear, revisar, actualizar e interpretar el RETIE, y detalla las sanciones para 
+    quienes incumplan los requisitos del reglamento, incluyendo empresas de servicios públicos, 
+    responsables de instalaciones eléctricas, usuarios, productores y laboratorios de pruebas.
+    """
 
-    response=chain({"input_documents": docs, "human_input": query, "chat_history":memory}, return_only_outputs=False)['output_text'] #AI answer
+    return _consultar_coleccion("capitulo_4", query, model, chat_id)
 
-    #Save the chat history (memory) for a new iteration of the conversation for the general agent:
-    with open(path_memory, 'wb') as f:
-        pickle.dump(chain.memory, f)
 
+@tool
+def resolucion_40117(query: str, model:str, chat_id:str) -> str:
+    """
+    Usar cuando se necesite responder preguntas acerca de la resolución resolucion 40117 del 02 de Abril de 2024.
+    """
 
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
+    return _consultar_coleccion("resolucion_40117", query, model, chat_id)
 
-    return response
 
 @tool
 def normativa_apoyos(query: str, model:str, chat_id:str) -> str:
@@ -514,86 +457,8 @@ def normativa_apoyos(query: str, model:str, chat_id:str) -> str:
     estabilidad estructural y seguridad en diversas condiciones ambientales y operativas.
     """
 
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
-        
-    # Abrir el archivo en modo de escritura
-    with open(f"number_iteration.pkl", "w") as archivo:
-        # Escribir el número entero en el archivo
-        number_iteration=number_iteration+1
-        archivo.write(str(number_iteration))
-
-
-    #PROMP TEMPLATE:
-    template = """ Se te proporcionará una serie de textos que contienen instrucciones sobre cómo 
-                resolver preguntas acerca de normativas en redes eléctricas de nivel de tensión 2. 
-                Según estos textos, responde a la pregunta de la manera más completa posible.
+    return _consultar_coleccion("normativa_apoyos", query, model, chat_id)
 
-                Dado el siguiente contexto y teniendo en cuenta el historial de la conversación, 
-                responde a las preguntas hechas por el usuario:
-
-                {context}
-
-                {chat_history}
-                Human: {human_input}
-                Chatbot (RESPUESTA FORMAL):
-                """ 
-    prompt = PromptTemplate(
-        input_variables=["chat_history", "human_input", "context"], template=template
-    )
-
-    memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
-
-    if model=="gpt":
-        llm_chat=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    elif model=="llama1":
-        llm_chat=ChatOllama(model="llama3.1",temperature=0)
-    elif model=="llama2":
-        llm_chat=ChatOllama(model="llama3.2:1b",temperature=0)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    else:
-        try:
-            llm_chat=ChatOllama(model=model,temperature=0)
-        except:
-            llm_chat=ChatOpenAI(temperature=0, model=model)
-
-    
-    chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
-    
-    # Load the chat history of the conversation for every particular agent
-    path_memory=f"memories/{chat_id}.pkl"
-    if os.path.exists(path_memory):
-        with open(path_memory, 'rb') as f:
-            memory = pickle.load(f) #memory of the conversation
-        
-        chain.memory=memory
-
-    embeddings = OpenAIEmbeddings(model="text-embedding-ada-002") #word2vec model of openAI
-    # load from disk
-    vectorstore = Chroma(persist_directory=f"C:/Users/User/Documents/Dashboard_Criticidad/Dashboard_CHEC/embeddings_by_procces/normativa_apoyos",embedding_function=embeddings)
-
-    docs=vectorstore.similarity_search(query,k=5) #Retriever
-
-    print(docs)
-
-    response=chain({"input_documents": docs, "human_input": query, "chat_history":memory}, return_only_outputs=False)['output_text'] #AI answer
-
-    #Save the chat history (memory) for a new iteration of the conversation for the general agent:
-    with open(path_memory, 'wb') as f:
-        pickle.dump(chain.memory, f)
-
-
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
-
-    return response
 
 @tool
 def normativa_protecciones(query: str, model:str, chat_id:str) -> str:
@@ -607,86 +472,7 @@ def normativa_protecciones(query: str, model:str, chat_id:str) -> str:
     distribución.
     """
 
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
-        
-    # Abrir el archivo en modo de escritura
-    with open(f"number_iteration.pkl", "w") as archivo:
-        # Escribir el número entero en el archivo
-        number_iteration=number_iteration+1
-        archivo.write(str(number_iteration))
-
-
-    #PROMP TEMPLATE:
-    template = """ Se te proporcionará una serie de textos que contienen instrucciones sobre cómo 
-                resolver preguntas acerca de normativas en redes eléctricas de nivel de tensión 2. 
-                Según estos textos, responde a la pregunta de la manera más completa posible.
-
-                Dado el siguiente contexto y teniendo en cuenta el historial de la conversación, 
-                responde a las preguntas hechas por el usuario:
-
-                {context}
-
-                {chat_history}
-                Human: {human_input}
-                Chatbot (RESPUESTA FORMAL):
-                """ 
-    prompt = PromptTemplate(
-        input_variables=["chat_history", "human_input", "context"], template=template
-    )
-
-    memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
-
-    if model=="gpt":
-        llm_chat=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    elif model=="llama1":
-        llm_chat=ChatOllama(model="llama3.1",temperature=0)
-    elif model=="llama2":
-        llm_chat=ChatOllama(model="llama3.2:1b",temperature=0)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    else:
-        try:
-            llm_chat=ChatOllama(model=model,temperature=0)
-        except:
-            llm_chat=ChatOpenAI(temperature=0, model=model)
-
-    
-    chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
-    
-    # Load the chat history of the conversation for every particular agent
-    path_memory=f"memories/{chat_id}.pkl"
-    if os.path.exists(path_memory):
-        with open(path_memory, 'rb') as f:
-            memory = pickle.load(f) #memory of the conversation
-        
-        chain.memory=memory
-
-    embeddings = OpenAIEmbeddings(model="text-embedding-ada-002") #word2vec model of openAI
-    # load from disk
-    vectorstore = Chroma(persist_directory=f"C:/Users/User/Documents/Dashboard_Criticidad/Dashboard_CHEC/embeddings_by_procces/normativa_protecciones",embedding_function=embeddings)
-
-    docs=vectorstore.similarity_search(query,k=5) #Retriever
-
-    print(docs)
-
-    response=chain({"input_documents": docs, "human_input": query, "chat_history":memory}, return_only_outputs=False)['output_text'] #AI answer
-
-    #Save the chat history (memory) for a new iteration of the conversation for the general agent:
-    with open(path_memory, 'wb') as f:
-        pickle.dump(chain.memory, f)
-
-
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
-
-    return response
+    return _consultar_coleccion("normativa_protecciones", query, model, chat_id)
 
 
 @tool
@@ -699,90 +485,8 @@ def normativa_aisladores(query: str, model:str, chat_id:str) -> str:
     confiabilidad y seguridad en condiciones operativas y ambientales adversas.
     """
 
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
-        
-    # Abrir el archivo en modo de escritura
-    with open(f"number_iteration.pkl", "w") as archivo:
-        # Escribir el número entero en el archivo
-        number_iteration=number_iteration+1
-        archivo.write(str(number_iteration))
-
-
-    #PROMP TEMPLATE:
-    template = """ Se te proporcionará una serie de textos que contienen instrucciones sobre cómo 
-                resolver preguntas acerca de normativas en redes eléctricas de nivel de tensión 2. 
-                Según estos textos, responde a la pregunta de la manera más completa posible.
-
-                Dado el siguiente contexto y teniendo en cuenta el historial de la conversación, 
-                responde a las preguntas hechas por el usuario:
-
-                {context}
-
-                {chat_history}
-                Human: {human_input}
-                Chatbot (RESPUESTA FORMAL):
-                """ 
-    prompt = PromptTemplate(
-        input_variables=["chat_history", "human_input", "context"], template=template
-    )
-
-    memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
-
-    if model=="gpt":
-        llm_chat=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    elif model=="llama1":
-        llm_chat=ChatOllama(model="llama3.1",temperature=0)
-    elif model=="llama2":
-        llm_chat=ChatOllama(model="llama3.2:1b",temperature=0)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    else:
-        try:
-            llm_chat=ChatOllama(model=model,temperature=0)
-        except:
-            llm_chat=ChatOpenAI(temperature=0, model=model)
-
-    
-    chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
-    
-    # Load the chat history of the conversation for every particular agent
-    path_memory=f"memories/{chat_id}.pkl"
-    if os.path.exists(path_memory):
-        with open(path_memory, 'rb') as f:
-            memory = pickle.load(f) #memory of the conversation
-        
-        chain.memory=memory
-
-    embeddings = OpenAIEmbeddings(model="text-embedding-ada-002") #word2vec model of openAI
-    # load from disk
-    vectorstore = Chroma(persist_directory=f"C:/Users/User/Documents/Dashboard_Criticidad/Dashboard_CHEC/embeddings_by_procces/normativa_aisladores",embedding_function=embeddings)
+    return _consultar_coleccion("normativa_aisladores", query, model, chat_id)
 
-    docs=vectorstore.similarity_search(query,k=5) #Retriever
-
-    print(docs)
-
-    response=chain({"input_documents": docs, "human_input": query, "chat_history":memory}, return_only_outputs=False)['output_text'] #AI answer
-
-    #Save the chat history (memory) for a new iteration of the conversation for the general agent:
-    with open(path_memory, 'wb') as f:
-        pickle.dump(chain.memory, f)
-
-
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
-
-    return response
 
 @tool
 def redes_aereas_media_tension(query: str, model:str, chat_id:str) -> str:
@@ -794,86 +498,8 @@ def redes_aereas_media_tension(query: str, model:str, chat_id:str) -> str:
     seguridad, confiabilidad y conformidad con estándares técnicos en zonas urbanas y rurales.
     """
 
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
-        
-    # Abrir el archivo en modo de escritura
-    with open(f"number_iteration.pkl", "w") as archivo:
-        # Escribir el número entero en el archivo
-        number_iteration=number_iteration+1
-        archivo.write(str(number_iteration))
-
-
-    #PROMP TEMPLATE:
-    template = """ Se te proporcionará una serie de textos que contienen instrucciones sobre cómo 
-                resolver preguntas acerca de normativas en redes eléctricas de nivel de tensión 2. 
-                Según estos textos, responde a la pregunta de la manera más completa posible.
-
-                Dado el siguiente contexto y teniendo en cuenta el historial de la conversación, 
-                responde a las preguntas hechas por el usuario:
-
-                {context}
-
-                {chat_history}
-                Human: {human_input}
-                Chatbot (RESPUESTA FORMAL):
-                """ 
-    prompt = PromptTemplate(
-        input_variables=["chat_history", "human_input", "context"], template=template
-    )
-
-    memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
-
-    if model=="gpt":
-        llm_chat=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    elif model=="llama1":
-        llm_chat=ChatOllama(model="llama3.1",temperature=0)
-    elif model=="llama2":
-        llm_chat=ChatOllama(model="llama3.2:1b",temperature=0)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    else:
-        try:
-            llm_chat=ChatOllama(model=model,temperature=0)
-        except:
-            llm_chat=ChatOpenAI(temperature=0, model=model)
-
-    
-    chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
-    
-    # Load the chat history of the conversation for every particular agent
-    path_memory=f"memories/{chat_id}.pkl"
-    if os.path.exists(path_memory):
-        with open(path_memory, 'rb') as f:
-            memory = pickle.load(f) #memory of the conversation
-        
-        chain.memory=memory
-
-    embeddings = OpenAIEmbeddings(model="text-embedding-ada-002") #word2vec model of openAI
-    # load from disk
-    vectorstore = Chroma(persist_directory=f"C:/Users/User/Documents/Dashboard_Criticidad/Dashboard_CHEC/embeddings_by_procces/redes_aereas_media_tension",embedding_function=embeddings)
-
-    docs=vectorstore.similarity_search(query,k=5) #Retriever
-
-    print(docs)
+    return _consultar_coleccion("redes_aereas_media_tension", query, model, chat_id)
 
-    response=chain({"input_documents": docs, "human_input": query, "chat_history":memory}, return_only_outputs=False)['output_text'] #AI answer
-
-    #Save the chat history (memory) for a new iteration of the conversation for the general agent:
-    with open(path_memory, 'wb') as f:
-        pickle.dump(chain.memory, f)
-
-
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
-
-    return response
 
 @tool
 def codigo_electrico_colombiano(query: str, model:str, chat_id:str) -> str:
@@ -885,86 +511,7 @@ def codigo_electrico_colombiano(query: str, model:str, chat_id:str) -> str:
     proyectos residenciales, comerciales e industriales.
     """
 
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
-        
-    # Abrir el archivo en modo de escritura
-    with open(f"number_iteration.pkl", "w") as archivo:
-        # Escribir el número entero en el archivo
-        number_iteration=number_iteration+1
-        archivo.write(str(number_iteration))
-
-
-    #PROMP TEMPLATE:
-    template = """ Se te proporcionará una serie de textos que contienen instrucciones sobre cómo 
-                resolver preguntas acerca de normativas en redes eléctricas de nivel de tensión 2. 
-                Según estos textos, responde a la pregunta de la manera más completa posible.
-
-                Dado el siguiente contexto y teniendo en cuenta el historial de la conversación, 
-                responde a las preguntas hechas por el usuario:
-
-                {context}
-
-                {chat_history}
-                Human: {human_input}
-                Chatbot (RESPUESTA FORMAL):
-                """ 
-    prompt = PromptTemplate(
-        input_variables=["chat_history", "human_input", "context"], template=template
-    )
-
-    memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
-
-    if model=="gpt":
-        llm_chat=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    elif model=="llama1":
-        llm_chat=ChatOllama(model="llama3.1",temperature=0)
-    elif model=="llama2":
-        llm_chat=ChatOllama(model="llama3.2:1b",temperature=0)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    else:
-        try:
-            llm_chat=ChatOllama(model=model,temperature=0)
-        except:
-            llm_chat=ChatOpenAI(temperature=0, model=model)
-
-    
-    chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
-    
-    # Load the chat history of the conversation for every particular agent
-    path_memory=f"memories/{chat_id}.pkl"
-    if os.path.exists(path_memory):
-        with open(path_memory, 'rb') as f:
-            memory = pickle.load(f) #memory of the conversation
-        
-        chain.memory=memory
-
-    embeddings = OpenAIEmbeddings(model="text-embedding-ada-002") #word2vec model of openAI
-    # load from disk
-    vectorstore = Chroma(persist_directory=f"C:/Users/User/Documents/Dashboard_Criticidad/Dashboard_CHEC/embeddings_by_procces/codigo_electrico_colombiano",embedding_function=embeddings)
-
-    docs=vectorstore.similarity_search(query,k=5) #Retriever
-
-    print(docs)
-
-    response=chain({"input_documents": docs, "human_input": query, "chat_history":memory}, return_only_outputs=False)['output_text'] #AI answer
-
-    #Save the chat history (memory) for a new iteration of the conversation for the general agent:
-    with open(path_memory, 'wb') as f:
-        pickle.dump(chain.memory, f)
-
-
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
-
-    return response
+    return _consultar_coleccion("codigo_electrico_colombiano", query, model, chat_id)
 
 
 @tool
@@ -978,86 +525,8 @@ def requisitos_redes_aereas(query: str, model:str, chat_id:str) -> str:
     adversas, basándose en normativas como IEEE 1410, RETIE e IEC 60815.
     """
 
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
-        
-    # Abrir el archivo en modo de escritura
-    with open(f"number_iteration.pkl", "w") as archivo:
-        # Escribir el número entero en el archivo
-        number_iteration=number_iteration+1
-        archivo.write(str(number_iteration))
-
-
-    #PROMP TEMPLATE:
-    template = """ Se te proporcionará una serie de textos que contienen instrucciones sobre cómo 
-                resolver preguntas acerca de normativas en redes eléctricas de nivel de tensión 2. 
-                Según estos textos, responde a la pregunta de la manera más completa posible.
-
-                Dado el siguiente contexto y teniendo en cuenta el historial de la conversación, 
-                responde a las preguntas hechas por el usuario:
-
-                {context}
-
-                {chat_history}
-                Human: {human_input}
-                Chatbot (RESPUESTA FORMAL):
-                """ 
-    prompt = PromptTemplate(
-        input_variables=["chat_history", "human_input", "context"], template=template
-    )
-
-    memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
-
-    if model=="gpt":
-        llm_chat=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    elif model=="llama1":
-        llm_chat=ChatOllama(model="llama3.1",temperature=0)
-    elif model=="llama2":
-        llm_chat=ChatOllama(model="llama3.2:1b",temperature=0)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    else:
-        try:
-            llm_chat=ChatOllama(model=model,temperature=0)
-        except:
-            llm_chat=ChatOpenAI(temperature=0, model=model)
-
-    
-    chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
-    
-    # Load the chat history of the conversation for every particular agent
-    path_memory=f"memories/{chat_id}.pkl"
-    if os.path.exists(path_memory):
-        with open(path_memory, 'rb') as f:
-            memory = pickle.load(f) #memory of the conversation
-        
-        chain.memory=memory
-
-    embeddings = OpenAIEmbeddings(model="text-embedding-ada-002") #word2vec model of openAI
-    # load from disk
-    vectorstore = Chroma(persist_directory=f"C:/Users/User/Documents/Dashboard_Criticidad/Dashboard_CHEC/embeddings_by_procces/requisitos_redes_aereas",embedding_function=embeddings)
-
-    docs=vectorstore.similarity_search(query,k=5) #Retriever
-
-    print(docs)
-
-    response=chain({"input_documents": docs, "human_input": query, "chat_history":memory}, return_only_outputs=False)['output_text'] #AI answer
-
-    #Save the chat history (memory) for a new iteration of the conversation for the general agent:
-    with open(path_memory, 'wb') as f:
-        pickle.dump(chain.memory, f)
-
+    return _consultar_coleccion("requisitos_redes_aereas", query, model, chat_id)
 
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
-
-    return response
 
 @tool
 def retie(query: str, model:str, chat_id:str) -> str:
@@ -1070,86 +539,8 @@ def retie(query: str, model:str, chat_id:str) -> str:
     seguridad eléctrica y ambiental.
     """
 
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
-        
-    # Abrir el archivo en modo de escritura
-    with open(f"number_iteration.pkl", "w") as archivo:
-        # Escribir el número entero en el archivo
-        number_iteration=number_iteration+1
-        archivo.write(str(number_iteration))
-
-
-    #PROMP TEMPLATE:
-    template = """ Se te proporcionará una serie de textos que contienen instrucciones sobre cómo 
-                resolver preguntas acerca de normativas en redes eléctricas de nivel de tensión 2. 
-                Según estos textos, responde a la pregunta de la manera más completa posible.
-
-                Dado el siguiente contexto y teniendo en cuenta el historial de la conversación, 
-                responde a las preguntas hechas por el usuario:
-
-                {context}
-
-                {chat_history}
-                Human: {human_input}
-                Chatbot (RESPUESTA FORMAL):
-                """ 
-    prompt = PromptTemplate(
-        input_variables=["chat_history", "human_input", "context"], template=template
-    )
-
-    memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
-
-    if model=="gpt":
-        llm_chat=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    elif model=="llama1":
-        llm_chat=ChatOllama(model="llama3.1",temperature=0)
-    elif model=="llama2":
-        llm_chat=ChatOllama(model="llama3.2:1b",temperature=0)
-    elif model=="gemini-2.5-pro-exp-03-25":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    elif model=="gemini-2.0-flash-001":
-        llm_chat=ChatGoogleGenerativeAI(temperature=0,model=model)
-    else:
-        try:
-            llm_chat=ChatOllama(model=model,temperature=0)
-        except:
-            llm_chat=ChatOpenAI(temperature=0, model=model)
-
-    
-    chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
-    
-    # Load the chat history of the conversation for every particular agent
-    path_memory=f"memories/{chat_id}.pkl"
-    if os.path.exists(path_memory):
-        with open(path_memory, 'rb') as f:
-            memory = pickle.load(f) #memory of the conversation
-        
-        chain.memory=memory
-
-    embeddings = OpenAIEmbeddings(model="text-embedding-ada-002") #word2vec model of openAI
-    # load from disk
-    vectorstore = Chroma(persist_directory=f"C:/Users/User/Documents/Dashboard_Criticidad/Dashboard_CHEC/embeddings_by_procces/retie",embedding_function=embeddings)
+    return _consultar_coleccion("retie", query, model, chat_id)
 
-    docs=vectorstore.similarity_search(query,k=5) #Retriever
-
-    print(docs)
-
-    response=chain({"input_documents": docs, "human_input": query, "chat_history":memory}, return_only_outputs=False)['output_text'] #AI answer
-
-    #Save the chat history (memory) for a new iteration of the conversation for the general agent:
-    with open(path_memory, 'wb') as f:
-        pickle.dump(chain.memory, f)
-
-
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
-
-    return response
 
 @tool
 def eventos_transformadores(query: str, model:str, chat_id:str) -> str:
@@ -1157,189 +548,148 @@ def eventos_transformadores(query: str, model:str, chat_id:str) -> str:
     Usar cuando se necesite responder preguntas acerca de eventos y/o interrupciones.
     """
 
+    model=resolve_model(model, "structured")
+    with span("tool", tool="eventos_transformadores", model=model, chat_id=chat_id):
+        # Streaming, SAIDI/SAIFI, intervalos o SQL; si ninguna ruta aplica, agente de pandas
+        response=_respuesta_directa(query, model)
+        if response is not None:
+            _incrementar_iteracion(2)
+            _guardar_respuesta(response)
+            return response
 
-    eventos_trafos = pd.read_csv('structured_data/Tabla_General.csv')
-    NUMERIC_COLUMNS = eventos_trafos.select_dtypes(include=['number']).columns.tolist()
-    CATEGORICAL_COLUMNS= eventos_trafos.select_dtypes(include=['object', 'category']).columns.tolist()
+        eventos_trafos = _consultar_eventos(query)
 
-    eventos_trafos[NUMERIC_COLUMNS] = eventos_trafos[NUMERIC_COLUMNS].apply(pd.to_numeric, errors='coerce')
+        _incrementar_iteracion(2)
 
-    # 4. Convertir columnas categóricas al tipo 'category'
-    # Esto optimiza el uso de memoria y puede mejorar el rendimiento en ciertas operaciones
-    eventos_trafos[CATEGORICAL_COLUMNS] = eventos_trafos[CATEGORICAL_COLUMNS].astype('category')
+        # if model=="gpt":
+        #     llm_agent=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
+        # elif model=="llama1":
+        #     llm_agent=ChatOllama(model="llama3.1",temperature=0)
+        # elif model=="llama2":
+        #     llm_agent=ChatOllama(model="llama3.2:1b",temperature=0)
 
+        try:
+            agent = _crear_agente_eventos(eventos_trafos)
 
-    # Supongamos que tu DataFrame se llama df y la columna de fecha se llama 'fecha_sin_hora'
-    eventos_trafos['FECHA'] = pd.to_datetime(eventos_trafos['FECHA'].astype(str), format='%Y-%m-%d')
-    # Supongamos que la columna de fecha y hora se llama 'fecha_con_hora'
-    eventos_trafos['inicio'] = pd.to_datetime(eventos_trafos['inicio'].astype(str), format='%Y-%m-%d %H:%M:%S')
-    eventos_trafos['fin'] = pd.to_datetime(eventos_trafos['fin'].astype(str), format='%Y-%m-%d %H:%M:%S')
-
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
-        
-    # Abrir el archivo en modo de escritura
-    with open(f"number_iteration.pkl", "w") as archivo:
-        # Escribir el número entero en el archivo
-        number_iteration=number_iteration+2
-        archivo.write(str(number_iteration))
-    
-    # if model=="gpt":
-    #     llm_agent=ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    # elif model=="llama1":
-    #     llm_agent=ChatOllama(model="llama3.1",temperature=0)
-    # elif model=="llama2":
-    #     llm_agent=ChatOllama(model="llama3.2:1b",temperature=0)
-
-    try:
-        agent = create_pandas_dataframe_agent(
-        ChatOpenAI(temperature=0, model="gpt-3.5-turbo"),
-        eventos_trafos,
-        verbose=True,
-        agent_type=AgentType.OPENAI_FUNCTIONS,
-        allow_dangerous_code=True,
-        include_df_in_prompt=True,  # Incluye las primeras filas del DataFrame en el prompt
-        number_of_head_rows=5)
-
-        response=agent.invoke(query)["output"]
-
-    except:
-        response="De acuerdo a mi conocimiento actual, no tengo la capacidad para responder a tu pregunta, por favor reformula tu pregunta."
+            with span("generate"):
+                response=agent.invoke(query)["output"]
 
+        except:
+            response=RESPUESTA_NO_DISPONIBLE
 
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
+        _guardar_respuesta(response)
 
     return response
 
+
 @tool
 def eventos_transformadores_plots(query: str, model:str, chat_id:str) -> str:
     """
     Usar cuando se necesite graficar acerca de eventos y/o interrupciones.
     """
     
-    number_image=int(len(os.listdir(f"plots/{chat_id}")))
-    path_plot=f"plots/{chat_id}/output_{number_image}.jpg"
-
-    eventos_trafos = pd.read_csv('structured_data/Tabla_General.csv')
-    NUMERIC_COLUMNS = eventos_trafos.select_dtypes(include=['number']).columns.tolist()
-    CATEGORICAL_COLUMNS= eventos_trafos.select_dtypes(include=['object', 'category']).columns.tolist()
-
-    eventos_trafos[NUMERIC_COLUMNS] = eventos_trafos[NUMERIC_COLUMNS].apply(pd.to_numeric, errors='coerce')
-
-    # 4. Convertir columnas categóricas al tipo 'category'
-    # Esto optimiza el uso de memoria y puede mejorar el rendimiento en ciertas operaciones
-    eventos_trafos[CATEGORICAL_COLUMNS] = eventos_trafos[CATEGORICAL_COLUMNS].astype('category')
-
-
-    # Supongamos que tu DataFrame se llama df y la columna de fecha se llama 'fecha_sin_hora'
-    eventos_trafos['FECHA'] = pd.to_datetime(eventos_trafos['FECHA'].astype(str), format='%Y-%m-%d')
-    # Supongamos que la columna de fecha y hora se llama 'fecha_con_hora'
-    eventos_trafos['inicio'] = pd.to_datetime(eventos_trafos['inicio'].astype(str), format='%Y-%m-%d %H:%M:%S')
-    eventos_trafos['fin'] = pd.to_datetime(eventos_trafos['fin'].astype(str), format='%Y-%m-%d %H:%M:%S')
-
-    head_df = eventos_trafos.head(5).to_string(index=False)
-    
-    descripcion_df=""" 
-    Este DataFrame contiene información acerca de interrupciones o eventos presentadas en redes eléctricas de media tensión, 
-    más específicamente en tres tipos de equipos: Tranformadores, interruptores y tramos de linea (tramos de red).
-
-    Las columnas incluyen: 
-    - **Evento**: Id de la interrupción o el evento.
-    - **equipo_ope**: Código del equipo en el que ocurrió la interrupción.
-    - **tipo_equi_ope**: Me indica si la interrupción ocurrió sobre un Transformador, o sobre un interruptor o sobre un tramo de linea, es decir que tiene solo tres posibles valores.
-    - **cto_equi_ope**: Código del circuito al que pertenece el equipo en el cual se dió la interrupción.
-    - **tipo_elemento**: Capacidad en Kilo Voltios del equipo en el cual ocurrió la interrupción, tiene 4 posibles valores: 33, 13.2, TFD y TFP
-    - **inicio**: Fecha y hora del inicio del evento o interrupción.
-    - **fin**: Fecha y hora de la finalización del evento o interrupción.
-    - **duracion_h**: Duración en horas del evento o interrupción.
-    - **tipo_duracion**: Variable categórica que indica si ele vento duró más de tres minutos o no; por tanto, tiene dos posibles valores: > 3 min y <= 3 min
-    - **causa**: Causa del evento o interrupción.
-    - **CNT_TRAFOS_AFEC**: Cantidad de transformadores afectados en la interrupción o evento.
-    - **cnt_usus**: Cantidad de usuarios afectados por la interrupción o evento.
-    - **SAIDI**: Indicador que mide el promedio de la duración en horas de la interrupción por usuario.
-    - **SAIFI**: Indicador que mide el promedio de cantidad de interrupciones por usuario.
-    - **PHASES**: Número de fases del equipo en el que ocurrió la interrupción; por tanto tiene 3 posibles valores: 3., 1., 2.
-    - **FPARENT**: Código del circuito que contiene el equipo en donde se presentó la interrupción.
-    - **FECHA**: Fecha en la que se presentó el evento o interrupción.
-    - **LONGITUD**: Longitud geográfica de la ubicación del equipo en el que se presentó la interrupción o evento.
-    - **LATITUD**: Latiud geográfica de la ubicación del equipo en el que se presentó la interrupción o evento.
-    - **DEP**: Departamento en donde se presentó la interrupción o evento.
-    - **MUN**: Municipio en donde se presentó la interrupción o evento.
-
-    A continuación, se muestran las primeras 5 filas del DataFrame:
+    model=resolve_model(model, "structured")
+    with span("tool", tool="eventos_transformadores_plots", model=model, chat_id=chat_id):
+        # Ruta de salida asignada con un contador por chat (sin listar el directorio)
+        path_plot=default_plot_store.allocate_output_path(chat_id)
+
+        # Si el mismo gráfico ya se generó sobre los mismos datos, se reutiliza
+        version_datos=_version_eventos()
+        clave_grafico=default_plot_store.key(query, version_datos, model)
+        with span("plot_cache_lookup"):
+            guardado=default_plot_store.get(clave_grafico)
+        if guardado is not None:
+            response=default_plot_store.materialize(guardado, path_plot)
+            _incrementar_iteracion(3)
+            _guardar_respuesta(response)
+            return response
+
+        # Gráficos comunes: el modelo solo elige la plantilla y sus parámetros
+        agregados=get_aggregates(version_datos, lambda: _consultar_eventos(columnas=COLUMNAS_EVENTOS))
+        try:
+            with span("llm_init"):
+                llm_chat=create_llm_chat_model(model)
+            seleccion=select_chart(query, llm_chat, agregados)
+        except Exception as e:
+            print(f"Error seleccionando plantilla de gráfico: {e}")
+            seleccion=None
+
+        if seleccion is not None:
+            response=render_chart(seleccion, agregados, path_plot)
+            _incrementar_iteracion(3)
+            with span("plot_cache_store"):
+                default_plot_store.put(clave_grafico, path_plot, response, query=query, model=model)
+            _guardar_respuesta(response)
+            return response
+
+        # Solicitudes que no corresponden a ninguna plantilla: agente de pandas
+        eventos_trafos = _consultar_eventos(query)
+
+        head_df = eventos_trafos.head(5).to_string(index=False)
+    
+        descripcion_df=""" 
+        Este DataFrame contiene información acerca de interrupciones o eventos presentadas en redes eléctricas de media tensión, 
+        más específicamente en tres tipos de equipos: Tranformadores, interruptores y tramos de linea (tramos de red).
+
+        Las columnas incluyen: 
+        - **Evento**: Id de la interrupción o el evento.
+        - **equipo_ope**: Código del equipo en el que ocurrió la interrupción.
+        - **tipo_equi_ope**: Me indica si la interrupción ocurrió sobre un Transformador, o sobre un interruptor o sobre un tramo de linea, es decir que tiene solo tres posibles valores.
+        - **cto_equi_ope**: Código del circuito al que pertenece el equipo en el cual se dió la interrupción.
+        - **tipo_elemento**: Capacidad en Kilo Voltios del equipo en el cual ocurrió la interrupción, tiene 4 posibles valores: 33, 13.2, TFD y TFP
+        - **inicio**: Fecha y hora del inicio del evento o interrupción.
+        - **fin**: Fecha y hora de la finalización del evento o interrupción.
+        - **duracion_h**: Duración en horas del evento o interrupción.
+        - **tipo_duracion**: Variable categórica que indica si ele vento duró más de tres minutos o no; por tanto, tiene dos posibles valores: > 3 min y <= 3 min
+        - **causa**: Causa del evento o interrupción.
+        - **CNT_TRAFOS_AFEC**: Cantidad de transformadores afectados en la interrupción o evento.
+        - **cnt_usus**: Cantidad de usuarios afectados por la interrupción o evento.
+        - **SAIDI**: Indicador que mide el promedio de la duración en horas de la interrupción por usuario.
+        - **SAIFI**: Indicador que mide el promedio de cantidad de interrupciones por usuario.
+        - **PHASES**: Número de fases del equipo en el que ocurrió la interrupción; por tanto tiene 3 posibles valores: 3., 1., 2.
+        - **FPARENT**: Código del circuito que contiene el equipo en donde se presentó la interrupción.
+        - **FECHA**: Fecha en la que se presentó el evento o interrupción.
+        - **LONGITUD**: Longitud geográfica de la ubicación del equipo en el que se presentó la interrupción o evento.
+        - **LATITUD**: Latiud geográfica de la ubicación del equipo en el que se presentó la interrupción o evento.
+        - **DEP**: Departamento en donde se presentó la interrupción o evento.
+        - **MUN**: Municipio en donde se presentó la interrupción o evento.
+
+        A continuación, se muestran las primeras 5 filas del DataFrame:
 
    {head_df}
-    """
+        """
 
-    suffix_instrucciones ="""
-    Construye el gráfico de la forma más estética posible para mostrar a un usuario. 
-    Puedes utilizar los siguientes colores: verde y gris en diferentes tonalidades (si es necesario, utiliza más colores).
-    Además, los títulos y ejes de los gráficos deben estar en español.
-    Guarda la imagen en la ruta relativa {path_plot}.
-    No ejecutes el comando plt.show().
-    Siempre ejecuta el comando plt.tight_layout()
+        suffix_instrucciones ="""
+        Construye el gráfico de la forma más estética posible para mostrar a un usuario. 
+        Puedes utilizar los siguientes colores: verde y gris en diferentes tonalidades (si es necesario, utiliza más colores).
+        Además, los títulos y ejes de los gráficos deben estar en español.
+        Guarda la imagen en la ruta relativa {path_plot}.
+        No ejecutes el comando plt.show().
+        Siempre ejecuta el comando plt.tight_layout()
 
 
-    Ojo, la información que utilizes para el gráfico y las conclusiones debe ser extraida únicamente del DataFrame proporcionado, no inventes.
-    """
+        Ojo, la información que utilizes para el gráfico y las conclusiones debe ser extraida únicamente del DataFrame proporcionado, no inventes.
+        """
     
-    query=f"""{query}. Construye el gráfico de la forma más estética posible para mostrar a un usuario. 
-    Puedes utilizar los siguientes colores: verde y gris en diferentes tonalidades (si es necesario, utiliza más colores).
-    Además, los títulos y ejes de los gráficos deben estar en español.
-    Guarda la imagen en la ruta relativa {path_plot}.
-    No ejecutes el comando plt.show().
-    Siempre ejecuta el comando plt.tight_layout().
-    Siempre poner los ejes del gráfico con un fontsize = 14.
-    Siempre rotar las etiquetas del eje x a 90 grados.
-    """
-    # Al final, redacta conclusiones basadas **únicamente en los datos proporcionados en el DataFrame**.
-    # Asegúrate de que todas las estadísticas y observaciones estén directamente derivadas de los datos.
-
-    agent = create_pandas_dataframe_agent(OpenAI(temperature=0), eventos_trafos, verbose=True, allow_dangerous_code=True)
-   
-    # Abrir el archivo en modo de lectura
-    with open(f"number_iteration.pkl", "r") as archivo:
-        # Leer el contenido del archivo
-        contenido = archivo.read()
-        # Convertir el contenido a un número entero
-        number_iteration = int(contenido)
+        query=_instrucciones_grafico(query, path_plot)
+        # Al final, redacta conclusiones basadas **únicamente en los datos proporcionados en el DataFrame**.
+        # Asegúrate de que todas las estadísticas y observaciones estén directamente derivadas de los datos.
 
-    try:
-        agent = create_pandas_dataframe_agent(
-        ChatOpenAI(temperature=0, model="gpt-3.5-turbo"),
-        eventos_trafos,
-        verbose=True, 
-        agent_type="openai-functions",#prefix=descripcion_df,  # Añade la descripción al inicio del prompt #suffix=suffix_instrucciones.format(path_plot=path_plot),
-        allow_dangerous_code=True,
-        include_df_in_prompt=True,  # Incluye las primeras filas del DataFrame en el prompt
-        number_of_head_rows=5)
+        try:
+            agent = _crear_agente_eventos(eventos_trafos)
 
-        response=agent.invoke(query)["output"]
-        # Abrir el archivo en modo de escritura
-        with open(f"number_iteration.pkl", "w") as archivo:
-            # Escribir el número entero en el archivo
-            number_iteration=number_iteration+3
-            archivo.write(str(number_iteration))
+            with span("generate"):
+                response=agent.invoke(query)["output"]
+            _incrementar_iteracion(3)
 
-    except:
-        response="De acuerdo a mi conocimiento actual, no tengo la capacidad para responder a tu pregunta, por favor reformula tu pregunta."
-        # Abrir el archivo en modo de escritura
-        with open(f"number_iteration.pkl", "w") as archivo:
-            # Escribir el número entero en el archivo
-            number_iteration=number_iteration+4
-            archivo.write(str(number_iteration))
+            with span("plot_cache_store"):
+                default_plot_store.put(clave_grafico, path_plot, response, query=query, model=model)
 
-    
-    
-        
-    
+        except:
+            response=RESPUESTA_NO_DISPONIBLE
+            _incrementar_iteracion(4)
+            default_plot_store.release_output_path(path_plot)
 
-    with open("answer.pkl", 'wb') as archivo:
-        pickle.dump(response, archivo)
+        _guardar_respuesta(response)
 
     return response
\ No newline at end of file
@@ -0,0 +1,276 @@
+"""
+Lightweight tracing for stage-level latency analysis
+Spans are timed with the monotonic perf_counter clock, nest through context
+variables (so they follow asyncio tasks and context-copied threads) and can be
+exported as JSONL or as Chrome trace events for flame views
+"""
+
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+# Anchor perf_counter to wall-clock time once so exported timestamps are absolute
+_EPOCH_WALL = time.time()
+_EPOCH_PERF = time.perf_counter()
+
+_span_ids = itertools.count(1)
+
+
+@dataclass
+class Span:
+    """
+    A single timed stage.
+
+    Attributes:
+        name (str): Stage name, e.g. 'retrieve' or 'generate'
+        span_id (int): Unique span identifier
+        parent_id (Optional[int]): Identifier of the enclosing span, None for roots
+        trace_id (int): Identifier of the root span of the tree
+        start (float): perf_counter value when the span was opened
+        end (Optional[float]): perf_counter value when the span was closed
+        attributes (dict): Free-form metadata (tool, model, chat_id, ...)
+        thread_id (int): Identifier of the thread that opened the span
+        error (Optional[str]): Exception representation if the stage failed
+    """
+    name: str
+    span_id: int
+    parent_id: Optional[int]
+    trace_id: int
+    start: float
+    end: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    thread_id: int = field(default_factory=threading.get_ident)
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        """Duration of the span in seconds (up to now if still open)."""
+        end = self.end if self.end is not None else time.perf_counter()
+        return end - self.start
+
+    def to_dict(self) -> dict:
+        """Serializable representation with wall-clock start time."""
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "trace_id": self.trace_id,
+            "start": _EPOCH_WALL + (self.start - _EPOCH_PERF),
+            "duration": self.duration,
+            "thread_id": self.thread_id,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    """
+    Thread-safe collector of finished spans.
+
+    Args:
+        max_spans (int): Maximum number of finished spans kept in memory
+    """
+
+    def __init__(self, max_spans: int = 100_000):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+        self.enabled = os.getenv("CRITAIR_TRACING", "1") != "0"
+
+    def record(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self, trace_id: Optional[int] = None) -> List[Span]:
+        """
+        Returns the finished spans, optionally restricted to one trace.
+
+        Args:
+            trace_id (Optional[int]): Root span identifier to filter by
+
+        Returns:
+            List[Span]: Finished spans in completion order
+        """
+        with self._lock:
+            spans = list(self._spans)
+        if trace_id is not None:
+            spans = [s for s in spans if s.trace_id == trace_id]
+        return spans
+
+    def clear(self) -> None:
+        with self._lock:
+            self._spans.clear()
+
+    def summary(self, trace_id: Optional[int] = None) -> Dict[str, float]:
+        """
+        Total time per stage name, in seconds.
+
+        Args:
+            trace_id (Optional[int]): Root span identifier to filter by
+
+        Returns:
+            Dict[str, float]: Stage name to accumulated duration
+        """
+        totals: Dict[str, float] = {}
+        for s in self.spans(trace_id):
+            totals[s.name] = totals.get(s.name, 0.0) + s.duration
+        return totals
+
+    def export_jsonl(self, path: str, trace_id: Optional[int] = None) -> None:
+        """
+        Writes one JSON object per finished span.
+
+        Args:
+            path (str): Output file path
+            trace_id (Optional[int]): Root span identifier to filter by
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            for s in self.spans(trace_id):
+                f.write(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+    def export_chrome_trace(self, path: str, trace_id: Optional[int] = None) -> None:
+        """
+        Writes the spans in Chrome trace-event format (chrome://tracing, Perfetto).
+
+        Args:
+            path (str): Output file path
+            trace_id (Optional[int]): Root span identifier to filter by
+        """
+        pid = os.getpid()
+        events = []
+        for s in self.spans(trace_id):
+            events.append({
+                "name": s.name,
+                "cat": s.attributes.get("tool", "critair"),
+                "ph": "X",
+                "ts": (_EPOCH_WALL + (s.start - _EPOCH_PERF)) * 1e6,
+                "dur": s.duration * 1e6,
+                "pid": pid,
+                "tid": s.thread_id,
+                "args": {**s.attributes, "trace_id": s.trace_id, "error": s.error},
+            })
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
+
+
+_tracer = Tracer()
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("critair_span", default=None)
+
+
+def get_tracer() -> Tracer:
+    """Returns the process-wide tracer."""
+    return _tracer
+
+
+def current_span() -> Optional[Span]:
+    """Returns the innermost open span of the current context, if any."""
+    return _current_span.get()
+
+
+def set_attribute(key: str, value: Any) -> None:
+    """
+    Attaches metadata to the innermost open span.
+
+    Args:
+        key (str): Attribute name
+        value (Any): Attribute value
+    """
+    s = _current_span.get()
+    if s is not None:
+        s.attributes[key] = value
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Times a stage as a child of the current span.
+
+    Args:
+        name (str): Stage name
+        **attributes: Metadata stored on the span
+
+    Yields:
+        Optional[Span]: The open span (None when tracing is disabled)
+    """
+    if not _tracer.enabled:
+        yield None
+        return
+
+    parent = _current_span.get()
+    span_id = next(_span_ids)
+    s = Span(
+        name=name,
+        span_id=span_id,
+        parent_id=parent.span_id if parent else None,
+        trace_id=parent.trace_id if parent else span_id,
+        start=time.perf_counter(),
+        attributes=dict(attributes),
+    )
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = repr(e)
+        raise
+    finally:
+        s.end = time.perf_counter()
+        _current_span.reset(token)
+        _tracer.record(s)
+
+
+def traced(name: Optional[str] = None, **attributes) -> Callable:
+    """
+    Decorator that wraps a sync or async function in a span.
+
+    Args:
+        name (Optional[str]): Stage name, defaults to the function name
+        **attributes: Metadata stored on the span
+
+    Returns:
+        Callable: Decorator
+    """
+    def decorator(func: Callable) -> Callable:
+        stage = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage, **attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def bind_context(func: Callable) -> Callable:
+    """
+    Binds a callable to the current context so spans opened inside a worker
+    thread (e.g. ThreadPoolExecutor.submit) nest under the caller's span.
+
+    Args:
+        func (Callable): Function to run later in another thread
+
+    Returns:
+        Callable: Function that runs inside a copy of the current context
+    """
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return ctx.run(func, *args, **kwargs)
+    return wrapper
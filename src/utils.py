@@ -3,17 +3,25 @@ Utility module for AI models precision and time analysis
 Contains auxiliary functions for text processing and technical recommendations
 """
 
+import asyncio
+import threading
 import time
+import unicodedata
 import pandas as pd
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 
 from langchain.prompts import PromptTemplate
 from langchain.memory import ConversationBufferMemory
 from langchain.chains.question_answering import load_qa_chain
-from langchain_community.chat_models import ChatOllama
 from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_openai import OpenAIEmbeddings
+
+from hedging import HedgedChatModel, is_hedged_model
+from mock_provider import MockEmbeddings, is_mock_model
+from model_factory import default_model_factory
+from replay import wrap_embeddings
+from router import RoutedChatModel, is_routed_model, resolve_model
+from tracing import span, traced
 
 
 def verify_substring(cadena_principal: str, subcadena: str, to_return: str) -> str:
@@ -65,48 +73,63 @@ def normalize_variable_name(variable: str) -> str:
     return variable
 
 
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a user query for use as a cache or coalescing key.
+    
+    Lowercases, removes accents, collapses whitespace and strips surrounding
+    punctuation, so '¿Cuántas  interrupciones?' and 'cuantas interrupciones'
+    share a key.
+    
+    Args:
+        query (str): Original query
+        
+    Returns:
+        str: Normalized query
+    """
+    text = unicodedata.normalize("NFKD", query.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = " ".join(text.split())
+    return text.strip("¿?¡!.,;: ")
+
+
 def create_llm_chat_model(model: str):
     """
     Creates an LLM chat model based on the model name.
     
     Args:
-        model (str): Model name ('gpt', 'gpt-4o', 'llama1', 'llama2', etc.)
+        model (str): Model name ('gpt', 'gpt-4o', 'llama1', 'llama2', 'mock', etc.),
+            'primary|backup@deadline' to hedge one model with another (see hedging.py),
+            or 'auto:<category>' to let router.default_router pick it per call
         
     Returns:
-        Corresponding chat model instance
+        Corresponding chat model instance, with the timeouts, circuit breaker and
+        fallback chain of model_factory.default_model_factory
     """
-    if model == "gpt":
-        return ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    elif model == "gpt-4o":
-        return ChatOpenAI(temperature=0, model=model)
-    elif model == "llama1":
-        return ChatOllama(model="llama3.1", temperature=0)
-    elif model == "llama2":
-        return ChatOllama(model="llama3.2:1b", temperature=0)
-    elif model == "gemini-2.5-pro-exp-03-25":
-        return ChatGoogleGenerativeAI(temperature=0, model=model)
-    elif model == "gemini-2.0-flash-001":
-        return ChatGoogleGenerativeAI(temperature=0, model=model)
-    else:
-        try:
-            return ChatOllama(model=model, temperature=0)
-        except:
-            return ChatOpenAI(temperature=0, model=model)
+    if is_hedged_model(model):
+        return HedgedChatModel.from_name(model, create_llm_chat_model)
+    elif is_routed_model(model):
+        return RoutedChatModel.from_name(model, create_llm_chat_model)
+    return default_model_factory.create(model)
 
 
-def recomendacion(model: str, info_poligono: dict) -> Tuple[Dict[str, str], Dict[str, float]]:
+def create_embeddings(model: str):
     """
-    Generates technical recommendations for electrical infrastructure variables.
+    Creates the embeddings client used for retrieval with a given chat model.
     
     Args:
-        model (str): Name of the AI model to use
-        info_poligono (dict): Polygon information with equipment and variables
+        model (str): Chat model name; mock models get deterministic local embeddings
         
     Returns:
-        Tuple[Dict[str, str], Dict[str, float]]: Tuple with responses and execution times
+        Embeddings instance (recorded or replayed when CRITAIR_LLM_REPLAY is set, see replay.py)
     """
-    
-    template = """
+    if is_mock_model(model):
+        return wrap_embeddings(MockEmbeddings, "mock")
+    return wrap_embeddings(lambda: OpenAIEmbeddings(model="text-embedding-ada-002"), "text-embedding-ada-002")
+
+
+# Prompt used to draft a recommendation for one variable
+RECOMMENDATION_TEMPLATE = """
     You are a technical expert in electrical infrastructure. Your objective is to provide recommendations and 
     regulatory guidelines based on the context provided to you. 
 
@@ -138,32 +161,106 @@ def recomendacion(model: str, info_poligono: dict) -> Tuple[Dict[str, str], Dict
     Chatbot (RECOMMENDATION RESPONSE IN A SINGLE PARAGRAPH):
     """
 
-    prompt = PromptTemplate(
-        input_variables=["chat_history", "human_input", "context"], 
-        template=template
-    )
+# Variables that should be excluded from processing
+EXCLUDED_VARIABLES = [
+    "ALTITUD_mean", "ALTITUD_median", "ALTITUD_min", "ALTITUD_max", "ALTITUD_std",
+    "CORRIENTE_mean", "CORRIENTE_median", "CORRIENTE_min", "CORRIENTE_max", "CORRIENTE_std",
+    "TIPO_1_count", "TIPO_2_count"
+]
+
+# Source recorded for recommendations generated by the model (see recomendacion's sources)
+MODEL_SOURCE = "model"
+
+_vectorstores = {}
+_vectorstores_lock = threading.Lock()
+
+
+def get_vectorstore(persist_directory: str, model: str):
+    """
+    Returns the Chroma collection stored in a directory, opening it once per process.
     
-    # Crear modelo de chat
-    llm_chat = create_llm_chat_model(model)
+    Opening a collection is costly and Chroma's client cache is not safe when
+    several threads open the same directory at the same time, so collections
+    are shared by all tools, sessions and the async variants.
     
-    # Configure embeddings
-    embeddings = OpenAIEmbeddings(model="text-embedding-ada-002")
+    Args:
+        persist_directory (str): Directory of the persisted collection
+        model (str): Chat model name (selects the embeddings, see create_embeddings)
+        
+    Returns:
+        Chroma vectorstore instance
+    """
+    key = (persist_directory, is_mock_model(model))
+    with _vectorstores_lock:
+        if key not in _vectorstores:
+            _vectorstores[key] = Chroma(
+                persist_directory=persist_directory,
+                embedding_function=create_embeddings(model)
+            )
+        return _vectorstores[key]
+
+
+def _recommendation_prompt() -> PromptTemplate:
+    return PromptTemplate(
+        input_variables=["chat_history", "human_input", "context"], 
+        template=RECOMMENDATION_TEMPLATE
+    )
+
+
+def _event_history(muestra: dict, indice_eventos, radio_km: float) -> Optional[str]:
+    """
+    Describes the events recorded around a sample, if it has a location.
     
-    responses = {}
-    times = {}
+    Args:
+        muestra (dict): Sample of info_poligono; may include 'LONGITUD' and 'LATITUD'
+            (radius search) or 'poligono' ((lon, lat) vertices or GeoJSON)
+        indice_eventos: spatial_index.EventSpatialIndex, or None
+        radio_km (float): Search radius around the coordinates
+        
+    Returns:
+        Optional[str]: Event history sentence, or None without index or location
+    """
+    if indice_eventos is None:
+        return None
+    if muestra.get("poligono") is not None:
+        eventos = indice_eventos.en_poligono(muestra["poligono"])
+    elif muestra.get("LONGITUD") is not None and muestra.get("LATITUD") is not None:
+        eventos = indice_eventos.en_radio(float(muestra["LONGITUD"]), float(muestra["LATITUD"]), radio_km)
+    else:
+        return None
+    return indice_eventos.describir(indice_eventos.resumen(eventos))
+
+
+def _variables_to_recommend(info_poligono: dict, indice_eventos=None, radio_km: float = 1.0):
+    """
+    Resolves the variables of every sample against the variables workbooks.
     
-    # Variables that should be excluded from processing
-    excluded_variables = [
-        "ALTITUD_mean", "ALTITUD_median", "ALTITUD_min", "ALTITUD_max", "ALTITUD_std",
-        "CORRIENTE_mean", "CORRIENTE_median", "CORRIENTE_min", "CORRIENTE_max", "CORRIENTE_std",
-        "TIPO_1_count", "TIPO_2_count"
-    ]
+    Args:
+        info_poligono (dict): Polygon information with equipment and variables
+            (or a poligono_features.PolygonTop5, converted with to_info_poligono())
+        indice_eventos: Optional spatial_index.EventSpatialIndex; samples with a
+            location get the surrounding event history ('historial_eventos')
+        radio_km (float): Radius used for samples located by coordinates
+        
+    Yields:
+        Tuple[str, Optional[dict]]: Result key and the variable context
+        (tipo_equipo, variable, variable_original, valor_variable, documento,
+        seccion, sugerencia, historial_eventos), or None for excluded variables
+    """
+    workbooks = {}
+    if hasattr(info_poligono, "to_info_poligono"):
+        info_poligono = info_poligono.to_info_poligono()
     
     for muestra in info_poligono.keys():
         tipo_equipo = info_poligono[muestra]["Tipo_de_equipo"]
+        with span("event_history"):
+            historial = _event_history(info_poligono[muestra], indice_eventos, radio_km)
         
         try:
-            variables_recomendacion = pd.read_excel(f"arbol_decision_recomendaciones/variables_{tipo_equipo}.xlsx")
+            if tipo_equipo not in workbooks:
+                with span("excel_load", tipo_equipo=tipo_equipo):
+                    workbooks[tipo_equipo] = pd.read_excel(f"arbol_decision_recomendaciones/variables_{tipo_equipo}.xlsx")
+            variables_recomendacion = workbooks[tipo_equipo]
         except Exception as e:
             print(f"Error cargando archivo Excel para {tipo_equipo}: {e}")
             continue
@@ -174,11 +271,12 @@ def recomendacion(model: str, info_poligono: dict) -> Tuple[Dict[str, str], Dict
             # Normalize variable name if not in the list
             if variable not in list(variables_recomendacion["Variables"]):
                 variable = normalize_variable_name(variable)
+            
+            key = f"{tipo_equipo}_{variable_original}_{variable}"
                 
             # Skip excluded variables
-            if variable in excluded_variables:
-                responses[f"{tipo_equipo}_{variable_original}_{variable}"] = "NA"
-                times[f"{tipo_equipo}_{variable_original}_{variable}"] = "NA"
+            if variable in EXCLUDED_VARIABLES:
+                yield key, None
                 continue
                 
             try:
@@ -193,55 +291,277 @@ def recomendacion(model: str, info_poligono: dict) -> Tuple[Dict[str, str], Dict
                 except:
                     documento_buscar = var_info["Documento"].iloc[0]
                     
-                seccion_buscar = var_info["Normativa"].iloc[0]
-                sugerencia = var_info["Sugerencia"].iloc[0]
-                valor_variable = info_poligono[muestra]["top_5"][variable_original]
+                yield key, {
+                    "tipo_equipo": tipo_equipo,
+                    "variable": variable,
+                    "variable_original": variable_original,
+                    "valor_variable": info_poligono[muestra]["top_5"][variable_original],
+                    "documento": documento_buscar,
+                    "seccion": var_info["Normativa"].iloc[0],
+                    "sugerencia": var_info["Sugerencia"].iloc[0],
+                    "historial_eventos": historial,
+                }
+                
+            except Exception as e:
+                print(f"Error procesando variable {variable}: {e}")
+                continue
+
+
+def _recommendation_query(item: dict) -> Tuple[str, str]:
+    """Returns the retrieval query and the question sent to the model for a variable."""
+    query_search = item["sugerencia"] + " " + item["seccion"]
+    query_recommendation = f"Generate a recommendation for the variable {item['variable']}, which has a value of {item['valor_variable']}. {item['sugerencia']}"
+    if item.get("historial_eventos"):
+        query_recommendation += f" Interruption history around this equipment: {item['historial_eventos']}."
+    return query_search, query_recommendation
+
+
+def _rule_precheck(items: list, reglas) -> Tuple[Dict[str, str], float]:
+    """
+    Templated recommendations of the variables a numeric rule already settles.
+    
+    Args:
+        items (list): (key, item) pairs from _variables_to_recommend
+        reglas: reglas.RuleSet (reglas.NO_RULES skips the pre-check)
+        
+    Returns:
+        Tuple[Dict[str, str], float]: Recommendation of each compliant key, and
+        the pre-check time per templated recommendation
+    """
+    if not reglas.enabled:
+        return {}, 0.0
+    init = time.perf_counter()
+    with span("rules_precheck") as s:
+        plantillas, reporte = reglas.precheck(items)
+        if s is not None:
+            s.attributes.update(llm_calls=reporte.llamadas_llm, llm_calls_saved=reporte.llamadas_ahorradas)
+    if reporte.total:
+        print(reporte)
+    return plantillas, (time.perf_counter() - init) / max(len(plantillas), 1)
 
-                # Configure memory and chain
+
+@traced("recommendation")
+def recomendacion(model: str, info_poligono: dict, indice_eventos=None,
+                  radio_km: float = 1.0, reglas=None, cache=None,
+                  sources: Optional[Dict[str, str]] = None) -> Tuple[Dict[str, str], Dict[str, float]]:
+    """
+    Generates technical recommendations for electrical infrastructure variables.
+    
+    Values clearly inside the normative range of their variable get a templated
+    recommendation without calling the model, and values in the bucket of an
+    earlier recommendation reuse it. Their time is the time actually spent
+    (the pre-check's share, the cache lookup), and `sources` tells them apart
+    from generated ones.
+    
+    Args:
+        model (str): Name of the AI model to use
+        info_poligono (dict): Polygon information with equipment and variables
+        indice_eventos: Optional spatial_index.EventSpatialIndex used to add the
+            interruption history around samples that have a location
+        radio_km (float): Radius of that history for samples given by coordinates
+        reglas: reglas.RuleSet used for the pre-check (None for no pre-check, so
+            every variable goes to the model; the server passes reglas.default_rules)
+        cache: recommendation_cache.RecommendationCache to reuse recommendations
+            across samples and runs (None for no cache, so evaluation runs measure
+            every generation; the server passes default_recommendation_cache)
+        sources (Optional[Dict[str, str]]): Filled with the source of each
+            response: reglas.RULE_SOURCE, recommendation_cache.CACHE_SOURCE or MODEL_SOURCE
+        
+    Returns:
+        Tuple[Dict[str, str], Dict[str, float]]: Tuple with responses and execution times
+    """
+    from reglas import NO_RULES, RULE_SOURCE
+    from recommendation_cache import CACHE_SOURCE, NO_CACHE
+    
+    sources = {} if sources is None else sources
+    reglas = NO_RULES if reglas is None else reglas
+    cache = NO_CACHE if cache is None else cache
+    model = resolve_model(model, "recommendations")
+    prompt = _recommendation_prompt()
+    
+    # Crear modelo de chat
+    with span("llm_init", model=model):
+        llm_chat = create_llm_chat_model(model)
+    
+    responses = {}
+    times = {}
+    
+    items = list(_variables_to_recommend(info_poligono, indice_eventos, radio_km))
+    plantillas, rule_time = _rule_precheck(items, reglas)
+    
+    for key, item in items:
+        if item is None:
+            responses[key] = "NA"
+            times[key] = "NA"
+            continue
+        if key in plantillas:
+            responses[key] = plantillas[key]
+            times[key] = rule_time
+            sources[key] = RULE_SOURCE
+            continue
+        init = time.perf_counter()
+        cached = cache.get(model, item)
+        if cached is not None:
+            responses[key] = cached
+            times[key] = time.perf_counter() - init
+            sources[key] = CACHE_SOURCE
+            continue
+            
+        try:
+            # Configure memory and chain
+            with span("prompt_build"):
                 memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
                 chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
-                
-                # Load vectorstore
-                vectorstore = Chroma(
-                    persist_directory=f"embeddings_by_procces/{documento_buscar}",
-                    embedding_function=embeddings
-                )
-                
-                # Perform relevant documents search
-                query_search = sugerencia + " " + seccion_buscar
-                docs_variable = vectorstore.similarity_search(query_search, k=5)
-                
-                # Generate query for recommendation
-                query_recommendation = f"Generate a recommendation for the variable {variable}, which has a value of {valor_variable}. {sugerencia}"
-                
-                # Execute chain and measure time
-                init = time.time()
+            
+            # Load vectorstore
+            with span("vectorstore_open", documento=item["documento"]):
+                vectorstore = get_vectorstore(f"embeddings_by_procces/{item['documento']}", model)
+            
+            # Perform relevant documents search
+            query_search, query_recommendation = _recommendation_query(item)
+            with span("embed_query"):
+                query_embedding = vectorstore.embeddings.embed_query(query_search)
+            with span("retrieve", k=5):
+                docs_variable = vectorstore.similarity_search_by_vector(query_embedding, k=5)
+            
+            # Execute chain and measure time
+            with span("generate", model=model, variable=item["variable"]):
+                init = time.perf_counter()
                 response = chain({
                     "input_documents": docs_variable, 
                     "human_input": query_recommendation, 
                     "chat_history": memory
                 }, return_only_outputs=False)
-                end = time.time()
+                end = time.perf_counter()
 
-                response_text = response['output_text']
-                
-                # Store results
-                key = f"{tipo_equipo}_{variable_original}_{variable}"
-                responses[key] = response_text
-                times[key] = end - init
-
-                print(f"RESPONSE GENERATED FOR {key}")
-                print(response_text)
-                print("-" * 50)
-                
-            except Exception as e:
-                print(f"Error procesando variable {variable}: {e}")
-                continue
+            response_text = response['output_text']
+            
+            # Store results
+            responses[key] = response_text
+            times[key] = end - init
+            sources[key] = MODEL_SOURCE
+            cache.put(model, item, response_text)
+
+            print(f"RESPONSE GENERATED FOR {key}")
+            print(response_text)
+            print("-" * 50)
+            
+        except Exception as e:
+            print(f"Error procesando variable {item['variable']}: {e}")
+            continue
+    
+    cache.save()
+    if cache.enabled:
+        print(cache.describe())
+    return responses, times
+
+
+async def arecomendacion(model: str, info_poligono: dict, max_concurrency: int = 8, indice_eventos=None,
+                         radio_km: float = 1.0, reglas=None, cache=None,
+                         sources: Optional[Dict[str, str]] = None) -> Tuple[Dict[str, str], Dict[str, float]]:
+    """
+    Async version of recomendacion(): retrieval and generation for all variables
+    run concurrently on the event loop (ainvoke), bounded by a semaphore.
+    
+    Args:
+        model (str): Name of the AI model to use
+        info_poligono (dict): Polygon information with equipment and variables
+        max_concurrency (int): Maximum number of simultaneous LLM calls
+        indice_eventos: Optional spatial_index.EventSpatialIndex (see recomendacion)
+        radio_km (float): Radius of the event history for samples given by coordinates
+        reglas: reglas.RuleSet used for the pre-check (see recomendacion)
+        cache: recommendation_cache.RecommendationCache (see recomendacion)
+        sources (Optional[Dict[str, str]]): Filled with the source of each response (see recomendacion)
         
+    Returns:
+        Tuple[Dict[str, str], Dict[str, float]]: Tuple with responses and execution times
+    """
+    from reglas import NO_RULES, RULE_SOURCE
+    from recommendation_cache import CACHE_SOURCE, NO_CACHE
+    
+    sources = {} if sources is None else sources
+    reglas = NO_RULES if reglas is None else reglas
+    cache = NO_CACHE if cache is None else cache
+    model = resolve_model(model, "recommendations")
+    prompt = _recommendation_prompt()
+    # Creating an Ollama model loads it (a blocking HTTP call), so it runs in a worker thread
+    llm_chat = await asyncio.to_thread(create_llm_chat_model, model)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    responses = {}
+    times = {}
+    pendientes: Dict[str, asyncio.Future] = {}
+    
+    async def process(key: str, item: dict) -> None:
+        # Items of a bucket being generated wait for it and reuse the recommendation
+        clave = cache.key(model, item) if cache.cacheable(item) else None
+        while clave in pendientes:
+            await pendientes[clave]
+        init = time.perf_counter()
+        cached = cache.get(model, item)
+        if cached is not None:
+            responses[key] = cached
+            times[key] = time.perf_counter() - init
+            sources[key] = CACHE_SOURCE
+            return
+        if clave is not None:
+            pendientes[clave] = asyncio.get_running_loop().create_future()
+        try:
+            async with semaphore:
+                memory = ConversationBufferMemory(memory_key="chat_history", input_key="human_input")
+                chain = load_qa_chain(llm_chat, chain_type="stuff", memory=memory, prompt=prompt)
+                vectorstore = await asyncio.to_thread(
+                    get_vectorstore, f"embeddings_by_procces/{item['documento']}", model
+                )
+                query_search, query_recommendation = _recommendation_query(item)
+                with span("embed_query"):
+                    query_embedding = await vectorstore.embeddings.aembed_query(query_search)
+                with span("retrieve", k=5):
+                    docs_variable = await vectorstore.asimilarity_search_by_vector(query_embedding, k=5)
+                with span("generate", model=model, variable=item["variable"]):
+                    init = time.perf_counter()
+                    response = await chain.ainvoke({
+                        "input_documents": docs_variable, 
+                        "human_input": query_recommendation
+                    })
+                    end = time.perf_counter()
+            responses[key] = response['output_text']
+            times[key] = end - init
+            sources[key] = MODEL_SOURCE
+            cache.put(model, item, response['output_text'])
+        except Exception as e:
+            print(f"Error procesando variable {item['variable']}: {e}")
+        finally:
+            if clave is not None:
+                pendientes.pop(clave).set_result(None)
+    
+    with span("recommendation", model=model, mode="async"):
+        # Workbooks are read in a worker thread so the event loop is not blocked
+        items = await asyncio.to_thread(
+            lambda: list(_variables_to_recommend(info_poligono, indice_eventos, radio_km))
+        )
+        plantillas, rule_time = _rule_precheck(items, reglas)
+        tasks = []
+        for key, item in items:
+            if item is None:
+                responses[key] = "NA"
+                times[key] = "NA"
+            elif key in plantillas:
+                responses[key] = plantillas[key]
+                times[key] = rule_time
+                sources[key] = RULE_SOURCE
+            else:
+                tasks.append(process(key, item))
+        await asyncio.gather(*tasks)
+        await asyncio.to_thread(cache.save)
+    
+    if cache.enabled:
+        print(cache.describe())
     return responses, times
 
 
 # Additional auxiliary functions
+@traced("pickle_save")
 def save_results_to_pickle(data: dict, filename: str) -> None:
     """
     Saves results in pickle format.
@@ -255,6 +575,7 @@ def save_results_to_pickle(data: dict, filename: str) -> None:
         pickle.dump(data, archivo)
 
 
+@traced("pickle_load")
 def load_results_from_pickle(filename: str) -> dict:
     """
     Loads results from pickle format.
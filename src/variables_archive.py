@@ -0,0 +1,305 @@
+"""
+Stream reader and columnar cache of the *_variables.zip archives
+Regulation_files ships one archive per equipment type (Apoyos, RedMT,
+Switches, Transformadores) holding a .docx per variable with the regulation
+notes behind its recommendations. Members are read straight from the zip
+(and the document XML parsed incrementally) without extracting anything;
+the paragraphs are converted once into a Parquet file keyed by the SHA-256
+of the archive, and the frame of an equipment type is only loaded when it
+is first asked for.
+
+Usage (from the project root):
+    python src/variables_archive.py
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zipfile
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
+import pandas as pd
+
+from tracing import span
+from utils import normalize_query
+
+
+VARIABLES_DIR = os.getenv("CRITAIR_VARIABLES_DIR", "Regulation_files")
+CACHE_DIR = "structured_data/variables_cache"
+
+# Archive of each equipment type
+ARCHIVOS = {
+    "apoyos": "Apoyos_Variables.zip",
+    "redmt": "RedMT_variables.zip",
+    "switches": "Switches_variables.zip",
+    "transformadores": "Transformadores_variables.zip",
+}
+
+# Names of the equipment types in file names and in info_poligono
+ALIAS = {
+    "apoyos": ["apoyo", "apoyos", "postes"],
+    "redmt": ["redmt", "red mt", "red_mt", "redes mt", "tramo de red", "tramos"],
+    "switches": ["switch", "switche", "switches", "interruptor", "interruptores"],
+    "transformadores": ["trafo", "trafos", "transformador", "transformadores"],
+}
+
+COLUMNAS = ["tipo_equipo", "archivo", "variable", "parrafo", "normativa", "texto"]
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def tipo_canonico(tipo_equipo: str) -> Optional[str]:
+    """Key of ARCHIVOS for an equipment type name ('Transformadores', 'TRAFOS', 'Switches'...), or None."""
+    texto = normalize_query(tipo_equipo).replace("_", " ").strip()
+    for tipo, nombres in ALIAS.items():
+        if texto == tipo or texto in nombres:
+            return tipo
+    return None
+
+
+def archive_hash(path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(block_size), b""):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+def iter_members(path: str) -> Iterator[Tuple[str, IO[bytes]]]:
+    """
+    Yields the .docx members of an archive as decompressing streams.
+
+    macOS metadata (__MACOSX/, ._ files) and folders are skipped.
+
+    Args:
+        path (str): Zip archive
+
+    Yields:
+        Tuple[str, IO[bytes]]: Member name and an open (seekable) stream
+    """
+    with zipfile.ZipFile(path) as archivo:
+        for info in archivo.infolist():
+            nombre = info.filename
+            base = nombre.rsplit("/", 1)[-1]
+            if info.is_dir() or nombre.startswith("__MACOSX/") or base.startswith("._"):
+                continue
+            if not base.lower().endswith(".docx"):
+                continue
+            with archivo.open(info) as miembro:
+                yield nombre, miembro
+
+
+def docx_paragraphs(stream: IO[bytes]) -> Iterator[str]:
+    """
+    Yields the non-empty paragraphs of a .docx, parsing word/document.xml incrementally.
+
+    Args:
+        stream (IO[bytes]): Seekable stream of the .docx (e.g. a zip member)
+
+    Yields:
+        str: Paragraph text
+    """
+    with zipfile.ZipFile(stream) as documento, documento.open("word/document.xml") as xml:
+        partes: List[str] = []
+        for evento, nodo in ElementTree.iterparse(xml, events=("start", "end")):
+            if evento == "start" and nodo.tag == f"{_W}p":
+                partes = []
+            elif evento == "end" and nodo.tag == f"{_W}t":
+                partes.append(nodo.text or "")
+            elif evento == "end" and nodo.tag == f"{_W}p":
+                texto = re.sub(r"\s+", " ", "".join(partes)).strip()
+                if texto:
+                    yield texto
+                nodo.clear()
+
+
+def _variable(archivo: str, tipo_equipo: str) -> str:
+    """Variable named by a member ('temperatura_APOYOS.docx' -> 'temperatura')."""
+    base = os.path.splitext(archivo.rsplit("/", 1)[-1])[0]
+    base = re.sub(r"^normativa\s+", "", base, flags=re.IGNORECASE)
+    propios = {normalize_query(a) for a in ALIAS[tipo_equipo] + [tipo_equipo]}
+    partes = [p for p in re.split(r"[_\s]+", base) if p and normalize_query(p) not in propios]
+    return "_".join(partes) or base
+
+
+def _normativa(parrafo: str) -> str:
+    """Regulation a paragraph refers to ('NTC 1065 (Postes Metálicos) : ...' -> 'NTC 1065 (Postes Metálicos)')."""
+    cabeza, separador, _ = parrafo.partition(":")
+    return cabeza.strip() if separador and len(cabeza) <= 120 else ""
+
+
+def read_archive(path: str, tipo_equipo: str) -> pd.DataFrame:
+    """
+    Parses the paragraphs of every variable document of an archive.
+
+    Args:
+        path (str): Zip archive
+        tipo_equipo (str): Key of ARCHIVOS
+
+    Returns:
+        pd.DataFrame: One row per paragraph with COLUMNAS
+    """
+    filas = []
+    for nombre, miembro in iter_members(path):
+        variable = _variable(nombre, tipo_equipo)
+        for i, parrafo in enumerate(docx_paragraphs(miembro)):
+            filas.append((tipo_equipo, nombre, variable, i, _normativa(parrafo), parrafo))
+    tabla = pd.DataFrame(filas, columns=COLUMNAS)
+    for col in ["tipo_equipo", "archivo", "variable", "normativa"]:
+        tabla[col] = tabla[col].astype("category")
+    tabla["parrafo"] = tabla["parrafo"].astype("int16")
+    return tabla
+
+
+class VariablesArchive:
+    """
+    Lazily loaded, cached view of the variable archives.
+
+    Args:
+        directory (str): Folder with the archives
+        cache_dir (Optional[str]): Folder of the Parquet cache (None to parse every time)
+    """
+
+    def __init__(self, directory: str = VARIABLES_DIR, cache_dir: Optional[str] = CACHE_DIR):
+        self.directory = directory
+        self.cache_dir = cache_dir
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.cache_dir, "_index.json")
+
+    def _leer_indice(self) -> dict:
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _hash(self, path: str, indice: dict) -> str:
+        """Archive hash, recomputed only when its size or modification time changed."""
+        estado = os.stat(path)
+        previo = indice.get(os.path.basename(path))
+        if previo and previo["size"] == estado.st_size and previo["mtime_ns"] == estado.st_mtime_ns:
+            return previo["sha256"]
+        digest = archive_hash(path)
+        indice[os.path.basename(path)] = {"size": estado.st_size, "mtime_ns": estado.st_mtime_ns, "sha256": digest}
+        return digest
+
+    def _cargar(self, tipo: str) -> pd.DataFrame:
+        path = os.path.join(self.directory, ARCHIVOS[tipo])
+        if self.cache_dir is None:
+            return read_archive(path, tipo)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        indice = self._leer_indice()
+        digest = self._hash(path, indice)
+        cache = os.path.join(self.cache_dir, f"{tipo}-{digest[:16]}.parquet")
+        try:
+            with span("variables_cache_read", tipo_equipo=tipo):
+                return pd.read_parquet(cache)
+        except (FileNotFoundError, ImportError, OSError, ValueError):
+            pass
+
+        with span("variables_archive_parse", tipo_equipo=tipo):
+            tabla = read_archive(path, tipo)
+        try:
+            tmp = f"{cache}.{os.getpid()}.tmp"
+            tabla.to_parquet(tmp, index=False)
+            os.replace(tmp, cache)
+        except ImportError:
+            # Without pyarrow the archive is parsed again in the next process
+            return tabla
+        for nombre in os.listdir(self.cache_dir):
+            if nombre.startswith(f"{tipo}-") and os.path.join(self.cache_dir, nombre) != cache:
+                os.remove(os.path.join(self.cache_dir, nombre))
+        tmp = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(indice, f)
+        os.replace(tmp, self._index_path)
+        return tabla
+
+    @property
+    def tipos(self) -> List[str]:
+        """Equipment types whose archive is present."""
+        return [t for t, a in ARCHIVOS.items() if os.path.exists(os.path.join(self.directory, a))]
+
+    def frame(self, tipo_equipo: str) -> pd.DataFrame:
+        """
+        Paragraphs of the variable documents of an equipment type, loaded on first use.
+
+        Args:
+            tipo_equipo (str): Equipment type (any name in ALIAS)
+
+        Returns:
+            pd.DataFrame: One row per paragraph with COLUMNAS
+
+        Raises:
+            KeyError: If the equipment type is unknown
+            FileNotFoundError: If its archive is missing
+        """
+        tipo = tipo_canonico(tipo_equipo)
+        if tipo is None:
+            raise KeyError(f"Unknown equipment type: {tipo_equipo}")
+        with self._lock:
+            if tipo not in self._frames:
+                self._frames[tipo] = self._cargar(tipo)
+            return self._frames[tipo]
+
+    def variables(self, tipo_equipo: str) -> List[str]:
+        """Variables documented for an equipment type."""
+        return sorted(self.frame(tipo_equipo)["variable"].astype(str).unique().tolist())
+
+    def texto(self, tipo_equipo: str, variable: str) -> Optional[str]:
+        """
+        Regulation notes of a variable.
+
+        The variable is matched by name ignoring case and accents; a feature
+        name such as 'temp_mean' matches the documented 'temperatura'.
+
+        Args:
+            tipo_equipo (str): Equipment type
+            variable (str): Variable or feature name
+
+        Returns:
+            Optional[str]: Paragraphs joined, or None if no document matches
+        """
+        if tipo_canonico(tipo_equipo) is None:
+            return None
+        tabla = self.frame(tipo_equipo)
+        buscada = normalize_query(variable).replace(" ", "_")
+        base = re.sub(r"_(mean|median|min|max|std|count)$", "", buscada)
+        for documentada in self.variables(tipo_equipo):
+            nombre = normalize_query(documentada).replace(" ", "_")
+            if nombre in (buscada, base) or (len(base) >= 3 and (nombre.startswith(base) or base.startswith(nombre))):
+                return "\n".join(tabla.loc[tabla["variable"] == documentada, "texto"])
+        return None
+
+
+default_variables_archive = VariablesArchive()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Caché columnar de los archivos *_variables.zip")
+    parser.add_argument("--directory", default=VARIABLES_DIR)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args()
+
+    for pasada in ["fría", "caliente"]:
+        archivo = VariablesArchive(args.directory, args.cache_dir)
+        for tipo in archivo.tipos:
+            inicio = time.perf_counter()
+            tabla = archivo.frame(tipo)
+            print(f"[{pasada}] {tipo}: {tabla['variable'].nunique()} variables, {len(tabla)} párrafos, "
+                  f"{(time.perf_counter() - inicio) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()